@@ -0,0 +1,184 @@
+# Copyright (C) 2023 DNEG - All Rights reserved.
+"""
+Perforce bulk protections update.
+
+Adds the protections lines a division config requires to every show that is
+missing them, in a single write of the protections table. Converging each show
+on its own would read and rewrite the whole table, and lock it, once per show.
+
+The required lines of every show are rendered from its division config, and
+the ones whose rule is not in the table yet are inserted in one pass over the
+table: each show's lines go at their alphabetical position in the depot
+specific block, the same place `populate_permissions_table()` puts them. The
+change is shown as a unified diff before it is submitted, and it is only
+submitted if the table did not change since it was read.
+"""
+import collections
+import difflib
+import logging
+
+import p4_show_fleet_audit
+import p4_show_setup
+from shared import protections_utility
+
+START_MARKER = "## START OF DEPOT SPECIFIC PERMISSIONS"
+END_MARKER = "## END OF DEPOT SPECIFIC PERMISSIONS"
+
+ProtectionsUpdate = collections.namedtuple(
+    "ProtectionsUpdate", ["current", "updated", "added"]
+)
+ProtectionsUpdate.__doc__ = """A protections table update.
+
+Attributes:
+    current (list[str]): the table as it was read.
+    updated (list[str]): the table with the missing lines inserted.
+    added (dict): the lines added for each show, keyed by show.
+"""
+
+
+def required_lines(shows, config_data, division=None, user=None):
+    """Render the protections lines every show's division config requires.
+
+    Args:
+        shows (list[str]): the show codes.
+        config_data (dict): the configs for every division.
+        division (str, optional): the division of every show. Deduced from each
+            show code if not given.
+        user (str, optional): the user to credit in the lines' comments.
+
+    Returns:
+        dict: the lines of each show, keyed by show.
+    """
+    return {
+        show: p4_show_setup.P4ShowSetup(
+            show, p4_show_fleet_audit.division_config(show, config_data, division)
+        ).render_permissions(user or "")
+        for show in shows
+    }
+
+
+def insert_missing(protections, required):
+    """Insert the required lines that are missing, in one pass over the table.
+
+    Args:
+        protections (list[str]): the protections table lines.
+        required (dict): the lines each show requires, keyed by show.
+
+    Returns:
+        ProtectionsUpdate: the update.
+
+    Raises:
+        ValueError: if lines have to be added and the table has no depot
+            specific permissions block.
+    """
+    rules = {protections_utility.rule_of(line) for line in protections}
+    added = {}
+    for show, lines in required.items():
+        missing = [
+            line for line in lines if protections_utility.rule_of(line) not in rules
+        ]
+        if missing:
+            added[show] = missing
+    if not added:
+        return ProtectionsUpdate(list(protections), list(protections), {})
+
+    # Shows in the order their lines go in, compared as the setup compares them.
+    pending = sorted(added, key=str.upper)
+    updated = []
+    in_block = False
+    for line in protections:
+        if in_block:
+            if line.startswith(END_MARKER):
+                for show in pending:
+                    updated.extend(added[show])
+                pending = []
+                in_block = False
+            else:
+                entry = protections_utility.parse_entry(line)
+                depot = protections_utility.depot_of(entry.path) if entry else None
+                while depot and pending and depot.upper() > pending[0].upper():
+                    updated.extend(added[pending.pop(0)])
+        else:
+            in_block = line.startswith(START_MARKER)
+        updated.append(line)
+    if pending:
+        raise ValueError(f"Permissions table is missing '{START_MARKER}'")
+    return ProtectionsUpdate(list(protections), updated, added)
+
+
+def unified_diff(update):
+    """Format an update for review.
+
+    Args:
+        update (ProtectionsUpdate | Optimization): the update, with the
+            `current` and `updated` tables.
+
+    Returns:
+        str: the unified diff of the table, empty if nothing changes.
+    """
+    return "\n".join(
+        difflib.unified_diff(
+            update.current,
+            update.updated,
+            "protections (server)",
+            "protections (updated)",
+            lineterm="",
+        )
+    )
+
+
+def plan_update(p4, config_data, division=None, shows=None):
+    """Read the table and the shows, and work out the update.
+
+    Args:
+        p4 (P4.P4): the connection.
+        config_data (dict): the configs for every division.
+        division (str, optional): the division of every show. Deduced from each
+            show code if not given.
+        shows (list[str], optional): the shows to update. Every show depot if
+            not given.
+
+    Returns:
+        ProtectionsUpdate: the update.
+    """
+    if shows is None:
+        shows = sorted(
+            depot["name"]
+            for depot in p4.run("depots")
+            if p4_show_fleet_audit.is_show_depot(depot)
+        )
+    protections = p4.run("protect", "-o")[0]["Protections"]
+    logging.info("Checking the protections of %d shows", len(shows))
+    return insert_missing(
+        protections, required_lines(shows, config_data, division, p4.user)
+    )
+
+
+def submit_update(p4, update):
+    """Write the updated table, if the table did not change since it was read.
+
+    Args:
+        p4 (P4.P4): the connection.
+        update (ProtectionsUpdate): the update.
+
+    Returns:
+        bool: whether the table was written. It is not if nothing changes or
+            if the table changed since it was read.
+    """
+    if not update.added:
+        return False
+    table = p4.run("protect", "-o")
+    if table[0]["Protections"] != update.current:
+        logging.warning(
+            "The protections table changed since it was read. Not submitting"
+        )
+        return False
+    table[0]["Protections"] = update.updated
+    p4.input = table
+    logging.info(p4.run("protect", "-i"))
+    logging.info(
+        "Added %d protections lines for %d shows",
+        sum(len(lines) for lines in update.added.values()),
+        len(update.added),
+    )
+    return True
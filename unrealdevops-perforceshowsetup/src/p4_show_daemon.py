@@ -0,0 +1,689 @@
+# Copyright (C) 2023 DNEG - All Rights reserved.
+"""
+Perforce show setup service.
+
+Runs show setup, undo and audit jobs continuously instead of one CLI process per
+show. Jobs are submitted over HTTP on localhost, persisted in an SQLite queue
+that survives restarts, and executed by a pool of worker threads that keep
+their Perforce connections and the division configs warm between jobs.
+
+HTTP API:
+- `POST /jobs` with `{"command": "apply", "show": "SHOW", "division": "VFX"}`
+  queues a job and returns its id. `division` is optional, and must name a
+  division in the config if given.
+- `GET /jobs/<id>` returns a job's status and result.
+- `GET /jobs?status=queued` lists the most recent jobs.
+- `GET /health` reports whether the service is accepting jobs.
+"""
+import contextlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import p4_show_setup
+from shared import logging_utility
+from shared import metrics_utility
+from shared import p4_connection_utility
+from shared import p4_deadline_utility
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_WORKERS = 2
+DEFAULT_QUEUE_PATH = os.path.join(
+    os.path.expanduser("~"), "P4ShowSetup", "show_setup_jobs.sqlite3"
+)
+POLL_INTERVAL_SECONDS = 0.5
+
+JOB_COMMANDS = ("apply", "undo", "audit")
+# Jobs that only read from the server are safe to run again after a restart.
+READ_ONLY_COMMANDS = ("audit",)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+JOB_STATUSES = (QUEUED, RUNNING, SUCCEEDED, FAILED)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    command TEXT NOT NULL,
+    show TEXT NOT NULL,
+    division TEXT,
+    status TEXT NOT NULL,
+    submitted_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+"""
+_JOB_COLUMNS = (
+    "id",
+    "command",
+    "show",
+    "division",
+    "status",
+    "submitted_at",
+    "started_at",
+    "finished_at",
+    "result",
+    "error",
+)
+
+
+class JobQueue:
+    """Persistent FIFO queue of show setup jobs, stored in SQLite."""
+
+    def __init__(self, path: str = DEFAULT_QUEUE_PATH):
+        """Construct an instance of JobQueue, creating the database if needed.
+
+        Args:
+            path (str, optional): the database file.
+        """
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(_SCHEMA)
+
+    def _connect(self):
+        """Open a connection to the database.
+
+        Connections are not shared between threads; each call opens its own.
+
+        Returns:
+            sqlite3.Connection: the connection, in autocommit mode.
+        """
+        connection = sqlite3.connect(self.path, timeout=30.0, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        return _ClosingConnection(connection)
+
+    def submit(self, command: str, show: str, division: str = None):
+        """Add a job to the end of the queue.
+
+        Args:
+            command (str): the job command, one of `JOB_COMMANDS`.
+            show (str): the show code.
+            division (str, optional): the division, deduced from the show if None.
+
+        Returns:
+            int: the job id.
+
+        Raises:
+            ValueError: if the command is not a job command.
+        """
+        if command not in JOB_COMMANDS:
+            raise ValueError(f"Unknown job command: {command}")
+        with self._connect() as connection:
+            cursor = connection.execute(
+                "INSERT INTO jobs (command, show, division, status, submitted_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (command, show, division, QUEUED, time.time()),
+            )
+            return cursor.lastrowid
+
+    def claim(self):
+        """Take the oldest queued job and mark it as running.
+
+        Returns:
+            dict: the job, or None if the queue is empty.
+        """
+        with self._connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = connection.execute(
+                    "SELECT * FROM jobs WHERE status = ? ORDER BY id LIMIT 1", (QUEUED,)
+                ).fetchone()
+                if row is None:
+                    return None
+                started_at = time.time()
+                connection.execute(
+                    "UPDATE jobs SET status = ?, started_at = ? WHERE id = ?",
+                    (RUNNING, started_at, row["id"]),
+                )
+            finally:
+                connection.execute("COMMIT")
+        job = _job_from_row(row)
+        job.update(status=RUNNING, started_at=started_at)
+        return job
+
+    def finish(self, job_id: int, result=None):
+        """Mark a running job as succeeded.
+
+        Args:
+            job_id (int): the job id.
+            result (Any, optional): the job result, stored as JSON.
+        """
+        self._set_outcome(job_id, SUCCEEDED, result=result)
+
+    def fail(self, job_id: int, error: str, result=None):
+        """Mark a running job as failed.
+
+        Args:
+            job_id (int): the job id.
+            error (str): why the job failed.
+            result (Any, optional): the job result, stored as JSON.
+        """
+        self._set_outcome(job_id, FAILED, result=result, error=error)
+
+    def _set_outcome(self, job_id, status, result=None, error=None):
+        """Record how a job finished.
+
+        Args:
+            job_id (int): the job id.
+            status (str): SUCCEEDED or FAILED.
+            result (Any, optional): the job result, stored as JSON.
+            error (str, optional): why the job failed.
+        """
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, result = ?, error = ? "
+                "WHERE id = ?",
+                (
+                    status,
+                    time.time(),
+                    None if result is None else json.dumps(result, default=str),
+                    error,
+                    job_id,
+                ),
+            )
+
+    def get(self, job_id: int):
+        """Get a job.
+
+        Args:
+            job_id (int): the job id.
+
+        Returns:
+            dict: the job, or None if there is no such job.
+        """
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT * FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return None if row is None else _job_from_row(row)
+
+    def list(self, status: str = None, limit: int = 100):
+        """List the most recent jobs.
+
+        Args:
+            status (str, optional): only list jobs with this status.
+            limit (int, optional): the maximum number of jobs to list.
+
+        Returns:
+            list[dict]: the jobs, newest first.
+        """
+        query = "SELECT * FROM jobs"
+        parameters = []
+        if status:
+            query += " WHERE status = ?"
+            parameters.append(status)
+        query += " ORDER BY id DESC LIMIT ?"
+        parameters.append(limit)
+        with self._connect() as connection:
+            rows = connection.execute(query, parameters).fetchall()
+        return [_job_from_row(row) for row in rows]
+
+    def recover(self):
+        """Deal with jobs that were running when the service last stopped.
+
+        Read-only jobs are queued again. Setup and undo jobs are failed, since
+        they may have been partially applied and need a person to look at them.
+
+        Returns:
+            int: the number of interrupted jobs.
+        """
+        with self._connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                rows = connection.execute(
+                    "SELECT id, command FROM jobs WHERE status = ?", (RUNNING,)
+                ).fetchall()
+                for row in rows:
+                    if row["command"] in READ_ONLY_COMMANDS:
+                        connection.execute(
+                            "UPDATE jobs SET status = ?, started_at = NULL WHERE id = ?",
+                            (QUEUED, row["id"]),
+                        )
+                    else:
+                        connection.execute(
+                            "UPDATE jobs SET status = ?, finished_at = ?, error = ? "
+                            "WHERE id = ?",
+                            (
+                                FAILED,
+                                time.time(),
+                                "Interrupted by a service restart. Check the show with "
+                                "an audit job before retrying.",
+                                row["id"],
+                            ),
+                        )
+            finally:
+                connection.execute("COMMIT")
+        if rows:
+            logging.warning("Recovered %d jobs interrupted by a restart", len(rows))
+        return len(rows)
+
+
+class _ClosingConnection:
+    """Context manager closing an SQLite connection on exit.
+
+    `sqlite3.Connection` only ends transactions as a context manager, it does
+    not close the connection.
+    """
+
+    def __init__(self, connection):
+        """Construct an instance of _ClosingConnection.
+
+        Args:
+            connection (sqlite3.Connection): the connection.
+        """
+        self.connection = connection
+
+    def __enter__(self):
+        """Enter the context.
+
+        Returns:
+            sqlite3.Connection: the connection.
+        """
+        return self.connection
+
+    def __exit__(self, *exc_info):
+        """Close the connection.
+
+        Args:
+            *exc_info (Any): the exception raised in the context, if any.
+        """
+        self.connection.close()
+
+
+def _job_from_row(row):
+    """Convert a database row to a job.
+
+    Args:
+        row (sqlite3.Row): the row.
+
+    Returns:
+        dict: the job, with its result decoded from JSON.
+    """
+    job = {column: row[column] for column in _JOB_COLUMNS}
+    if job["result"] is not None:
+        job["result"] = json.loads(job["result"])
+    return job
+
+
+class _ConfigCache:
+    """The division configs, reloaded only when the config file changes."""
+
+    def __init__(self):
+        """Construct an instance of _ConfigCache."""
+        self.path = p4_show_setup.CONFIG_PATH
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._config_data = None
+
+    def get(self):
+        """Get the configs for every division.
+
+        Returns:
+            dict: the configs, or None if they could not be read.
+        """
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError as error:
+            logging.warning("Unable to read %s: %s", self.path, error)
+            return None
+        with self._lock:
+            if mtime != self._mtime or self._config_data is None:
+                self._config_data = p4_show_setup.load_config_data()
+                self._mtime = mtime
+            return self._config_data
+
+
+class ShowSetupService:
+    """Executes queued show setup jobs on a pool of worker threads."""
+
+    def __init__(self, job_queue: JobQueue, workers: int = DEFAULT_WORKERS, pool=None):
+        """Construct an instance of ShowSetupService.
+
+        Args:
+            job_queue (JobQueue): the queue to take jobs from.
+            workers (int, optional): how many jobs may run at once.
+            pool (p4_connection_utility.ConnectionPool, optional): the pool to
+                borrow connections from. Defaults to one connection per worker.
+        """
+        self.job_queue = job_queue
+        self.workers = workers
+        self.pool = pool or p4_connection_utility.ConnectionPool(
+            p4_show_setup.create_connected_connection, size=workers
+        )
+        self.configs = _ConfigCache()
+        self.stop_token = p4_deadline_utility.CancellationToken()
+        self._threads = []
+        # One lock per show with a job running or waiting, so that jobs for the
+        # same show run one at a time. Each entry holds the lock and its users.
+        self._show_locks = {}
+        self._show_locks_lock = threading.Lock()
+
+    def start(self):
+        """Recover interrupted jobs, then start the workers."""
+        self.job_queue.recover()
+        for index in range(self.workers):
+            thread = threading.Thread(
+                target=self._work, name=f"P4ShowSetupWorker-{index}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, command: str, show: str, division: str = None):
+        """Check a job's division against the configs, and add the job to the queue.
+
+        Args:
+            command (str): the job command, one of `JOB_COMMANDS`.
+            show (str): the show code.
+            division (str, optional): the division, deduced from the show if None.
+
+        Returns:
+            int: the job id.
+
+        Raises:
+            ValueError: if the command is not a job command, or the division is
+                not in the configs.
+        """
+        config_data = self.configs.get()
+        # Unreadable configs fail the job when it runs, with their own error.
+        if (
+            config_data is not None
+            and division is not None
+            and division not in config_data
+        ):
+            raise ValueError(f"Unknown division: {division}")
+        return self.job_queue.submit(command, show, division)
+
+    def stop(self):
+        """Stop taking jobs, wait for the running ones, and disconnect."""
+        self.stop_token.cancel("Service stopping")
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self.pool.close()
+
+    def _work(self):
+        """Worker loop: run queued jobs until the service stops."""
+        while not self.stop_token.cancelled:
+            try:
+                job = self.job_queue.claim()
+            except sqlite3.Error as error:
+                logging.error("Unable to read the job queue: %s", error)
+                job = None
+            if job is None:
+                try:
+                    self.stop_token.sleep(POLL_INTERVAL_SECONDS)
+                except p4_deadline_utility.OperationCancelled:
+                    return
+                continue
+            self.run_job(job)
+
+    def run_job(self, job):
+        """Run a claimed job and record its outcome.
+
+        Args:
+            job (dict): the job, see `JobQueue.claim()`.
+        """
+        with logging_utility.logging_context(
+            show=job["show"], worker=threading.current_thread().name, job=job["id"]
+        ):
+            self._run_job(job)
+
+    def _run_job(self, job):
+        """Run a claimed job and record its outcome, in the job's logging context.
+
+        Args:
+            job (dict): the job, see `JobQueue.claim()`.
+        """
+        logging.info("Running job %s: %s %s", job["id"], job["command"], job["show"])
+        try:
+            succeeded, result, error = self._execute(job)
+        except Exception as unexpected_error:  # pylint: disable=broad-except
+            logging.exception("Job %s failed unexpectedly", job["id"])
+            succeeded, result, error = (False, None, repr(unexpected_error))
+        if succeeded:
+            self.job_queue.finish(job["id"], result)
+        else:
+            self.job_queue.fail(job["id"], error, result)
+        logging.info("Job %s %s", job["id"], SUCCEEDED if succeeded else FAILED)
+        metrics_utility.record_run(job["command"], succeeded)
+        try:
+            metrics_utility.write_textfile()
+        except OSError as write_error:
+            logging.error("Could not write the metrics: %s", write_error)
+
+    @contextlib.contextmanager
+    def _show_lock(self, show):
+        """Hold a show's lock while a job for the show runs.
+
+        The lock is forgotten once no job for the show runs or waits for it.
+
+        Args:
+            show (str): the show code.
+
+        Yields:
+            None: once the show's lock is held.
+        """
+        with self._show_locks_lock:
+            entry = self._show_locks.setdefault(show, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._show_locks_lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._show_locks[show]
+
+    def _execute(self, job):
+        """Execute a job on a pooled connection, after any other job for the same show.
+
+        Args:
+            job (dict): the job.
+
+        Returns:
+            tuple: whether the job succeeded, its result and its error message.
+        """
+        config_data = self.configs.get()
+        if config_data is None:
+            return (False, None, "Unable to read the show setup configs")
+        # The configs may have changed since the job was submitted.
+        if job["division"] is not None and job["division"] not in config_data:
+            return (False, None, f"Unknown division: {job['division']}")
+        json_config = p4_show_setup.get_show_config(
+            job["show"], division=job["division"], config_data=config_data
+        )
+        show_setup_instance = p4_show_setup.P4ShowSetup(job["show"], json_config)
+        errors = show_setup_instance.validate_show()
+        if errors:
+            return (False, None, "; ".join(errors))
+        with self._show_lock(job["show"]), self.pool.acquire() as p4:
+            show_setup_instance.p4 = p4
+            if job["command"] == "apply":
+                return _apply(show_setup_instance)
+            if job["command"] == "undo":
+                return _undo(show_setup_instance)
+            # An audit succeeds whether or not it finds differences; they are its result.
+            return (True, show_setup_instance.audit(), None)
+
+
+def _apply(show_setup_instance):
+    """Set up a show, rolling back on failure.
+
+    Args:
+        show_setup_instance (p4_show_setup.P4ShowSetup): the validated instance.
+
+    Returns:
+        tuple: whether the setup succeeded, what it created and its error message.
+    """
+    try:
+        for step_name in p4_show_setup.SETUP_STEPS:
+            getattr(show_setup_instance, step_name)()
+    # Existing depots and permissions for the show raise a bare Exception.
+    except Exception as error:  # pylint: disable=broad-except
+        logging.warning(
+            "Perforce Show Setup for %s Failed: %s. Rolling back.",
+            show_setup_instance.show,
+            repr(error),
+        )
+        show_setup_instance.undo_show_setup()
+        return (False, None, repr(error))
+    return (True, show_setup_instance.result, None)
+
+
+def _undo(show_setup_instance):
+    """Remove everything the setup creates for a show.
+
+    Args:
+        show_setup_instance (p4_show_setup.P4ShowSetup): the validated instance.
+
+    Returns:
+        tuple: whether the removal succeeded, what was removed and its error message.
+    """
+    try:
+        show_setup_instance.result = show_setup_instance.discover_result()
+        show_setup_instance.result.pop("StreamSpecs", None)
+        show_setup_instance.undo_show_setup()
+    except p4_connection_utility.p4_exception_types() as error:
+        return (False, None, repr(error))
+    return (True, show_setup_instance.result, None)
+
+
+class _JobRequestHandler(BaseHTTPRequestHandler):
+    """HTTP handler for the job API. The server holds the job queue."""
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Report the service health, a job, or the recent jobs."""
+        url = urlparse(self.path)
+        parts = [part for part in url.path.split("/") if part]
+        if parts == ["health"]:
+            self._send(200, {"accepting": not self.server.service.stop_token.cancelled})
+        elif parts == ["jobs"]:
+            status = parse_qs(url.query).get("status", [None])[0]
+            self._send(200, {"jobs": self.server.job_queue.list(status=status)})
+        elif len(parts) == 2 and parts[0] == "jobs" and parts[1].isdigit():
+            job = self.server.job_queue.get(int(parts[1]))
+            if job is None:
+                self._send(404, {"error": f"No job {parts[1]}"})
+            else:
+                self._send(200, job)
+        else:
+            self._send(404, {"error": f"Unknown path {url.path}"})
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Queue a job."""
+        if urlparse(self.path).path.rstrip("/") != "/jobs":
+            self._send(404, {"error": f"Unknown path {self.path}"})
+            return
+        if self.server.service.stop_token.cancelled:
+            self._send(503, {"error": "The service is stopping"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            job_id = self.server.service.submit(
+                request.get("command", "apply"),
+                request["show"],
+                request.get("division"),
+            )
+        except (ValueError, KeyError, TypeError) as error:
+            self._send(400, {"error": f"Invalid job request: {error!r}"})
+            return
+        self._send(202, {"id": job_id, "status": QUEUED})
+
+    def _send(self, status, body):
+        """Send a JSON response.
+
+        Args:
+            status (int): the HTTP status code.
+            body (dict): the response body.
+        """
+        payload = json.dumps(body, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """Log requests with the module logger instead of stderr.
+
+        Args:
+            format (str): the message format.
+            *args (Any): the message arguments.
+        """
+        logging.debug("%s - " + format, self.address_string(), *args)
+
+
+def create_server(
+    service: ShowSetupService, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT
+):
+    """Create the HTTP server for the job API.
+
+    Args:
+        service (ShowSetupService): the service executing the jobs.
+        host (str, optional): the address to listen on. Localhost by default,
+            since the API is not authenticated.
+        port (int, optional): the port to listen on, 0 for any free port.
+
+    Returns:
+        http.server.ThreadingHTTPServer: the server, not yet serving.
+    """
+    server = ThreadingHTTPServer((host, port), _JobRequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    server.job_queue = service.job_queue
+    return server
+
+
+def serve(
+    host: str = DEFAULT_HOST,
+    port: int = DEFAULT_PORT,
+    workers: int = DEFAULT_WORKERS,
+    queue_path: str = DEFAULT_QUEUE_PATH,
+):
+    """Run the service until Ctrl-C or SIGTERM.
+
+    Args:
+        host (str, optional): the address to listen on.
+        port (int, optional): the port to listen on.
+        workers (int, optional): how many jobs may run at once.
+        queue_path (str, optional): the job queue database file.
+    """
+    service = ShowSetupService(JobQueue(queue_path), workers=workers)
+    server = create_server(service, host, port)
+    server_thread = threading.Thread(
+        target=server.serve_forever, name="P4ShowSetupHTTP", daemon=True
+    )
+    service.start()
+    server_thread.start()
+    logging.info(
+        "Show setup service listening on http://%s:%s with %d workers",
+        *server.server_address[:2],
+        workers,
+    )
+    with p4_deadline_utility.handle_termination_signals(service.stop_token):
+        while not service.stop_token.cancelled:
+            try:
+                service.stop_token.sleep(POLL_INTERVAL_SECONDS)
+            except p4_deadline_utility.OperationCancelled:
+                break
+    logging.info("Stopping: waiting for running jobs to finish")
+    server.shutdown()
+    server.server_close()
+    service.stop()
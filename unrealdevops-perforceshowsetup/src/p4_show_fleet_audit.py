@@ -0,0 +1,303 @@
+# Copyright (C) 2023 DNEG - All Rights reserved.
+"""
+Perforce fleet audit.
+
+Compares every show on the server to its division config, as `audit` does for
+one show. Running the one-show audit for each of hundreds of shows costs a
+handful of server queries per show; the fleet audit instead scans the server
+once:
+- one `depots`, one tagged `groups` and one `protect -o` for the whole server,
+  run at the same time on pooled connections;
+- `streams` for pages of depots at a time, the pages run in parallel.
+
+The results are indexed in memory, protections lines by depot and by group,
+groups by name and streams by depot, so auditing each show only looks up its
+own entries and the whole audit stays linear in the number of shows.
+
+A show is any stream depot whose name looks like a show code. Its division is
+the one given, or deduced from its show code.
+"""
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import re
+
+import p4_show_setup
+from shared import p4_connection_utility
+from shared import protections_utility
+
+DEFAULT_WORKERS = 4
+DEFAULT_PAGE_SIZE = 50
+# 2-8 capitals and digits, not starting with a digit, see `validate_show()`.
+SHOW_CODE_PATTERN = re.compile(r"^[A-Z][A-Z0-9]{1,7}$")
+
+FleetState = collections.namedtuple(
+    "FleetState", ["shows", "lines_by_depot", "lines_by_group", "groups", "streams"]
+)
+FleetState.__doc__ = """The server's state, indexed for looking up one show at a time.
+
+Attributes:
+    shows (list[str]): the show depots.
+    lines_by_depot (dict): protections lines, keyed by the depot of their path.
+    lines_by_group (dict): protections lines granting access to a group,
+        keyed by the group.
+    groups (dict): the "Owners" and "Users" sets of every group, keyed by group.
+    streams (dict): the stream specs of every show, keyed by depot then stream.
+"""
+
+
+def is_show_depot(depot):
+    """Check whether a `depots` record is a show's depot.
+
+    Args:
+        depot (dict): the record, with the depot's "name" and "type".
+
+    Returns:
+        bool: whether it is a stream depot named like a show code.
+    """
+    return depot.get("type") == "stream" and bool(
+        SHOW_CODE_PATTERN.match(depot["name"])
+    )
+
+
+def division_config(show, config_data, division=None):
+    """Get the division config a show follows.
+
+    Args:
+        show (str): the show code.
+        config_data (dict): the configs for every division.
+        division (str, optional): the division of every show. Deduced from the
+            show code if not given.
+
+    Returns:
+        dict: the division config.
+    """
+    return config_data[division or p4_show_setup.division_from_show(show)]
+
+
+def index_protections(protections):
+    """Index the protections lines by the depot of their path and by group.
+
+    Args:
+        protections (list[str]): the protections table lines.
+
+    Returns:
+        tuple: the lines keyed by depot, and the group lines keyed by group.
+    """
+    lines_by_depot = collections.defaultdict(list)
+    lines_by_group = collections.defaultdict(list)
+    for line in protections:
+        entry = protections_utility.parse_entry(line)
+        if entry is None:
+            continue
+        depot = protections_utility.depot_of(entry.path)
+        if depot:
+            lines_by_depot[depot].append(line)
+        if entry.type == "group":
+            lines_by_group[entry.name].append(line)
+    return dict(lines_by_depot), dict(lines_by_group)
+
+
+def index_groups(records):
+    """Index the tagged `groups` records by group.
+
+    Args:
+        records (Iterable): the records, one per group member, or the group names.
+
+    Returns:
+        dict: the "Owners" and "Users" sets of every group.
+    """
+    groups = {}
+    for record in records:
+        if not isinstance(record, dict):
+            groups.setdefault(record, {"Owners": set(), "Users": set()})
+            continue
+        members = groups.setdefault(record["group"], {"Owners": set(), "Users": set()})
+        if record.get("user") and record.get("isSubGroup") != "1":
+            if record.get("isOwner") == "1":
+                members["Owners"].add(record["user"])
+            if record.get("isUser") == "1":
+                members["Users"].add(record["user"])
+    return groups
+
+
+def _pages(items, page_size):
+    """Split a list into pages.
+
+    Args:
+        items (list): the items.
+        page_size (int): the largest page.
+
+    Returns:
+        list[list]: the pages.
+    """
+    return [
+        items[start : start + page_size] for start in range(0, len(items), page_size)
+    ]
+
+
+def scan(pool, workers=DEFAULT_WORKERS, page_size=DEFAULT_PAGE_SIZE):
+    """Read the whole server's state with bulk queries on pooled connections.
+
+    Args:
+        pool (ConnectionPool): the pool of connected connections to use.
+        workers (int, optional): how many queries may run at once.
+        page_size (int, optional): the number of depots to list streams for per query.
+
+    Returns:
+        FleetState: the indexed state.
+    """
+
+    def run(*args):
+        with pool.acquire() as p4:
+            return p4.run(*args)
+
+    def read_groups():
+        # The groups listing has one record per member, so it is indexed as it streams.
+        with pool.acquire() as p4:
+            return index_groups(p4_connection_utility.run_iter(p4, "groups"))
+
+    with ThreadPoolExecutor(
+        max_workers=workers, thread_name_prefix="P4FleetAudit"
+    ) as executor:
+        depots = executor.submit(run, "depots")
+        groups = executor.submit(read_groups)
+        protections = executor.submit(run, "protect", "-o")
+
+        shows = sorted(
+            depot["name"] for depot in depots.result() if is_show_depot(depot)
+        )
+        stream_pages = [
+            executor.submit(run, "streams", *[f"//{show}/..." for show in page])
+            for page in _pages(shows, page_size)
+        ]
+        streams = collections.defaultdict(dict)
+        for page in stream_pages:
+            for spec in page.result():
+                streams[spec["Stream"].split("/")[2]][spec["Stream"]] = spec
+        lines_by_depot, lines_by_group = index_protections(
+            protections.result()[0]["Protections"]
+        )
+        return FleetState(
+            shows, lines_by_depot, lines_by_group, groups.result(), dict(streams)
+        )
+
+
+def expected_members(grp_settings, groups):
+    """Get the members a show group is configured to have.
+
+    Args:
+        grp_settings (dict | str): the group's config, or "empty".
+        groups (dict): the indexed groups, to expand source groups with.
+
+    Returns:
+        dict: the "Owners" and "Users" sets, keyed by member type.
+    """
+    members = {}
+    if grp_settings == "empty":
+        return members
+    for member_type, entries in grp_settings.items():
+        expected = members.setdefault(member_type, set())
+        for entry in entries:
+            if isinstance(entry, dict) and "groups" in entry:
+                expected.update(groups.get(entry["groups"], {}).get("Users", set()))
+            else:
+                expected.add(entry)
+    return members
+
+
+def audit_show(show, json_config, state):
+    """Compare one show to its division config, using only the indexed state.
+
+    Args:
+        show (str): the show code.
+        json_config (dict): the division config.
+        state (FleetState): the indexed server state.
+
+    Returns:
+        dict: the differences, only the non-empty ones of: the "Permissions"
+            lines that are missing, the "Extra Permissions" lines granting access
+            to the show that are not in its config, the missing "Groups", the
+            "Owners" missing from each group, the missing "Streams", and the
+            "Mismatched Streams" whose type or parent differ.
+    """
+    plan = p4_show_setup.P4ShowSetup(show, json_config).plan()
+    planned_rules = {protections_utility.rule_of(line) for line in plan["Permissions"]}
+
+    lines = list(state.lines_by_depot.get(show, []))
+    seen = set(lines)
+    for grp in plan["Groups"]:
+        for line in state.lines_by_group.get(grp, []):
+            if line not in seen:
+                seen.add(line)
+                lines.append(line)
+    live_rules = {protections_utility.rule_of(line) for line in lines}
+
+    differences = {
+        "Permissions": [
+            line
+            for line in plan["Permissions"]
+            if protections_utility.rule_of(line) not in live_rules
+        ],
+        "Extra Permissions": [
+            line
+            for line in lines
+            if protections_utility.rule_of(line) not in planned_rules
+        ],
+        "Groups": [grp for grp in plan["Groups"] if grp not in state.groups],
+        "Owners": {},
+        "Streams": [],
+        "Mismatched Streams": [],
+    }
+    for grp_name, grp_settings in json_config["groups"].items():
+        grp = grp_name.replace("{show}", show)
+        if grp not in state.groups:
+            continue
+        owners = expected_members(grp_settings, state.groups).get("Owners", set())
+        missing = sorted(owners - state.groups[grp]["Owners"])
+        if missing:
+            differences["Owners"][grp] = missing
+
+    live_streams = state.streams.get(show, {})
+    for stream, stream_settings in plan["Streams"].items():
+        if stream not in live_streams:
+            differences["Streams"].append(stream)
+            continue
+        live = live_streams[stream]
+        if live.get("Type") != stream_settings["type"] or (
+            live.get("Parent", "none") != stream_settings.get("parent", "none")
+        ):
+            differences["Mismatched Streams"].append(stream)
+    return {key: value for key, value in differences.items() if value}
+
+
+def audit_fleet(
+    pool,
+    config_data,
+    division=None,
+    workers=DEFAULT_WORKERS,
+    page_size=DEFAULT_PAGE_SIZE,
+):
+    """Compare every show on the server to its division config.
+
+    Args:
+        pool (ConnectionPool): the pool of connected connections to use.
+        config_data (dict): the configs for every division.
+        division (str, optional): the division of every show. Deduced from each
+            show code if not given.
+        workers (int, optional): how many queries may run at once.
+        page_size (int, optional): the number of depots to list streams for per query.
+
+    Returns:
+        dict: the differences of every show that has any, keyed by show.
+    """
+    state = scan(pool, workers=workers, page_size=page_size)
+    logging.info("Auditing %d shows", len(state.shows))
+    report = {}
+    for show in state.shows:
+        differences = audit_show(
+            show, division_config(show, config_data, division), state
+        )
+        if differences:
+            report[show] = differences
+    return report
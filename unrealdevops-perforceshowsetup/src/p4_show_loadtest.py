@@ -0,0 +1,339 @@
+# Copyright (C) 2023 DNEG - All Rights reserved.
+"""
+Perforce show setup load test.
+
+Drives many concurrent `P4ShowSetup` runs against a simulated commit server,
+see `shared.p4_simulator_utility`, at increasing levels of concurrency. For
+each level it reports:
+- throughput, in setups per second;
+- the p50, p95 and p99 latency of a whole setup;
+- the time setups spent waiting on table locks, mostly `protect -i` and
+  `populate`, and the share of their latency it makes up;
+- protections entries lost to concurrent `protect -o` / `protect -i` updates
+  overwriting each other.
+
+Each simulated setup stands for an operator running its own process, so it
+gets its own `P4ShowSetup.protections_lock` and nothing in this process
+serializes its protections updates with the other setups'.
+
+Every level starts from a fresh server, so levels do not affect each other.
+"""
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import math
+import threading
+import time
+
+import p4_show_setup
+from shared import p4_simulator_utility
+
+DEFAULT_CONCURRENCY_LEVELS = (1, 2, 4, 8, 16)
+DEFAULT_SETUPS_PER_LEVEL = 16
+SHOW_PREFIX = "LT"
+# Users of the groups the show groups copy their owners from.
+SOURCE_GROUP_USERS = ["vp_lead", "vp_artist"]
+
+SetupOutcome = collections.namedtuple(
+    "SetupOutcome",
+    [
+        "show",
+        "succeeded",
+        "duration",
+        "lock_wait",
+        "round_trips",
+        "error",
+        "permissions_lost",
+    ],
+)
+SetupOutcome.__doc__ = """Outcome of one simulated setup.
+
+Attributes:
+    show (str): the show code.
+    succeeded (bool): whether every step succeeded.
+    duration (float): the seconds the setup took, rollback included.
+    lock_wait (float): the seconds it waited for table locks, and for its
+        protections lock.
+    round_trips (int): the commands it ran.
+    error (str): why it failed, or None.
+    permissions_lost (bool): whether its verification found its protections
+        entries missing.
+"""
+
+LevelReport = collections.namedtuple(
+    "LevelReport",
+    [
+        "concurrency",
+        "setups",
+        "failures",
+        "elapsed",
+        "throughput",
+        "p50",
+        "p95",
+        "p99",
+        "lock_wait_mean",
+        "lock_wait_p95",
+        "lock_wait_share",
+        "lost_permissions",
+    ],
+)
+LevelReport.__doc__ = """Results of one concurrency level.
+
+Attributes:
+    concurrency (int): the number of setups run at once.
+    setups (int): the number of setups run.
+    failures (int): the number of setups that failed.
+    elapsed (float): the seconds the level took.
+    throughput (float): setups completed per second.
+    p50 (float): median setup latency, in seconds.
+    p95 (float): 95th percentile setup latency, in seconds.
+    p99 (float): 99th percentile setup latency, in seconds.
+    lock_wait_mean (float): mean seconds a setup waited for locks.
+    lock_wait_p95 (float): 95th percentile seconds a setup waited for locks.
+    lock_wait_share (float): share of the total setup time spent waiting for locks.
+    lost_permissions (int): setups whose protections entries were overwritten
+        by another setup.
+"""
+
+
+class _OperatorLock:
+    """Protections lock of one simulated operator, timing how long it waits."""
+
+    def __init__(self):
+        """Construct an instance of _OperatorLock."""
+        self._lock = threading.Lock()
+        self.wait = 0.0
+
+    def __enter__(self):
+        """Take the lock.
+
+        Returns:
+            _OperatorLock: this lock.
+        """
+        start = time.perf_counter()
+        self._lock.acquire()
+        self.wait += time.perf_counter() - start
+        return self
+
+    def __exit__(self, *exc_info):
+        """Release the lock.
+
+        Args:
+            *exc_info (Any): the exception raised in the block, if any.
+        """
+        self._lock.release()
+
+
+def percentile(values, fraction):
+    """Get a percentile of some values, by the nearest-rank method.
+
+    Args:
+        values (list[float]): the values.
+        fraction (float): the percentile, between 0 and 1.
+
+    Returns:
+        float: the percentile, 0 if there are no values.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = min(max(1, math.ceil(fraction * len(ordered))), len(ordered))
+    return ordered[rank - 1]
+
+
+def _run_setup(server, show, json_config, protections_lock=None):
+    """Run one setup against the simulated server, rolling back on failure.
+
+    Args:
+        server (SimulatedServer): the server.
+        show (str): the show code.
+        json_config (dict): the division config.
+        protections_lock (_OperatorLock, optional): the lock held around its
+            protections updates. A new one, shared with no other setup, if None.
+
+    Returns:
+        SetupOutcome: how the setup went.
+    """
+    if protections_lock is None:
+        protections_lock = _OperatorLock()
+    connection = p4_simulator_utility.SimulatedConnection(server)
+    connection.connect()
+    show_setup_instance = p4_show_setup.P4ShowSetup(show, json_config, p4=connection)
+    show_setup_instance.protections_lock = protections_lock
+    start = time.perf_counter()
+    error = None
+    permissions_lost = False
+    try:
+        for step_name in p4_show_setup.SETUP_STEPS:
+            getattr(show_setup_instance, step_name)()
+    except Exception as setup_error:  # pylint: disable=broad-except
+        error = repr(setup_error)
+        permissions_lost = isinstance(
+            setup_error, p4_show_setup.PermissionsVerificationError
+        )
+        try:
+            show_setup_instance.undo_show_setup()
+        except Exception as undo_error:  # pylint: disable=broad-except
+            logging.warning("Rolling back %s failed: %r", show, undo_error)
+    return SetupOutcome(
+        show,
+        error is None,
+        time.perf_counter() - start,
+        connection.lock_wait + protections_lock.wait,
+        connection.round_trips,
+        error,
+        permissions_lost,
+    )
+
+
+def _lost_permissions(server, outcomes, json_config):
+    """Count the setups whose protections entries are gone.
+
+    Verification fails the setups that find their entries missing, and the
+    successful setups are checked against the table left at the end.
+
+    Args:
+        server (SimulatedServer): the server.
+        outcomes (list[SetupOutcome]): the setups.
+        json_config (dict): the division config.
+
+    Returns:
+        int: the number of setups missing entries.
+    """
+    rules = {
+        p4_show_setup.strip_permission_comment(entry) for entry in server.protections
+    }
+    lost = 0
+    for outcome in outcomes:
+        if outcome.permissions_lost:
+            lost += 1
+            continue
+        if not outcome.succeeded:
+            continue
+        planned = p4_show_setup.P4ShowSetup(
+            outcome.show, json_config
+        ).render_permissions("")
+        if any(
+            p4_show_setup.strip_permission_comment(entry) not in rules
+            for entry in planned
+        ):
+            lost += 1
+    return lost
+
+
+def run_level(
+    concurrency, setups, json_config, timings=p4_simulator_utility.DEFAULT_TIMINGS
+):
+    """Run setups concurrently against a fresh simulated server.
+
+    Args:
+        concurrency (int): the number of setups to run at once.
+        setups (int): the number of setups to run.
+        json_config (dict): the division config.
+        timings (SimulatorTimings, optional): how long the server takes.
+
+    Returns:
+        tuple: the `LevelReport` and the `SetupOutcome` of every setup.
+    """
+    server = p4_simulator_utility.SimulatedServer(
+        timings,
+        groups={
+            group: {
+                "Group": group,
+                "Description": "",
+                "Users": list(SOURCE_GROUP_USERS),
+            }
+            for group in p4_show_setup.get_source_groups(json_config)
+        },
+    )
+    shows = [f"{SHOW_PREFIX}{index:04d}" for index in range(setups)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(
+        max_workers=concurrency, thread_name_prefix="P4ShowSetupLoad"
+    ) as executor:
+        outcomes = list(
+            executor.map(lambda show: _run_setup(server, show, json_config), shows)
+        )
+    elapsed = time.perf_counter() - start
+
+    durations = [outcome.duration for outcome in outcomes]
+    lock_waits = [outcome.lock_wait for outcome in outcomes]
+    completed = sum(1 for outcome in outcomes if outcome.succeeded)
+    report = LevelReport(
+        concurrency=concurrency,
+        setups=setups,
+        failures=setups - completed,
+        elapsed=elapsed,
+        throughput=completed / elapsed if elapsed else 0.0,
+        p50=percentile(durations, 0.50),
+        p95=percentile(durations, 0.95),
+        p99=percentile(durations, 0.99),
+        lock_wait_mean=sum(lock_waits) / len(lock_waits) if lock_waits else 0.0,
+        lock_wait_p95=percentile(lock_waits, 0.95),
+        lock_wait_share=sum(lock_waits) / sum(durations) if sum(durations) else 0.0,
+        lost_permissions=_lost_permissions(server, outcomes, json_config),
+    )
+    return report, outcomes
+
+
+def run_load_test(
+    json_config,
+    concurrency_levels=DEFAULT_CONCURRENCY_LEVELS,
+    setups=DEFAULT_SETUPS_PER_LEVEL,
+    timings=p4_simulator_utility.DEFAULT_TIMINGS,
+):
+    """Run the load test at every concurrency level.
+
+    Args:
+        json_config (dict): the division config.
+        concurrency_levels (list[int], optional): the numbers of concurrent setups.
+        setups (int, optional): the setups to run at each level.
+        timings (SimulatorTimings, optional): how long the server takes.
+
+    Returns:
+        list[LevelReport]: the report of each level.
+    """
+    reports = []
+    for concurrency in concurrency_levels:
+        logging.info("Running %d setups, %d at a time", setups, concurrency)
+        report, outcomes = run_level(concurrency, setups, json_config, timings)
+        for outcome in outcomes:
+            if not outcome.succeeded:
+                logging.debug("Setup %s failed: %s", outcome.show, outcome.error)
+        reports.append(report)
+    return reports
+
+
+def format_report(reports):
+    """Format the level reports as a table.
+
+    Args:
+        reports (list[LevelReport]): the reports.
+
+    Returns:
+        str: the table.
+    """
+    lines = [
+        f"{'conc':>5} {'setups/s':>9} {'p50 s':>8} {'p95 s':>8} {'p99 s':>8} "
+        f"{'lock s':>8} {'lock p95':>8} {'lock %':>7} {'failed':>7} {'lost':>5}"
+    ]
+    for report in reports:
+        lines.append(
+            f"{report.concurrency:>5} {report.throughput:>9.2f} {report.p50:>8.3f} "
+            f"{report.p95:>8.3f} {report.p99:>8.3f} {report.lock_wait_mean:>8.3f} "
+            f"{report.lock_wait_p95:>8.3f} {report.lock_wait_share * 100:>6.1f}% "
+            f"{report.failures:>7} {report.lost_permissions:>5}"
+        )
+    return "\n".join(lines)
+
+
+def write_report(reports, path):
+    """Write the level reports as JSON.
+
+    Args:
+        reports (list[LevelReport]): the reports.
+        path (str): the file to write.
+    """
+    with open(path, "w", encoding="utf-8") as report_file:
+        json.dump([report._asdict() for report in reports], report_file, indent=2)
@@ -0,0 +1,225 @@
+# Copyright (C) 2023 DNEG - All Rights reserved.
+"""
+Perforce show orphan scanner.
+
+Finds what failed setups, partial undos and hand edits left behind of shows
+whose depot no longer exists:
+- show groups, named after a group in a division config, such as
+  `SHOW-External`, or the bare `SHOW` group of a show that has other
+  leftovers;
+- protections lines whose path is in a depot that does not exist, or that
+  grant access to a leftover show group;
+- streams whose depot does not exist.
+
+The server is read with one `depots`, one `groups`, one `protect -o` and one
+`streams` query, run at the same time on pooled connections, and everything
+is matched against in-memory indexes. The cleanup removes every orphaned
+protections line in a single table write, and deletes the groups and streams
+in parallel.
+"""
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import re
+
+import p4_show_fleet_audit
+import p4_show_teardown
+from shared import p4_connection_utility
+from shared import protections_utility
+
+DEFAULT_WORKERS = 4
+
+OrphanReport = collections.namedtuple(
+    "OrphanReport", ["groups", "protections", "stream_levels"]
+)
+OrphanReport.__doc__ = """What is left of shows whose depot does not exist.
+
+Attributes:
+    groups (list[str]): the leftover show groups.
+    protections (list[str]): the orphaned protections lines, in table order.
+    stream_levels (list[list[str]]): the streams whose depot does not exist,
+        deepest level first.
+"""
+
+
+def show_group_patterns(config_data):
+    """Compile the show group names of every division config into patterns.
+
+    The bare `{show}` group is left out, since any upper case group name
+    would match it.
+
+    Args:
+        config_data (dict): the configs for every division.
+
+    Returns:
+        list[re.Pattern]: patterns capturing the show code as "show".
+    """
+    show_code = p4_show_fleet_audit.SHOW_CODE_PATTERN.pattern.strip("^$")
+    templates = {
+        grp_name
+        for json_config in config_data.values()
+        for grp_name in json_config.get("groups", {})
+        if grp_name != "{show}" and "{show}" in grp_name
+    }
+    return [
+        re.compile(
+            "^"
+            + re.escape(template).replace(re.escape("{show}"), f"(?P<show>{show_code})")
+            + "$"
+        )
+        for template in sorted(templates)
+    ]
+
+
+def find_orphans(depots, groups, protections, streams, config_data):
+    """Find the leftovers of shows whose depot does not exist.
+
+    Args:
+        depots (Iterable[str]): the names of every depot.
+        groups (Iterable[str]): the names of every group.
+        protections (list[str]): the protections table lines.
+        streams (list[dict]): the `streams` results, with `Stream` and `Parent`.
+        config_data (dict): the configs for every division.
+
+    Returns:
+        OrphanReport: the leftovers.
+    """
+    # Names are matched without regard to case, as on the show setup server.
+    depots = {depot.casefold() for depot in depots}
+    groups = set(groups)
+    patterns = show_group_patterns(config_data)
+
+    orphan_groups = set()
+    missing_shows = set()
+    for grp in groups:
+        for pattern in patterns:
+            match = pattern.match(grp)
+            if match and match.group("show").casefold() not in depots:
+                orphan_groups.add(grp)
+                missing_shows.add(match.group("show").casefold())
+                break
+
+    entries = []
+    for line in protections:
+        entry = protections_utility.parse_entry(line)
+        if entry is None:
+            continue
+        depot = protections_utility.depot_of(entry.path)
+        depot = depot.casefold() if depot else None
+        entries.append((line, entry, depot))
+        if depot and depot not in depots:
+            missing_shows.add(depot)
+    # The bare show group, only for shows with other leftovers.
+    orphan_groups.update(
+        grp
+        for grp in groups
+        if grp.casefold() in missing_shows
+        and p4_show_fleet_audit.SHOW_CODE_PATTERN.match(grp)
+    )
+    orphan_group_names = {grp.casefold() for grp in orphan_groups}
+
+    orphan_lines = [
+        line
+        for line, entry, depot in entries
+        if (depot and depot not in depots)
+        or (entry.type == "group" and entry.name.casefold() in orphan_group_names)
+    ]
+    orphan_streams = [
+        spec
+        for spec in streams
+        if spec["Stream"].split("/")[2].casefold() not in depots
+    ]
+    return OrphanReport(
+        sorted(orphan_groups),
+        orphan_lines,
+        p4_show_teardown.stream_levels(orphan_streams),
+    )
+
+
+def scan(pool, config_data, workers=DEFAULT_WORKERS):
+    """Read the server with one query of each kind, and find the leftovers.
+
+    Args:
+        pool (ConnectionPool): the pool of connected connections to use.
+        config_data (dict): the configs for every division.
+        workers (int, optional): how many queries may run at once.
+
+    Returns:
+        OrphanReport: the leftovers.
+    """
+
+    def run(*args):
+        with pool.acquire() as p4:
+            return p4.run(*args)
+
+    def read_groups():
+        # The groups listing has one record per member, so it is indexed as it streams.
+        with pool.acquire() as p4:
+            return p4_show_fleet_audit.index_groups(
+                p4_connection_utility.run_iter(p4, "groups")
+            )
+
+    with ThreadPoolExecutor(
+        max_workers=workers, thread_name_prefix="P4Orphans"
+    ) as executor:
+        depots = executor.submit(run, "depots")
+        groups = executor.submit(read_groups)
+        protections = executor.submit(run, "protect", "-o")
+        streams = executor.submit(run, "streams", "//...")
+        return find_orphans(
+            [depot["name"] for depot in depots.result()],
+            groups.result(),
+            protections.result()[0]["Protections"],
+            streams.result(),
+            config_data,
+        )
+
+
+def cleanup(pool, report, workers=DEFAULT_WORKERS):
+    """Remove the leftovers.
+
+    The protections lines are removed in one table write, read again right
+    before it. Groups, and streams level by level, are deleted in parallel.
+
+    Args:
+        pool (ConnectionPool): the pool of connected connections to use.
+        report (OrphanReport): the leftovers.
+        workers (int, optional): how many deletions may run at once.
+
+    Returns:
+        dict: the error of each leftover that could not be removed.
+    """
+    errors = {}
+    if report.protections:
+        orphan_lines = set(report.protections)
+        with pool.acquire() as p4:
+            table = p4.run("protect", "-o")
+            table[0]["Protections"] = [
+                line for line in table[0]["Protections"] if line not in orphan_lines
+            ]
+            p4.input = table
+            logging.info(p4.run("protect", "-i"))
+        logging.info("Removed %d orphaned protections lines", len(orphan_lines))
+
+    def delete(*args):
+        with pool.acquire() as p4:
+            return p4.run(*args)
+
+    def delete_all(executor, commands):
+        futures = {
+            item: executor.submit(delete, *args) for item, args in commands.items()
+        }
+        for item, future in futures.items():
+            try:
+                logging.info("Removed %s: %s", item, future.result())
+            except p4_connection_utility.p4_exception_types() as error:
+                logging.error("Could not remove %s: %s", item, error)
+                errors[item] = str(error)
+
+    with ThreadPoolExecutor(
+        max_workers=workers, thread_name_prefix="P4Orphans"
+    ) as executor:
+        delete_all(executor, {grp: ("group", "-d", grp) for grp in report.groups})
+        for level in report.stream_levels:
+            delete_all(executor, {stream: ("stream", "-d", stream) for stream in level})
+    return errors
@@ -0,0 +1,194 @@
+# Copyright (C) 2023 DNEG - All Rights reserved.
+"""
+Perforce show group owner sync.
+
+Show groups copy the members of source groups when they are created, through
+`{"groups": "<source>"}` entries in the division config, such as the Owners of
+`{show}-External` in the TS config. When a source group changes, its dependent
+show groups go stale. Syncing them:
+- reads every group with one tagged `groups` query, and the show depots with
+  one `depots` query;
+- builds a reverse index from each source group to the show groups that
+  depend on it, from the division configs;
+- works out, for each dependent group, the members its config requires that
+  it is missing, and with pruning the members it has that its config no longer
+  requires;
+- rewrites only the groups that change, in parallel on pooled connections.
+"""
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import logging
+
+import p4_show_fleet_audit
+from shared import p4_connection_utility
+
+DEFAULT_WORKERS = 4
+# Set as the only user of new groups without users, see `create_groups()`.
+PLACEHOLDER_USER = "empty"
+
+Dependent = collections.namedtuple("Dependent", ["group", "settings"])
+Dependent.__doc__ = """A show group whose members come from source groups.
+
+Attributes:
+    group (str): the show group.
+    settings (dict): the group's config, its member entries keyed by member type.
+"""
+
+
+def source_index(shows, config_data, division=None):
+    """Index the show groups that copy members from each source group.
+
+    Args:
+        shows (list[str]): the show codes.
+        config_data (dict): the configs for every division.
+        division (str, optional): the division of every show. Deduced from each
+            show code if not given.
+
+    Returns:
+        dict: the `Dependent` show groups, keyed by source group.
+    """
+    index = collections.defaultdict(list)
+    for show in shows:
+        json_config = p4_show_fleet_audit.division_config(show, config_data, division)
+        for grp_name, grp_settings in json_config["groups"].items():
+            if grp_settings == "empty":
+                continue
+            sources = {
+                entry["groups"]
+                for entries in grp_settings.values()
+                for entry in entries
+                if isinstance(entry, dict) and "groups" in entry
+            }
+            dependent = Dependent(grp_name.replace("{show}", show), grp_settings)
+            for source in sources:
+                index[source].append(dependent)
+    return dict(index)
+
+
+def plan_sync(groups, index, sources=None, prune=False):
+    """Work out the member changes of every dependent group that is stale.
+
+    Args:
+        groups (dict): the "Owners" and "Users" sets of every group, from
+            `p4_show_fleet_audit.index_groups()`.
+        index (dict): the dependent groups of each source group.
+        sources (list[str], optional): only sync the dependents of these
+            source groups. Every source group if not given.
+        prune (bool, optional): whether to also remove the members a group's
+            config no longer requires.
+
+    Returns:
+        dict: the "add" and "remove" lists of each changed member type, keyed by
+            group then member type.
+    """
+    changes = {}
+    dependents = {}
+    for source in sources if sources is not None else sorted(index):
+        for dependent in index.get(source, []):
+            dependents.setdefault(dependent.group, dependent)
+    for grp, dependent in sorted(dependents.items()):
+        if grp not in groups:
+            # Missing groups are for `converge` to create.
+            continue
+        expected = p4_show_fleet_audit.expected_members(dependent.settings, groups)
+        for member_type, members in expected.items():
+            current = groups[grp].get(member_type, set())
+            change = {"add": sorted(members - current), "remove": []}
+            if prune:
+                change["remove"] = sorted(current - members - {PLACEHOLDER_USER})
+            if change["add"] or change["remove"]:
+                changes.setdefault(grp, {})[member_type] = change
+    return changes
+
+
+def _rewrite_group(pool, grp, change):
+    """Apply the member changes to a group with one read and one write.
+
+    Args:
+        pool (ConnectionPool): the pool of connected connections to use.
+        grp (str): the group.
+        change (dict): the "add" and "remove" lists, keyed by member type.
+
+    Returns:
+        list: the `group -i` results.
+    """
+    with pool.acquire() as p4:
+        spec = p4.run("group", "-o", grp)[0]
+        for member_type, members in change.items():
+            current = [
+                member
+                for member in spec.get(member_type, [])
+                if member not in members["remove"]
+            ]
+            current.extend(member for member in members["add"] if member not in current)
+            spec[member_type] = current
+        p4.input = [spec]
+        return p4.run("group", "-i")
+
+
+def apply_sync(pool, changes, workers=DEFAULT_WORKERS):
+    """Rewrite the changed groups in parallel.
+
+    Args:
+        pool (ConnectionPool): the pool of connected connections to use.
+        changes (dict): the member changes, from `plan_sync()`.
+        workers (int, optional): how many groups may be rewritten at once.
+
+    Returns:
+        dict: the error of each group that could not be rewritten.
+    """
+    errors = {}
+    with ThreadPoolExecutor(
+        max_workers=workers, thread_name_prefix="P4OwnerSync"
+    ) as executor:
+        futures = {
+            grp: executor.submit(_rewrite_group, pool, grp, change)
+            for grp, change in changes.items()
+        }
+        for grp, future in futures.items():
+            try:
+                logging.info("Synced %s: %s", grp, future.result())
+            except p4_connection_utility.p4_exception_types() as error:
+                logging.error("Could not sync %s: %s", grp, error)
+                errors[grp] = str(error)
+    return errors
+
+
+def plan_fleet_sync(pool, config_data, division=None, sources=None, prune=False):
+    """Read the show depots and the groups, and work out the member changes.
+
+    Args:
+        pool (ConnectionPool): the pool of connected connections to use.
+        config_data (dict): the configs for every division.
+        division (str, optional): the division of every show. Deduced from each
+            show code if not given.
+        sources (list[str], optional): only sync the dependents of these
+            source groups.
+        prune (bool, optional): whether to also remove the members a group's
+            config no longer requires.
+
+    Returns:
+        dict: the member changes, see `plan_sync()`.
+    """
+    with pool.acquire() as p4:
+        shows = sorted(
+            depot["name"]
+            for depot in p4.run("depots")
+            if p4_show_fleet_audit.is_show_depot(depot)
+        )
+        groups = p4_show_fleet_audit.index_groups(
+            p4_connection_utility.run_iter(p4, "groups")
+        )
+    index = source_index(shows, config_data, division)
+    logging.info(
+        "%d show groups depend on %d source groups",
+        len(
+            {
+                dependent.group
+                for dependents in index.values()
+                for dependent in dependents
+            }
+        ),
+        len(index),
+    )
+    return plan_sync(groups, index, sources, prune)
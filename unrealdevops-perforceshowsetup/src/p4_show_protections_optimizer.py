@@ -0,0 +1,421 @@
+# Copyright (C) 2023 DNEG - All Rights reserved.
+"""
+Perforce protections table optimizer.
+
+The server evaluates the protections table for every command, so every line
+adds to the latency of every user. Show setups add lines for each show and
+never remove them, and hand edits leave lines that change nobody's access:
+- duplicate lines, with the same rule as a line below them;
+- shadowed lines, whose every request is decided first by a line below them
+  granting at least the same rights to the same user or group, on a host and
+  path covering theirs;
+- redundant lines, covered the same way by a line above them, with no line in
+  between that could exclude any of their rights. For example
+  `write group SHOW 10.* //SHOW/*-dev/...` under `write group SHOW * //SHOW/...`.
+
+The optimized table leaves these lines out. It is compared to the current
+table with the local evaluator in `shared.protections_utility`, for a member
+of every line's user or group, from every host in the table, on a file of
+every line's path. It is only submitted, in a single table write, if nobody's
+access changes and the table did not change since it was read.
+"""
+import collections
+import logging
+import re
+
+from shared import protections_utility
+
+# Perforce path wildcards. Hosts only use `*`.
+WILDCARD_PATTERN = re.compile(r"\.\.\.|\*|%%[0-9]")
+PROBE_USER = "probe-user"
+
+Finding = collections.namedtuple("Finding", ["index", "line", "kind", "covered_by"])
+Finding.__doc__ = """A protections line that changes nobody's access.
+
+Attributes:
+    index (int): the line's index in the table.
+    line (str): the line.
+    kind (str): "duplicate", "shadowed" or "redundant".
+    covered_by (str): the line deciding its requests instead.
+"""
+
+Optimization = collections.namedtuple(
+    "Optimization", ["current", "updated", "findings", "differences"]
+)
+Optimization.__doc__ = """A protections table optimization.
+
+Attributes:
+    current (list[str]): the table as it was read.
+    updated (list[str]): the table without the lines found.
+    findings (list[Finding]): the lines left out, in table order.
+    differences (list[tuple]): the probes whose access the optimization
+        changes, with the rights before and after. Empty if it is equivalent.
+"""
+
+
+def _literal_prefix(pattern):
+    """Get the part of a path or host pattern before its first wildcard.
+
+    Args:
+        pattern (str): the pattern.
+
+    Returns:
+        str: the prefix, lower cased.
+    """
+    match = WILDCARD_PATTERN.search(pattern)
+    return (pattern[: match.start()] if match else pattern).lower()
+
+
+def _pattern_covers(outer, inner, match_all):
+    """Check whether a path or host pattern matches everything another one matches.
+
+    Only proven for identical patterns, and for patterns that are a literal
+    prefix followed by a wildcard matching anything, e.g. `//SHOW/...`.
+
+    Args:
+        outer (str): the broader pattern.
+        inner (str): the narrower pattern.
+        match_all (str): the wildcard matching anything, "..." for paths and "*" for hosts.
+
+    Returns:
+        bool: whether `outer` is proven to cover `inner`.
+    """
+    if outer.lower() == inner.lower():
+        return True
+    if not outer.endswith(match_all):
+        return False
+    prefix = outer[: -len(match_all)]
+    return not WILDCARD_PATTERN.search(prefix) and inner.lower().startswith(
+        prefix.lower()
+    )
+
+
+def _patterns_may_overlap(first, second):
+    """Check whether two path or host patterns could match the same thing.
+
+    Args:
+        first (str): a pattern.
+        second (str): the other pattern.
+
+    Returns:
+        bool: False only if no path or host can match both.
+    """
+    first, second = _literal_prefix(first), _literal_prefix(second)
+    return first.startswith(second) or second.startswith(first)
+
+
+def _path_of(rule):
+    """Get a compiled line's path, without the exclusion `-`.
+
+    Args:
+        rule (Rule): the compiled line.
+
+    Returns:
+        str: the path.
+    """
+    return rule.entry.path[1:] if rule.exclusion else rule.entry.path
+
+
+def covers(outer, inner):
+    """Check whether a line grants everything another line grants, to everyone it grants it to.
+
+    Args:
+        outer (Rule): the broader compiled line.
+        inner (Rule): the narrower compiled line.
+
+    Returns:
+        bool: whether both grant access, and `outer` applies to every user, host
+            and path `inner` applies to, with at least the same rights.
+    """
+    if outer.exclusion or inner.exclusion or not outer.rights >= inner.rights:
+        return False
+    principal = (outer.entry.type, outer.entry.name)
+    if principal not in ((inner.entry.type, inner.entry.name), ("user", "*")):
+        return False
+    return _pattern_covers(outer.entry.host, inner.entry.host, "*") and _pattern_covers(
+        _path_of(outer), _path_of(inner), "..."
+    )
+
+
+def _may_exclude(exclusion, rule):
+    """Check whether an exclusion line could take away a right another line grants.
+
+    Args:
+        exclusion (Rule): the compiled exclusion line.
+        rule (Rule): the compiled line granting access.
+
+    Returns:
+        bool: False only if the exclusion cannot apply to any of the line's requests.
+    """
+    if not exclusion.rights & rule.rights:
+        return False
+    if (
+        exclusion.entry.type == rule.entry.type == "user"
+        and not ("*" in exclusion.entry.name + rule.entry.name)
+        and exclusion.entry.name != rule.entry.name
+    ):
+        return False
+    return _patterns_may_overlap(exclusion.entry.host, rule.entry.host) and (
+        _patterns_may_overlap(_path_of(exclusion), _path_of(rule))
+    )
+
+
+def analyze(protections):
+    """Find the protections lines that change nobody's access.
+
+    Duplicate and shadowed lines never decide a request, so they are found
+    against the whole table. Redundant lines do decide requests, so each one
+    is only left out if the line above it that covers it is kept.
+
+    Args:
+        protections (list[str]): the protections table lines.
+
+    Returns:
+        list[Finding]: the lines to leave out, in table order.
+    """
+    rules = [
+        (index, rule)
+        for index, rule in (
+            (index, protections_utility.compile_rule(line))
+            for index, line in enumerate(protections)
+        )
+        if rule is not None
+    ]
+    findings = {}
+
+    # From the bottom up, against the lines below.
+    below_rules = {}
+    below = collections.defaultdict(list)
+    for index, rule in reversed(rules):
+        rule_text = protections_utility.rule_of(rule.entry.line)
+        if rule_text in below_rules:
+            findings[index] = Finding(
+                index, rule.entry.line, "duplicate", below_rules[rule_text]
+            )
+        else:
+            for candidate in _candidates(below, rule):
+                if covers(candidate, rule):
+                    findings[index] = Finding(
+                        index, rule.entry.line, "shadowed", candidate.entry.line
+                    )
+                    break
+        below_rules.setdefault(rule_text, rule.entry.line)
+        below[(rule.entry.type, rule.entry.name)].append(rule)
+
+    # From the top down, against the kept lines above.
+    exclusions = []
+    above = collections.defaultdict(list)
+    for index, rule in rules:
+        if index in findings:
+            continue
+        if rule.exclusion:
+            exclusions.append((index, rule))
+            continue
+        for candidate_index, candidate in reversed(
+            _candidates(above, rule, with_index=True)
+        ):
+            if covers(candidate, rule) and not any(
+                candidate_index < exclusion_index and _may_exclude(exclusion, rule)
+                for exclusion_index, exclusion in exclusions
+            ):
+                findings[index] = Finding(
+                    index, rule.entry.line, "redundant", candidate.entry.line
+                )
+                break
+        else:
+            above[(rule.entry.type, rule.entry.name)].append((index, rule))
+    return [findings[index] for index in sorted(findings)]
+
+
+def _candidates(lines, rule, with_index=False):
+    """Get the lines that could cover a line.
+
+    Args:
+        lines (dict): lines keyed by their (type, name).
+        rule (Rule): the compiled line.
+        with_index (bool, optional): whether the lines are (index, Rule) pairs,
+            to be returned in table order.
+
+    Returns:
+        list: the lines of the same user or group, and those of every user.
+    """
+    candidates = list(lines.get((rule.entry.type, rule.entry.name), []))
+    if (rule.entry.type, rule.entry.name) != ("user", "*"):
+        candidates.extend(lines.get(("user", "*"), []))
+    if with_index:
+        candidates.sort(key=lambda item: item[0])
+    return candidates
+
+
+def evaluation_cost(protections):
+    """Estimate what evaluating the table costs the server, for each command.
+
+    The server matches the command's user, host and files against every line,
+    and a wildcard costs more to match than a literal path.
+
+    Args:
+        protections (list[str]): the protections table lines.
+
+    Returns:
+        int: a relative cost: one for each line, and one more for each of its wildcards.
+    """
+    cost = 0
+    for line in protections:
+        entry = protections_utility.parse_entry(line)
+        if entry is not None:
+            cost += 1 + len(WILDCARD_PATTERN.findall(entry.host + " " + entry.path))
+    return cost
+
+
+def probes(protections):
+    """Get the requests to compare two versions of the table with.
+
+    Each line is probed with its user or a member of its group, in no other
+    group and in every group of the table, and with a user in no group, from
+    every host in the table, on a file of its path.
+
+    Args:
+        protections (list[str]): the protections table lines.
+
+    Returns:
+        list[tuple]: the probes, as (user, groups, host, path).
+    """
+    rules = protections_utility.compile_rules(protections)
+    hosts = sorted(
+        {protections_utility.example_of(rule.entry.host, "1") for rule in rules}
+    )
+    all_groups = frozenset(
+        rule.entry.name for rule in rules if rule.entry.type == "group"
+    )
+    requests = set()
+    for rule in rules:
+        if rule.entry.type == "group":
+            user, groups = PROBE_USER, frozenset((rule.entry.name,))
+        else:
+            user, groups = protections_utility.example_of(rule.entry.name), frozenset()
+        principals = [(user, groups), (user, all_groups), (PROBE_USER, frozenset())]
+        path = protections_utility.example_of(rule.entry.path)
+        for user, groups in principals:
+            for host in hosts:
+                requests.add((user, groups, host, path))
+    return sorted(
+        requests, key=lambda request: (request[0], sorted(request[1]), request[2:])
+    )
+
+
+def differences(current, updated):
+    """Compare the access two versions of the table give, with the local evaluator.
+
+    Args:
+        current (list[str]): the table.
+        updated (list[str]): the other version of the table.
+
+    Returns:
+        list[tuple]: the probes whose access differs, with the rights before and after.
+    """
+    current_evaluator = protections_utility.ProtectionsEvaluator(current)
+    updated_evaluator = protections_utility.ProtectionsEvaluator(updated)
+    changed = []
+    for user, groups, host, path in probes(current):
+        before = current_evaluator.access(user, host, path, groups)
+        after = updated_evaluator.access(user, host, path, groups)
+        if before != after:
+            changed.append(
+                ((user, sorted(groups), host, path), sorted(before), sorted(after))
+            )
+    return changed
+
+
+def optimize(protections):
+    """Leave out the lines that change nobody's access, and check the result.
+
+    Args:
+        protections (list[str]): the protections table lines.
+
+    Returns:
+        Optimization: the optimization.
+    """
+    findings = analyze(protections)
+    removed = {finding.index for finding in findings}
+    updated = [line for index, line in enumerate(protections) if index not in removed]
+    return Optimization(
+        list(protections),
+        updated,
+        findings,
+        differences(protections, updated) if findings else [],
+    )
+
+
+def summary(optimization):
+    """Summarize an optimization for the report.
+
+    Args:
+        optimization (Optimization): the optimization.
+
+    Returns:
+        dict: the line counts and evaluation costs before and after, and the
+            number of lines of each kind found.
+    """
+    kinds = collections.Counter(finding.kind for finding in optimization.findings)
+    return {
+        "Lines": [len(optimization.current), len(optimization.updated)],
+        "Evaluation Cost": [
+            evaluation_cost(optimization.current),
+            evaluation_cost(optimization.updated),
+        ],
+        "Duplicate": kinds["duplicate"],
+        "Shadowed": kinds["shadowed"],
+        "Redundant": kinds["redundant"],
+        "Access Changes": len(optimization.differences),
+    }
+
+
+def plan_optimization(p4):
+    """Read the table and work out the optimization.
+
+    Args:
+        p4 (P4.P4): the connection.
+
+    Returns:
+        Optimization: the optimization.
+    """
+    optimization = optimize(p4.run("protect", "-o")[0]["Protections"])
+    logging.info("Protections table optimization: %s", summary(optimization))
+    return optimization
+
+
+def submit_optimization(p4, optimization):
+    """Write the optimized table, if it is equivalent and the table did not change.
+
+    Args:
+        p4 (P4.P4): the connection.
+        optimization (Optimization): the optimization.
+
+    Returns:
+        bool: whether the table was written. It is not if nothing changes, if
+            the optimization changes anyone's access, or if the table changed
+            since it was read.
+    """
+    if not optimization.findings:
+        return False
+    if optimization.differences:
+        logging.error(
+            "The optimized table changes the access of %d probes. Not submitting",
+            len(optimization.differences),
+        )
+        return False
+    table = p4.run("protect", "-o")
+    if table[0]["Protections"] != optimization.current:
+        logging.warning(
+            "The protections table changed since it was read. Not submitting"
+        )
+        return False
+    table[0]["Protections"] = optimization.updated
+    p4.input = table
+    logging.info(p4.run("protect", "-i"))
+    logging.info(
+        "Removed %d protections lines, %d left",
+        len(optimization.findings),
+        len(optimization.updated),
+    )
+    return True
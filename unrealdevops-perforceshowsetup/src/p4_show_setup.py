@@ -9,34 +9,352 @@ The steps that will be covered include:
 - Populating the permissions table.
 - Adding the permissions groups.
 - Creating the streams for the new depot.
+
+P4Python is only imported, and the server only connected to, by the subcommands
+that need it. Importing this module is kept under `IMPORT_TIME_BUDGET_SECONDS`,
+so profiling, recording and batching are also only imported when used.
 """
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import contextvars
 from datetime import datetime
+import functools
+import getpass
 import json
 import logging
 import os
 import pathlib
+import sys
+import threading
+import time
 
-from P4 import P4, P4Exception
-
+import p4_show_teardown
 from shared import arg_parser_utility
+from shared import event_utility
+from shared import logging_utility
+from shared import metrics_utility
+from shared import p4_connection_utility
+from shared import p4_deadline_utility
+from shared import p4_retry_utility
+from shared import protections_utility
+from shared import subprocess_utility
+
+CONFIG_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "config", "show_setup_configs.json"
+)
+DEFAULT_P4_PORT = (
+    "rsh:C:\\Program Files\\Perforce\\DVCS\\p4d.exe -i -J off "
+    '-r "F:\\P4Server\\.p4root"'
+)  # "ssl:zroperforce1:1666"
+LOG_OUTPUT_DIR = "P4ShowSetup"
+IMPORT_TIME_BUDGET_SECONDS = 0.25
+# The kinds in profiling_utility.PROFILE_KINDS, which is only imported to profile.
+PROFILE_KINDS = ("cpu", "mem")
+PREFETCH_MAX_AGE_SECONDS = 30.0
+# Seconds each setup step may take, across all of its commands.
+STEP_DEADLINES = {
+    "depot": 300.0,
+    "permissions": 600.0,
+    "verify": 300.0,
+    "groups": 900.0,
+    "streams": 7200.0,
+    "undo": 7200.0,
+    "converge": 7200.0,
+}
+
+COMMANDS = (
+    "validate",
+    "plan",
+    "apply",
+    "converge",
+    "undo",
+    "audit",
+    "bench",
+    "serve",
+    "loadtest",
+    "decommission",
+    "protections-update",
+    "protections-optimize",
+    "sync-owners",
+    "orphans",
+)
+DEFAULT_COMMAND = "apply"
+DIVISIONS = ("TS", "RE", "VFX", "TESTDIV")
+
+# The P4ShowSetup methods every way of setting up a show runs, in order.
+SETUP_STEPS = (
+    "create_depot",
+    "populate_permissions_table",
+    "check_permissions",
+    "create_groups",
+    "create_initial_streams",
+)
+UNDO_WORKERS = 4
+# The member of each group whose access `verify_permissions()` evaluates.
+VERIFY_USER = "show-setup-verify"
+
+# Held around every read then write of the protections table, so setups running
+# concurrently in this process do not write over each other's entries.
+PROTECTIONS_LOCK = threading.Lock()
+
+_P4_CONNECTION = None
+_CANCELLATION = p4_deadline_utility.CancellationToken()
+
+
+def _get_p4_connection():
+    """Get the module's shared Perforce connection, creating it on first use.
+
+    Commands on the connection are retried according to
+    `p4_retry_utility.DEFAULT_RETRY_POLICY`, and are bound by the deadlines in
+    `p4_deadline_utility`. They can be cancelled through `_CANCELLATION`.
+
+    Returns:
+        event_utility.EventConnection: the shared connection object.
+    """
+    global _P4_CONNECTION  # pylint: disable=global-statement
+    if _P4_CONNECTION is None:
+        _P4_CONNECTION = _build_connection()
+    return _P4_CONNECTION
+
+
+def _build_connection():
+    """Create a new, unconnected, connection with events, retries, metrics and deadlines.
+
+    Returns:
+        event_utility.EventConnection: the connection object.
+    """
+    connection = p4_connection_utility.create_connection()
+    # The recording module is only imported to record, see _initialize_recording().
+    p4_recording_utility = sys.modules.get("shared.p4_recording_utility")
+    if p4_recording_utility is not None:
+        connection = p4_recording_utility.record(connection)
+    return event_utility.EventConnection(
+        p4_retry_utility.RetryingConnection(
+            metrics_utility.MetricsConnection(
+                p4_deadline_utility.DeadlineConnection(
+                    connection,
+                    token=_CANCELLATION,
+                )
+            ),
+            sleep=_CANCELLATION.sleep,
+        )
+    )
+
+
+def create_connected_connection():
+    """Create a new connection to the show setup server and connect it.
+
+    Used as the factory for connection pools.
+
+    Returns:
+        event_utility.EventConnection: the connected connection.
+
+    Raises:
+        p4_connection_utility.P4CommandError: if the connection failed.
+    """
+    p4 = _build_connection()
+    errors = _setup_p4_instance(p4)
+    if errors is not None:
+        raise p4_connection_utility.P4CommandError(
+            "Perforce Connection Setup Failed", errors=errors
+        )
+    return p4
+
+
+def _setup_step(step_name):
+    """Mark a P4ShowSetup method as a named setup step.
+
+    The method body runs inside `P4ShowSetup.step()`.
+
+    Args:
+        step_name (str): the step name.
+
+    Returns:
+        callable: the method decorator.
+    """
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.step(step_name):
+                return method(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class PermissionsVerificationError(Exception):
+    """Raised when the permissions table does not grant the configured access."""
+
+    def __init__(self, failures):
+        """Construct an instance of PermissionsVerificationError.
+
+        Args:
+            failures (list[dict]): the expectations that do not hold, see
+                `P4ShowSetup.verify_permissions()`.
+        """
+        super().__init__(
+            f"{len(failures)} configured accesses are not granted: {failures}"
+        )
+        self.failures = failures
 
-logging.basicConfig(level=logging.DEBUG)
-P4 = P4()
 
 class P4ShowSetup:
     """Wrapper class for setting up a show in perforce."""
 
-    def __init__(self, show, json_config):
+    def __init__(self, show, json_config, p4=None):
         """Construct an instance of P4ShowSetup Class.
 
         Args:
             show (str): the show code.
             json_config (dict): the configurations to follow for setting up the depot.
+            p4 (P4.P4, optional): the connection to run commands on. Defaults to the
+                module's shared connection, created on first use.
         """
         self.show = show
         self.json_config = json_config
         self.result = {}
+        # Read-only results fetched ahead of time, keyed by command arguments.
+        self.prefetched = {}
+        # Callables taking a step name and returning a context manager to run
+        # the step in.
+        self.step_hooks = [
+            self._step_log_context,
+            event_utility.step_events,
+            self._step_deadline,
+            self._step_profile,
+            metrics_utility.step_metrics,
+        ]
+        # Held around every read then write of the protections table. Setups
+        # standing in for separate processes can be given a lock of their own.
+        self.protections_lock = PROTECTIONS_LOCK
+        self._p4 = p4
+
+    @property
+    def p4(self):
+        """P4.P4: the connection this instance runs its commands on."""
+        if self._p4 is None:
+            return _get_p4_connection()
+        return self._p4
+
+    @p4.setter
+    def p4(self, p4):
+        """Set the connection this instance runs its commands on.
+
+        Args:
+            p4 (P4.P4): the connection, or None for the module's shared one.
+        """
+        self._p4 = p4
+
+    @contextlib.contextmanager
+    def step(self, step_name):
+        """Run the body as a named setup step, inside every step hook.
+
+        Args:
+            step_name (str): the step name.
+
+        Yields:
+            str: the step name.
+        """
+        with contextlib.ExitStack() as stack:
+            for hook in self.step_hooks:
+                stack.enter_context(hook(step_name))
+            yield step_name
+
+    def _step_log_context(self, step_name):
+        """Step hook adding the show and step to every record logged in the step.
+
+        Args:
+            step_name (str): the step name.
+
+        Returns:
+            contextlib.AbstractContextManager: the logging context.
+        """
+        return logging_utility.logging_context(show=self.show, step=step_name)
+
+    @staticmethod
+    def _step_profile(step_name):
+        """Step hook attributing the step to the running profile, if any.
+
+        Only a profile imports the profiling module, see `_run_command()`.
+
+        Args:
+            step_name (str): the step name.
+
+        Returns:
+            contextlib.AbstractContextManager: the step's profiling context.
+        """
+        profiling_utility = sys.modules.get("shared.profiling_utility")
+        if profiling_utility is None:
+            return contextlib.nullcontext(step_name)
+        return profiling_utility.step_profile(step_name)
+
+    def _step_deadline(self, step_name):
+        """Step hook bounding the step by its entry in `STEP_DEADLINES`.
+
+        Does not create the connection if it does not exist yet.
+
+        Args:
+            step_name (str): the step name.
 
+        Returns:
+            contextlib.AbstractContextManager: the step's deadline.
+        """
+        p4 = self._p4 if self._p4 is not None else _P4_CONNECTION
+        step_deadline = getattr(p4, "step_deadline", None)
+        if step_deadline is None:
+            return contextlib.nullcontext()
+        return step_deadline(STEP_DEADLINES.get(step_name), name=step_name)
+
+    def _run_prefetched(self, *args):
+        """Run a read-only command, using its prefetched result when it is fresh.
+
+        Prefetched results are only used once, and only within
+        `PREFETCH_MAX_AGE_SECONDS` of being fetched.
+
+        Args:
+            *args (str): the command and its arguments.
+
+        Returns:
+            list: the command results.
+        """
+        result = self._fresh_prefetched(*args)
+        if result is not None:
+            return result
+        return self.p4.run(*args)
+
+    def _fresh_prefetched(self, *args):
+        """Take the prefetched result of a read-only command, if it is fresh.
+
+        Args:
+            *args (str): the command and its arguments.
+
+        Returns:
+            list: the prefetched results, or None if there are none, or they
+                are older than `PREFETCH_MAX_AGE_SECONDS`.
+        """
+        prefetched = self.prefetched.pop(args, None)
+        if prefetched is not None:
+            fetched_at, result = prefetched
+            if time.monotonic() - fetched_at <= PREFETCH_MAX_AGE_SECONDS:
+                logging.debug("Using prefetched result for: %s", " ".join(args))
+                return result
+        return None
+
+    def prefetch_commands(self):
+        """Get the read-only commands the setup starts with.
+
+        Returns:
+            list[tuple]: the arguments of each command.
+        """
+        commands = [("depots", "-E", self.show), ("protect", "-o")]
+        for grp_name in get_source_groups(self.json_config):
+            commands.append(("group", "-o", grp_name))
+        return commands
+
+    @_setup_step("validate")
     def validate_show(self):
         """Ensure showcode follows normal conventions.
 
@@ -54,11 +372,30 @@ class P4ShowSetup:
         # names that we can't call a show
         # mkvfx directories
         precious_names = [
-            "CG", "ELEMENT", "ENV", "OUT", "REF", "REI", "SCAN", "SIM", "TEST"
+            "CG",
+            "ELEMENT",
+            "ENV",
+            "OUT",
+            "REF",
+            "REI",
+            "SCAN",
+            "SIM",
+            "TEST",
         ]
         # environment variables - #45501
         precious_names.extend(
-            ["HOME", "HOST", "LANG", "PATH", "PWD", "SHELL", "TEMP", "TERM", "TMP", "USER"]
+            [
+                "HOME",
+                "HOST",
+                "LANG",
+                "PATH",
+                "PWD",
+                "SHELL",
+                "TEMP",
+                "TERM",
+                "TMP",
+                "USER",
+            ]
         )
         precious_names.extend(["SHOW", "SITE", "SHOT"])
         # show should not be named WEED as we have internal tool named weed (SYS-19820)
@@ -85,7 +422,9 @@ class P4ShowSetup:
             errors.append("Show code length must be at least 2 characters")
 
         if self.show in precious_names:
-            errors.append(self.show + " is a precious name and can not be used as a show code")
+            errors.append(
+                self.show + " is a precious name and can not be used as a show code"
+            )
 
         # Check invalid Windows directory names
         if pathlib.PureWindowsPath(self.show).is_reserved():
@@ -93,6 +432,310 @@ class P4ShowSetup:
 
         return errors
 
+    def render_permissions(self, user):
+        """Render the configured permissions table entries for the show.
+
+        Args:
+            user (str): the user to credit in the entries' comments.
+
+        Returns:
+            list[str]: the permissions table entries, in configured order.
+        """
+        date = datetime.today()
+        mdy_str = f"{date.month}/{date.day}/{date.year}"
+        permissions_entries = []
+        for line in self.json_config["permissions"]:
+            line = line.replace("{show}", self.show)
+            line = line.replace("{user}", user)
+            line = line.replace("{mdy_str}", mdy_str)
+            permissions_entries.append(line)
+        return permissions_entries
+
+    def plan(self, user=None):
+        """Render everything the setup would create, without contacting the server.
+
+        Args:
+            user (str, optional): the user to credit in comments and descriptions.
+                Defaults to the current login.
+
+        Returns:
+            dict: the planned "Depot", "Permissions", "Groups" and "Streams", keyed
+                the same way as `self.result`.
+        """
+        user = user or getpass.getuser()
+        streams = {}
+        for stream, stream_settings in self.json_config["streams"].items():
+            streams[stream.replace("{show}", self.show)] = {
+                key: value.replace("{show}", self.show)
+                for key, value in stream_settings.items()
+            }
+        return {
+            "Depot": self.show,
+            "Permissions": self.render_permissions(user),
+            "Groups": [
+                grp_name.replace("{show}", self.show)
+                for grp_name in self.json_config["groups"]
+            ],
+            "Streams": streams,
+        }
+
+    def audit(self):
+        """Compare the show's live state on the server against its plan.
+
+        Only read commands are run. Permissions entries are compared without
+        their trailing `##` comment, since it records who added them and when.
+
+        Returns:
+            dict: the "Depot", "Permissions", "Groups" and "Streams" that are
+                missing from the server. Streams whose type or parent differ from
+                the plan are listed under "Mismatched Streams".
+        """
+        plan = self.plan(user=self.p4.user)
+        existing = self.discover_result()
+        existing_rules = {
+            strip_permission_comment(entry) for entry in existing.get("Permissions", [])
+        }
+
+        differences = {}
+        if "Depot" not in existing:
+            differences["Depot"] = plan["Depot"]
+        differences["Permissions"] = [
+            entry
+            for entry in plan["Permissions"]
+            if strip_permission_comment(entry) not in existing_rules
+        ]
+        differences["Groups"] = [
+            grp for grp in plan["Groups"] if grp not in existing.get("Groups", [])
+        ]
+        differences["Streams"] = []
+        differences["Mismatched Streams"] = []
+        live_streams = existing.get("StreamSpecs", {})
+        for stream, stream_settings in plan["Streams"].items():
+            if stream not in live_streams:
+                differences["Streams"].append(stream)
+                continue
+            live = live_streams[stream]
+            parent = stream_settings.get("parent", "none")
+            if live.get("Type") != stream_settings["type"] or (
+                live.get("Parent", "none") != parent
+            ):
+                differences["Mismatched Streams"].append(stream)
+        return {key: value for key, value in differences.items() if value}
+
+    def discover_result(self):
+        """Find which of the show's planned entities already exist on the server.
+
+        The returned dictionary has the same shape as `self.result`, so it can be
+        assigned to it to remove a show with `undo_show_setup()`.
+
+        Returns:
+            dict: the existing "Depot", "Permissions", "Groups" and "Streams".
+                Stream specs are included under "StreamSpecs".
+        """
+        plan = self.plan(user=self.p4.user)
+        existing = {}
+
+        logging.debug("Discovering existing entities for show %s", self.show)
+        if len(self.p4.run("depots", "-E", self.show)) > 0:
+            existing["Depot"] = self.show
+
+        planned_rules = {
+            strip_permission_comment(entry) for entry in plan["Permissions"]
+        }
+        protections = self.p4.run("protect", "-o")[0]["Protections"]
+        permissions = [
+            entry
+            for entry in protections
+            if strip_permission_comment(entry) in planned_rules
+        ]
+        if permissions:
+            existing["Permissions"] = permissions
+
+        live_groups = set()
+        for group in p4_connection_utility.run_iter(self.p4, "groups"):
+            live_groups.add(group["group"] if isinstance(group, dict) else group)
+        groups = [grp for grp in plan["Groups"] if grp in live_groups]
+        if groups:
+            existing["Groups"] = groups
+
+        if "Depot" in existing:
+            stream_specs = {
+                spec["Stream"]: spec
+                for spec in self.p4.run("streams", f"//{self.show}/...")
+            }
+            # Children have to be removed before their parents.
+            streams = [stream for stream in plan["Streams"] if stream in stream_specs]
+            if streams:
+                existing["Streams"] = list(reversed(streams))
+                existing["StreamSpecs"] = stream_specs
+
+        return existing
+
+    def plan_converge(self):
+        """Find what to change to bring the existing show in line with its config.
+
+        Only read commands are run. Permissions entries are matched without
+        their trailing `##` comment. An entry for the same type, name and path
+        as a configured one, but with another mode or host, is changed rather
+        than added. Entries that are not in the config are left alone.
+
+        Returns:
+            dict: only the non-empty ones of: the "Depot" to create, the
+                "Permissions" entries to add, the "Changed Permissions" to
+                replace, keyed by their current entry, the "Groups" to create,
+                the "Group Members" to add to existing groups, keyed by group
+                then member type, the "Streams" to create and the "Mismatched
+                Streams" whose type or parent to update.
+        """
+        plan = self.plan(user=self.p4.user)
+        delta = {}
+
+        logging.debug("Comparing show %s with its config", self.show)
+        if not self.p4.run("depots", "-E", self.show):
+            delta["Depot"] = self.show
+
+        planned_rules = {
+            strip_permission_comment(entry) for entry in plan["Permissions"]
+        }
+        live_rules = set()
+        live_entries = {}
+        for entry in self.p4.run("protect", "-o")[0]["Protections"]:
+            parsed = protections_utility.parse_entry(entry)
+            if parsed is None:
+                continue
+            live_rules.add(strip_permission_comment(entry))
+            if strip_permission_comment(entry) not in planned_rules:
+                live_entries.setdefault((parsed.type, parsed.name, parsed.path), entry)
+        for entry in plan["Permissions"]:
+            if strip_permission_comment(entry) in live_rules:
+                continue
+            parsed = protections_utility.parse_entry(entry)
+            current = live_entries.pop((parsed.type, parsed.name, parsed.path), None)
+            if current is None:
+                delta.setdefault("Permissions", []).append(entry)
+            else:
+                delta.setdefault("Changed Permissions", {})[current] = entry
+
+        live_groups = set()
+        for group in p4_connection_utility.run_iter(self.p4, "groups"):
+            live_groups.add(group["group"] if isinstance(group, dict) else group)
+        for grp_name, grp_settings_dict in self.json_config["groups"].items():
+            grp_name = grp_name.replace("{show}", self.show)
+            if grp_name not in live_groups:
+                delta.setdefault("Groups", []).append(grp_name)
+            elif grp_settings_dict != "empty":
+                current_group = self.p4.run("group", "-o", grp_name)[0]
+                added = self._add_group_members(
+                    grp_name, grp_settings_dict, current_group
+                )
+                if added:
+                    delta.setdefault("Group Members", {})[grp_name] = added
+
+        live_streams = {}
+        if "Depot" not in delta:
+            live_streams = {
+                spec["Stream"]: spec
+                for spec in self.p4.run("streams", f"//{self.show}/...")
+            }
+        for stream, stream_settings in plan["Streams"].items():
+            live = live_streams.get(stream)
+            if live is None:
+                delta.setdefault("Streams", []).append(stream)
+            elif live.get("Type") != stream_settings["type"] or (
+                live.get("Parent", "none") != stream_settings.get("parent", "none")
+            ):
+                delta.setdefault("Mismatched Streams", []).append(stream)
+        return delta
+
+    @_setup_step("converge")
+    def converge(self, delta=None):
+        """Bring the existing show in line with its config, changing only what differs.
+
+        Unchanged groups and streams are not written, and the permissions table
+        is written at most once. What gets created is recorded in `self.result`.
+
+        Args:
+            delta (dict, optional): the changes, from `plan_converge()`. Planned
+                if not given.
+
+        Returns:
+            dict: the changes that were made.
+
+        Raises:
+            ValueError: if permissions have to be added and the permissions
+                table has no depot specific permissions block.
+        """
+        delta = self.plan_converge() if delta is None else delta
+        date = datetime.today()
+        mdy_str = f"{date.month}/{date.day}/{date.year}"
+
+        if "Depot" in delta:
+            logging.info("Creating depot %s", self.show)
+            depot = self.p4.run("depot", "-o", self.show)[0]
+            depot["Type"] = "stream"
+            self.p4.input = [depot]
+            logging.info(self.p4.run("depot", "-i"))
+            self.result["Depot"] = self.show
+
+        if "Permissions" in delta or "Changed Permissions" in delta:
+            with self.protections_lock:
+                current_permissions = self.p4.run("protect", "-o")
+                protections = current_permissions[0]["Protections"]
+                for current, entry in delta.get("Changed Permissions", {}).items():
+                    if current in protections:
+                        logging.info(
+                            "Changing permissions entry %s to %s", current, entry
+                        )
+                        protections[protections.index(current)] = entry
+                if delta.get("Permissions"):
+                    insert_index = self._permissions_insert_index(protections)
+                    if insert_index == 0:
+                        raise ValueError(
+                            "Permissions table is missing "
+                            "'## START OF DEPOT SPECIFIC PERMISSIONS'"
+                        )
+                    for index, entry in enumerate(delta["Permissions"]):
+                        logging.info("Adding permissions entry %s", entry)
+                        protections.insert(insert_index + index, entry)
+                self.p4.input = current_permissions
+                logging.info(self.p4.run("protect", "-i"))
+            if delta.get("Permissions"):
+                self.result["Permissions"] = list(delta["Permissions"])
+
+        json_groups = {
+            grp_name.replace("{show}", self.show): grp_settings_dict
+            for grp_name, grp_settings_dict in self.json_config["groups"].items()
+        }
+        for grp_name in delta.get("Groups", []):
+            logging.info("Creating group: %s", grp_name)
+            self._create_group(grp_name, json_groups[grp_name], mdy_str)
+        for grp_name, added in delta.get("Group Members", {}).items():
+            logging.info("Adding %s to group %s", added, grp_name)
+            current_group = self.p4.run("group", "-o", grp_name)[0]
+            for user_grp_type, users in added.items():
+                members = current_group.setdefault(user_grp_type, [])
+                members.extend(user for user in users if user not in members)
+            self.p4.input = [current_group]
+            logging.info(self.p4.run("group", "-i"))
+
+        description = f"Created by {self.p4.user} {mdy_str}"
+        for stream, stream_settings in self.json_config["streams"].items():
+            stream = stream.replace("{show}", self.show)
+            if stream in delta.get("Streams", []):
+                logging.info("Creating stream %s", stream)
+                self._create_stream(stream, stream_settings, description)
+            elif stream in delta.get("Mismatched Streams", []):
+                logging.info("Updating the type and parent of stream %s", stream)
+                current_stream = self.p4.run("stream", "-o", stream)[0]
+                current_stream["Type"] = stream_settings["type"]
+                current_stream["Parent"] = stream_settings.get(
+                    "parent", "none"
+                ).replace("{show}", self.show)
+                self.p4.input = [current_stream]
+                logging.info(self.p4.run("stream", "-i"))
+        return delta
+
+    @_setup_step("depot")
     def create_depot(self):
         """Create the show Perforce Depot.
 
@@ -106,100 +749,285 @@ class P4ShowSetup:
 
         logging.debug("Checking for duplicate depot")
         try:
-            if len(P4.run("depots", "-E", self.show)) > 0:
+            if len(self._run_prefetched("depots", "-E", self.show)) > 0:
                 logging.error("Depot %s already exists. Cancelling process", self.show)
                 raise Exception
 
-            depot = P4.run("depot", "-o", self.show)[0]
+            depot = self.p4.run("depot", "-o", self.show)[0]
             depot["Type"] = "stream"
-            P4.input = [depot]
-            result = P4.run("depot", "-i")
-        except P4Exception as error:
+            self.p4.input = [depot]
+            result = self.p4.run("depot", "-i")
+        except p4_connection_utility.p4_exception_types() as error:
             logging.error("There was an error while creating the depot: %s", error)
             raise
 
         logging.info(result)
         self.result["Depot"] = self.show
 
+    def _permissions_insert_index(self, protections):
+        """Find where the show's entries go in the permissions table, alphabetically by show.
+
+        Args:
+            protections (list[str]): the permissions table entries.
+
+        Returns:
+            int: the index to insert the entries at, or 0 if the table has no
+                depot specific permissions block.
+        """
+        insert_index = 0
+        in_editable_block = False
+        for index, entry in enumerate(protections):
+            if in_editable_block:
+                if entry.startswith("## END OF DEPOT SPECIFIC PERMISSIONS"):
+                    in_editable_block = False
+                    insert_index = index
+                    break
+                # Get showcode from Depot name
+                showcode = entry.split("/")[2]
+                if showcode.upper() > self.show.upper():
+                    insert_index = index
+                    break
+            else:
+                in_editable_block = entry.startswith(
+                    "## START OF DEPOT SPECIFIC PERMISSIONS"
+                )
+        return insert_index
+
+    @_setup_step("permissions")
     def populate_permissions_table(self):
         """Add the permissions table entries for the show.
 
         Returns:
             list[str]: List of entires that were successfully added to permissions table.
         """
-        date = datetime.today()
-        mdy_str = f"{date.month}/{date.day}/{date.year}"
-        user = P4.user
+        user = self.p4.user
 
         logging.info("Populating permissions table with new permissions")
 
         logging.debug("Grabbing configurated permissions from json")
         # List of permission table entries
-        permissions_entries = []
-        for line in self.json_config["permissions"]:
-            line = line.replace("{show}", self.show)
-            line = line.replace("{user}", user)
-            line = line.replace("{mdy_str}", mdy_str)
-            permissions_entries.append(line)
+        permissions_entries = self.render_permissions(user)
 
         try:
-            current_permissions = P4.run("protect", "-o")
-            # TODO: save these permissions in a backup file in case of failure. (tjen - 12/8/23)
-
-            # Check that permission table doesn't already contain permissions for the show.
-            logging.debug("Checking for duplicate permissions")
-            existing_show_permissions = [
-                entry for entry in current_permissions[0]["Protections"] if (
-                    f"//{self.show}/" in entry
-                )
-            ]
-
-            if len(existing_show_permissions) > 0:
-                logging.error(
-                    "Some permissions for this show already exist.\n"
-                    "Cancelling process to avoid conflicts. Please verify permissions table."
+            # The prefetched table may be out of date, so it is only used to
+            # stop early if the show already has permissions.
+            prefetched = self._fresh_prefetched("protect", "-o")
+            if prefetched is not None:
+                self._check_no_show_permissions(prefetched[0]["Protections"])
+
+            with self.protections_lock:
+                current_permissions = self.p4.run("protect", "-o")
+                # TODO: save these permissions in a backup file in case of failure.
+                # (tjen - 12/8/23)
+                self._check_no_show_permissions(current_permissions[0]["Protections"])
+
+                insert_index = self._permissions_insert_index(
+                    current_permissions[0]["Protections"]
                 )
-                raise Exception
 
-            # Find correct place in permission table, alphabetically by show.
-            insert_index = 0
-            in_editable_block = False
-            for index, entry in enumerate(current_permissions[0]["Protections"]):
-                if in_editable_block:
-                    if entry.startswith("## END OF DEPOT SPECIFIC PERMISSIONS"):
-                        in_editable_block = False
-                        insert_index = index
-                        break
-                    # Get showcode from Depot name
-                    showcode = entry.split('/')[2]
-                    if showcode.upper() > self.show.upper():
-                        insert_index = index
-                        break
-                else:
-                    in_editable_block = entry.startswith(
-                        "## START OF DEPOT SPECIFIC PERMISSIONS"
+                # if no start block was found, do not insert
+                if insert_index == 0:
+                    logging.error(
+                        "Permissions table is missing '## START OF DEPOT SPECIFIC PERMISSIONS'.\n"
+                        "Cancelling process to avoid conflicts. Please verify permissions table."
                     )
+                    raise Exception
 
-            # if no start block was found, do not insert
-            if insert_index == 0:
-                logging.error(
-                    "Permissions table is missing '## START OF DEPOT SPECIFIC PERMISSIONS'.\n"
-                    "Cancelling process to avoid conflicts. Please verify permissions table."
-                )
-                raise Exception
-
-            for index, new_entry in enumerate(permissions_entries):
-                logging.info(new_entry)
-                current_permissions[0]["Protections"].insert(insert_index + index, new_entry)
-            logging.debug("Loading permissions changes back into permissions table")
-            P4.input = current_permissions
-            permissions_result = P4.run("protect", "-i")
-            logging.info(permissions_result)
+                for index, new_entry in enumerate(permissions_entries):
+                    logging.info(new_entry)
+                    current_permissions[0]["Protections"].insert(
+                        insert_index + index, new_entry
+                    )
+                logging.debug("Loading permissions changes back into permissions table")
+                self.p4.input = current_permissions
+                permissions_result = self.p4.run("protect", "-i")
+                logging.info(permissions_result)
             self.result["Permissions"] = permissions_entries
         except Exception as error:
             logging.error("There was an error while adding permissions: %s", error)
             raise
 
+    def _check_no_show_permissions(self, protections):
+        """Check that the permissions table doesn't already contain permissions for the show.
+
+        Args:
+            protections (list[str]): the protections table lines.
+
+        Raises:
+            Exception: if some lines are for the show.
+        """
+        logging.debug("Checking for duplicate permissions")
+        existing_show_permissions = [
+            entry for entry in protections if f"//{self.show}/" in entry
+        ]
+
+        if len(existing_show_permissions) > 0:
+            logging.error(
+                "Some permissions for this show already exist.\n"
+                "Cancelling process to avoid conflicts. Please verify permissions table."
+            )
+            raise Exception
+
+    @_setup_step("verify")
+    def verify_permissions(self):
+        """Check that the configured groups have their access on every stream of the show.
+
+        The protections table and the groups are read once, and every group,
+        host and stream the config grants access to is evaluated locally,
+        instead of running `p4 protects` for each of them. The access each
+        one is expected to have is what the show's configured entries grant
+        on their own; other entries of the table may grant more.
+
+        Returns:
+            list[dict]: the expectations that do not hold, with the "Group" or
+                "User", "Host", "Path", and the "Expected" and "Actual" access
+                levels.
+
+        Raises:
+            P4Exception: if the table or the groups could not be read.
+        """
+        protections = self.p4.run("protect", "-o")[0]["Protections"]
+        groups = protections_utility.GroupSnapshot(
+            p4_connection_utility.run_iter(self.p4, "groups")
+        )
+        evaluator = protections_utility.ProtectionsEvaluator(protections, groups)
+        configured = protections_utility.compile_rules(self.render_permissions(""))
+
+        paths = [
+            protections_utility.example_of(stream.replace("{show}", self.show) + "/...")
+            for stream in self.json_config["streams"]
+        ]
+        paths.extend(
+            protections_utility.example_of(rule.entry.path)
+            for rule in configured
+            if not rule.exclusion
+        )
+        principals = {
+            (
+                rule.entry.type,
+                rule.entry.name,
+                protections_utility.example_of(rule.entry.host, "1"),
+            )
+            for rule in configured
+            if not rule.exclusion
+        }
+
+        failures = []
+        for principal_type, name, host in sorted(principals):
+            if principal_type == "group":
+                user, member_groups = VERIFY_USER, groups.enclosing(name)
+            else:
+                user, member_groups = name, groups.groups_of(name)
+            for path in dict.fromkeys(paths):
+                expected = protections_utility.access(
+                    configured, user, host, path, member_groups
+                )
+                if not expected:
+                    continue
+                actual = evaluator.access(user, host, path, member_groups)
+                if expected - actual:
+                    failures.append(
+                        {
+                            principal_type.capitalize(): name,
+                            "Host": host,
+                            "Path": path,
+                            "Expected": protections_utility.access_level(expected),
+                            "Actual": protections_utility.access_level(actual),
+                        }
+                    )
+        for failure in failures:
+            logging.warning(
+                "Permissions do not grant the configured access: %s", failure
+            )
+        logging.info(
+            "Verified the access of %d groups and users on %d paths",
+            len(principals),
+            len(set(paths)),
+        )
+        return failures
+
+    def check_permissions(self):
+        """Fail the setup if the permissions table does not grant the configured access.
+
+        Raises:
+            PermissionsVerificationError: if some configured access is not granted.
+            P4Exception: if the table or the groups could not be read.
+        """
+        failures = self.verify_permissions()
+        if failures:
+            raise PermissionsVerificationError(failures)
+
+    def _add_group_members(self, grp_name, grp_settings_dict, current_group):
+        """Add the configured owners and users to a group spec.
+
+        Args:
+            grp_name (str): the group name.
+            grp_settings_dict (dict | str): the group's config, or "empty".
+            current_group (dict): the group spec, changed in place.
+
+        Returns:
+            dict: the members added, keyed by member type.
+        """
+        added = {}
+        logging.debug("Adding owners and users to group %s", grp_name)
+        if grp_settings_dict != "empty":
+            for user_grp_type in grp_settings_dict:
+                user_grp_array = grp_settings_dict[user_grp_type]
+                for user_grp in user_grp_array:
+                    # A source group entry adds the source's users, anything else
+                    # is one member.
+                    if isinstance(user_grp, dict) and "groups" in user_grp:
+                        u = self._run_prefetched("group", "-o", user_grp["groups"])[0]
+                        users = u.get("Users", [])
+                    else:
+                        users = [user_grp]
+                    if user_grp_type not in current_group:
+                        current_group[user_grp_type] = []
+                    for user in users:
+                        if user not in current_group[user_grp_type]:
+                            logging.debug(
+                                "Adding %s as %s to group %s",
+                                user,
+                                user_grp_type,
+                                grp_name,
+                            )
+                            current_group[user_grp_type].append(user)
+                            added.setdefault(user_grp_type, []).append(user)
+        return added
+
+    def _create_group(self, grp_name, grp_settings_dict, mdy_str):
+        """Create a group, or add the configured members to it if it exists.
+
+        Args:
+            grp_name (str): the group name.
+            grp_settings_dict (dict | str): the group's config, or "empty".
+            mdy_str (str): the date to put in the description of a new group.
+        """
+        current_group = self.p4.run("group", "-o", grp_name)[0]
+        # A group only exists while it has users, owners or subgroups.
+        is_new = not any(
+            current_group.get(field) for field in ("Users", "Owners", "Subgroups")
+        )
+        # Check that it's not over-writing existing Descriptions or Users.
+        if current_group["Description"] == "":
+            current_group["Description"] = f"Created by {self.p4.user} {mdy_str}"
+        if "Users" not in current_group:
+            current_group["Users"] = ["empty"]
+
+        # Add owners to the the External groups.
+        self._add_group_members(grp_name, grp_settings_dict, current_group)
+
+        logging.debug("Loading group settings for %s", grp_name)
+        self.p4.input = [current_group]
+        permissions_result = self.p4.run("group", "-i")
+        logging.info(permissions_result)
+        # A create retried after the first attempt landed reports an update.
+        if permissions_result == [f"Group {grp_name} created"] or (
+            is_new and permissions_result == [f"Group {grp_name} updated"]
+        ):
+            self.result.setdefault("Groups", []).append(grp_name)
+
+    @_setup_step("groups")
     def create_groups(self):
         """Add permissions groups to perforce that match permissions table entries."""
         date = datetime.today()
@@ -214,45 +1042,54 @@ class P4ShowSetup:
             grp_name = grp_name.replace("{show}", self.show)
             try:
                 logging.info("Creating group: %s", grp_name)
-                current_group = P4.run("group", "-o", grp_name)[0]
-                # Check that it's not over-writing existing Descriptions or Users.
-                if current_group["Description"] == "":
-                    current_group["Description"] = f"Created by {P4.user} {mdy_str}"
-                if "Users" not in current_group:
-                    current_group["Users"] = ["empty"]
-
-                # Add owners to the the External groups.
-                logging.debug("Adding owners and users to group %s", grp_name)
-                if grp_settings_dict != "empty":
-                    for user_grp_type in grp_settings_dict:
-                        user_grp_array = grp_settings_dict[user_grp_type]
-                        for user_grp in user_grp_array:
-                            if "groups" in user_grp:
-                                u = P4.run("group", "-o", user_grp["groups"])[0]
-                                if "Users" in u:
-                                    user_grp = u["Users"]
-                            if user_grp_type not in current_group:
-                                current_group[user_grp_type] = []
-                            for user in user_grp:
-                                if user not in current_group[user_grp_type]:
-                                    logging.debug(
-                                        "Adding %s as %s to group %s",
-                                        user,
-                                        user_grp_type,
-                                        grp_name
-                                    )
-                                    current_group[user_grp_type].append(user)
-
-                logging.debug("Loading group settings for %s", grp_name)
-                P4.input = [current_group]
-                permissions_result = P4.run("group", "-i")
-                logging.info(permissions_result)
-                if permissions_result == [f'Group {grp_name} created']:
-                    self.result["Groups"].append(grp_name)
+                self._create_group(grp_name, grp_settings_dict, mdy_str)
             except Exception as error:
                 logging.error("There was an error while adding groups: %s", error)
                 raise
 
+    def _create_stream(self, stream, stream_settings, description):
+        """Create a stream and populate it from its branch or parent.
+
+        Args:
+            stream (str): the stream name.
+            stream_settings (dict): the stream's config, with `{show}` not yet replaced.
+            description (str): the stream description.
+        """
+        new_stream = self.p4.run("stream", "-o", stream)[0]
+        # Only saved streams have an update time.
+        is_new = "Update" not in new_stream
+        new_stream["Description"] = description
+        new_stream["Type"] = stream_settings["type"]
+        if "parent" in stream_settings:
+            new_stream["Parent"] = stream_settings["parent"].replace(
+                "{show}", self.show
+            )
+        logging.debug("Loading stream settings for %s", stream)
+        self.p4.input = [new_stream]
+        result = self.p4.run("stream", "-i")
+        logging.info(result)
+        # A create retried after the first attempt landed reports an update.
+        if result == [f"Stream {stream} saved."] or (
+            is_new and result == [f"Stream {stream} updated."]
+        ):
+            self.result.setdefault("Streams", []).append(stream)
+
+        if "branch" in stream_settings:
+            branch = stream_settings["branch"].replace("{show}", self.show)
+            logging.info("Populating %s with branch contents %s", stream, branch)
+            for branch_result in p4_connection_utility.run_iter(
+                self.p4, "populate", f"{branch}/...", f"{stream}/..."
+            ):
+                logging.info(branch_result)
+        elif "parent" in stream_settings:
+            parent = stream_settings["parent"].replace("{show}", self.show)
+            logging.info("Populating %s with parent contents %s", stream, parent)
+            for parent_result in p4_connection_utility.run_iter(
+                self.p4, "populate", f"{parent}/...", f"{stream}/..."
+            ):
+                logging.info(parent_result)
+
+    @_setup_step("streams")
     def create_initial_streams(self):
         """Create the default initial streams.
 
@@ -263,7 +1100,7 @@ class P4ShowSetup:
         """
         date = datetime.today()
         mdy_str = f"{date.month}/{date.day}/{date.year}"
-        description = f"Created by {P4.user} {mdy_str}"
+        description = f"Created by {self.p4.user} {mdy_str}"
         self.result["Streams"] = []
         json_streams = self.json_config["streams"]
 
@@ -273,246 +1110,1782 @@ class P4ShowSetup:
                 stream_settings = json_streams[stream]
                 stream = stream.replace("{show}", self.show)
                 logging.info("Creating stream %s", stream)
-                new_stream = P4.run("stream", "-o", stream)[0]
-                new_stream["Description"] = description
-                new_stream["Type"] = stream_settings["type"]
-                if "parent" in stream_settings:
-                    new_stream["Parent"] = stream_settings["parent"].replace("{show}", self.show)
-                logging.debug("Loading stream settings for %s", stream)
-                P4.input = [new_stream]
-                result = P4.run("stream", "-i")
-                logging.info(result)
-                if result == [f"Stream {stream} saved."]:
-                    self.result["Streams"].append(stream)
-
-                if "branch" in stream_settings:
-                    branch = stream_settings["branch"].replace("{show}", self.show)
-                    logging.info("Populating %s with branch contents %s", stream, branch)
-                    branch_result = P4.run(
-                        "populate",
-                        f"{branch}/...",
-                        f"{stream}/..."
-                    )
-                    logging.info(branch_result)
-                elif "parent" in stream_settings:
-                    parent = stream_settings["parent"].replace("{show}", self.show)
-                    logging.info("Populating %s with parent contents %s", stream, parent)
-                    parent_result = P4.run(
-                        "populate",
-                        f"{parent}/...",
-                        f"{stream}/..."
-                    )
-                    logging.info(parent_result)
+                self._create_stream(stream, stream_settings, description)
 
         except Exception as error:
             logging.error("There was an error when creating the streams: %s", error)
             raise
 
-    def undo_show_setup(self):
-        """Reverse the steps that have been taken for show setup in Perforce.
-
-        If any step of the process fails, all steps so far should be reversed.
+    def _stream_levels(self, streams):
+        """Order the streams this setup created so that children come before parents.
 
         Args:
-            result (dict): the results from the previous steps. Describes which steps
-                succeeded.
-        """
-        # Remove the streams that were created.
-        logging.info("Removing all streams from the depot %s", self.result["Depot"])
-        if "Streams" in self.result:
-            for stream in self.result["Streams"]:
-                stream_result = P4.run("stream", "-d", stream)
-                P4.run("stream", "--obliterate", "-y", stream)
-                logging.info("Removing stream: %s", stream_result)
-
-        # Remove the groups that have been created.
-        logging.info("Removing all groups for the depot %s", self.result["Depot"])
-        if "Groups" in self.result:
-            for grp in self.result["Groups"]:
-                group_result = P4.run("group", f'-d {grp}')
-                logging.info("Removing group: %s", group_result)
-
-        # Remove any permissions entries
-        # TODO: check against backed-up permissions table. (tjen 12/8/23)
-        current_permissions = P4.run("protect", "-o")
-        logging.info("Removing all permissions for the depot %s", self.result["Depot"])
-        if "Permissions" in self.result:
-            for entry in self.result["Permissions"]:
-                current_permissions[0]["Protections"].remove(entry)
-            P4.input = current_permissions
-            permissions_result = P4.run("protect", "-i")
-            logging.info("Removing permissions: %s", permissions_result)
-
-        # Remove depot
-        if self.result["Depot"]:
-            depot_result = P4.run("obliterate", '-y', f'//{self.result["Depot"]}/...')
-            print(depot_result)
-            depot_result = P4.run("depot", '-d', self.result["Depot"])
-            logging.info("Removing depot: %s", depot_result)
-
-
-def _print_help():
-    """
-    Print the help information to the screen.
+            streams (list[str]): the streams to order.
 
-    Returns:
-        string: The contents of the help message.
-    """
-    help_message = (
-        """\n
-        Dneg's Perforce Show Setup.
-        ================================\n\n
-        A command line tool to help automate the process of p4 show setup.\n\n
+        Returns:
+            list[list[str]]: the streams grouped by depth, deepest first.
         """
-    )
-
-    return help_message
-
+        parents = {}
+        for stream, stream_settings in self.json_config.get("streams", {}).items():
+            parent = stream_settings.get("parent", "none")
+            parents[stream.replace("{show}", self.show)] = parent.replace(
+                "{show}", self.show
+            )
+        return p4_show_teardown.stream_levels(
+            [
+                {"Stream": stream, "Parent": parents.get(stream, "none")}
+                for stream in streams
+            ]
+        )
 
-def _setup_parse_arguments():
-    """
-    Parse the arguments.
+    def _depot_has_files(self, depot):
+        """Check whether a depot has any files, with a single one-file query.
 
-    Returns:
-        list: a list of arguments.
-    """
-    logging.info("Parsing Command line Arguments")
+        Args:
+            depot (str): the depot name.
 
-    parser = arg_parser_utility.setup_parser(help_message=_print_help())
-    parser.add_argument(
-        "-s",
-        "--show",
-        type=str,
-        required=True,
-        help="Showcode for the show being set up. Must be all CAPS. (required)",
-    )
-    parser.add_argument(
-        "-d",
-        "--division",
-        nargs='*',
-        default=None,
-        help="Division of company. Specifies permission groups, and stream structure.",
-    )
-    return parser
+        Returns:
+            bool: whether the depot has files.
 
+        Raises:
+            P4Exception: if the query fails for any other reason than the depot being empty.
+        """
+        try:
+            return bool(self.p4.run("files", "-m", "1", f"//{depot}/..."))
+        except p4_connection_utility.p4_exception_types() as error:
+            # An empty depot is reported as "no such file(s)".
+            if "no such file" not in p4_retry_utility.error_text(error):
+                raise
+            logging.debug("No files found in //%s/...: %s", depot, error)
+            return False
 
-def _setup_p4_instance():
-    """Set up the Perforce instance."""
-    P4.port = 'rsh:C:\\Program Files\\Perforce\\DVCS\\p4d.exe -i -J off -r "F:\\P4Server\\.p4root"' #"ssl:zroperforce1:1666"
-    P4.user = os.getlogin()
+    def _remove_permissions(self, p4):
+        """Remove the permissions entries this setup added, in one table write.
 
-    logging.info("Connecting to perforce %s", P4.port)
-    try:
-        P4.connect()
-        logging.info("Successfully connected to perforce %s", P4.port)
-        return None
-    except P4Exception:
-        logging.error("Error connecting to perforce %s", P4.port)
-        for error in P4.errors:
-            logging.error(error)
-        return P4.errors
+        Args:
+            p4 (P4.P4): the connection to run the commands on.
 
+        Returns:
+            list: the `protect -i` results.
+        """
+        added = set(self.result["Permissions"])
+        with self.protections_lock:
+            current_permissions = p4.run("protect", "-o")
+            current_permissions[0]["Protections"] = [
+                entry
+                for entry in current_permissions[0]["Protections"]
+                if entry not in added
+            ]
+            p4.input = current_permissions
+            return p4.run("protect", "-i")
 
-def _cleanup_p4_instance():
-    """Clean up the Perforce instance."""
-    logging.info("Disconnecting from perforce server")
-    P4.disconnect()
+    def plan_undo(self):
+        """Plan the removals that reverse what this setup did, from `self.result`.
 
+        Nothing is planned for steps that did not get to create anything. The
+        depot's files are obliterated with one command, and only if it has any,
+        so streams only need their specs deleted. Children streams are deleted
+        before their parents, and the depot after every stream.
 
-def run_p4_show_setup():
-    """Set up show depot, permissions, and streams in Perforce."""
-    arg_parser = _setup_parse_arguments()
-    args = arg_parser.parse_args()
-    json_config = None
-    show = args.show
-    div = args.division
+        Returns:
+            list[list[tuple]]: the phases to run in order. Each is a list of
+                `(name, callable)` removals, which take the connection to run
+                on and are independent of each other.
+        """
+        depot = self.result.get("Depot")
+        first_phase = []
+        if self.result.get("Permissions"):
+            first_phase.append(("permissions", self._remove_permissions))
+        for grp in self.result.get("Groups", []):
+            first_phase.append(
+                (f"group {grp}", functools.partial(_run_removal, ("group", "-d", grp)))
+            )
+        if depot and self._depot_has_files(depot):
+            first_phase.append(
+                (
+                    f"//{depot}/...",
+                    functools.partial(
+                        _run_removal, ("obliterate", "-y", f"//{depot}/...")
+                    ),
+                )
+            )
+
+        phases = [first_phase] if first_phase else []
+        for level in self._stream_levels(self.result.get("Streams", [])):
+            # Without the depot, its files are not obliterated with it.
+            commands = [("stream", "-d")] + (
+                [] if depot else [("stream", "--obliterate", "-y")]
+            )
+            phases.append(
+                [
+                    (
+                        stream,
+                        functools.partial(
+                            _run_removals, [args + (stream,) for args in commands]
+                        ),
+                    )
+                    for stream in level
+                ]
+            )
+        if depot:
+            phases.append(
+                [
+                    (
+                        f"depot {depot}",
+                        functools.partial(_run_removal, ("depot", "-d", depot)),
+                    )
+                ]
+            )
+        return phases
+
+    @_setup_step("undo")
+    def undo_show_setup(self, pool=None):
+        """Reverse the steps that have been taken for show setup in Perforce.
+
+        If any step of the process fails, all steps so far should be reversed.
+        Only what `self.result` records as done is removed, see `plan_undo()`.
+
+        Args:
+            pool (ConnectionPool, optional): connections to run independent
+                removals on in parallel. They run one after another on this
+                instance's connection by default.
+
+        Raises:
+            P4Exception: the first removal that failed. The phases after it are
+                not run, the rest of its own phase is.
+        """
+        logging.info(
+            "Removing what was set up for the depot %s", self.result.get("Depot")
+        )
+        phases = self.plan_undo()
+        if not phases:
+            logging.info("Nothing to remove for show %s", self.show)
+            return
+
+        def remove(name, removal):
+            try:
+                if pool is None:
+                    removal_result = removal(self.p4)
+                else:
+                    with pool.acquire() as p4:
+                        removal_result = removal(p4)
+            except p4_connection_utility.p4_exception_types() as error:
+                logging.error("Could not remove %s: %s", name, error)
+                return error
+            logging.info("Removing %s: %s", name, removal_result)
+            return None
+
+        executor = None
+        if pool is not None:
+            executor = ThreadPoolExecutor(
+                max_workers=pool.size, thread_name_prefix="P4ShowUndo"
+            )
+        try:
+            for phase in phases:
+                if executor is None:
+                    errors = [remove(name, removal) for name, removal in phase]
+                else:
+                    # Each removal runs in a copy of this context, which keeps the undo
+                    # step and the show in its log lines and events.
+                    futures = [
+                        executor.submit(
+                            contextvars.copy_context().run, remove, name, removal
+                        )
+                        for name, removal in phase
+                    ]
+                    errors = [future.result() for future in futures]
+                errors = [error for error in errors if error is not None]
+                if errors:
+                    raise errors[0]
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+
+def _run_removal(args, p4):
+    """Run one removal command.
+
+    Args:
+        args (tuple[str]): the command and its arguments.
+        p4 (P4.P4): the connection to run it on.
+
+    Returns:
+        list: the command results.
+    """
+    return p4.run(*args)
+
+
+def _run_removals(commands, p4):
+    """Run removal commands one after another.
+
+    Args:
+        commands (list[tuple[str]]): the commands and their arguments.
+        p4 (P4.P4): the connection to run them on.
+
+    Returns:
+        list: the results of every command.
+    """
+    return [result for args in commands for result in p4.run(*args)]
+
+
+def strip_permission_comment(entry):
+    """Get a permissions table entry without its trailing comment.
+
+    Args:
+        entry (str): the permissions table entry.
+
+    Returns:
+        str: the entry's rule, with whitespace normalized.
+    """
+    return " ".join(entry.split("##", 1)[0].split())
+
+
+def get_source_groups(json_config):
+    """Get the groups whose members are copied into the show's groups.
+
+    Args:
+        json_config (dict): the division config.
+
+    Returns:
+        list[str]: the source group names, in config order, without duplicates.
+    """
+    source_groups = []
+    for grp_settings_dict in json_config["groups"].values():
+        if grp_settings_dict == "empty":
+            continue
+        for user_grp_array in grp_settings_dict.values():
+            for user_grp in user_grp_array:
+                if not isinstance(user_grp, dict) or "groups" not in user_grp:
+                    continue
+                if user_grp["groups"] not in source_groups:
+                    source_groups.append(user_grp["groups"])
+    return source_groups
+
+
+class _SetupPrefetch:
+    """Connect and prefetch read-only state while the user answers the prompts.
+
+    The work runs on a background thread. `result()` waits for it, `cancel()`
+    stops it after the command in flight and disconnects.
+    """
+
+    def __init__(self, args, prefetch_reads=True):
+        """Start the background work.
+
+        Args:
+            args (argparse.Namespace): the parsed command line arguments.
+            prefetch_reads (bool, optional): whether to run the setup's first read
+                commands, or only connect.
+        """
+        self.args = args
+        self.prefetch_reads = prefetch_reads
+        self._cancelled = threading.Event()
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="P4ShowSetupPrefetch"
+        )
+        self._future = self._executor.submit(self._prefetch)
+
+    def _prefetch(self):
+        """Load the config, connect and run the read-only commands.
+
+        Returns:
+            dict: the "config_data", the validated "show_setup_instance" if the
+                division was given, the "connection_errors", and the "prefetched"
+                command results.
+        """
+        result = {
+            "config_data": load_config_data(),
+            "show_setup_instance": None,
+            "connection_errors": None,
+            "prefetched": {},
+        }
+        if result["config_data"] is None:
+            return result
+
+        if self.args.division:
+            result["show_setup_instance"] = _create_validated_instance(
+                self.args, config_data=result["config_data"]
+            )
+            if result["show_setup_instance"] is None:
+                return result
+            commands = result["show_setup_instance"].prefetch_commands()
+        else:
+            show_setup_instance = P4ShowSetup(self.args.show, {"groups": {}})
+            commands = show_setup_instance.prefetch_commands()
+            for json_config in result["config_data"].values():
+                for grp_name in get_source_groups(json_config):
+                    if ("group", "-o", grp_name) not in commands:
+                        commands.append(("group", "-o", grp_name))
+
+        if self._cancelled.is_set():
+            return result
+        result["connection_errors"] = _setup_p4_instance()
+        if result["connection_errors"] is not None or not self.prefetch_reads:
+            return result
+
+        from shared import p4_batch_utility  # pylint: disable=import-outside-toplevel
+
+        p4 = _get_p4_connection()
+        if p4_batch_utility.supports_argument_files(p4):
+            commands = self._prefetch_groups(p4, commands, result["prefetched"])
+        for command in commands:
+            if self._cancelled.is_set():
+                break
+            try:
+                result["prefetched"][command] = (time.monotonic(), p4.run(*command))
+            except p4_connection_utility.p4_exception_types() as error:
+                # The setup runs the command itself and handles the error.
+                logging.debug("Unable to prefetch %s: %s", " ".join(command), error)
+        return result
+
+    def _prefetch_groups(self, p4, commands, prefetched):
+        """Prefetch every `group -o` command in batches.
+
+        Args:
+            p4 (P4.P4): the connection.
+            commands (list[tuple]): the commands to prefetch.
+            prefetched (dict): the prefetched results to add to.
+
+        Returns:
+            list[tuple]: the commands left to prefetch.
+        """
+        group_commands = [
+            command for command in commands if command[:2] == ("group", "-o")
+        ]
+        if self._cancelled.is_set() or not group_commands:
+            return commands
+        from shared import p4_batch_utility  # pylint: disable=import-outside-toplevel
+
+        batch_result = p4_batch_utility.BatchReader(p4).read(
+            ("group", "-o"), [command[2] for command in group_commands]
+        )
+        fetched_at = time.monotonic()
+        for grp_name, group_result in batch_result.results.items():
+            prefetched[("group", "-o", grp_name)] = (fetched_at, group_result)
+        return [command for command in commands if command not in group_commands]
+
+    def result(self):
+        """Wait for the background work to finish.
+
+        Returns:
+            dict: see `_prefetch()`.
+        """
+        try:
+            return self._future.result()
+        finally:
+            self._executor.shutdown()
+
+    def cancel(self):
+        """Stop the background work and disconnect."""
+        logging.debug("Cancelling background connection and prefetch")
+        self._cancelled.set()
+        try:
+            self._future.result()
+        except Exception as error:  # pylint: disable=broad-except
+            logging.debug("Background prefetch failed: %s", error)
+        self._executor.shutdown()
+        _cleanup_p4_instance()
+
+
+def _print_help():
+    """
+    Print the help information to the screen.
+
+    Returns:
+        string: The contents of the help message.
+    """
+    help_message = """\n
+        Dneg's Perforce Show Setup.
+        ================================\n\n
+        A command line tool to help automate the process of p4 show setup.\n\n
+        """
+
+    return help_message
+
+
+def _setup_parse_arguments():
+    """
+    Parse the arguments.
+
+    Returns:
+        list: a list of arguments.
+    """
+    logging.info("Parsing Command line Arguments")
+
+    parser = arg_parser_utility.setup_parser(help_message=_print_help())
+    parser.add_argument(
+        "--events",
+        type=str,
+        default=None,
+        help="File to append structured events to, one JSON object per line.",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        type=str,
+        default=None,
+        help="Prometheus textfile (.prom) to write the run's metrics to when it ends.",
+    )
+    parser.add_argument(
+        "--record",
+        type=str,
+        default=None,
+        help="File to record the run's perforce commands to, with user names scrubbed.",
+    )
+    parser.add_argument(
+        "--replay",
+        type=str,
+        default=None,
+        help="Recording to serve perforce commands from, instead of the server.",
+    )
+    parser.add_argument(
+        "--replay-latency",
+        type=float,
+        default=None,
+        help="Wait this multiple of the recorded latencies when replaying, 1 for the originals.",
+    )
+    parser.add_argument(
+        "--profile",
+        choices=PROFILE_KINDS,
+        default=None,
+        help="Profile the run's CPU time or memory, attributed to the setup steps.",
+    )
+    parser.add_argument(
+        "--profile-output",
+        type=str,
+        default=None,
+        help="Directory to write the profiles to. Defaults to the log directory.",
+    )
+    show_arguments = argparse.ArgumentParser(add_help=False)
+    show_arguments.add_argument(
+        "-s",
+        "--show",
+        type=str,
+        required=True,
+        help="Showcode for the show being set up. Must be all CAPS. (required)",
+    )
+    show_arguments.add_argument(
+        "-d",
+        "--division",
+        nargs="*",
+        default=None,
+        help="Division of company. Specifies permission groups, and stream structure.",
+    )
+
+    subparsers = parser.add_subparsers(dest="command", metavar="command")
+    subparsers.add_parser(
+        "validate",
+        parents=[show_arguments],
+        help="Check the show code and division config. Does not contact the server.",
+    )
+    subparsers.add_parser(
+        "plan",
+        parents=[show_arguments],
+        help="Print what would be created. Does not contact the server.",
+    )
+    subparsers.add_parser(
+        "apply",
+        parents=[show_arguments],
+        help="Set up the show in Perforce. (default)",
+    )
+    converge_parser = subparsers.add_parser(
+        "converge",
+        parents=[show_arguments],
+        help="Change only what differs between an existing show and its division config.",
+    )
+    converge_parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        default=False,
+        help="Only report what would be changed.",
+    )
+    subparsers.add_parser(
+        "undo",
+        parents=[show_arguments],
+        help="Remove everything the setup creates for the show from Perforce.",
+    )
+    audit_parser = subparsers.add_parser(
+        "audit",
+        help="Report what is missing from the show's setup in Perforce.",
+    )
+    audit_targets = audit_parser.add_mutually_exclusive_group(required=True)
+    audit_targets.add_argument(
+        "-s",
+        "--show",
+        type=str,
+        help="Showcode of the show to audit.",
+    )
+    audit_targets.add_argument(
+        "--all",
+        action="store_true",
+        default=False,
+        help="Audit every show on the server against its division config.",
+    )
+    audit_parser.add_argument(
+        "-d",
+        "--division",
+        nargs="*",
+        default=None,
+        help="Division of company. With --all, deduced from each show code if not given.",
+    )
+    audit_parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="With --all, number of server queries to run at once.",
+    )
+    audit_parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="With --all, JSON file to write the differences of every show to.",
+    )
+    bench_parser = subparsers.add_parser(
+        "bench",
+        help="Measure import time, connection time and server round trips.",
+    )
+    bench_parser.add_argument(
+        "--iterations",
+        type=int,
+        default=10,
+        help="Number of server round trips to time.",
+    )
+    bench_parser.add_argument(
+        "--offline",
+        action="store_true",
+        default=False,
+        help="Skip the measurements that need the server.",
+    )
+    decommission_parser = subparsers.add_parser(
+        "decommission",
+        help="Remove a finished show's protections, groups, streams, files and depot.",
+    )
+    decommission_parser.add_argument(
+        "-s",
+        "--show",
+        type=str,
+        required=True,
+        help="Showcode of the show to remove. (required)",
+    )
+    decommission_parser.add_argument(
+        "-d",
+        "--division",
+        type=str,
+        default=None,
+        help="Division of the show, whose config names its groups. Deduced from the show "
+        "code if not given.",
+    )
+    decommission_parser.add_argument(
+        "--obliterate",
+        choices=("full", "fast"),
+        default="full",
+        help="'fast' skips the have list and archive files, for shows whose archives "
+        "were moved off the server.",
+    )
+    decommission_parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="Number of removals to run at once.",
+    )
+    decommission_parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        default=False,
+        help="Only report what would be removed.",
+    )
+    protections_parser = subparsers.add_parser(
+        "protections-update",
+        help="Add the protections lines the division configs require to every show, in one write.",
+    )
+    protections_parser.add_argument(
+        "-d",
+        "--division",
+        type=str,
+        default=None,
+        help="Division of every show. Deduced from each show code if not given.",
+    )
+    protections_parser.add_argument(
+        "--shows",
+        nargs="+",
+        default=None,
+        help="Showcodes of the shows to update. Defaults to every show depot.",
+    )
+    protections_parser.add_argument(
+        "--diff-output",
+        type=str,
+        default=None,
+        help="File to write the diff of the protections table to, for review.",
+    )
+    protections_parser.add_argument(
+        "--apply",
+        action="store_true",
+        default=False,
+        help="Submit the updated table. Without it, only the diff is produced.",
+    )
+    optimize_parser = subparsers.add_parser(
+        "protections-optimize",
+        help="Remove the duplicate, shadowed and redundant protections lines, in one write.",
+    )
+    optimize_parser.add_argument(
+        "--diff-output",
+        type=str,
+        default=None,
+        help="File to write the diff of the protections table to, for review.",
+    )
+    optimize_parser.add_argument(
+        "--apply",
+        action="store_true",
+        default=False,
+        help="Submit the optimized table. Without it, only the report and diff are produced.",
+    )
+    sync_owners_parser = subparsers.add_parser(
+        "sync-owners",
+        help="Copy source group changes to the show groups whose members come from them.",
+    )
+    sync_owners_parser.add_argument(
+        "-d",
+        "--division",
+        type=str,
+        default=None,
+        help="Division of every show. Deduced from each show code if not given.",
+    )
+    sync_owners_parser.add_argument(
+        "--source",
+        nargs="+",
+        default=None,
+        help="Only sync the show groups depending on these source groups, e.g. dnegvp_volume.",
+    )
+    sync_owners_parser.add_argument(
+        "--prune",
+        action="store_true",
+        default=False,
+        help="Also remove the members the source groups no longer have.",
+    )
+    sync_owners_parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="Number of groups to rewrite at once.",
+    )
+    sync_owners_parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        default=False,
+        help="Only report what would be changed.",
+    )
+    orphans_parser = subparsers.add_parser(
+        "orphans",
+        help="Find the groups, protections lines and streams of shows whose depot is gone.",
+    )
+    orphans_parser.add_argument(
+        "--cleanup",
+        action="store_true",
+        default=False,
+        help="Remove what was found, the protections lines in a single table write.",
+    )
+    orphans_parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="Number of server queries and removals to run at once.",
+    )
+    orphans_parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="JSON file to write what was found to.",
+    )
+    loadtest_parser = subparsers.add_parser(
+        "loadtest",
+        help="Measure concurrent setups against a simulated server, with table locks.",
+    )
+    loadtest_parser.add_argument(
+        "-d",
+        "--division",
+        type=str,
+        default="VFX",
+        help="Division whose config the simulated setups follow.",
+    )
+    loadtest_parser.add_argument(
+        "--concurrency",
+        type=lambda value: [int(level) for level in value.split(",")],
+        default=[1, 2, 4, 8, 16],
+        help="Comma-separated numbers of setups to run at once, e.g. 1,2,4,8.",
+    )
+    loadtest_parser.add_argument(
+        "--setups",
+        type=int,
+        default=16,
+        help="Number of setups to run at each concurrency level.",
+    )
+    loadtest_parser.add_argument(
+        "--source-files",
+        type=int,
+        default=5000,
+        help="Number of files in the template streams are populated from.",
+    )
+    loadtest_parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="JSON file to write the results of each level to.",
+    )
+    serve_parser = subparsers.add_parser(
+        "serve",
+        help="Run apply, undo and audit jobs submitted over HTTP, until stopped.",
+    )
+    serve_parser.add_argument(
+        "--port",
+        type=int,
+        default=8765,
+        help="Port to accept jobs on, on localhost.",
+    )
+    serve_parser.add_argument(
+        "--workers",
+        type=int,
+        default=2,
+        help="Number of jobs to run at once.",
+    )
+    serve_parser.add_argument(
+        "--queue",
+        type=str,
+        default=None,
+        help="SQLite file the job queue is kept in.",
+    )
+    return parser
+
+
+def _normalize_arguments(argv):
+    """Route invocations without a subcommand to the default command.
+
+    Keeps `p4_show_setup.py -s SHOW -d TS` working as it did before subcommands.
+
+    Args:
+        argv (list[str]): the command line arguments, without the program name.
+
+    Returns:
+        list[str]: the arguments, with the default command inserted if needed.
+    """
+    if any(arg in COMMANDS for arg in argv):
+        return argv
+    for index, arg in enumerate(argv):
+        if arg.startswith(("-s", "--show", "-d", "--division")):
+            return argv[:index] + [DEFAULT_COMMAND] + argv[index:]
+    return argv
+
+
+def _initialize_logging(args):
+    """Set up console and file logging for the run.
+
+    Args:
+        args (argparse.Namespace): the parsed command line arguments.
+    """
+    log_output_path = logging_utility.set_logger_output_path(
+        LOG_OUTPUT_DIR, getattr(args, "log_locally", False)
+    )
+    logging_utility.initialize_logger(
+        getattr(args, "loglevel", "INFO"),
+        True,
+        log_output_path,
+        LOG_OUTPUT_DIR,
+        use_queue=getattr(args, "queue_logging", False),
+        overflow_policy=getattr(args, "log_overflow", logging_utility.OVERFLOW_BLOCK),
+        max_bytes=getattr(args, "log_max_bytes", 0),
+    )
+    if getattr(args, "events", None):
+        event_utility.configure(args.events)
+    if getattr(args, "metrics_file", None):
+        metrics_utility.configure(args.metrics_file)
+
+
+def _initialize_recording(args):
+    """Set up recording or replaying of the run's perforce commands.
+
+    Args:
+        args (argparse.Namespace): the parsed command line arguments.
+    """
+    record = getattr(args, "record", None)
+    replay = getattr(args, "replay", None)
+    if not record and not replay:
+        return
+    from shared import p4_recording_utility  # pylint: disable=import-outside-toplevel
+
+    if record:
+        p4_recording_utility.configure_recording(record)
+    if replay:
+        p4_recording_utility.configure_replay(replay, args.replay_latency)
+        os.environ[
+            p4_connection_utility.BACKEND_ENVIRONMENT_VARIABLE
+        ] = p4_connection_utility.REPLAY_BACKEND
+
+
+def load_config_data():
+    """Load the division configs.
+
+    Returns:
+        dict: the configs for every division, or None if they could not be read.
+    """
+    logging.info(
+        "Retrieving configs from"
+        " \\unrealdevops-perforceshowsetup\\src\\config\\show_setup_configs.json"
+    )
+    try:
+        with open(CONFIG_PATH, "r") as config_file:
+            return json.load(config_file)
+    except OSError as error:
+        logging.warning("Unable to open file show_setup_configs.json: %s", repr(error))
+        return None
+
+
+def division_from_show(show):
+    """Deduce a show's division from its show code.
+
+    Args:
+        show (str): the show code.
+
+    Returns:
+        str: "TS" for codes starting with TS, "RE" for codes ending with RE,
+            otherwise "VFX".
+    """
+    if show.startswith("TS"):
+        return "TS"
+    if show.endswith("RE"):
+        return "RE"
+    return "VFX"
+
+
+def _get_division_config(config_data, div, show, interactive=True):
+    """Select the config for the requested division.
+
+    Args:
+        config_data (dict): the configs for every division.
+        div (list[str]): the division given on the command line, if any.
+        show (str): the show code, used to deduce the division when not interactive.
+        interactive (bool, optional): whether to ask the user for a missing division.
+
+    Returns:
+        dict: the config for the division.
+    """
+    div = div or []
+    if "TS" in div:
+        logging.info("Perforce depot will be set up using configs for TS (ThreeSixty)")
+        return config_data["TS"]
+    if "RE" in div:
+        logging.info("Perforce depot will be set up using configs for RE (Redefine)")
+        return config_data["RE"]
+    if "VFX" in div:
+        logging.info("Perforce depot will be set up using configs for VFX")
+        return config_data["VFX"]
+    if "TESTDIV" in div:
+        logging.info("Perforce depot will be set up using configs for Testing")
+        return config_data["TESTDIV"]
+
+    logging.info("division not specified")
+    if interactive:
+        user_input_division = input("Please specify a company division TS|RE|[VFX]:")
+    else:
+        user_input_division = division_from_show(show)
+    if "TS" in user_input_division:
+        logging.info("Perforce depot will be set up using configs for TS (ThreeSixty)")
+        return config_data["TS"]
+    if "RE" in user_input_division:
+        logging.info("Perforce depot will be set up using configs for Redefine")
+        return config_data["RE"]
+    logging.info("Perforce depot will be set up using configs for VFX")
+    return config_data["VFX"]
 
-    # Validate showcode
+
+def get_show_config(show, division=None, config_data=None):
+    """Get the division config for a show, without asking the user.
+
+    Args:
+        show (str): the show code.
+        division (str, optional): the division. Deduced from the show code if not
+            given.
+        config_data (dict, optional): the configs for every division. Loaded from
+            `CONFIG_PATH` if not given.
+
+    Returns:
+        dict: the division config, or None if the configs could not be read.
+    """
+    if config_data is None:
+        config_data = load_config_data()
+    if config_data is None:
+        return None
+    return _get_division_config(
+        config_data, [division] if division else None, show, interactive=False
+    )
+
+
+def _confirm_show(show):
+    """Ask the user to type the show code again.
+
+    Args:
+        show (str): the show code given on the command line.
+
+    Returns:
+        bool: whether the user confirmed the show code.
+    """
     user_input_show = input("Please confirm the Show Code: ")
     if user_input_show != show:
         logging.warning(
             "Manual show code confirmation failed: %s does not match %s\nCancelling Process",
             show,
-            user_input_show
+            user_input_show,
+        )
+        return False
+    return True
+
+
+def _create_validated_instance(args, interactive=False, config_data=None):
+    """Build a P4ShowSetup for the command line arguments and validate its show code.
+
+    Args:
+        args (argparse.Namespace): the parsed command line arguments.
+        interactive (bool, optional): whether to ask the user for a missing division.
+        config_data (dict, optional): the configs for every division. Loaded from
+            `CONFIG_PATH` if not given.
+
+    Returns:
+        P4ShowSetup: the instance, or None if the config or show code is invalid.
+    """
+    if config_data is None:
+        config_data = load_config_data()
+    if config_data is None:
+        return None
+    json_config = _get_division_config(
+        config_data, args.division, args.show, interactive=interactive
+    )
+
+    show_setup_instance = P4ShowSetup(args.show, json_config)
+
+    logging.info("Validating show code against show naming conventions.")
+    show_name_errors = show_setup_instance.validate_show()
+
+    if show_name_errors:
+        logging.warning("Show code invalid: %s", "; ".join(show_name_errors))
+        return None
+
+    logging.info("Showcode %s is valid", args.show)
+    return show_setup_instance
+
+
+def _setup_p4_instance(p4=None):
+    """Set up the Perforce instance.
+
+    Args:
+        p4 (P4.P4, optional): the connection to set up. Defaults to the module's
+            shared connection.
+
+    Returns:
+        list: the connection errors, or None if the connection succeeded.
+    """
+    if p4 is None:
+        p4 = _get_p4_connection()
+    p4.port = DEFAULT_P4_PORT
+    p4.user = os.getlogin()
+
+    logging.info("Connecting to perforce %s", p4.port)
+    try:
+        p4.connect()
+        logging.info("Successfully connected to perforce %s", p4.port)
+        return None
+    except p4_connection_utility.p4_exception_types():
+        logging.error("Error connecting to perforce %s", p4.port)
+        for error in p4.errors:
+            logging.error(error)
+        return p4.errors
+
+
+def _cleanup_p4_instance(p4=None):
+    """Clean up the Perforce instance.
+
+    Args:
+        p4 (P4.P4, optional): the connection to close. Defaults to the module's
+            shared connection, if it was ever created.
+    """
+    if p4 is None:
+        p4 = _P4_CONNECTION
+    if p4 is None:
+        return
+    retry_counts = getattr(p4, "retry_counts", None)
+    if retry_counts:
+        logging.info(
+            "Retried %d perforce commands: %s",
+            sum(retry_counts.values()),
+            ", ".join(
+                f"{count} after {error_class} errors"
+                for error_class, count in sorted(retry_counts.items())
+            ),
         )
+    if not p4.connected():
         return
+    logging.info("Disconnecting from perforce server")
+    p4.disconnect()
 
+
+def _run_validate(args):
+    """Validate the show code and division config without contacting the server.
+
+    Args:
+        args (argparse.Namespace): the parsed command line arguments.
+
+    Returns:
+        bool: whether the show can be set up.
+    """
+    return _create_validated_instance(args) is not None
+
+
+def _run_plan(args):
+    """Log everything the setup would create without contacting the server.
+
+    Args:
+        args (argparse.Namespace): the parsed command line arguments.
+
+    Returns:
+        bool: whether a plan could be made.
+    """
+    show_setup_instance = _create_validated_instance(args)
+    if show_setup_instance is None:
+        return False
     logging.info(
-        "Retrieving configs from"
-        " \\unrealdevops-perforceshowsetup\\src\\config\\show_setup_configs.json"
+        "Show setup plan for %s:\n%s",
+        args.show,
+        json.dumps(show_setup_instance.plan(), indent=4),
+    )
+    return True
+
+
+def _start_prefetched_instance(args, prefetch_reads=True):
+    """Confirm the show with the user while connecting in the background.
+
+    Args:
+        args (argparse.Namespace): the parsed command line arguments.
+        prefetch_reads (bool, optional): whether to prefetch the setup's first
+            read commands, or only connect.
+
+    Returns:
+        P4ShowSetup: the validated instance, on a connected server, or None if
+            the user aborted or anything failed. The background work is cancelled
+            in that case.
+    """
+    # Connect, compile the config and prefetch while the prompts are waiting.
+    prefetch = _SetupPrefetch(args, prefetch_reads=prefetch_reads)
+
+    # Validate showcode
+    if not _confirm_show(args.show):
+        prefetch.cancel()
+        return None
+
+    prefetched = prefetch.result()
+    if prefetched["config_data"] is None:
+        prefetch.cancel()
+        return None
+
+    show_setup_instance = prefetched["show_setup_instance"]
+    if show_setup_instance is None:
+        if args.division:
+            # The show code was already rejected in the background.
+            prefetch.cancel()
+            return None
+        show_setup_instance = _create_validated_instance(
+            args, interactive=True, config_data=prefetched["config_data"]
+        )
+        if show_setup_instance is None:
+            prefetch.cancel()
+            return None
+
+    if prefetched["connection_errors"] is not None:
+        logging.warning("Perforce Connection Setup Failed. Cancelling operation")
+        return None
+
+    show_setup_instance.prefetched = prefetched["prefetched"]
+    return show_setup_instance
+
+
+def _rollback(show_setup_instance):
+    """Undo a show setup, running independent removals on pooled connections.
+
+    Args:
+        show_setup_instance (P4ShowSetup): the setup to undo.
+    """
+    pool = p4_connection_utility.ConnectionPool(
+        create_connected_connection, size=UNDO_WORKERS
     )
     try:
-        with open('.\\config\\show_setup_configs.json', 'r') as config_file:
-            config_data = json.load(config_file)
-    except OSError as error:
-        logging.warning("Unable to open file show_setup_configs.json: %s", repr(error))
-        return
+        show_setup_instance.undo_show_setup(pool=pool)
+    finally:
+        pool.close()
 
-    if "TS" in div:
-        logging.info("Perforce depot will be set up using configs for TS (ThreeSixty)")
-        json_config = config_data["TS"]
-    elif "RE" in div:
-        logging.info("Perforce depot will be set up using configs for RE (Redefine)")
-        json_config = config_data["RE"]
-    elif "VFX" in div:
-        logging.info("Perforce depot will be set up using configs for VFX")
-        json_config = config_data["VFX"]
-    elif "TESTDIV" in div:
-        logging.info("Perforce depot will be set up using configs for Testing")
-        json_config = config_data["TESTDIV"]
-    else:
-        logging.info("division not specified")
-        user_input_division = input("Please specify a company division TS|RE|[VFX]:")
-        if "TS" in user_input_division:
+
+def _rollback_failed_setup(show_setup_instance):
+    """Undo a failed show setup, logging any error the rollback raises.
+
+    The setup's own error is the one reported, so a rollback error, or a
+    second cancellation, is logged instead of raised.
+
+    Args:
+        show_setup_instance (P4ShowSetup): the setup to undo.
+    """
+    try:
+        _rollback(show_setup_instance)
+    except Exception as error:  # pylint: disable=broad-except
+        logging.error(
+            "Rolling back the setup of %s failed: %s. Remove what is left with undo.",
+            show_setup_instance.show,
+            repr(error),
+        )
+
+
+def _run_apply(args):
+    """Set up show depot, permissions, and streams in Perforce.
+
+    Args:
+        args (argparse.Namespace): the parsed command line arguments.
+
+    Returns:
+        bool: whether the setup succeeded.
+    """
+    show_setup_instance = _start_prefetched_instance(args)
+    if show_setup_instance is None:
+        return False
+
+    succeeded = False
+    try:
+        with p4_deadline_utility.handle_termination_signals(_CANCELLATION):
+            # Creating the depot, permissions, groups and initial streams.
+            for step_name in SETUP_STEPS:
+                getattr(show_setup_instance, step_name)()
+        succeeded = True
+    except p4_deadline_utility.OperationCancelled as error:
+        logging.warning("Perforce Show Setup Stopped: %s. Rolling back.", error)
+        # Let the rollback commands run.
+        _CANCELLATION.reset()
+        with p4_deadline_utility.handle_termination_signals(_CANCELLATION):
+            _rollback_failed_setup(show_setup_instance)
+    except p4_connection_utility.p4_exception_types() as error:
+        logging.warning(
+            "Perforce Show Setup Failed with P4 Exception: %s.", repr(error)
+        )
+        for key, value in show_setup_instance.result.items():
+            logging.warning("Removing %s: %s", key, value)
+        _rollback_failed_setup(show_setup_instance)
+    except (PermissionsVerificationError, TypeError, AttributeError, KeyError) as error:
+        logging.warning("Perforce Show Setup Failed with Exception: %s.", repr(error))
+        for key, value in show_setup_instance.result.items():
+            logging.warning("Removing %s: %s", key, value)
+        _rollback_failed_setup(show_setup_instance)
+    finally:
+        _cleanup_p4_instance()
+    return succeeded
+
+
+def _run_converge(args):
+    """Bring an existing show in line with its division config.
+
+    Args:
+        args (argparse.Namespace): the parsed command line arguments.
+
+    Returns:
+        bool: whether the show was brought in line, or for a dry run, whether
+            the changes could be planned.
+    """
+    show_setup_instance = _create_validated_instance(args)
+    if show_setup_instance is None:
+        return False
+
+    if _setup_p4_instance() is not None:
+        logging.warning("Perforce Connection Setup Failed. Cancelling operation")
+        return False
+
+    try:
+        delta = show_setup_instance.plan_converge()
+        if not delta:
+            logging.info("Show %s matches its division config", args.show)
+            return True
+        logging.info("Changes for show %s:\n%s", args.show, json.dumps(delta, indent=4))
+        if args.dry_run:
+            return True
+        show_setup_instance.converge(delta)
+        return True
+    except p4_connection_utility.p4_exception_types() + (ValueError,) as error:
+        logging.warning("Perforce Show Converge Failed: %s.", repr(error))
+        return False
+    finally:
+        _cleanup_p4_instance()
+
+
+def _run_undo(args):
+    """Remove everything the setup creates for a show from Perforce.
+
+    Args:
+        args (argparse.Namespace): the parsed command line arguments.
+
+    Returns:
+        bool: whether the removal succeeded.
+    """
+    show_setup_instance = _start_prefetched_instance(args, prefetch_reads=False)
+    if show_setup_instance is None:
+        return False
+
+    try:
+        show_setup_instance.result = show_setup_instance.discover_result()
+        show_setup_instance.result.pop("StreamSpecs", None)
+        if not show_setup_instance.result:
+            logging.info("Nothing to remove for show %s", args.show)
+            return True
+        _rollback(show_setup_instance)
+        return True
+    except p4_connection_utility.p4_exception_types() as error:
+        logging.warning("Perforce Show Undo Failed with P4 Exception: %s.", repr(error))
+        return False
+    finally:
+        _cleanup_p4_instance()
+
+
+def _run_audit(args):
+    """Report what is missing from a show's setup in Perforce.
+
+    Args:
+        args (argparse.Namespace): the parsed command line arguments.
+
+    Returns:
+        bool: whether the show matches its division config.
+    """
+    if args.all:
+        return _run_fleet_audit(args)
+    show_setup_instance = _create_validated_instance(args)
+    if show_setup_instance is None:
+        return False
+
+    if _setup_p4_instance() is not None:
+        logging.warning("Perforce Connection Setup Failed. Cancelling operation")
+        return False
+
+    try:
+        differences = show_setup_instance.audit()
+    finally:
+        _cleanup_p4_instance()
+
+    for key, value in differences.items():
+        logging.warning("Missing %s for %s: %s", key, args.show, value)
+    if not differences:
+        logging.info("Show %s matches its division config", args.show)
+    return not differences
+
+
+def _run_fleet_audit(args):
+    """Report how every show on the server differs from its division config.
+
+    Args:
+        args (argparse.Namespace): the parsed command line arguments.
+
+    Returns:
+        bool: whether every show matches its division config.
+    """
+    # Imported here, since the fleet audit module depends on this one.
+    import p4_show_fleet_audit  # pylint: disable=import-outside-toplevel
+
+    config_data = load_config_data()
+    if config_data is None:
+        return False
+    division = args.division[0] if args.division else None
+    if division is not None and division not in config_data:
+        logging.warning("Unknown division %s", division)
+        return False
+
+    workers = max(1, args.workers)
+    pool = p4_connection_utility.ConnectionPool(
+        create_connected_connection, size=workers
+    )
+    try:
+        report = p4_show_fleet_audit.audit_fleet(
+            pool, config_data, division, workers=workers
+        )
+    except p4_connection_utility.p4_exception_types() as error:
+        logging.warning(
+            "Perforce Fleet Audit Failed with P4 Exception: %s.", repr(error)
+        )
+        return False
+    finally:
+        pool.close()
+
+    for show, differences in sorted(report.items()):
+        for key, value in differences.items():
+            logging.warning("%s for %s: %s", key, show, value)
+    logging.info("%d shows differ from their division config", len(report))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as report_file:
+            json.dump(report, report_file, indent=2, sort_keys=True)
+        logging.info("Wrote the audit results to %s", args.output)
+    return not report
+
+
+def _measure_import_time():
+    """Time a fresh interpreter importing this module.
+
+    Returns:
+        tuple: the import time in seconds, and whether P4Python got imported.
+            The time is None if it could not be measured.
+    """
+    module_dir = os.path.dirname(os.path.abspath(__file__))
+    command = (
+        f'"{sys.executable}" -c "import sys, time; '
+        f"sys.path.insert(0, {module_dir!r}); "
+        "start = time.perf_counter(); import p4_show_setup; "
+        "print(time.perf_counter() - start, 'P4' in sys.modules)\""
+    )
+    success, output = subprocess_utility.trigger_subprocess(command)
+    if not success:
+        logging.warning("Unable to measure import time: %s", output)
+        return (None, None)
+    import_time, p4_imported = output.splitlines()[-1].split()
+    return (float(import_time), p4_imported == "True")
+
+
+def _run_bench(args):
+    """Measure import time, connection time and server round trip latency.
+
+    Args:
+        args (argparse.Namespace): the parsed command line arguments.
+
+    Returns:
+        bool: whether the import time is within `IMPORT_TIME_BUDGET_SECONDS`.
+    """
+    import_time, p4_imported = _measure_import_time()
+    within_budget = (
+        import_time is not None and import_time <= IMPORT_TIME_BUDGET_SECONDS
+    )
+    logging.info(
+        "Import time: %.4fs (budget %.2fs, P4Python imported: %s)",
+        import_time or 0.0,
+        IMPORT_TIME_BUDGET_SECONDS,
+        p4_imported,
+    )
+
+    start = time.perf_counter()
+    p4_connection_utility.import_p4python()
+    logging.info("P4Python import time: %.4fs", time.perf_counter() - start)
+
+    start = time.perf_counter()
+    load_config_data()
+    logging.info("Config load time: %.4fs", time.perf_counter() - start)
+
+    if args.offline:
+        return within_budget
+
+    start = time.perf_counter()
+    if _setup_p4_instance() is not None:
+        logging.warning("Perforce Connection Setup Failed. Cancelling operation")
+        return False
+    logging.info("Connection time: %.4fs", time.perf_counter() - start)
+
+    try:
+        p4 = _get_p4_connection()
+        round_trips = []
+        for _ in range(args.iterations):
+            start = time.perf_counter()
+            p4.run("info")
+            round_trips.append(time.perf_counter() - start)
+    finally:
+        _cleanup_p4_instance()
+
+    if round_trips:
+        round_trips.sort()
+        logging.info(
+            "Round trip time over %d commands: min %.4fs, median %.4fs, max %.4fs",
+            len(round_trips),
+            round_trips[0],
+            round_trips[len(round_trips) // 2],
+            round_trips[-1],
+        )
+    return within_budget
+
+
+def _run_serve(args):
+    """Run the show setup service until Ctrl-C or SIGTERM.
+
+    Args:
+        args (argparse.Namespace): the parsed command line arguments.
+
+    Returns:
+        bool: True once the service has stopped.
+    """
+    # Imported here, since the service module depends on this one.
+    import p4_show_daemon  # pylint: disable=import-outside-toplevel
+
+    p4_show_daemon.serve(
+        port=args.port,
+        workers=args.workers,
+        queue_path=args.queue or p4_show_daemon.DEFAULT_QUEUE_PATH,
+    )
+    return True
+
+
+def _run_loadtest(args):
+    """Run concurrent setups against a simulated server and report how they scale.
+
+    Args:
+        args (argparse.Namespace): the parsed command line arguments.
+
+    Returns:
+        bool: whether the division config could be loaded.
+    """
+    # Imported here, since the load test module depends on this one.
+    import p4_show_loadtest  # pylint: disable=import-outside-toplevel
+    from shared import p4_simulator_utility  # pylint: disable=import-outside-toplevel
+
+    json_config = get_show_config(p4_show_loadtest.SHOW_PREFIX, division=args.division)
+    if json_config is None:
+        return False
+    timings = p4_simulator_utility.DEFAULT_TIMINGS._replace(
+        source_files=args.source_files
+    )
+    reports = p4_show_loadtest.run_load_test(
+        json_config, args.concurrency, args.setups, timings
+    )
+    logging.info("Load test results:\n%s", p4_show_loadtest.format_report(reports))
+    if args.output:
+        p4_show_loadtest.write_report(reports, args.output)
+        logging.info("Wrote the load test results to %s", args.output)
+    return True
+
+
+def _run_decommission(args):
+    """Remove a finished show from Perforce, with bulk queries and parallel removals.
+
+    Args:
+        args (argparse.Namespace): the parsed command line arguments.
+
+    Returns:
+        bool: whether everything was removed.
+    """
+    config_data = load_config_data()
+    if config_data is None:
+        return False
+    # A guessed division would remove the groups and streams of another config.
+    if args.division is not None and args.division not in config_data:
+        logging.warning("Unknown division %s", args.division)
+        return False
+    json_config = get_show_config(
+        args.show, division=args.division, config_data=config_data
+    )
+    pool = p4_connection_utility.ConnectionPool(
+        create_connected_connection, size=max(1, args.workers)
+    )
+    try:
+        teardown = p4_show_teardown.ShowTeardown(
+            args.show,
+            json_config,
+            pool,
+            workers=args.workers,
+            obliterate_mode=args.obliterate,
+        )
+        plan = teardown.plan()
+        logging.info(
+            "Decommission plan for %s:\n%s",
+            args.show,
+            json.dumps(plan._asdict(), indent=4),
+        )
+        # The plan is shown first, so that the user confirms what will be removed.
+        if args.dry_run or not _confirm_show(args.show):
+            return args.dry_run
+        report = teardown.execute(plan)
+    except p4_connection_utility.p4_exception_types() as error:
+        logging.warning(
+            "Perforce Show Decommission Failed with P4 Exception: %s.", repr(error)
+        )
+        return False
+    finally:
+        pool.close()
+
+    logging.info("Decommissioned %s:\n%s", args.show, json.dumps(report, indent=4))
+    return not report["Errors"]
+
+
+def _run_protections_update(args):
+    """Add the protections lines the division configs require to every show, in one write.
+
+    Args:
+        args (argparse.Namespace): the parsed command line arguments.
+
+    Returns:
+        bool: whether the table needed no update, or was updated.
+    """
+    # Imported here, since the bulk protections module depends on this one.
+    import p4_show_bulk_protections  # pylint: disable=import-outside-toplevel
+
+    config_data = load_config_data()
+    if config_data is None:
+        return False
+    if args.division is not None and args.division not in config_data:
+        logging.warning("Unknown division %s", args.division)
+        return False
+    if _setup_p4_instance() is not None:
+        logging.warning("Perforce Connection Setup Failed. Cancelling operation")
+        return False
+
+    try:
+        p4 = _get_p4_connection()
+        update = p4_show_bulk_protections.plan_update(
+            p4, config_data, args.division, args.shows
+        )
+        if not update.added:
             logging.info(
-                "Perforce depot will be set up using configs for TS (ThreeSixty)"
+                "Every show has the protections lines its division config requires"
             )
-            json_config = config_data["TS"]
-        elif "RE" in user_input_division:
-            logging.info("Perforce depot will be set up using configs for Redefine")
-            json_config = config_data["RE"]
+            return True
+        diff = p4_show_bulk_protections.unified_diff(update)
+        if args.diff_output:
+            with open(args.diff_output, "w", encoding="utf-8") as diff_file:
+                diff_file.write(diff + "\n")
+            logging.info("Wrote the protections diff to %s", args.diff_output)
         else:
-            logging.info("Perforce depot will be set up using configs for VFX")
-            json_config = config_data["VFX"]
+            logging.info("Protections diff:\n%s", diff)
+        if not args.apply:
+            return True
+        return p4_show_bulk_protections.submit_update(p4, update)
+    except p4_connection_utility.p4_exception_types() + (ValueError,) as error:
+        logging.warning("Perforce Protections Update Failed: %s.", repr(error))
+        return False
+    finally:
+        _cleanup_p4_instance()
 
-    show_setup_instance = P4ShowSetup(show, json_config)
 
-    logging.info("Validating show code against show naming conventions.")
-    show_name_errors = show_setup_instance.validate_show()
+def _run_protections_optimize(args):
+    """Remove the protections lines that change nobody's access, in one write.
 
-    if show_name_errors:
-        logging.warning("Show code invalid: %s", '; '.join(show_name_errors))
-        return
-    else:
-        logging.info("Showcode %s is valid", show)
+    Args:
+        args (argparse.Namespace): the parsed command line arguments.
+
+    Returns:
+        bool: whether the table needed no optimization, or was optimized.
+    """
+    # Imported here, since the bulk protections module depends on this one.
+    import p4_show_bulk_protections  # pylint: disable=import-outside-toplevel
+    import p4_show_protections_optimizer  # pylint: disable=import-outside-toplevel
+
+    if _setup_p4_instance() is not None:
+        logging.warning("Perforce Connection Setup Failed. Cancelling operation")
+        return False
 
     try:
-        # Connecting to Perforce
-        if _setup_p4_instance() is not None:
-            logging.warning("Perforce Connection Setup Failed. Cancelling operation")
-            return
+        p4 = _get_p4_connection()
+        optimization = p4_show_protections_optimizer.plan_optimization(p4)
+        if not optimization.findings:
+            logging.info("Every protections line decides some access")
+            return True
+        for finding in optimization.findings:
+            logging.info(
+                "Line %d is %s by: %s\n    %s",
+                finding.index + 1,
+                finding.kind,
+                finding.covered_by,
+                finding.line,
+            )
+        diff = p4_show_bulk_protections.unified_diff(optimization)
+        if args.diff_output:
+            with open(args.diff_output, "w", encoding="utf-8") as diff_file:
+                diff_file.write(diff + "\n")
+            logging.info("Wrote the protections diff to %s", args.diff_output)
+        else:
+            logging.info("Protections diff:\n%s", diff)
+        if optimization.differences:
+            logging.error(
+                "The optimized table is not equivalent:\n%s",
+                json.dumps(optimization.differences, indent=4),
+            )
+            return False
+        if not args.apply:
+            return True
+        return p4_show_protections_optimizer.submit_optimization(p4, optimization)
+    except p4_connection_utility.p4_exception_types() as error:
+        logging.warning("Perforce Protections Optimization Failed: %s.", repr(error))
+        return False
+    finally:
+        _cleanup_p4_instance()
 
-        # Creating the depot
-        show_setup_instance.create_depot()
-        # Populating permissions
-        show_setup_instance.populate_permissions_table()
-        # Creating groups
-        show_setup_instance.create_groups()
-        # Creating initial streams
-        show_setup_instance.create_initial_streams()
-    except P4Exception as error:
+
+def _run_sync_owners(args):
+    """Copy source group changes to the show groups whose members come from them.
+
+    Args:
+        args (argparse.Namespace): the parsed command line arguments.
+
+    Returns:
+        bool: whether every stale group was synced.
+    """
+    # Imported here, since the owner sync module depends on this one.
+    import p4_show_owner_sync  # pylint: disable=import-outside-toplevel
+
+    config_data = load_config_data()
+    if config_data is None:
+        return False
+    if args.division is not None and args.division not in config_data:
+        logging.warning("Unknown division %s", args.division)
+        return False
+
+    workers = max(1, args.workers)
+    pool = p4_connection_utility.ConnectionPool(
+        create_connected_connection, size=workers
+    )
+    try:
+        changes = p4_show_owner_sync.plan_fleet_sync(
+            pool, config_data, args.division, args.source, args.prune
+        )
+        if not changes:
+            logging.info("Every show group has the members of its source groups")
+            return True
+        logging.info("Group member changes:\n%s", json.dumps(changes, indent=4))
+        if args.dry_run:
+            return True
+        errors = p4_show_owner_sync.apply_sync(pool, changes, workers=workers)
+    except p4_connection_utility.p4_exception_types() as error:
         logging.warning(
-            "Perforce Show Setup Failed with P4 Exception: %s.", repr(error))
-        logging.warning("Removing %s: %s\n" for (key,value) in show_setup_instance.result)
-        show_setup_instance.undo_show_setup()
-    except (TypeError, AttributeError, KeyError) as error:
+            "Perforce Owner Sync Failed with P4 Exception: %s.", repr(error)
+        )
+        return False
+    finally:
+        pool.close()
+
+    logging.info("Synced %d of %d groups", len(changes) - len(errors), len(changes))
+    return not errors
+
+
+def _run_orphans(args):
+    """Find, and optionally remove, what is left of shows whose depot is gone.
+
+    Args:
+        args (argparse.Namespace): the parsed command line arguments.
+
+    Returns:
+        bool: whether nothing was found, or everything found was removed.
+    """
+    # Imported here, since the orphan scanner module depends on this one.
+    import p4_show_orphans  # pylint: disable=import-outside-toplevel
+
+    config_data = load_config_data()
+    if config_data is None:
+        return False
+
+    workers = max(1, args.workers)
+    pool = p4_connection_utility.ConnectionPool(
+        create_connected_connection, size=workers
+    )
+    try:
+        report = p4_show_orphans.scan(pool, config_data, workers=workers)
+        logging.info("Orphans found:\n%s", json.dumps(report._asdict(), indent=4))
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as report_file:
+                json.dump(report._asdict(), report_file, indent=2)
+            logging.info("Wrote the orphans found to %s", args.output)
+        if not any(report):
+            return True
+        if not args.cleanup:
+            return False
+        errors = p4_show_orphans.cleanup(pool, report, workers=workers)
+    except p4_connection_utility.p4_exception_types() as error:
         logging.warning(
-            "Perforce Show Setup Failed with Exception: %s.", repr(error))
-        logging.warning("Removing %s: %s\n" for (key,value) in show_setup_instance.result)
-        show_setup_instance.undo_show_setup()
+            "Perforce Orphan Scan Failed with P4 Exception: %s.", repr(error)
+        )
+        return False
+    finally:
+        pool.close()
+
+    return not errors
+
+
+_COMMAND_HANDLERS = {
+    "validate": _run_validate,
+    "plan": _run_plan,
+    "apply": _run_apply,
+    "converge": _run_converge,
+    "undo": _run_undo,
+    "audit": _run_audit,
+    "bench": _run_bench,
+    "serve": _run_serve,
+    "loadtest": _run_loadtest,
+    "decommission": _run_decommission,
+    "protections-update": _run_protections_update,
+    "protections-optimize": _run_protections_optimize,
+    "sync-owners": _run_sync_owners,
+    "orphans": _run_orphans,
+}
+
+
+def _run_command(command, args):
+    """Run a subcommand's handler, profiled if `--profile` was given.
+
+    Args:
+        command (str): the subcommand.
+        args (argparse.Namespace): the parsed command line arguments.
+
+    Returns:
+        bool: whether the subcommand succeeded.
+    """
+    profile_kind = getattr(args, "profile", None)
+    if profile_kind is None:
+        return _COMMAND_HANDLERS[command](args)
+
+    output_dir = getattr(args, "profile_output", None)
+    if output_dir is None:
+        output_dir = logging_utility.set_logger_output_path(
+            LOG_OUTPUT_DIR, getattr(args, "log_locally", False)
+        )
+    from shared import profiling_utility  # pylint: disable=import-outside-toplevel
+
+    os.makedirs(output_dir, exist_ok=True)
+    prefix = f"{command}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    with profiling_utility.profile(profile_kind, output_dir, prefix):
+        return _COMMAND_HANDLERS[command](args)
+
+
+def _write_metrics(command, succeeded):
+    """Record a finished run and write the metrics textfile, if one is configured.
+
+    Args:
+        command (str): the subcommand.
+        succeeded (bool): whether the subcommand succeeded.
+    """
+    if not metrics_utility.enabled():
+        return
+    metrics_utility.record_run(command, succeeded)
+    try:
+        metrics_utility.write_textfile()
+    except OSError as error:
+        logging.error("Could not write the metrics: %s", error)
+
+
+def run_p4_show_setup(argv=None):
+    """Run the requested show setup subcommand.
+
+    Args:
+        argv (list[str], optional): the command line arguments, without the
+            program name. Defaults to `sys.argv`.
 
-    _cleanup_p4_instance()
+    Returns:
+        int: the exit status, 0 on success.
+    """
+    arg_parser = _setup_parse_arguments()
+    if argv is None:
+        argv = sys.argv[1:]
+    args = arg_parser.parse_args(_normalize_arguments(argv))
+    if args.command is None:
+        # Nothing was routed to the default command, which needs a show.
+        arg_parser.error("the following arguments are required: -s/--show")
+    _initialize_logging(args)
+    _initialize_recording(args)
+
+    command = args.command
+    succeeded = False
+    try:
+        succeeded = _run_command(command, args)
+    finally:
+        _write_metrics(command, succeeded)
+    if succeeded:
+        return 0
+    return 1
 
 
 if __name__ == "__main__":
-    run_p4_show_setup()
+    sys.exit(run_p4_show_setup())
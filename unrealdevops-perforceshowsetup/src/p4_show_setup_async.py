@@ -0,0 +1,274 @@
+# Copyright (C) 2023 DNEG - All Rights reserved.
+"""
+Asyncio API for Perforce show setup.
+
+P4Python is blocking, so every setup step runs on a dedicated thread pool. Each
+thread borrows its own connection from a pool for the duration of the step,
+which lets several shows be set up at once with `asyncio.gather`:
+
+    async with AsyncShowSetupRunner(max_workers=4) as runner:
+        await asyncio.gather(
+            runner.setup("SHOWA").apply(),
+            runner.setup("SHOWB").apply(),
+        )
+
+Cancelling an awaiting task does not stop the step already running on its
+thread; the step finishes, or stops at its deadline, before the task goes on
+to roll the setup back.
+"""
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import p4_show_setup
+from shared import metrics_utility
+from shared import p4_connection_utility
+
+DEFAULT_MAX_WORKERS = 4
+SETUP_STEPS = p4_show_setup.SETUP_STEPS
+
+
+class AsyncShowSetupRunner:
+    """Runs blocking show setup calls on a thread pool bound to a connection pool."""
+
+    def __init__(self, max_workers: int = DEFAULT_MAX_WORKERS, pool=None):
+        """Construct an instance of AsyncShowSetupRunner.
+
+        Args:
+            max_workers (int, optional): how many steps may run at once.
+            pool (p4_connection_utility.ConnectionPool, optional): the pool to
+                borrow connections from. Defaults to a pool of `max_workers`
+                connections to the show setup server.
+        """
+        if pool is None:
+            pool = p4_connection_utility.ConnectionPool(
+                p4_show_setup.create_connected_connection, size=max_workers
+            )
+        self.pool = pool
+        # No more threads than connections, so that a thread never waits on the pool.
+        self.executor = ThreadPoolExecutor(
+            max_workers=min(max_workers, pool.size),
+            thread_name_prefix="P4ShowSetupAsync",
+        )
+
+    async def __aenter__(self):
+        """Enter the runner's context.
+
+        Returns:
+            AsyncShowSetupRunner: the runner.
+        """
+        return self
+
+    async def __aexit__(self, *exc_info):
+        """Shut the runner down when leaving its context.
+
+        Args:
+            *exc_info (Any): the exception raised in the context, if any.
+        """
+        await self.close()
+
+    def setup(self, show, json_config=None, division=None):
+        """Get the asyncio API for setting up a show.
+
+        Args:
+            show (str): the show code.
+            json_config (dict, optional): the configurations to follow for setting
+                up the depot. Loaded from the division config if not given.
+            division (str, optional): the division. Deduced from the show code if
+                not given.
+
+        Returns:
+            AsyncP4ShowSetup: the show's setup.
+
+        Raises:
+            ValueError: if the division configs could not be read, or the
+                division is not in them.
+        """
+        if json_config is None:
+            config_data = p4_show_setup.load_config_data()
+            if config_data is None:
+                raise ValueError("Unable to read the show setup configs")
+            if division is not None and division not in config_data:
+                raise ValueError(f"Unknown division: {division}")
+            json_config = p4_show_setup.get_show_config(
+                show, division=division, config_data=config_data
+            )
+        return AsyncP4ShowSetup(p4_show_setup.P4ShowSetup(show, json_config), self)
+
+    async def run(self, function, *args):
+        """Run a blocking function on the runner's threads.
+
+        Args:
+            function (callable): the function to run.
+            *args (Any): the function's arguments.
+
+        Returns:
+            Any: the function's return value.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, functools.partial(function, *args))
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # The function keeps running on its thread. It is waited for, so that
+            # a rollback does not start while the step it undoes is still running.
+            await asyncio.wait([future])
+            raise
+
+    async def run_on_connection(self, show_setup_instance, method_name):
+        """Run a P4ShowSetup method on a pooled connection.
+
+        Args:
+            show_setup_instance (p4_show_setup.P4ShowSetup): the instance.
+            method_name (str): the method to call.
+
+        Returns:
+            Any: the method's return value.
+        """
+        return await self.run(
+            self._call_on_connection, show_setup_instance, method_name
+        )
+
+    def _call_on_connection(self, show_setup_instance, method_name):
+        """Call a P4ShowSetup method with a connection borrowed from the pool.
+
+        Args:
+            show_setup_instance (p4_show_setup.P4ShowSetup): the instance.
+            method_name (str): the method to call.
+
+        Returns:
+            Any: the method's return value.
+        """
+        with self.pool.acquire() as p4:
+            show_setup_instance.p4 = p4
+            try:
+                return getattr(show_setup_instance, method_name)()
+            finally:
+                show_setup_instance.p4 = None
+
+    async def close(self):
+        """Wait for running steps, then disconnect the pooled connections.
+
+        Writes the metrics textfile if one was configured with
+        `metrics_utility.configure()`.
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.executor.shutdown)
+        self.pool.close()
+        if metrics_utility.enabled():
+            metrics_utility.write_textfile()
+
+
+class AsyncP4ShowSetup:
+    """Asyncio API for setting up a show in perforce.
+
+    Steps of the same show must be awaited one after the other. Steps of
+    different shows can run concurrently.
+    """
+
+    def __init__(self, show_setup_instance, runner):
+        """Construct an instance of AsyncP4ShowSetup.
+
+        Args:
+            show_setup_instance (p4_show_setup.P4ShowSetup): the setup to run.
+            runner (AsyncShowSetupRunner): the runner to run its steps on.
+        """
+        self.show_setup_instance = show_setup_instance
+        self.runner = runner
+
+    @property
+    def show(self):
+        """str: the show code."""
+        return self.show_setup_instance.show
+
+    @property
+    def result(self):
+        """dict: what the setup has created so far."""
+        return self.show_setup_instance.result
+
+    async def validate_show(self):
+        """Ensure showcode follows normal conventions.
+
+        Returns:
+            list[str]: the reasons the show code is not valid, empty if it is.
+        """
+        return await self.runner.run(self.show_setup_instance.validate_show)
+
+    async def plan(self):
+        """Render everything the setup would create, without a server.
+
+        Returns:
+            dict: the rendered settings, keyed by setup step.
+        """
+        return await self.runner.run(self.show_setup_instance.plan)
+
+    async def audit(self):
+        """Compare the show's setup in Perforce with its config.
+
+        Returns:
+            dict: what is missing or different, keyed by setup step.
+        """
+        return await self.runner.run_on_connection(self.show_setup_instance, "audit")
+
+    async def create_depot(self):
+        """Create the show depot."""
+        await self.runner.run_on_connection(self.show_setup_instance, "create_depot")
+
+    async def populate_permissions_table(self):
+        """Add the show's entries to the protections table."""
+        await self.runner.run_on_connection(
+            self.show_setup_instance, "populate_permissions_table"
+        )
+
+    async def check_permissions(self):
+        """Fail the setup if the permissions table does not grant the configured access."""
+        await self.runner.run_on_connection(
+            self.show_setup_instance, "check_permissions"
+        )
+
+    async def create_groups(self):
+        """Create the show groups."""
+        await self.runner.run_on_connection(self.show_setup_instance, "create_groups")
+
+    async def create_initial_streams(self):
+        """Create the show streams."""
+        await self.runner.run_on_connection(
+            self.show_setup_instance, "create_initial_streams"
+        )
+
+    async def undo_show_setup(self):
+        """Remove everything the setup has created so far."""
+        await self.runner.run_on_connection(self.show_setup_instance, "undo_show_setup")
+
+    async def apply(self):
+        """Validate the show, then run every setup step, rolling back on failure.
+
+        Returns:
+            dict: what the setup created.
+
+        Raises:
+            ValueError: if the show code is not valid.
+            Exception: the error that stopped the setup, after rolling back.
+            asyncio.CancelledError: if the setup was cancelled, after rolling back.
+        """
+        errors = await self.validate_show()
+        if errors:
+            raise ValueError(f"Invalid show code {self.show}: {'; '.join(errors)}")
+        try:
+            for step_name in SETUP_STEPS:
+                await getattr(self, step_name)()
+        # Existing depots and permissions raise a bare Exception, and cancelling
+        # the task leaves what the steps created so far behind as well.
+        # pylint: disable-next=broad-except
+        except (Exception, asyncio.CancelledError) as error:
+            logging.warning(
+                "Perforce Show Setup for %s Failed: %s. Rolling back.",
+                self.show,
+                repr(error),
+            )
+            await self.undo_show_setup()
+            metrics_utility.record_run("apply", False)
+            raise
+        metrics_utility.record_run("apply", True)
+        return self.result
@@ -0,0 +1,328 @@
+# Copyright (C) 2023 DNEG - All Rights reserved.
+"""
+Perforce show decommissioning.
+
+Removes a finished show from Perforce: its protections lines, groups, streams,
+files and depot. Unlike `P4ShowSetup.undo_show_setup()`, which only rolls back
+what one failed setup recorded creating, decommissioning:
+- discovers everything with bulk queries, one `streams`, one `groups` and one
+  `protect -o` for the whole show;
+- removes every protections line in a single `protect -i`;
+- deletes groups, and streams level by level, children first, in parallel on
+  pooled connections;
+- obliterates the depot's files in one command, optionally with the fast
+  variant that skips the have list and archive files;
+- reports the depot's size before and after.
+"""
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import logging
+
+from shared import p4_connection_utility
+from shared import protections_utility
+
+FULL_OBLITERATE = "full"
+# Skips the have list (-h) and archive file removal (-a). For shows whose
+# archives have already been moved off the server, or whose files are all lazy
+# copies, so that there are no archive files of their own to remove.
+FAST_OBLITERATE = "fast"
+OBLITERATE_MODES = (FULL_OBLITERATE, FAST_OBLITERATE)
+_OBLITERATE_FLAGS = {
+    FULL_OBLITERATE: ("-y",),
+    FAST_OBLITERATE: ("-y", "-h", "-a"),
+}
+DEFAULT_WORKERS = 4
+
+TeardownPlan = collections.namedtuple(
+    "TeardownPlan", ["show", "depot", "protections", "groups", "stream_levels"]
+)
+TeardownPlan.__doc__ = """Everything to remove for a show.
+
+Attributes:
+    show (str): the show code.
+    depot (str): the show's depot, or None if it does not exist.
+    protections (list[str]): the show's protections lines.
+    groups (list[str]): the show's groups.
+    stream_levels (list[list[str]]): the show's streams, deepest level first.
+        Streams of the same level can be deleted in parallel.
+"""
+
+
+def show_group_names(json_config, show):
+    """Get the names of the groups a show's division config creates for it.
+
+    Other groups starting with the show code, such as `IT-Admins` for the show
+    `IT`, are not the show's.
+
+    Args:
+        json_config (dict): the show's division config.
+        show (str): the show code.
+
+    Returns:
+        set[str]: the group names.
+    """
+    return {
+        grp_name.replace("{show}", show) for grp_name in json_config.get("groups", {})
+    }
+
+
+def stream_levels(stream_specs):
+    """Order streams so that children come before their parents.
+
+    Args:
+        stream_specs (list[dict]): the `streams` results, with `Stream` and `Parent`.
+
+    Returns:
+        list[list[str]]: the streams grouped by depth, deepest first.
+    """
+    parents = {spec["Stream"]: spec.get("Parent", "none") for spec in stream_specs}
+    depths = {}
+    for stream in parents:
+        depth, parent, seen = 0, parents[stream], {stream}
+        while parent in parents and parent not in seen:
+            seen.add(parent)
+            depth += 1
+            parent = parents[parent]
+        depths[stream] = depth
+    levels = collections.defaultdict(list)
+    for stream, depth in depths.items():
+        levels[depth].append(stream)
+    return [sorted(levels[depth]) for depth in sorted(levels, reverse=True)]
+
+
+def discover(p4, show, json_config):
+    """Find everything to remove for a show, with one query of each kind.
+
+    Args:
+        p4 (P4.P4): the connection.
+        show (str): the show code.
+        json_config (dict): the show's division config, naming its groups.
+
+    Returns:
+        TeardownPlan: what to remove.
+    """
+    depot = show if p4.run("depots", "-E", show) else None
+    group_names = show_group_names(json_config, show)
+    # Tagged `groups` output has one record per group member.
+    groups = sorted(
+        {
+            name
+            for name in (
+                group["group"] if isinstance(group, dict) else group
+                for group in p4_connection_utility.run_iter(p4, "groups")
+            )
+            if name in group_names
+        }
+    )
+    protections = p4.run("protect", "-o")[0]["Protections"]
+    levels = stream_levels(p4.run("streams", f"//{show}/...")) if depot else []
+    return TeardownPlan(
+        show,
+        depot,
+        protections_utility.show_entries(protections, show, groups),
+        groups,
+        levels,
+    )
+
+
+def measure_size(p4, show):
+    """Get the number and size of a show's files.
+
+    Args:
+        p4 (P4.P4): the connection.
+        show (str): the show code.
+
+    Returns:
+        dict: the "files" and their "bytes", and the "archive bytes" of the
+            files that are not lazy copies.
+    """
+    size = {"files": 0, "bytes": 0, "archive bytes": 0}
+    try:
+        for record in p4.run("sizes", "-s", f"//{show}/..."):
+            size["files"] += int(record.get("fileCount", 0))
+            size["bytes"] += int(record.get("fileSize", 0))
+        for record in p4.run("sizes", "-s", "-z", f"//{show}/..."):
+            size["archive bytes"] += int(record.get("fileSize", 0))
+    except p4_connection_utility.p4_exception_types() as error:
+        # No files at all is reported as an error.
+        logging.debug("Could not size //%s/...: %s", show, error)
+    return size
+
+
+class ShowTeardown:
+    """Decommissions a show, running independent removals in parallel."""
+
+    def __init__(
+        self,
+        show,
+        json_config,
+        pool,
+        workers: int = DEFAULT_WORKERS,
+        obliterate_mode: str = FULL_OBLITERATE,
+    ):
+        """Construct an instance of ShowTeardown.
+
+        Args:
+            show (str): the show code.
+            json_config (dict): the show's division config, naming its groups.
+            pool (ConnectionPool): the pool of connected connections to use.
+            workers (int, optional): how many removals may run at once.
+            obliterate_mode (str, optional): one of `OBLITERATE_MODES`.
+
+        Raises:
+            ValueError: if the obliterate mode is unknown.
+        """
+        if obliterate_mode not in OBLITERATE_MODES:
+            raise ValueError(f"Unknown obliterate mode: {obliterate_mode}")
+        self.show = show
+        self.json_config = json_config
+        self.pool = pool
+        self.workers = workers
+        self.obliterate_mode = obliterate_mode
+        self.errors = {}
+
+    def _run(self, *args):
+        """Run a command on a pooled connection.
+
+        Args:
+            *args (str): the command and its arguments.
+
+        Returns:
+            list: the command results.
+        """
+        with self.pool.acquire() as p4:
+            return p4.run(*args)
+
+    def _run_all(self, executor, commands):
+        """Run independent commands in parallel, recording the ones that fail.
+
+        Args:
+            executor (ThreadPoolExecutor): the executor to run them on.
+            commands (dict): the commands, a list of arguments tuples for each
+                item they remove.
+
+        Returns:
+            list[str]: the items whose commands all succeeded.
+        """
+
+        def remove(item):
+            for args in commands[item]:
+                self._run(*args)
+            return item
+
+        futures = {item: executor.submit(remove, item) for item in commands}
+        removed = []
+        for item, future in futures.items():
+            try:
+                removed.append(future.result())
+            except p4_connection_utility.p4_exception_types() as error:
+                logging.error("Could not remove %s: %s", item, error)
+                self.errors[item] = str(error)
+        return removed
+
+    def plan(self):
+        """Discover what to remove.
+
+        Returns:
+            TeardownPlan: what to remove.
+        """
+        with self.pool.acquire() as p4:
+            return discover(p4, self.show, self.json_config)
+
+    def remove_protections(self, plan):
+        """Remove the show's protections lines in one table write.
+
+        Args:
+            plan (TeardownPlan): what to remove.
+
+        Returns:
+            list[str]: the lines removed.
+        """
+        if not plan.protections:
+            return []
+        removed = set(plan.protections)
+        with self.pool.acquire() as p4:
+            # Read again right before writing, to keep concurrent edits.
+            table = p4.run("protect", "-o")
+            table[0]["Protections"] = [
+                line for line in table[0]["Protections"] if line not in removed
+            ]
+            p4.input = table
+            p4.run("protect", "-i")
+        logging.info("Removed %d protections lines", len(removed))
+        return list(plan.protections)
+
+    def execute(self, plan=None):
+        """Remove everything the plan lists.
+
+        Streams are only removed once every stream deeper than them is, and the
+        depot once every stream is.
+
+        Args:
+            plan (TeardownPlan, optional): what to remove. Discovered if not given.
+
+        Returns:
+            dict: what was removed, the "Size before" and "Size after", and the
+                "Errors" of what could not be removed.
+        """
+        plan = plan or self.plan()
+        report = {}
+        with self.pool.acquire() as p4:
+            report["Size before"] = measure_size(p4, self.show)
+        logging.info(
+            "Decommissioning %s: %d files, %d bytes, %d bytes of archives",
+            self.show,
+            report["Size before"]["files"],
+            report["Size before"]["bytes"],
+            report["Size before"]["archive bytes"],
+        )
+
+        report["Permissions"] = self.remove_protections(plan)
+        with ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="P4ShowTeardown"
+        ) as executor:
+            report["Groups"] = self._run_all(
+                executor, {group: [("group", "-d", group)] for group in plan.groups}
+            )
+            if plan.depot:
+                logging.info(
+                    "Obliterating //%s/... (%s)", plan.depot, self.obliterate_mode
+                )
+                obliterated = self._run_all(
+                    executor,
+                    {
+                        f"//{plan.depot}/...": [
+                            ("obliterate",)
+                            + _OBLITERATE_FLAGS[self.obliterate_mode]
+                            + (f"//{plan.depot}/...",)
+                        ]
+                    },
+                )
+                report["Streams"] = []
+                for level in plan.stream_levels if obliterated else []:
+                    removed = self._run_all(
+                        executor,
+                        {
+                            stream: [
+                                ("stream", "-d", stream),
+                                ("stream", "--obliterate", "-y", stream),
+                            ]
+                            for stream in level
+                        },
+                    )
+                    report["Streams"].extend(removed)
+                    if len(removed) < len(level):
+                        break
+                streams_left = sum(len(level) for level in plan.stream_levels) - len(
+                    report["Streams"]
+                )
+                if obliterated and not streams_left:
+                    if self._run_all(
+                        executor, {plan.depot: [("depot", "-d", plan.depot)]}
+                    ):
+                        report["Depot"] = plan.depot
+
+        with self.pool.acquire() as p4:
+            report["Size after"] = measure_size(p4, self.show)
+        report["Errors"] = dict(self.errors)
+        return report
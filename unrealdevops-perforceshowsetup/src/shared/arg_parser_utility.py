@@ -70,4 +70,39 @@ def setup_parser(bare: bool = False, help_message: str = None):
             dest="log_locally",
         )
 
+        parser.add_argument(
+            "--queue-logging",
+            help=(
+                "Write the logs from a background thread, so that logging\n"
+                "large results does not hold up the command.\n\n"
+            ),
+            action="store_true",
+            default=False,
+            dest="queue_logging",
+        )
+
+        parser.add_argument(
+            "--log-overflow",
+            help=(
+                "What to do with `--queue-logging` when logs are produced faster\n"
+                "than they are written: `block` until there is room, or `drop`\n"
+                "records below WARNING. Defaults to `block`.\n\n"
+            ),
+            type=str,
+            choices=["block", "drop"],
+            default="block",
+            dest="log_overflow",
+        )
+
+        parser.add_argument(
+            "--log-max-bytes",
+            help=(
+                "Rotate the log file once it reaches this size, compressing the\n"
+                "old logs with gzip. Never rotated by default.\n\n"
+            ),
+            type=int,
+            default=0,
+            dest="log_max_bytes",
+        )
+
     return parser
@@ -0,0 +1,301 @@
+# Copyright (C) 2023 DNEG - All Rights reserved.
+"""
+Event Utility.
+
+This utility's responsibility is to write machine-readable events, one JSON
+object per line, next to the free-text logs.
+
+Events go through their own logger, so nothing is computed unless an event
+file has been configured with `configure()` and the event's level is enabled:
+field values can be callables, evaluated only then. Large payloads such as
+protections tables or file lists are replaced by a summary holding their size,
+a hash and a bounded sample, so that event files stay small at batch scale.
+"""
+import contextlib
+import datetime
+import hashlib
+import json
+import logging
+import time
+
+from shared import logging_utility
+from shared import p4_connection_utility
+
+EVENT_LOGGER_NAME = "p4_show_setup.events"
+SAMPLE_SIZE = 5
+MAX_STRING_LENGTH = 200
+HASH_LENGTH = 16
+
+_EVENT_LOGGER = logging.getLogger(EVENT_LOGGER_NAME)
+_EVENT_LOGGER.propagate = False
+_EVENT_LOGGER.addHandler(logging.NullHandler())
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """Format event records as single-line JSON objects."""
+
+    def format(self, record):
+        """Format an event record.
+
+        Args:
+            record (logging.LogRecord): the record, with `event` and `fields`.
+
+        Returns:
+            str: the JSON object.
+        """
+        event = {
+            "time": datetime.datetime.fromtimestamp(record.created).isoformat(
+                timespec="milliseconds"
+            ),
+            "level": record.levelname,
+            "event": getattr(record, "event", record.getMessage()),
+        }
+        context = getattr(record, "log_context", None) or {}
+        event.update(context)
+        event.update(getattr(record, "fields", {}))
+        return json.dumps(event, default=str, separators=(",", ":"))
+
+
+def configure(path: str, level: int = logging.INFO):
+    """Write events to a JSON-lines file.
+
+    Args:
+        path (str): the file to append the events to.
+        level (int, optional): the lowest level of events to write.
+
+    Returns:
+        logging.Handler: the handler writing the file.
+    """
+    handler = logging.FileHandler(path, encoding="utf-8")
+    handler.setFormatter(JsonLinesFormatter())
+    _EVENT_LOGGER.addHandler(handler)
+    _EVENT_LOGGER.setLevel(level)
+    return handler
+
+
+def enabled(level: int = logging.INFO):
+    """Check whether events of a level are written anywhere.
+
+    Args:
+        level (int, optional): the event level.
+
+    Returns:
+        bool: whether emitting such an event would write it.
+    """
+    return _EVENT_LOGGER.isEnabledFor(level) and any(
+        not isinstance(handler, logging.NullHandler)
+        for handler in _EVENT_LOGGER.handlers
+    )
+
+
+def emit(event: str, level: int = logging.INFO, **fields):
+    """Emit an event.
+
+    Args:
+        event (str): the event name, e.g. "step_end".
+        level (int, optional): the event level.
+        **fields (Any): the event fields. Callables are called, and every value
+            summarized with `summarize()`, only if the event is written.
+    """
+    if not enabled(level):
+        return
+    values = {
+        key: summarize(value() if callable(value) else value)
+        for key, value in fields.items()
+    }
+    _EVENT_LOGGER.log(
+        level,
+        event,
+        extra={
+            "event": event,
+            "fields": values,
+            "log_context": logging_utility.current_logging_context(),
+        },
+    )
+
+
+def summarize(
+    value, sample_size: int = SAMPLE_SIZE, max_length: int = MAX_STRING_LENGTH
+):
+    """Replace large values by a summary, so that they can be logged cheaply.
+
+    Lists longer than `sample_size` become `{"count", "hash", "sample"}`,
+    strings longer than `max_length` become `{"length", "hash", "sample"}`.
+    Dictionaries and short lists are summarized item by item.
+
+    Args:
+        value (Any): the value.
+        sample_size (int, optional): the most list items to keep.
+        max_length (int, optional): the most characters of a string to keep.
+
+    Returns:
+        Any: the value, or its summary.
+    """
+    if isinstance(value, str):
+        if len(value) <= max_length:
+            return value
+        return {
+            "length": len(value),
+            "hash": _hash(value),
+            "sample": value[:max_length],
+        }
+    if isinstance(value, dict):
+        return {
+            str(key): summarize(item, sample_size, max_length)
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple, set, frozenset)):
+        items = (
+            sorted(value, key=str)
+            if isinstance(value, (set, frozenset))
+            else list(value)
+        )
+        if len(items) <= sample_size:
+            return [summarize(item, sample_size, max_length) for item in items]
+        return {
+            "count": len(items),
+            "hash": _hash(items),
+            "sample": [
+                summarize(item, sample_size, max_length) for item in items[:sample_size]
+            ],
+        }
+    return value
+
+
+def _hash(value):
+    """Hash a value, to tell whether two summarized payloads are the same.
+
+    Args:
+        value (Any): a JSON-serializable value.
+
+    Returns:
+        str: the start of the SHA-256 of the value's JSON.
+    """
+    payload = json.dumps(value, default=str, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()[:HASH_LENGTH]
+
+
+@contextlib.contextmanager
+def step_events(step_name: str):
+    """Emit "step_start" and "step_end" events around a setup step.
+
+    Args:
+        step_name (str): the step name.
+
+    Yields:
+        str: the step name.
+    """
+    emit("step_start", step=step_name)
+    start = time.perf_counter()
+    outcome = "failed"
+    try:
+        yield step_name
+        outcome = "succeeded"
+    finally:
+        emit(
+            "step_end",
+            step=step_name,
+            outcome=outcome,
+            duration=round(time.perf_counter() - start, 6),
+        )
+
+
+class EventConnection(p4_connection_utility.ConnectionWrapper):
+    """Connection emitting an event for every write it runs.
+
+    - Spec writes (`<spec> -i`) emit "spec_write" with a summary of the spec.
+    - `populate` emits "populate" with the number of files populated.
+    - Deletes emit "delete", or "rollback" when run during the undo step.
+    """
+
+    def __init__(self, connection):
+        """Construct an instance of EventConnection.
+
+        Args:
+            connection (P4.P4): the connection to wrap.
+        """
+        super().__init__(connection)
+        self._input = None
+
+    def __setattr__(self, name, value):
+        """Remember the command input, to describe spec writes.
+
+        Args:
+            name (str): the attribute name.
+            value (Any): the value to set.
+        """
+        if name == "input":
+            object.__setattr__(self, "_input", value)
+        super().__setattr__(name, value)
+
+    def run(self, *args):
+        """Run a command, emitting an event if it writes.
+
+        Args:
+            *args (str): the command and its arguments.
+
+        Returns:
+            list: the command results.
+        """
+        command_input, self._input = self._input, None
+        kind = _write_kind(args)
+        if kind is None or not enabled():
+            return self._connection.run(*args)
+
+        start = time.perf_counter()
+        outcome = "failed"
+        result = None
+        try:
+            result = self._connection.run(*args)
+            outcome = "succeeded"
+            return result
+        finally:
+            fields = {
+                "command": " ".join(str(arg) for arg in args),
+                "outcome": outcome,
+                "duration": round(time.perf_counter() - start, 6),
+            }
+            if kind == "spec_write":
+                fields["spec"] = command_input
+            elif kind == "populate":
+                fields["files"] = len(result) if result is not None else None
+                fields["results"] = result
+            elif logging_utility.current_logging_context().get("step") == "undo":
+                kind = "rollback"
+            emit(kind, **fields)
+
+    def run_iter(self, *args):
+        """Run a command, yielding its results as they arrive.
+
+        Writes are run with `run()`, since their events describe the whole result.
+
+        Args:
+            *args (str): the command and its arguments.
+
+        Returns:
+            Iterator: the command results.
+        """
+        if _write_kind(args) is not None and enabled():
+            return iter(self.run(*args))
+        self._input = None
+        return p4_connection_utility.run_iter(self._connection, *args)
+
+
+def _write_kind(args):
+    """Get the event to emit for a command.
+
+    Args:
+        args (tuple): the command and its arguments.
+
+    Returns:
+        str: "spec_write", "populate" or "delete", or None for other commands.
+    """
+    command = args[0] if args else ""
+    flags = set(str(arg).split(" ")[0] for arg in args[1:])
+    if command == "populate":
+        return "populate"
+    if command == "obliterate" or "-d" in flags or "--obliterate" in flags:
+        return "delete"
+    if "-i" in flags:
+        return "spec_write"
+    return None
@@ -4,10 +4,29 @@ Logging Utility.
 
 This utility's responsibility is to set up the logging for the script.
 """
+import atexit
+import contextlib
+import contextvars
 import datetime
 import logging
+import logging.handlers
 import os
+import queue
+import shutil
 import tempfile
+import threading
+
+DEFAULT_LOG_QUEUE_SIZE = 10000
+OVERFLOW_BLOCK = "block"
+OVERFLOW_DROP = "drop"
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP)
+DEFAULT_BACKUP_COUNT = 5
+CONTEXT_FIELDS = ("show", "step", "worker")
+
+_LOG_CONTEXT = contextvars.ContextVar("log_context", default={})
+_QUEUE_LISTENER = None
+# Argument types that cannot change after logging, so formatting can wait.
+_IMMUTABLE_ARGUMENT_TYPES = (str, int, float, bool, type(None), bytes)
 
 
 def set_logger_output_path(logger_output_dir: str, log_locally: bool = False):
@@ -71,11 +90,259 @@ def generate_new_logger_output_dir(desired_path: str):
     os.makedirs(desired_path)
 
 
+@contextlib.contextmanager
+def logging_context(**fields):
+    """Add context, such as the show or step, to every record logged in the body.
+
+    Context follows the current thread or asyncio task, and nests.
+
+    Args:
+        **fields (str): the context fields, e.g. `show="SHOW", step="groups"`.
+
+    Yields:
+        dict: the context in effect.
+    """
+    context = dict(_LOG_CONTEXT.get())
+    context.update(fields)
+    token = _LOG_CONTEXT.set(context)
+    try:
+        yield context
+    finally:
+        _LOG_CONTEXT.reset(token)
+
+
+def current_logging_context():
+    """Get the fields set by the enclosing `logging_context()` blocks.
+
+    Returns:
+        dict: the context fields.
+    """
+    return dict(_LOG_CONTEXT.get())
+
+
+class ContextFilter(logging.Filter):
+    """Add the `logging_context()` fields to records.
+
+    Every field in `CONTEXT_FIELDS` is set on the record, "-" when not in
+    context, and `context` holds them all as " [show=X step=Y]", or "" when
+    there is no context.
+    """
+
+    def filter(self, record):
+        """Add the context fields to a record.
+
+        Args:
+            record (logging.LogRecord): the record.
+
+        Returns:
+            bool: always True, the record is never dropped.
+        """
+        context = _LOG_CONTEXT.get()
+        for field in CONTEXT_FIELDS:
+            setattr(record, field, context.get(field, "-"))
+        fields = " ".join(f"{key}={value}" for key, value in context.items())
+        record.context = f" [{fields}]" if fields else ""
+        return True
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler for a bounded queue, with a policy for when it is full.
+
+    With the drop policy, records below WARNING are dropped while the queue is
+    full, and the number dropped is reported once there is room again. Warnings
+    and errors always wait for room.
+    """
+
+    def __init__(self, log_queue, overflow_policy: str = OVERFLOW_BLOCK):
+        """Construct an instance of BoundedQueueHandler.
+
+        Args:
+            log_queue (queue.Queue): the bounded queue.
+            overflow_policy (str, optional): one of `OVERFLOW_POLICIES`.
+
+        Raises:
+            ValueError: if the policy is unknown.
+        """
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown log overflow policy: {overflow_policy}")
+        super().__init__(log_queue)
+        self.overflow_policy = overflow_policy
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+
+    def prepare(self, record):
+        """Prepare a record for the queue, formatting it only if it must be now.
+
+        Messages whose arguments are all immutable are formatted by the listener,
+        off the calling thread. Other arguments could change before then, so those
+        messages, and exceptions, are formatted now.
+
+        Args:
+            record (logging.LogRecord): the record.
+
+        Returns:
+            logging.LogRecord: the record to put on the queue.
+        """
+        args = record.args if isinstance(record.args, tuple) else (record.args,)
+        if record.exc_info or not all(
+            isinstance(arg, _IMMUTABLE_ARGUMENT_TYPES) for arg in args
+        ):
+            return super().prepare(record)
+        return logging.makeLogRecord(record.__dict__)
+
+    def enqueue(self, record):
+        """Put a record on the queue, following the overflow policy.
+
+        Args:
+            record (logging.LogRecord): the prepared record.
+        """
+        if self.overflow_policy == OVERFLOW_BLOCK or record.levelno >= logging.WARNING:
+            self.queue.put(record)
+        else:
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                with self._dropped_lock:
+                    self.dropped += 1
+                return
+        if self.dropped:
+            self._report_dropped()
+
+    def _report_dropped(self):
+        """Log how many records were dropped since the last report."""
+        with self._dropped_lock:
+            dropped, self.dropped = self.dropped, 0
+        if dropped:
+            self.queue.put(
+                logging.makeLogRecord(
+                    {
+                        "name": "logging_utility",
+                        "levelno": logging.WARNING,
+                        "levelname": "WARNING",
+                        "msg": "Dropped %d log records while the log queue was full",
+                        "args": (dropped,),
+                    }
+                )
+            )
+
+
+class GzipRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """Size-rotated log file whose old logs are compressed with gzip."""
+
+    def __init__(
+        self,
+        filename,
+        max_bytes: int,
+        backup_count: int = DEFAULT_BACKUP_COUNT,
+        encoding: str = "utf-8",
+    ):
+        """Construct an instance of GzipRotatingFileHandler.
+
+        Args:
+            filename (str): the log file.
+            max_bytes (int): the size at which the log is rotated.
+            backup_count (int, optional): the number of old logs to keep.
+            encoding (str, optional): the log encoding.
+        """
+        super().__init__(
+            filename, maxBytes=max_bytes, backupCount=backup_count, encoding=encoding
+        )
+        self.namer = self._gzip_name
+        self.rotator = self._gzip_rotate
+
+    @staticmethod
+    def _gzip_name(name):
+        """Name an old log.
+
+        Args:
+            name (str): the default name, e.g. "log.txt.1".
+
+        Returns:
+            str: the compressed name, e.g. "log.txt.1.gz".
+        """
+        return f"{name}.gz"
+
+    @staticmethod
+    def _gzip_rotate(source, dest):
+        """Compress the log being rotated out.
+
+        Args:
+            source (str): the log file.
+            dest (str): the compressed file to create.
+        """
+        import gzip  # pylint: disable=import-outside-toplevel
+
+        with open(source, "rb") as source_file, gzip.open(dest, "wb") as dest_file:
+            shutil.copyfileobj(source_file, dest_file)
+        os.remove(source)
+
+
+class _QueueListener(logging.handlers.QueueListener):
+    """Queue listener that can be stopped while its bounded queue is full."""
+
+    def enqueue_sentinel(self):
+        """Wait for room in the queue to put the stop marker."""
+        self.queue.put(self._sentinel)
+
+
+def start_queue_logging(
+    handlers,
+    queue_size: int = DEFAULT_LOG_QUEUE_SIZE,
+    overflow_policy: str = OVERFLOW_BLOCK,
+):
+    """Move the given handlers behind a queue, written by a background thread.
+
+    The root logger only enqueues records; the handlers run on the listener's
+    thread. Stopped by `stop_queue_logging()`, and at exit.
+
+    Args:
+        handlers (list[logging.Handler]): the handlers to write the records.
+        queue_size (int, optional): the most records waiting to be written.
+        overflow_policy (str, optional): one of `OVERFLOW_POLICIES`.
+
+    Returns:
+        BoundedQueueHandler: the handler added to the root logger.
+    """
+    global _QUEUE_LISTENER  # pylint: disable=global-statement
+    stop_queue_logging()
+    log_queue = queue.Queue(maxsize=queue_size)
+    queue_handler = BoundedQueueHandler(log_queue, overflow_policy)
+    queue_handler.addFilter(ContextFilter())
+    _QUEUE_LISTENER = _QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _QUEUE_LISTENER.start()
+    logging.getLogger().addHandler(queue_handler)
+    return queue_handler
+
+
+def stop_queue_logging():
+    """Write every queued record and stop the queue listener, if running."""
+    global _QUEUE_LISTENER  # pylint: disable=global-statement
+    if _QUEUE_LISTENER is None:
+        return
+    listener, _QUEUE_LISTENER = _QUEUE_LISTENER, None
+    root_logger = logging.getLogger()
+    for handler in list(root_logger.handlers):
+        if isinstance(handler, BoundedQueueHandler):
+            handler._report_dropped()  # pylint: disable=protected-access
+            root_logger.removeHandler(handler)
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
+
+
+atexit.register(stop_queue_logging)
+
+
 def initialize_logger(
     desired_log_level: str,
     log_to_file: bool,
     log_output_path: str,
     log_output_filename_suffix: str,
+    use_queue: bool = False,
+    queue_size: int = DEFAULT_LOG_QUEUE_SIZE,
+    overflow_policy: str = OVERFLOW_BLOCK,
+    max_bytes: int = 0,
+    backup_count: int = DEFAULT_BACKUP_COUNT,
 ):
     """
     Set the desired logging level for the runtime output.
@@ -86,6 +353,14 @@ def initialize_logger(
         log_output_path (str): Where to output the log file to.
         log_output_filename_suffix (str): What output log filename
             suffix to use.
+        use_queue (bool, optional): write the logs from a background thread,
+            see `start_queue_logging()`.
+        queue_size (int, optional): the most records waiting to be written.
+        overflow_policy (str, optional): what to do when the queue is full, one
+            of `OVERFLOW_POLICIES`.
+        max_bytes (int, optional): the size at which the log file is rotated and
+            compressed. Never rotated if 0.
+        backup_count (int, optional): the number of rotated log files to keep.
 
     """
     date_format = "%Y-%m-%d %H:%M:%S"
@@ -94,8 +369,10 @@ def initialize_logger(
     root_logger = logging.getLogger()
 
     # clear handlers created in obscure root logging.basicConfig() call.
+    stop_queue_logging()
     root_logger.handlers = []
     root_logger.setLevel(logging.DEBUG)
+    handlers = []
 
     # Set up the Console Logger to the default level.
     console_formatter = logging.Formatter(
@@ -107,7 +384,9 @@ def initialize_logger(
     console_handler.setFormatter(console_formatter)
 
     # NOTE:Earliest we can start logging to console.
-    root_logger.addHandler(console_handler)
+    handlers.append(console_handler)
+    if not use_queue:
+        root_logger.addHandler(console_handler)
 
     if log_to_file:
         # Set up the file logger in the user's temp folder.
@@ -117,13 +396,25 @@ def initialize_logger(
         file_logger_absolute_path = os.sep.join(
             [file_logger_output_path, file_logger_output_name]
         )
-        file_logger = logging.FileHandler(file_logger_absolute_path)
+        if max_bytes:
+            file_logger = GzipRotatingFileHandler(
+                file_logger_absolute_path, max_bytes, backup_count
+            )
+        else:
+            file_logger = logging.FileHandler(file_logger_absolute_path)
         file_logger.setLevel(logging.DEBUG)
         file_formatter = logging.Formatter(
             fmt=(
-                "%(asctime)s.%(msecs)03d - " "%(name)s - %(levelname)s: %(message)s\n"
+                "%(asctime)s.%(msecs)03d - "
+                "%(name)s - %(levelname)s%(context)s: %(message)s\n"
             ),
             datefmt=date_format,
         )
         file_logger.setFormatter(file_formatter)
-        root_logger.addHandler(file_logger)
+        handlers.append(file_logger)
+        if not use_queue:
+            file_logger.addFilter(ContextFilter())
+            root_logger.addHandler(file_logger)
+
+    if use_queue:
+        start_queue_logging(handlers, queue_size, overflow_policy)
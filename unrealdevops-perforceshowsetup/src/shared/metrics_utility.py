@@ -0,0 +1,490 @@
+# Copyright (C) 2023 DNEG - All Rights reserved.
+"""
+Metrics Utility.
+
+This utility's responsibility is to collect run metrics and write them for the
+node-exporter textfile collector, in the Prometheus text format.
+
+Metrics are only collected once a textfile has been configured with
+`configure()`. `write_textfile()` then replaces the file atomically, so the
+collector never reads a partially written file. Counters are cumulative for the
+life of the process: one run for the command line, every job for `serve`.
+
+Collected metrics:
+- `p4_show_setup_step_duration_seconds`: histogram of setup step durations, by
+  step and outcome.
+- `p4_show_setup_round_trips_total` and `p4_show_setup_round_trip_seconds`:
+  server round trips and their latency, by command. Retried attempts count as
+  round trips of their own.
+- `p4_show_setup_retries_total`: commands retried, by error class.
+- `p4_show_setup_populate_files_total` and `p4_show_setup_populate_bytes_total`:
+  files and bytes branched by `populate`.
+- `p4_show_setup_rollbacks_total`: undo steps run, for failed setups rolled
+  back and for `undo` commands; `runs_total{command="undo"}` tells them apart.
+- `p4_show_setup_runs_total` and `p4_show_setup_last_run_timestamp_seconds`:
+  finished runs or jobs, by command and outcome.
+"""
+import bisect
+import collections
+import contextlib
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from shared import p4_connection_utility
+
+METRIC_PREFIX = "p4_show_setup_"
+# Seconds; round trips are mostly in the milliseconds, steps up to minutes.
+LATENCY_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+STEP_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+
+COUNTER = "counter"
+GAUGE = "gauge"
+HISTOGRAM = "histogram"
+
+_Metric = collections.namedtuple("_Metric", ["kind", "help", "buckets"])
+
+METRICS = {
+    "step_duration_seconds": _Metric(
+        HISTOGRAM, "Duration of the setup steps.", STEP_BUCKETS
+    ),
+    "round_trips_total": _Metric(COUNTER, "Perforce server round trips.", None),
+    "round_trip_seconds": _Metric(
+        HISTOGRAM, "Latency of Perforce server round trips.", LATENCY_BUCKETS
+    ),
+    "retries_total": _Metric(
+        COUNTER, "Perforce commands retried, by error class.", None
+    ),
+    "populate_files_total": _Metric(COUNTER, "Files branched by populate.", None),
+    "populate_bytes_total": _Metric(COUNTER, "Bytes branched by populate.", None),
+    "rollbacks_total": _Metric(
+        COUNTER, "Undo steps run, including undo commands.", None
+    ),
+    "runs_total": _Metric(COUNTER, "Finished runs, by command and outcome.", None),
+    "last_run_timestamp_seconds": _Metric(GAUGE, "When the last run finished.", None),
+}
+
+
+class MetricsRegistry:
+    """Thread-safe store of the metric samples, by metric name and labels."""
+
+    def __init__(self):
+        """Construct an instance of MetricsRegistry."""
+        self._lock = threading.Lock()
+        self._values = collections.defaultdict(dict)
+
+    @staticmethod
+    def _key(labels):
+        """Get the sample key of a set of labels.
+
+        Args:
+            labels (dict): the label values.
+
+        Returns:
+            tuple: the sorted label items.
+        """
+        return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+    def inc(self, name, amount=1, **labels):
+        """Increase a counter.
+
+        Args:
+            name (str): the metric name, a key of `METRICS`.
+            amount (float, optional): the amount to add.
+            **labels (str): the label values.
+        """
+        key = self._key(labels)
+        with self._lock:
+            samples = self._values[name]
+            samples[key] = samples.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        """Set a gauge.
+
+        Args:
+            name (str): the metric name, a key of `METRICS`.
+            value (float): the value.
+            **labels (str): the label values.
+        """
+        with self._lock:
+            self._values[name][self._key(labels)] = value
+
+    def observe(self, name, value, **labels):
+        """Add an observation to a histogram.
+
+        Args:
+            name (str): the metric name, a key of `METRICS`.
+            value (float): the observed value.
+            **labels (str): the label values.
+        """
+        buckets = METRICS[name].buckets
+        key = self._key(labels)
+        with self._lock:
+            samples = self._values[name]
+            if key not in samples:
+                samples[key] = {"buckets": [0] * len(buckets), "sum": 0.0, "count": 0}
+            histogram = samples[key]
+            index = bisect.bisect_left(buckets, value)
+            if index < len(buckets):
+                histogram["buckets"][index] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def get(self, name, **labels):
+        """Get the value of a counter or gauge sample.
+
+        Args:
+            name (str): the metric name.
+            **labels (str): the label values.
+
+        Returns:
+            float: the value, 0 if it was never set.
+        """
+        with self._lock:
+            return self._values[name].get(self._key(labels), 0)
+
+    def render(self):
+        """Format every metric in the Prometheus text format.
+
+        Returns:
+            str: the metrics.
+        """
+        lines = []
+        with self._lock:
+            for name, metric in METRICS.items():
+                samples = self._values.get(name)
+                if not samples:
+                    continue
+                full_name = METRIC_PREFIX + name
+                lines.append(f"# HELP {full_name} {metric.help}")
+                lines.append(f"# TYPE {full_name} {metric.kind}")
+                for key, value in sorted(samples.items()):
+                    if metric.kind == HISTOGRAM:
+                        lines.extend(
+                            _render_histogram(full_name, metric.buckets, key, value)
+                        )
+                    else:
+                        lines.append(
+                            f"{full_name}{_render_labels(key)} {_render_value(value)}"
+                        )
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def clear(self):
+        """Forget every sample."""
+        with self._lock:
+            self._values.clear()
+
+
+def _render_labels(key, extra=()):
+    """Format the labels of a sample.
+
+    Args:
+        key (tuple): the label items.
+        extra (tuple, optional): more label items, e.g. a histogram's `le`.
+
+    Returns:
+        str: the labels in braces, or an empty string if there are none.
+    """
+    items = tuple(key) + tuple(extra)
+    if not items:
+        return ""
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+        for name, value in items
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _render_value(value):
+    """Format a sample value.
+
+    Args:
+        value (float): the value.
+
+    Returns:
+        str: the value.
+    """
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _render_histogram(full_name, buckets, key, histogram):
+    """Format the samples of one histogram.
+
+    Args:
+        full_name (str): the metric name, with its prefix.
+        buckets (tuple): the bucket upper bounds.
+        key (tuple): the label items.
+        histogram (dict): the bucket counts, sum and count.
+
+    Returns:
+        list[str]: the sample lines.
+    """
+    lines = []
+    cumulative = 0
+    for bound, count in zip(buckets, histogram["buckets"]):
+        cumulative += count
+        labels = _render_labels(key, (("le", _render_value(float(bound))),))
+        lines.append(f"{full_name}_bucket{labels} {cumulative}")
+    labels = _render_labels(key, (("le", "+Inf"),))
+    lines.append(f"{full_name}_bucket{labels} {histogram['count']}")
+    lines.append(
+        f"{full_name}_sum{_render_labels(key)} {_render_value(histogram['sum'])}"
+    )
+    lines.append(f"{full_name}_count{_render_labels(key)} {histogram['count']}")
+    return lines
+
+
+REGISTRY = MetricsRegistry()
+_TEXTFILE_PATH = None
+
+
+def configure(path: str):
+    """Collect metrics, to be written to a textfile.
+
+    Args:
+        path (str): the `.prom` file to write, in the textfile collector's directory.
+    """
+    global _TEXTFILE_PATH  # pylint: disable=global-statement
+    _TEXTFILE_PATH = path
+
+
+def enabled():
+    """Check whether metrics are being collected.
+
+    Returns:
+        bool: whether a textfile has been configured.
+    """
+    return _TEXTFILE_PATH is not None
+
+
+def inc(name, amount=1, **labels):
+    """Increase a counter of the default registry, if metrics are collected.
+
+    Args:
+        name (str): the metric name, a key of `METRICS`.
+        amount (float, optional): the amount to add.
+        **labels (str): the label values.
+    """
+    if enabled():
+        REGISTRY.inc(name, amount, **labels)
+
+
+def observe(name, value, **labels):
+    """Add an observation to a histogram of the default registry, if metrics are collected.
+
+    Args:
+        name (str): the metric name, a key of `METRICS`.
+        value (float): the observed value.
+        **labels (str): the label values.
+    """
+    if enabled():
+        REGISTRY.observe(name, value, **labels)
+
+
+def record_run(command, succeeded):
+    """Count a finished run or job.
+
+    Args:
+        command (str): the subcommand, e.g. "apply".
+        succeeded (bool): whether it succeeded.
+    """
+    if enabled():
+        outcome = "succeeded" if succeeded else "failed"
+        REGISTRY.inc("runs_total", command=command, outcome=outcome)
+        REGISTRY.set("last_run_timestamp_seconds", time.time(), command=command)
+
+
+def write_textfile(path: str = None, registry: MetricsRegistry = REGISTRY):
+    """Write the metrics to a textfile atomically.
+
+    The metrics are written to a temporary file in the same directory, which
+    then replaces the textfile.
+
+    Args:
+        path (str, optional): the file to write. Defaults to the configured one.
+        registry (MetricsRegistry, optional): the metrics to write.
+
+    Returns:
+        str: the file written, or None if there is no file to write.
+    """
+    path = path or _TEXTFILE_PATH
+    if path is None:
+        return None
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    # The collector only reads *.prom files, so the temporary file is ignored.
+    file_descriptor, temp_path = tempfile.mkstemp(
+        prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=directory
+    )
+    try:
+        with os.fdopen(file_descriptor, "w", encoding="utf-8") as temp_file:
+            temp_file.write(registry.render())
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except OSError:
+        with contextlib.suppress(OSError):
+            os.remove(temp_path)
+        raise
+    logging.debug("Wrote metrics to %s", path)
+    return path
+
+
+@contextlib.contextmanager
+def step_metrics(step_name: str):
+    """Step hook timing a setup step, and counting rollbacks.
+
+    Args:
+        step_name (str): the step name.
+
+    Yields:
+        str: the step name.
+    """
+    if not enabled():
+        yield step_name
+        return
+    if step_name == "undo":
+        REGISTRY.inc("rollbacks_total")
+    start = time.perf_counter()
+    outcome = "failed"
+    try:
+        yield step_name
+        outcome = "succeeded"
+    finally:
+        REGISTRY.observe(
+            "step_duration_seconds",
+            time.perf_counter() - start,
+            step=step_name,
+            outcome=outcome,
+        )
+
+
+class MetricsConnection(p4_connection_utility.ConnectionWrapper):
+    """Connection counting and timing its server round trips.
+
+    After a successful `populate`, the size of the populated files is read with
+    `sizes -s`, one extra round trip, to count the bytes branched.
+    """
+
+    def run(self, *args):
+        """Run a command, recording its round trip.
+
+        Args:
+            *args (str): the command and its arguments.
+
+        Returns:
+            list: the command results.
+        """
+        if not enabled():
+            return self._connection.run(*args)
+        command = _command_name(args)
+        start = time.perf_counter()
+        try:
+            return self._record_populate(args, self._connection.run(*args))
+        finally:
+            REGISTRY.inc("round_trips_total", command=command)
+            REGISTRY.observe(
+                "round_trip_seconds", time.perf_counter() - start, command=command
+            )
+
+    def run_iter(self, *args):
+        """Run a command, yielding its results as they arrive, and recording its round trip.
+
+        Args:
+            *args (str): the command and its arguments.
+
+        Yields:
+            dict | str: the command results.
+        """
+        if not enabled():
+            yield from p4_connection_utility.run_iter(self._connection, *args)
+            return
+        command = _command_name(args)
+        start = time.perf_counter()
+        records = files = 0
+        try:
+            for record in p4_connection_utility.run_iter(self._connection, *args):
+                records += 1
+                files += isinstance(record, dict)
+                yield record
+        finally:
+            REGISTRY.inc("round_trips_total", command=command)
+            REGISTRY.observe(
+                "round_trip_seconds", time.perf_counter() - start, command=command
+            )
+        self._record_populated_files(args, files or records)
+
+    def _record_populate(self, args, result):
+        """Count the files and bytes a populate branched.
+
+        Args:
+            args (tuple): the command and its arguments.
+            result (list): the command results.
+
+        Returns:
+            list: the command results, unchanged.
+        """
+        if result:
+            files = [record for record in result if isinstance(record, dict)]
+            self._record_populated_files(args, len(files) or len(result))
+        return result
+
+    def _record_populated_files(self, args, files):
+        """Count the files a populate branched, and read how many bytes they are.
+
+        Args:
+            args (tuple): the command and its arguments.
+            files (int): the number of results the command returned.
+        """
+        if not args or args[0] != "populate" or not files:
+            return
+        REGISTRY.inc("populate_files_total", files)
+        target = next(
+            (str(arg) for arg in reversed(args[1:]) if not str(arg).startswith("-")),
+            None,
+        )
+        if target is None:
+            return
+        try:
+            sizes = self._connection.run("sizes", "-s", target)
+        except p4_connection_utility.p4_exception_types() as error:
+            logging.debug("Could not read the size of %s: %s", target, error)
+            return
+        populated_bytes = sum(
+            int(record.get("fileSize", 0))
+            for record in sizes
+            if isinstance(record, dict)
+        )
+        REGISTRY.inc("populate_bytes_total", populated_bytes)
+
+
+def _command_name(args):
+    """Get the command a round trip ran, skipping global arguments such as `-x -`.
+
+    Args:
+        args (tuple): the command and its arguments.
+
+    Returns:
+        str: the command name.
+    """
+    args = [str(arg) for arg in args]
+    while len(args) >= 2 and args[0] == "-x":
+        args = args[2:]
+    return args[0] if args else ""
@@ -0,0 +1,140 @@
+# Copyright (C) 2023 DNEG - All Rights reserved.
+"""
+P4 Batch Utility.
+
+This utility's responsibility is to run many read commands of the same kind,
+such as `group -o` for hundreds of groups, in as few server round trips as
+possible.
+
+Operands are sent in batches through an argument file (`p4 -x - group -o`),
+so each batch is a single invocation. Results are matched back to their
+operand by the key field of each record, e.g. `Group` for `group -o`. Operands
+the batch did not answer, or every operand of a batch that failed, are retried
+one command at a time, so that callers get the same results and errors as if
+they had run each command themselves.
+
+Argument files need a connection backend that supports them, see
+`supports_argument_files()`. Other connections run every command individually.
+"""
+import collections
+import logging
+
+from shared import p4_connection_utility
+
+DEFAULT_BATCH_SIZE = 100
+# P4Python's exception level that never raises, see P4.P4.exception_level.
+_RAISE_NONE = 0
+
+# The field of each result naming the operand it answers, by command.
+KEY_FIELDS = {
+    ("client", "-o"): "Client",
+    ("depot", "-o"): "Depot",
+    ("depots", "-E"): "name",
+    ("group", "-o"): "Group",
+    ("stream", "-o"): "Stream",
+    ("user", "-o"): "User",
+}
+
+BatchResult = collections.namedtuple("BatchResult", ["results", "errors"])
+BatchResult.__doc__ = """Outcome of `BatchReader.read()`.
+
+Attributes:
+    results (dict): the command results, a list for each operand that succeeded.
+    errors (dict): the exception raised for each operand that failed.
+"""
+
+
+def supports_argument_files(connection):
+    """Check whether a connection can run commands with `-x -`.
+
+    Args:
+        connection (P4.P4): the connection, possibly wrapped.
+
+    Returns:
+        bool: whether argument files are supported.
+    """
+    return getattr(connection, "supports_argument_files", False) is True
+
+
+class BatchReader:
+    """Runs a read command for many operands in batches."""
+
+    def __init__(self, connection, batch_size: int = DEFAULT_BATCH_SIZE):
+        """Construct an instance of BatchReader.
+
+        Args:
+            connection (P4.P4): the connection to run the commands on.
+            batch_size (int, optional): the most operands per invocation.
+        """
+        self.connection = connection
+        self.batch_size = batch_size
+
+    def read(self, command, operands):
+        """Run a command once per operand, batching where possible.
+
+        Args:
+            command (tuple): the command and its flags, e.g. `("group", "-o")`.
+            operands (list[str]): the operand for each command.
+
+        Returns:
+            BatchResult: the results and errors, keyed by operand.
+        """
+        command = tuple(command)
+        operands = list(dict.fromkeys(operands))
+        batch_result = BatchResult({}, {})
+        key_field = KEY_FIELDS.get(command)
+        if key_field is None or not supports_argument_files(self.connection):
+            self._read_individually(command, operands, batch_result)
+            return batch_result
+
+        for start in range(0, len(operands), self.batch_size):
+            batch = operands[start : start + self.batch_size]
+            unanswered = self._read_batch(command, key_field, batch, batch_result)
+            self._read_individually(command, unanswered, batch_result)
+        return batch_result
+
+    def _read_batch(self, command, key_field, batch, batch_result):
+        """Run a command for a batch of operands in one invocation.
+
+        Args:
+            command (tuple): the command and its flags.
+            key_field (str): the result field naming the operand.
+            batch (list[str]): the operands.
+            batch_result (BatchResult): the results to add to.
+
+        Returns:
+            list[str]: the operands the batch did not answer.
+        """
+        previous_level = self.connection.exception_level
+        self.connection.exception_level = _RAISE_NONE
+        try:
+            self.connection.input = "\n".join(batch) + "\n"
+            records = self.connection.run("-x", "-", *command)
+        except p4_connection_utility.p4_exception_types() as error:
+            logging.debug("Batched '%s' failed: %s", " ".join(command), error)
+            return batch
+        finally:
+            self.connection.exception_level = previous_level
+
+        wanted = set(batch)
+        for record in records:
+            operand = record.get(key_field) if isinstance(record, dict) else None
+            if operand in wanted:
+                batch_result.results.setdefault(operand, []).append(record)
+        # Operands that errored or matched nothing are run one by one, so that
+        # they get their own result or error.
+        return [operand for operand in batch if operand not in batch_result.results]
+
+    def _read_individually(self, command, operands, batch_result):
+        """Run a command for each operand separately.
+
+        Args:
+            command (tuple): the command and its flags.
+            operands (list[str]): the operands.
+            batch_result (BatchResult): the results and errors to add to.
+        """
+        for operand in operands:
+            try:
+                batch_result.results[operand] = self.connection.run(*command, operand)
+            except p4_connection_utility.p4_exception_types() as error:
+                batch_result.errors[operand] = error
@@ -0,0 +1,331 @@
+# Copyright (C) 2023 DNEG - All Rights reserved.
+"""
+P4 Connection Utility.
+
+This utility's responsibility is to create Perforce connections on demand.
+
+P4Python is a heavyweight native module, so nothing in here imports it until a
+connection is actually requested. Helpers, validation-only scripts and `--help`
+can import the modules that talk to Perforce without paying for it.
+"""
+import contextlib
+import importlib
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+
+P4PYTHON_MODULE = "P4"
+# Environment variable selecting the connection backend, see `CONNECTION_BACKENDS`.
+BACKEND_ENVIRONMENT_VARIABLE = "P4_SHOW_SETUP_BACKEND"
+P4PYTHON_BACKEND = "p4python"
+MARSHAL_BACKEND = "marshal"
+REPLAY_BACKEND = "replay"
+CONNECTION_BACKENDS = (P4PYTHON_BACKEND, MARSHAL_BACKEND, REPLAY_BACKEND)
+
+
+class P4CommandError(Exception):
+    """Error raised by connection backends that are not P4Python.
+
+    Mirrors the `errors` and `warnings` attributes of `P4.P4Exception` so that
+    callers can handle both the same way.
+    """
+
+    def __init__(self, message, errors=None, warnings=None):
+        """Construct an instance of P4CommandError.
+
+        Args:
+            message (str): the error message.
+            errors (list[str], optional): the errors reported by the server.
+            warnings (list[str], optional): the warnings reported by the server.
+        """
+        super().__init__(message)
+        self.value = message
+        self.errors = list(errors or [])
+        self.warnings = list(warnings or [])
+
+
+class ConnectionWrapper:
+    """Base class for connections that add behaviour around another connection.
+
+    Everything that is not overridden, including setting `input`, `port` or
+    `user`, is passed through to the wrapped connection. Wrappers keep their own
+    state in underscore-prefixed attributes.
+    """
+
+    def __init__(self, connection):
+        """Construct an instance of ConnectionWrapper.
+
+        Args:
+            connection (P4.P4): the connection to wrap.
+        """
+        self._connection = connection
+
+    @property
+    def connection(self):
+        """P4.P4: the wrapped connection."""
+        return self._connection
+
+    def __getattr__(self, name):
+        """Get an attribute from the wrapped connection.
+
+        Args:
+            name (str): the attribute name.
+
+        Returns:
+            Any: the wrapped connection's attribute.
+        """
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self._connection, name)
+
+    def __setattr__(self, name, value):
+        """Set an attribute on the wrapped connection, or on the wrapper if private.
+
+        Args:
+            name (str): the attribute name.
+            value (Any): the value to set.
+        """
+        if name.startswith("_"):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._connection, name, value)
+
+    def run(self, *args):
+        """Run a command on the wrapped connection.
+
+        Args:
+            *args (str): the command and its arguments.
+
+        Returns:
+            list: the command results.
+        """
+        return self._connection.run(*args)
+
+    def run_iter(self, *args):
+        """Run a command on the wrapped connection, yielding its results as they arrive.
+
+        Wrappers that add behaviour to `run()` override this too, or results
+        would bypass them.
+
+        Args:
+            *args (str): the command and its arguments.
+
+        Returns:
+            Iterator: the command results.
+        """
+        return run_iter(self._connection, *args)
+
+
+def run_iter(connection, *args):
+    """Run a command, yielding its results as they arrive if the connection can stream them.
+
+    Large listings, such as `groups` or `populate` output, are then processed
+    one record at a time. Connections that cannot stream, such as P4Python's,
+    run the command with `run()` and yield its results.
+
+    Args:
+        connection (P4.P4): the connection.
+        *args (str): the command and its arguments.
+
+    Returns:
+        Iterator: the command results.
+    """
+    if getattr(type(connection), "run_iter", None) is None:
+        return iter(connection.run(*args))
+    return connection.run_iter(*args)
+
+
+def import_p4python():
+    """Import P4Python on first use.
+
+    Returns:
+        module: the `P4` module.
+    """
+    if P4PYTHON_MODULE not in sys.modules:
+        logging.debug("Importing P4Python")
+    return importlib.import_module(P4PYTHON_MODULE)
+
+
+def p4_exception_types():
+    """Get the exception types server commands can raise.
+
+    `P4.P4Exception` is only included once P4Python has been imported, since a
+    command cannot have raised it before then.
+
+    Returns:
+        tuple: exception classes, usable directly in an `except` clause.
+    """
+    exception_types = [P4CommandError]
+    p4_module = sys.modules.get(P4PYTHON_MODULE)
+    if p4_module is not None and hasattr(p4_module, "P4Exception"):
+        exception_types.append(p4_module.P4Exception)
+    return tuple(exception_types)
+
+
+def create_connection(port: str = None, user: str = None, backend: str = None):
+    """Create a new, unconnected, Perforce connection.
+
+    Args:
+        port (str, optional): the P4PORT to connect to.
+        user (str, optional): the P4USER to connect as.
+        backend (str, optional): one of `CONNECTION_BACKENDS`. Defaults to the
+            `P4_SHOW_SETUP_BACKEND` environment variable, or P4Python.
+
+    Returns:
+        P4.P4: the connection object.
+
+    Raises:
+        ValueError: if the backend is unknown, or is `replay` without a recording.
+    """
+    backend = (
+        backend or os.environ.get(BACKEND_ENVIRONMENT_VARIABLE) or P4PYTHON_BACKEND
+    )
+    if backend == MARSHAL_BACKEND:
+        # Imported here, since the marshal backend depends on this module.
+        from shared import p4_marshal_utility  # pylint: disable=import-outside-toplevel
+
+        return p4_marshal_utility.P4MarshalConnection(port=port, user=user)
+    if backend == REPLAY_BACKEND:
+        # Imported here, since the replay backend depends on this module.
+        # pylint: disable-next=import-outside-toplevel
+        from shared import p4_recording_utility
+
+        return p4_recording_utility.create_replay_connection(port=port, user=user)
+    if backend != P4PYTHON_BACKEND:
+        raise ValueError(f"Unknown connection backend: {backend}")
+    p4_module = import_p4python()
+    connection = p4_module.P4()
+    if port:
+        connection.port = port
+    if user:
+        connection.user = user
+    return connection
+
+
+class ConnectionPool:
+    """Fixed-size pool of connected connections, created on first use.
+
+    A P4 connection can only run one command at a time, so each thread acquires
+    its own connection for as long as it needs it. Released connections stay
+    connected for the next caller.
+    """
+
+    def __init__(self, factory, size: int = 4):
+        """Construct an instance of ConnectionPool.
+
+        Args:
+            factory (callable): function returning a new, connected, connection.
+            size (int, optional): the maximum number of connections.
+        """
+        self.factory = factory
+        self.size = size
+        # Idle connections, the most recently released last. Guarded, with
+        # `_created` and `_closed`, by `_condition`, which is notified whenever
+        # a connection is released or forgotten, or the pool is closed.
+        self._idle = []
+        self._condition = threading.Condition()
+        self._created = 0
+        self._closed = False
+
+    @contextlib.contextmanager
+    def acquire(self, timeout: float = None):
+        """Borrow a connection from the pool.
+
+        Connections that were dropped while borrowed are discarded instead of
+        being returned to the pool.
+
+        Args:
+            timeout (float, optional): seconds to wait for a free connection.
+                Waits forever by default.
+
+        Yields:
+            P4.P4: the connection.
+
+        Raises:
+            queue.Empty: if no connection became free within the timeout.
+        """
+        connection = self._take(timeout)
+        try:
+            yield connection
+        finally:
+            self._release(connection)
+
+    def _take(self, timeout):
+        """Get an idle connection, or create one if the pool is not full.
+
+        Args:
+            timeout (float): seconds to wait for a free connection.
+
+        Returns:
+            P4.P4: the connection.
+
+        Raises:
+            queue.Empty: if no connection became free within the timeout.
+            RuntimeError: if the pool is closed.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise RuntimeError("Connection pool is closed")
+                if self._idle:
+                    return self._idle.pop()
+                if self._created < self.size:
+                    self._created += 1
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise queue.Empty
+                self._condition.wait(remaining)
+        try:
+            return self.factory()
+        except Exception:
+            self._forget()
+            raise
+
+    def _forget(self):
+        """Stop counting a connection, so that a waiting caller can create another."""
+        with self._condition:
+            self._created -= 1
+            self._condition.notify()
+
+    def _release(self, connection):
+        """Return a borrowed connection to the pool.
+
+        Args:
+            connection (P4.P4): the connection.
+        """
+        connected = connection.connected()
+        with self._condition:
+            if connected and not self._closed:
+                self._idle.append(connection)
+                self._condition.notify()
+                return
+        self._forget()
+        _disconnect_quietly(connection)
+
+    def close(self):
+        """Disconnect every idle connection. Borrowed ones are closed on release."""
+        with self._condition:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._created -= len(idle)
+            self._condition.notify_all()
+        for connection in idle:
+            _disconnect_quietly(connection)
+
+
+def _disconnect_quietly(connection):
+    """Disconnect a connection, logging instead of raising errors.
+
+    Args:
+        connection (P4.P4): the connection.
+    """
+    try:
+        if connection.connected():
+            connection.disconnect()
+    except p4_exception_types() as error:
+        logging.debug("Error while disconnecting: %s", error)
@@ -0,0 +1,349 @@
+# Copyright (C) 2023 DNEG - All Rights reserved.
+"""
+P4 Deadline Utility.
+
+This utility's responsibility is to bound how long Perforce commands and setup
+steps can take, and to stop them in an orderly way when asked to.
+
+A command is stopped in three layers:
+- The server is told how long it may hold locks for (`maxlocktime`), and the
+  client how long to wait on the network (`net.maxwait`).
+- The connection's break callback (`P4.setbreak()`) reports the command as no
+  longer wanted once its deadline passes or the run is cancelled. P4API polls it
+  while waiting on the server and aborts the command.
+- A watchdog aborts the connection outright if the command is still running a
+  grace period after its deadline.
+"""
+import contextlib
+import logging
+import signal
+import threading
+import time
+
+from shared import p4_connection_utility
+
+DEFAULT_COMMAND_TIMEOUT_SECONDS = 300.0
+COMMAND_TIMEOUT_SECONDS = {
+    "obliterate": 3600.0,
+    "populate": 3600.0,
+}
+WATCHDOG_GRACE_SECONDS = 10.0
+
+
+class OperationCancelled(Exception):
+    """Raised when a command or step is stopped before it finished."""
+
+
+class DeadlineExceeded(OperationCancelled):
+    """Raised when a command or step runs past its deadline."""
+
+
+class CancellationToken:
+    """Thread-safe flag used to ask running work to stop."""
+
+    def __init__(self):
+        """Construct an instance of CancellationToken."""
+        self._event = threading.Event()
+        self.reason = None
+
+    @property
+    def cancelled(self):
+        """bool: whether cancellation has been requested."""
+        return self._event.is_set()
+
+    def cancel(self, reason: str = "cancelled"):
+        """Request cancellation.
+
+        Args:
+            reason (str, optional): why the work is being cancelled.
+        """
+        if not self._event.is_set():
+            self.reason = reason
+        self._event.set()
+
+    def reset(self):
+        """Clear a cancellation request, so that rollback commands can run."""
+        self._event.clear()
+        self.reason = None
+
+    def raise_if_cancelled(self):
+        """Raise if cancellation has been requested.
+
+        Raises:
+            OperationCancelled: if cancellation has been requested.
+        """
+        if self._event.is_set():
+            raise OperationCancelled(self.reason)
+
+    def sleep(self, seconds: float):
+        """Wait, waking up early if cancellation is requested.
+
+        Args:
+            seconds (float): how long to wait.
+
+        Raises:
+            OperationCancelled: if cancellation is requested while waiting.
+        """
+        if self._event.wait(seconds):
+            raise OperationCancelled(self.reason)
+
+
+class Deadline:
+    """A point in time by which some work has to be finished."""
+
+    def __init__(self, seconds: float, name: str = None):
+        """Construct an instance of Deadline.
+
+        Args:
+            seconds (float): how long from now the deadline is.
+            name (str, optional): what the deadline is for, used in errors.
+        """
+        self.seconds = seconds
+        self.name = name
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        """Get the time left before the deadline.
+
+        Returns:
+            float: the seconds left, negative once the deadline has passed.
+        """
+        return self.expires_at - time.monotonic()
+
+    def expired(self):
+        """Check whether the deadline has passed.
+
+        Returns:
+            bool: True once the deadline has passed.
+        """
+        return self.remaining() <= 0
+
+
+class DeadlineConnection(p4_connection_utility.ConnectionWrapper):
+    """Connection that enforces per-command and per-step deadlines."""
+
+    def __init__(
+        self,
+        connection,
+        token: CancellationToken = None,
+        default_timeout: float = DEFAULT_COMMAND_TIMEOUT_SECONDS,
+        timeouts: dict = None,
+    ):
+        """Construct an instance of DeadlineConnection.
+
+        Args:
+            connection (P4.P4): the connection to wrap.
+            token (CancellationToken, optional): token used to cancel commands.
+            default_timeout (float, optional): seconds any command may take.
+            timeouts (dict, optional): seconds specific commands may take, keyed by
+                command name. Defaults to `COMMAND_TIMEOUT_SECONDS`.
+        """
+        super().__init__(connection)
+        self._token = token or CancellationToken()
+        self._default_timeout = default_timeout
+        self._timeouts = COMMAND_TIMEOUT_SECONDS if timeouts is None else timeouts
+        self._step_deadlines = []
+        self._command_deadline = None
+
+        if hasattr(connection, "setbreak"):
+            connection.setbreak(self._is_alive)
+        if hasattr(connection, "set_tunable"):
+            longest_timeout = max([default_timeout] + list(self._timeouts.values()))
+            connection.set_tunable("net.maxwait", str(int(longest_timeout)))
+
+    @property
+    def token(self):
+        """CancellationToken: the token used to cancel commands."""
+        return self._token
+
+    @contextlib.contextmanager
+    def step_deadline(self, seconds: float, name: str = None):
+        """Bound the time every command in the body may take, together.
+
+        Args:
+            seconds (float): the step's time limit. None for no limit.
+            name (str, optional): the step name, used in errors.
+
+        Yields:
+            Deadline: the step's deadline, or None if it has no limit.
+        """
+        if seconds is None:
+            yield None
+            return
+        deadline = Deadline(seconds, name)
+        self._step_deadlines.append(deadline)
+        try:
+            yield deadline
+        finally:
+            self._step_deadlines.remove(deadline)
+
+    def _command_timeout(self, args):
+        """Get how long a command may take, given the step deadlines.
+
+        Args:
+            args (tuple): the command and its arguments.
+
+        Returns:
+            tuple: the timeout in seconds, and the name of what limits it.
+        """
+        command = args[0] if args else ""
+        timeout = self._timeouts.get(command, self._default_timeout)
+        limit = f"'{command}' command"
+        for deadline in self._step_deadlines:
+            if deadline.remaining() < timeout:
+                timeout = deadline.remaining()
+                limit = f"'{deadline.name}' step"
+        return (timeout, limit)
+
+    def _is_alive(self):
+        """Break callback polled by P4API while a command is running.
+
+        Returns:
+            bool: False once the command should be aborted.
+        """
+        if self._token.cancelled:
+            return False
+        deadline = self._command_deadline
+        return deadline is None or not deadline.expired()
+
+    def _watchdog(self, args):
+        """Abort a command that ignored its break callback.
+
+        Args:
+            args (tuple): the command and its arguments.
+        """
+        logging.error(
+            "'%s' is still running %ss after its deadline. Aborting the connection.",
+            " ".join(args),
+            WATCHDOG_GRACE_SECONDS,
+        )
+        abort = getattr(self._connection, "abort", None) or self._connection.disconnect
+        try:
+            abort()
+        except Exception as error:  # pylint: disable=broad-except
+            logging.error("Unable to abort the connection: %s", error)
+
+    def run(self, *args):
+        """Run a command within its deadline.
+
+        Args:
+            *args (str): the command and its arguments.
+
+        Returns:
+            list: the command results.
+
+        Raises:
+            OperationCancelled: if the run was cancelled.
+            DeadlineExceeded: if the command failed after its deadline, or its
+                step ran out of time before it started.
+        """
+        with self._command(args):
+            return self._connection.run(*args)
+
+    def run_iter(self, *args):
+        """Run a command within its deadline, yielding its results as they arrive.
+
+        Args:
+            *args (str): the command and its arguments.
+
+        Yields:
+            dict | str: the command results.
+
+        Raises:
+            OperationCancelled: if the run was cancelled.
+            DeadlineExceeded: if the command failed after its deadline, or its
+                step ran out of time before it started.
+        """
+        with self._command(args):
+            yield from p4_connection_utility.run_iter(self._connection, *args)
+
+    @contextlib.contextmanager
+    def _command(self, args):
+        """Bound the command run in the body by its deadline.
+
+        Args:
+            args (tuple): the command and its arguments.
+
+        Yields:
+            Deadline: the command's deadline.
+
+        Raises:
+            OperationCancelled: if the run was cancelled.
+            DeadlineExceeded: if the command failed after its deadline, or its
+                step ran out of time before it started.
+        """
+        self._token.raise_if_cancelled()
+        timeout, limit = self._command_timeout(args)
+        if timeout <= 0:
+            raise DeadlineExceeded(f"The {limit} deadline has passed")
+
+        if hasattr(self._connection, "maxlocktime"):
+            self._connection.maxlocktime = int(timeout * 1000)
+        deadline = Deadline(timeout, limit)
+        watchdog = threading.Timer(
+            timeout + WATCHDOG_GRACE_SECONDS, self._watchdog, args=(args,)
+        )
+        watchdog.daemon = True
+        self._command_deadline = deadline
+        watchdog.start()
+        try:
+            yield deadline
+        except p4_connection_utility.p4_exception_types() as error:
+            if self._token.cancelled:
+                raise OperationCancelled(self._token.reason) from error
+            if deadline.expired():
+                raise DeadlineExceeded(
+                    f"'{' '.join(args)}' ran past the {limit} deadline of "
+                    f"{deadline.seconds:.0f}s"
+                ) from error
+            raise
+        finally:
+            watchdog.cancel()
+            self._command_deadline = None
+
+        # The command's changes are made, so its result is returned for the
+        # caller to record. The next command enforces the step's deadline.
+        if deadline.expired():
+            logging.warning(
+                "'%s' finished past the %s deadline of %.0fs",
+                " ".join(args),
+                limit,
+                deadline.seconds,
+            )
+
+
+@contextlib.contextmanager
+def handle_termination_signals(token: CancellationToken):
+    """Turn Ctrl-C and SIGTERM into a cancellation request.
+
+    The first signal cancels the token, so that the command in flight is aborted
+    and the caller can roll back. A second Ctrl-C interrupts immediately.
+    Signal handlers can only be installed from the main thread; elsewhere this
+    does nothing.
+
+    Args:
+        token (CancellationToken): the token to cancel.
+
+    Yields:
+        CancellationToken: the token.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        yield token
+        return
+
+    def _handler(signum, _frame):
+        signal_name = signal.Signals(signum).name
+        if token.cancelled and signum == signal.SIGINT:
+            raise KeyboardInterrupt
+        logging.warning("Received %s. Stopping after the current command.", signal_name)
+        token.cancel(f"Received {signal_name}")
+
+    handled_signals = [signal.SIGINT, signal.SIGTERM]
+    previous_handlers = {signum: signal.getsignal(signum) for signum in handled_signals}
+    for signum in handled_signals:
+        signal.signal(signum, _handler)
+    try:
+        yield token
+    finally:
+        for signum, previous_handler in previous_handlers.items():
+            signal.signal(signum, previous_handler)
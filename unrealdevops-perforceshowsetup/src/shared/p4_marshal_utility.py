@@ -0,0 +1,399 @@
+# Copyright (C) 2023 DNEG - All Rights reserved.
+"""
+P4 Marshal Utility.
+
+This utility's responsibility is to talk to Perforce through the `p4` command
+line client instead of P4Python, for hosts where P4Python is not available.
+
+Commands run as `p4 -G`, which writes every result as a Python marshal record.
+Records are decoded one at a time as they arrive, so `run_iter()` can process
+large listings without holding the whole response in memory. `run()` and
+`input` follow the P4Python contract used by `P4ShowSetup`:
+- results are dictionaries of strings, with numbered fields such as `Users0`,
+  `Users1` combined into lists;
+- `input` takes a spec dictionary, or a list of them consumed one per command;
+- errors, and warnings at the default exception level, raise
+  `P4CommandError` with the `errors` and `warnings` of the command.
+"""
+import collections
+import logging
+import marshal
+import os
+import re
+import subprocess
+
+from shared import p4_connection_utility
+from shared import subprocess_utility
+
+DEFAULT_P4_EXECUTABLE = "p4"
+
+# Severities of -G error records, as in P4API's ErrorSeverity.
+P4_SEVERITY_WARNING = 2
+P4_SEVERITY_FAILED = 3
+
+# P4Python's exception levels.
+RAISE_NONE = 0
+RAISE_ERRORS = 1
+RAISE_ALL = 2
+
+_NUMBERED_FIELD = re.compile(r"^(\D+?)(\d+)$")
+
+Message = collections.namedtuple("Message", ["severity", "generic", "text"])
+Message.__doc__ = """An error or warning reported by a command, like P4.Message.
+
+Attributes:
+    severity (int): the P4API severity.
+    generic (int): the P4API generic error code.
+    text (str): the message text.
+"""
+
+
+def decode_record(record):
+    """Convert a -G record to the form P4Python returns.
+
+    Args:
+        record (dict): the record, with bytes keys and values.
+
+    Returns:
+        dict: the record with str keys and values, and numbered fields combined
+            into lists.
+    """
+    decoded = {}
+    numbered = collections.defaultdict(dict)
+    for key, value in record.items():
+        key = _to_str(key)
+        value = _to_str(value)
+        match = _NUMBERED_FIELD.match(key)
+        if match:
+            numbered[match.group(1)][int(match.group(2))] = value
+        else:
+            decoded[key] = value
+    for key, values in numbered.items():
+        if key in decoded:
+            # A plain field sharing the name; keep the numbered ones as they came.
+            decoded.update({f"{key}{index}": value for index, value in values.items()})
+        else:
+            decoded[key] = [values[index] for index in sorted(values)]
+    return decoded
+
+
+def encode_spec(spec):
+    """Convert a spec dictionary to a -G input record.
+
+    Args:
+        spec (dict): the spec, with list fields such as `Users`.
+
+    Returns:
+        bytes: the marshalled record.
+    """
+    record = {}
+    for key, value in spec.items():
+        if isinstance(value, (list, tuple)):
+            for index, item in enumerate(value):
+                record[f"{key}{index}".encode("utf-8")] = _to_bytes(item)
+        else:
+            record[key.encode("utf-8")] = _to_bytes(value)
+    # p4 reads the version 0 format, the one Python 2 wrote.
+    return marshal.dumps(record, 0)
+
+
+def _to_str(value):
+    """Decode bytes from a -G record.
+
+    Args:
+        value (Any): the value.
+
+    Returns:
+        Any: the value, as str if it was bytes.
+    """
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="replace")
+    return value
+
+
+def _to_bytes(value):
+    """Encode a value for a -G input record.
+
+    Args:
+        value (Any): the value.
+
+    Returns:
+        bytes: the encoded value.
+    """
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode("utf-8")
+
+
+class P4MarshalConnection:
+    """Perforce connection running the `p4` command line client with -G.
+
+    A drop-in replacement for the parts of `P4.P4` the show setup uses.
+    """
+
+    # Commands can be run for many operands with `-x -`, see p4_batch_utility.
+    supports_argument_files = True
+
+    def __init__(
+        self,
+        executable=DEFAULT_P4_EXECUTABLE,
+        port: str = None,
+        user: str = None,
+        client: str = None,
+    ):
+        """Construct an instance of P4MarshalConnection.
+
+        Args:
+            executable (str | list[str], optional): the p4 client to run.
+            port (str, optional): the P4PORT. Taken from the environment if None.
+            user (str, optional): the P4USER. Taken from the environment if None.
+            client (str, optional): the P4CLIENT. Taken from the environment if None.
+        """
+        self.executable = (
+            [executable] if isinstance(executable, str) else list(executable)
+        )
+        self.port = port
+        self.user = user
+        self.client = client
+        self.password = None
+        self.exception_level = RAISE_ALL
+        self.maxlocktime = 0
+        self.input = None
+        self.errors = []
+        self.warnings = []
+        self.messages = []
+        self._tunables = {}
+        self._break_callback = None
+        self._connected = False
+        self._process = None
+
+    def connect(self):
+        """Check that the server can be reached.
+
+        Raises:
+            P4CommandError: if the server cannot be reached.
+        """
+        self._connected = True
+        try:
+            info = self.run("info")
+        except p4_connection_utility.P4CommandError:
+            self._connected = False
+            raise
+        if self.user is None and info:
+            self.user = info[0].get("userName")
+
+    def connected(self):
+        """Check whether `connect()` succeeded and `disconnect()` was not called.
+
+        Returns:
+            bool: whether the connection is open.
+        """
+        return self._connected
+
+    def disconnect(self):
+        """Close the connection, aborting the running command if any."""
+        self.abort()
+        self._connected = False
+
+    def abort(self):
+        """Kill the running command."""
+        process = self._process
+        if process is not None:
+            process.kill()
+
+    def setbreak(self, callback):
+        """Set the callback polled while a command runs, as `P4.P4.setbreak()`.
+
+        Args:
+            callback (callable): returns False when the command should be aborted.
+        """
+        self._break_callback = callback
+
+    def set_tunable(self, name, value):
+        """Set a client tunable for every command, as `P4.P4.set_tunable()`.
+
+        Args:
+            name (str): the tunable name, such as `net.maxwait`.
+            value (str): the value.
+        """
+        self._tunables[name] = value
+
+    def _command(self, args):
+        """Build the command line for a command.
+
+        Args:
+            args (tuple): the command and its arguments.
+
+        Returns:
+            list[str]: the command line.
+        """
+        command = self.executable + ["-G"]
+        for flag, value in (
+            ("-p", self.port),
+            ("-u", self.user),
+            ("-c", self.client),
+        ):
+            if value:
+                command += [flag, value]
+        for name, value in self._tunables.items():
+            command += ["-v", f"{name}={value}"]
+        if self.maxlocktime:
+            command += ["-z", f"maxLockTime={self.maxlocktime}"]
+        return command + [str(arg) for arg in args]
+
+    def _environment(self):
+        """Build the environment for a command.
+
+        The password goes in P4PASSWD rather than on the command line, where any
+        local user could read it from the process list.
+
+        Returns:
+            dict: the environment, or None to inherit this process's.
+        """
+        if not self.password:
+            return None
+        return dict(os.environ, P4PASSWD=self.password)
+
+    def _take_input(self):
+        """Get the input for the next command, consuming it.
+
+        Returns:
+            bytes: the data to send to the command, or None.
+        """
+        command_input = self.input
+        if isinstance(command_input, (list, tuple)):
+            if not command_input:
+                self.input = None
+                return None
+            command_input, remaining = command_input[0], list(command_input[1:])
+            self.input = remaining or None
+        else:
+            self.input = None
+        if command_input is None:
+            return None
+        if isinstance(command_input, dict):
+            return encode_spec(command_input)
+        return _to_bytes(command_input)
+
+    def run_iter(self, *args):
+        """Run a command, yielding its results as they arrive.
+
+        Errors and warnings are raised once the command has finished, according
+        to `exception_level`.
+
+        Args:
+            *args (str): the command and its arguments.
+
+        Yields:
+            dict | str: every result, decoded as by `decode_record()`. Untagged
+                output is yielded as strings.
+
+        Raises:
+            P4CommandError: if the command failed or was aborted.
+        """
+        if not self._connected:
+            raise p4_connection_utility.P4CommandError(
+                "Not connected to the Perforce server"
+            )
+        self.errors, self.warnings, self.messages = [], [], []
+        command = self._command(args)
+        input_data = self._take_input()
+        aborted = False
+        with subprocess_utility.StreamingProcess(
+            command, input_data=input_data, env=self._environment()
+        ) as process:
+            self._process = process
+            try:
+                while True:
+                    if self._break_callback is not None and not self._break_callback():
+                        aborted = True
+                        process.kill()
+                        break
+                    try:
+                        record = decode_record(marshal.load(process.stdout))
+                    except EOFError:
+                        break
+                    except (ValueError, TypeError) as error:
+                        raise p4_connection_utility.P4CommandError(
+                            f"Unreadable output from {' '.join(args)}: {error}"
+                        ) from error
+                    code = record.pop("code", "stat")
+                    if code == "error":
+                        self._add_message(record)
+                    elif code == "stat":
+                        yield record
+                    else:
+                        # Untagged output; P4Python returns it as plain strings.
+                        yield record.get("data", "")
+                try:
+                    returncode = process.wait(subprocess_utility.KILL_WAIT_SECONDS)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+                    returncode = None
+            finally:
+                self._process = None
+
+        if aborted:
+            raise p4_connection_utility.P4CommandError(
+                f"'{' '.join(args)}' was aborted", errors=["Command aborted"]
+            )
+        if returncode and not self.errors:
+            # The client failed before it could report through -G, e.g. a bad port.
+            text = "\n".join(process.stderr) or f"p4 exited with status {returncode}"
+            self.errors.append(text)
+            self.messages.append(Message(P4_SEVERITY_FAILED, None, text))
+        self._raise_for_messages(args)
+
+    def run(self, *args):
+        """Run a command, as `P4.P4.run()`.
+
+        Args:
+            *args (str): the command and its arguments.
+
+        Returns:
+            list: the results.
+
+        Raises:
+            P4CommandError: if the command failed, or warned at the default
+                exception level.
+        """
+        return list(self.run_iter(*args))
+
+    def _add_message(self, record):
+        """Record an error or warning record.
+
+        Args:
+            record (dict): the decoded -G error record.
+        """
+        severity = int(record.get("severity", P4_SEVERITY_FAILED))
+        text = str(record.get("data", "")).rstrip()
+        generic = record.get("generic")
+        self.messages.append(
+            Message(severity, int(generic) if generic is not None else None, text)
+        )
+        if severity >= P4_SEVERITY_FAILED:
+            self.errors.append(text)
+        else:
+            self.warnings.append(text)
+
+    def _raise_for_messages(self, args):
+        """Raise for the errors and warnings of a command, per `exception_level`.
+
+        Args:
+            args (tuple): the command and its arguments.
+
+        Raises:
+            P4CommandError: if the command's messages call for it.
+        """
+        if self.errors and self.exception_level >= RAISE_ERRORS:
+            message = (
+                f"[P4.run()] Errors during command execution( \"p4 {' '.join(args)}\" )"
+            )
+        elif self.warnings and self.exception_level >= RAISE_ALL:
+            message = f"[P4.run()] Warnings during command execution( \"p4 {' '.join(args)}\" )"
+        else:
+            return
+        logging.debug("%s: %s %s", message, self.errors, self.warnings)
+        raise p4_connection_utility.P4CommandError(
+            message, errors=self.errors, warnings=self.warnings
+        )
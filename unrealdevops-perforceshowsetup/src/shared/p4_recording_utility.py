@@ -0,0 +1,546 @@
+# Copyright (C) 2023 DNEG - All Rights reserved.
+"""
+P4 Recording Utility.
+
+This utility's responsibility is to record the commands a setup run sends to
+Perforce, and to replay them without a server.
+
+Recording (`configure_recording()`) wraps every new connection in a
+`RecordingConnection`, which keeps each command's arguments, input spec,
+results, errors and duration. When the run ends they are written as gzipped JSON
+lines, with every user name replaced by a pseudonym (`user1`, `user2`, ...).
+Names are found in the user fields of specs, such as `Owner` and `Users`, in
+`user` lines of the protections table and in the connection's own user, and are
+then replaced wherever they appear.
+
+Replaying (the `replay` connection backend) serves the recorded results back
+from a `ReplayConnection`. Each command gets the first unused recording with
+the same arguments or, failing that, with the same command and number of
+arguments, so runs whose names differ from the recorded one still line up. The
+recorded latencies can be reproduced, scaled or skipped.
+"""
+import atexit
+import collections
+import datetime
+import gzip
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+from shared import p4_connection_utility
+
+RECORDING_FORMAT = "p4-show-setup-recording"
+RECORDING_VERSION = 1
+REPLAY_FILE_ENVIRONMENT_VARIABLE = "P4_SHOW_SETUP_REPLAY_FILE"
+REPLAY_LATENCY_ENVIRONMENT_VARIABLE = "P4_SHOW_SETUP_REPLAY_LATENCY"
+
+# Spec and result fields holding user names.
+USER_FIELDS = frozenset(
+    ["User", "Owner", "Users", "Owners", "userName", "user", "owner"]
+)
+_PROTECTION_USER_LINE = re.compile(r"^\s*\S+\s+user\s+(\S+)\s")
+
+_RECORDER = None
+_REPLAY = None
+_LOCK = threading.Lock()
+
+
+class UserScrubber:
+    """Replaces user names by stable pseudonyms, `user1`, `user2`, ..."""
+
+    def __init__(self):
+        """Construct an instance of UserScrubber."""
+        self.pseudonyms = collections.OrderedDict()
+        self._pattern = None
+
+    def add(self, name):
+        """Register a user name.
+
+        Args:
+            name (str): the user name.
+        """
+        if not isinstance(name, str) or not name or name in self.pseudonyms:
+            return
+        if name == "*":
+            return
+        self.pseudonyms[name] = f"user{len(self.pseudonyms) + 1}"
+        self._pattern = None
+
+    def collect(self, value, field=None):
+        """Register the user names found in a value.
+
+        Args:
+            value (Any): a command argument, input or result.
+            field (str, optional): the field the value was found in.
+        """
+        if isinstance(value, dict):
+            for key, item in value.items():
+                self.collect(item, key)
+        elif isinstance(value, (list, tuple)):
+            for item in value:
+                self.collect(item, field)
+        elif isinstance(value, str):
+            if field in USER_FIELDS:
+                self.add(value)
+            elif field == "Protections":
+                match = _PROTECTION_USER_LINE.match(value)
+                if match:
+                    self.add(match.group(1))
+
+    def scrub(self, value):
+        """Replace the registered user names in a value.
+
+        Args:
+            value (Any): a command argument, input or result.
+
+        Returns:
+            Any: a copy of the value, with pseudonyms instead of user names.
+        """
+        if isinstance(value, dict):
+            return {key: self.scrub(item) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [self.scrub(item) for item in value]
+        if isinstance(value, str) and self.pseudonyms:
+            if value in self.pseudonyms:
+                return self.pseudonyms[value]
+            return self._compiled().sub(
+                lambda match: self.pseudonyms[match.group(0)], value
+            )
+        return value
+
+    def _compiled(self):
+        """Get the pattern matching every registered name as a whole word.
+
+        Returns:
+            re.Pattern: the pattern, longest names first.
+        """
+        if self._pattern is None:
+            names = sorted(self.pseudonyms, key=len, reverse=True)
+            self._pattern = re.compile(
+                r"(?<![\w.@-])(?:"
+                + "|".join(re.escape(name) for name in names)
+                + r")(?![\w.@-])"
+            )
+        return self._pattern
+
+
+class Recorder:
+    """Collects the commands of every recording connection, and writes them."""
+
+    def __init__(self, path: str):
+        """Construct an instance of Recorder.
+
+        Args:
+            path (str): the file to write the recording to.
+        """
+        self.path = path
+        self.entries = []
+        self.users = []
+        self._lock = threading.Lock()
+        self._saved_count = None
+
+    def add(self, entry, user=None):
+        """Add a recorded command.
+
+        Args:
+            entry (dict): the command, see `RecordingConnection.run()`.
+            user (str, optional): the user the command ran as.
+        """
+        with self._lock:
+            entry["sequence"] = len(self.entries)
+            self.entries.append(entry)
+            if user and user not in self.users:
+                self.users.append(user)
+
+    def save(self):
+        """Write the recording, with user names scrubbed.
+
+        Returns:
+            str: the file written.
+        """
+        with self._lock:
+            entries = list(self.entries)
+            users = list(self.users)
+            if self._saved_count == len(entries):
+                return self.path
+            self._saved_count = len(entries)
+
+        scrubber = UserScrubber()
+        for user in users:
+            scrubber.add(user)
+        for entry in entries:
+            scrubber.collect(entry)
+        header = {
+            "format": RECORDING_FORMAT,
+            "version": RECORDING_VERSION,
+            "recorded_at": datetime.datetime.now().isoformat(timespec="seconds"),
+            "user": scrubber.scrub(users[0]) if users else None,
+            "commands": len(entries),
+        }
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        with gzip.open(self.path, "wt", encoding="utf-8") as recording_file:
+            for record in [header] + [scrubber.scrub(entry) for entry in entries]:
+                recording_file.write(
+                    json.dumps(record, default=str, separators=(",", ":"))
+                )
+                recording_file.write("\n")
+        logging.info(
+            "Recorded %d perforce commands to %s, %d user names scrubbed",
+            len(entries),
+            self.path,
+            len(scrubber.pseudonyms),
+        )
+        return self.path
+
+
+class RecordingConnection(p4_connection_utility.ConnectionWrapper):
+    """Connection recording every command it runs, see `Recorder`."""
+
+    def __init__(self, connection, recorder: Recorder):
+        """Construct an instance of RecordingConnection.
+
+        Args:
+            connection (P4.P4): the connection to wrap.
+            recorder (Recorder): where to add the recorded commands.
+        """
+        super().__init__(connection)
+        self._recorder = recorder
+        self._input = None
+
+    def __setattr__(self, name, value):
+        """Remember the command input, to record it.
+
+        Args:
+            name (str): the attribute name.
+            value (Any): the value to set.
+        """
+        if name == "input":
+            object.__setattr__(self, "_input", value)
+        super().__setattr__(name, value)
+
+    def run(self, *args):
+        """Run a command, recording it.
+
+        Args:
+            *args (str): the command and its arguments.
+
+        Returns:
+            list: the command results.
+        """
+        command_input, self._input = self._input, None
+        entry = {"args": [str(arg) for arg in args], "input": command_input}
+        start = time.perf_counter()
+        try:
+            result = self._connection.run(*args)
+        except p4_connection_utility.p4_exception_types() as error:
+            entry.update(
+                raised=str(getattr(error, "value", error)),
+                errors=list(getattr(error, "errors", None) or []),
+                warnings=list(getattr(error, "warnings", None) or []),
+            )
+            raise
+        else:
+            entry.update(
+                results=result,
+                errors=list(getattr(self._connection, "errors", None) or []),
+                warnings=list(getattr(self._connection, "warnings", None) or []),
+            )
+            return result
+        finally:
+            entry["duration"] = round(time.perf_counter() - start, 6)
+            self._recorder.add(entry, getattr(self._connection, "user", None))
+
+    def run_iter(self, *args):
+        """Run a command with `run()`, to record its whole result.
+
+        Args:
+            *args (str): the command and its arguments.
+
+        Returns:
+            Iterator: the command results.
+        """
+        return iter(self.run(*args))
+
+    def disconnect(self):
+        """Disconnect, saving the recording made so far."""
+        try:
+            self._connection.disconnect()
+        finally:
+            self._recorder.save()
+
+
+class Recording:
+    """Recorded commands, consumed in order by the replay connections."""
+
+    def __init__(self, header, entries):
+        """Construct an instance of Recording.
+
+        Args:
+            header (dict): the recording header.
+            entries (list[dict]): the recorded commands, in the order they ran.
+        """
+        self.header = header
+        self.entries = entries
+        self._used = [False] * len(entries)
+        self._by_args = collections.defaultdict(collections.deque)
+        self._by_shape = collections.defaultdict(collections.deque)
+        self._lock = threading.Lock()
+        for index, entry in enumerate(entries):
+            args = tuple(entry["args"])
+            self._by_args[args].append(index)
+            self._by_shape[_shape(args)].append(index)
+
+    @classmethod
+    def load(cls, path: str):
+        """Read a recording file.
+
+        Args:
+            path (str): the file written by `Recorder.save()`.
+
+        Returns:
+            Recording: the recording.
+
+        Raises:
+            ValueError: if the file is not a recording.
+        """
+        with gzip.open(path, "rt", encoding="utf-8") as recording_file:
+            records = [json.loads(line) for line in recording_file if line.strip()]
+        if not records or records[0].get("format") != RECORDING_FORMAT:
+            raise ValueError(f"{path} is not a show setup recording")
+        return cls(records[0], records[1:])
+
+    def take(self, args):
+        """Get the recording to replay for a command, and mark it used.
+
+        Args:
+            args (tuple[str]): the command and its arguments.
+
+        Returns:
+            dict: the recorded command, or None if there is none left.
+        """
+        with self._lock:
+            for candidates in (
+                self._by_args.get(args),
+                self._by_shape.get(_shape(args)),
+            ):
+                while candidates:
+                    index = candidates.popleft()
+                    if not self._used[index]:
+                        self._used[index] = True
+                        return self.entries[index]
+        return None
+
+    @property
+    def remaining(self):
+        """int: the number of recorded commands not replayed yet."""
+        with self._lock:
+            return self._used.count(False)
+
+
+def _shape(args):
+    """Get the command and number of arguments of a command.
+
+    Args:
+        args (tuple[str]): the command and its arguments.
+
+    Returns:
+        tuple: the command name and the number of arguments.
+    """
+    return (args[0] if args else "", len(args))
+
+
+class ReplayConnection:
+    """Connection serving recorded results instead of talking to a server.
+
+    A drop-in replacement for the parts of `P4.P4` the show setup uses.
+    """
+
+    def __init__(
+        self,
+        recording: Recording,
+        latency_scale: float = None,
+        port: str = None,
+        user: str = None,
+        sleep=time.sleep,
+    ):
+        """Construct an instance of ReplayConnection.
+
+        Args:
+            recording (Recording): the recording to serve.
+            latency_scale (float, optional): multiplier of the recorded durations
+                to wait for before each result, 1 for the recorded latencies.
+                No waiting if None.
+            port (str, optional): the P4PORT, only reported.
+            user (str, optional): the P4USER. Defaults to the recorded user.
+            sleep (callable, optional): function waiting for a number of seconds.
+        """
+        self.recording = recording
+        self.latency_scale = latency_scale
+        self.port = port or "replay"
+        self.user = user or recording.header.get("user")
+        self.client = None
+        self.password = None
+        self.exception_level = 2
+        self.maxlocktime = 0
+        self.input = None
+        self.errors = []
+        self.warnings = []
+        self.messages = []
+        # Batched reads replay only if they were recorded, see p4_batch_utility.
+        self.supports_argument_files = any(
+            entry["args"][:1] == ["-x"] for entry in recording.entries
+        )
+        self._sleep = sleep
+        self._connected = False
+
+    def connect(self):
+        """Open the replay; nothing is contacted."""
+        self._connected = True
+
+    def connected(self):
+        """Check whether `connect()` was called and `disconnect()` was not.
+
+        Returns:
+            bool: whether the connection is open.
+        """
+        return self._connected
+
+    def disconnect(self):
+        """Close the replay."""
+        self._connected = False
+
+    def abort(self):
+        """Do nothing; replayed commands cannot be aborted."""
+
+    def setbreak(self, callback):
+        """Ignore the break callback; replayed commands are not aborted.
+
+        Args:
+            callback (callable): the callback.
+        """
+
+    def set_tunable(self, name, value):
+        """Ignore a client tunable.
+
+        Args:
+            name (str): the tunable name.
+            value (str): the value.
+        """
+
+    def run(self, *args):
+        """Replay a command.
+
+        Args:
+            *args (str): the command and its arguments.
+
+        Returns:
+            list: the recorded results.
+
+        Raises:
+            P4CommandError: if the command failed when recorded, or was not
+                recorded.
+        """
+        args = tuple(str(arg) for arg in args)
+        self.input = None
+        if not self._connected:
+            raise p4_connection_utility.P4CommandError(
+                "Not connected to the Perforce server"
+            )
+        entry = self.recording.take(args)
+        if entry is None:
+            self.errors, self.warnings = [f"No recording of: p4 {' '.join(args)}"], []
+            raise p4_connection_utility.P4CommandError(
+                f"No recording of: p4 {' '.join(args)}", errors=self.errors
+            )
+        if self.latency_scale:
+            self._sleep(entry.get("duration", 0) * self.latency_scale)
+        self.errors = list(entry.get("errors") or [])
+        self.warnings = list(entry.get("warnings") or [])
+        if "raised" in entry:
+            raise p4_connection_utility.P4CommandError(
+                entry["raised"], errors=self.errors, warnings=self.warnings
+            )
+        return entry.get("results") or []
+
+
+def configure_recording(path: str):
+    """Record every connection created from now on, see `record()`.
+
+    The recording is written when a connection disconnects and when the
+    process exits.
+
+    Args:
+        path (str): the file to write the recording to.
+
+    Returns:
+        Recorder: the recorder.
+    """
+    global _RECORDER  # pylint: disable=global-statement
+    _RECORDER = Recorder(path)
+    atexit.register(_RECORDER.save)
+    return _RECORDER
+
+
+def record(connection):
+    """Wrap a new connection to record it, if recording is configured.
+
+    Args:
+        connection (P4.P4): the connection.
+
+    Returns:
+        P4.P4: the connection, wrapped in a `RecordingConnection` if recording.
+    """
+    if _RECORDER is None:
+        return connection
+    return RecordingConnection(connection, _RECORDER)
+
+
+def configure_replay(path: str, latency_scale: float = None):
+    """Replay a recording on every replay connection created from now on.
+
+    Args:
+        path (str): the recording file.
+        latency_scale (float, optional): see `ReplayConnection`.
+
+    Returns:
+        Recording: the loaded recording.
+    """
+    global _REPLAY  # pylint: disable=global-statement
+    recording = Recording.load(path)
+    _REPLAY = (recording, latency_scale)
+    logging.info("Replaying %d perforce commands from %s", len(recording.entries), path)
+    return recording
+
+
+def create_replay_connection(port: str = None, user: str = None):
+    """Create a connection replaying the configured recording.
+
+    Without `configure_replay()`, the recording and latency scale are read from
+    the `P4_SHOW_SETUP_REPLAY_FILE` and `P4_SHOW_SETUP_REPLAY_LATENCY`
+    environment variables.
+
+    Args:
+        port (str, optional): the P4PORT, only reported.
+        user (str, optional): the P4USER.
+
+    Returns:
+        ReplayConnection: the connection.
+
+    Raises:
+        ValueError: if no recording is configured.
+    """
+    with _LOCK:
+        if _REPLAY is None:
+            path = os.environ.get(REPLAY_FILE_ENVIRONMENT_VARIABLE)
+            if not path:
+                raise ValueError(
+                    f"No recording to replay, set {REPLAY_FILE_ENVIRONMENT_VARIABLE}"
+                )
+            latency = os.environ.get(REPLAY_LATENCY_ENVIRONMENT_VARIABLE)
+            configure_replay(path, float(latency) if latency else None)
+        recording, latency_scale = _REPLAY
+    return ReplayConnection(recording, latency_scale, port=port, user=user)
@@ -0,0 +1,412 @@
+# Copyright (C) 2023 DNEG - All Rights reserved.
+"""
+P4 Retry Utility.
+
+This utility's responsibility is to retry Perforce commands that failed for
+transient reasons, such as a dropped connection or a busy server, instead of
+letting them abort the whole run.
+
+Commands are retried according to what they do:
+- Reads are retried on any connection or transient error.
+- Idempotent writes (full spec writes with `-i`, deletes and obliterates) are
+  retried after reconnecting, since replaying them cannot change the outcome.
+  A delete that finds nothing left to delete on a retry succeeded the first time,
+  and a create that reports an update on a retry may have too, so callers tell
+  created specs apart by whether they existed before the write.
+- Other writes are only retried when they can be verified: `populate` is retried
+  only if its target is still empty, anything else only if the server was never
+  reached.
+"""
+import collections
+import logging
+import random
+import time
+
+from shared import metrics_utility
+from shared import p4_connection_utility
+
+CONNECTION_ERROR = "connection"
+TRANSIENT_ERROR = "transient"
+PERMANENT_ERROR = "permanent"
+
+READ = "read"
+IDEMPOTENT_WRITE = "idempotent write"
+IDEMPOTENT_DELETE = "idempotent delete"
+WRITE = "write"
+
+# Generic error code P4API uses for network errors (E_COMM).
+P4_GENERIC_COMMUNICATION_ERROR = 38
+
+CONNECTION_ERROR_PATTERNS = (
+    "tcp receive failed",
+    "tcp send failed",
+    "connect to server failed",
+    "connection refused",
+    "connection reset",
+    "connection closed",
+    "partner exited unexpectedly",
+    "rpctransport",
+    "wsaeconnreset",
+    "wsaeconnrefused",
+    "broken pipe",
+)
+TRANSIENT_ERROR_PATTERNS = (
+    "server is busy",
+    "too many connections",
+    "timed out",
+    "operation took too long",
+    "try again",
+    "temporarily unavailable",
+    "lock wait",
+    "database is locked",
+)
+# Errors meaning the command never reached the server.
+NOT_EXECUTED_PATTERNS = (
+    "connect to server failed",
+    "connection refused",
+    "wsaeconnrefused",
+    "check $p4port",
+)
+ALREADY_DELETED_PATTERNS = (
+    "doesn't exist",
+    "does not exist",
+    "no such file",
+)
+
+READ_COMMANDS = {
+    "changes",
+    "clients",
+    "counters",
+    "depots",
+    "describe",
+    "dirs",
+    "files",
+    "filelog",
+    "fstat",
+    "groups",
+    "have",
+    "info",
+    "opened",
+    "protects",
+    "sizes",
+    "streams",
+    "users",
+    "where",
+}
+SPEC_COMMANDS = {
+    "branch",
+    "client",
+    "depot",
+    "group",
+    "label",
+    "protect",
+    "stream",
+    "triggers",
+    "typemap",
+    "user",
+}
+
+
+def classify_error(error, messages=None):
+    """Classify why a command failed.
+
+    Args:
+        error (Exception): the exception raised by the command.
+        messages (list, optional): the connection's `P4.Message` objects for the
+            command, used for their generic error code when available.
+
+    Returns:
+        str: CONNECTION_ERROR, TRANSIENT_ERROR or PERMANENT_ERROR.
+    """
+    for message in messages or []:
+        if getattr(message, "generic", None) == P4_GENERIC_COMMUNICATION_ERROR:
+            return CONNECTION_ERROR
+
+    text = error_text(error)
+    if any(pattern in text for pattern in CONNECTION_ERROR_PATTERNS):
+        return CONNECTION_ERROR
+    if any(pattern in text for pattern in TRANSIENT_ERROR_PATTERNS):
+        return TRANSIENT_ERROR
+    return PERMANENT_ERROR
+
+
+def classify_command(args):
+    """Classify what a command does to the server.
+
+    Args:
+        args (tuple): the command and its arguments.
+
+    Returns:
+        str: READ, IDEMPOTENT_WRITE, IDEMPOTENT_DELETE or WRITE.
+    """
+    # An argument file (`-x file`) runs the command once per line.
+    while len(args) > 2 and args[0] == "-x":
+        args = args[2:]
+    command = args[0] if args else ""
+    flags = set(args[1:])
+    if command in READ_COMMANDS:
+        return READ
+    if command in SPEC_COMMANDS:
+        if "-o" in flags:
+            return READ
+        if "-d" in flags or "--obliterate" in flags:
+            return IDEMPOTENT_DELETE
+        if "-i" in flags:
+            return IDEMPOTENT_WRITE
+    if command == "obliterate":
+        return IDEMPOTENT_DELETE
+    return WRITE
+
+
+def error_text(error):
+    """Get all the text of an error, in lower case.
+
+    Args:
+        error (Exception): the exception raised by a command.
+
+    Returns:
+        str: the exception message, errors and warnings.
+    """
+    parts = [str(error)]
+    parts.extend(str(item) for item in getattr(error, "errors", None) or [])
+    parts.extend(str(item) for item in getattr(error, "warnings", None) or [])
+    return "\n".join(parts).lower()
+
+
+class RetryPolicy:
+    """How many times to retry, and how long to wait between attempts."""
+
+    def __init__(
+        self,
+        max_attempts: int = 4,
+        base_delay: float = 0.5,
+        max_delay: float = 10.0,
+        rng: random.Random = None,
+    ):
+        """Construct an instance of RetryPolicy.
+
+        Args:
+            max_attempts (int, optional): attempts per command, including the first.
+            base_delay (float, optional): the delay cap, in seconds, before the
+                first retry. It doubles for every retry after that.
+            max_delay (float, optional): the largest delay cap, in seconds.
+            rng (random.Random, optional): the random generator used for jitter.
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rng = rng or random.Random()
+
+    def backoff(self, attempt: int):
+        """Get how long to wait before a retry.
+
+        Uses exponential backoff with full jitter, so that concurrent clients
+        retrying after the same outage do not all come back at once.
+
+        Args:
+            attempt (int): the number of attempts made so far.
+
+        Returns:
+            float: the delay in seconds.
+        """
+        cap = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return self.rng.uniform(0, cap)
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+
+
+class RetryingConnection(p4_connection_utility.ConnectionWrapper):
+    """Connection that retries commands which failed for transient reasons."""
+
+    def __init__(self, connection, policy: RetryPolicy = None, sleep=time.sleep):
+        """Construct an instance of RetryingConnection.
+
+        Args:
+            connection (P4.P4): the connection to wrap.
+            policy (RetryPolicy, optional): the retry policy to follow.
+            sleep (callable, optional): function used to wait between attempts.
+        """
+        super().__init__(connection)
+        self._policy = policy or DEFAULT_RETRY_POLICY
+        self._sleep = sleep
+        self._input = None
+        self._retry_counts = collections.Counter()
+
+    @property
+    def retry_count(self):
+        """int: the total number of retries made on this connection."""
+        return sum(self._retry_counts.values())
+
+    @property
+    def retry_counts(self):
+        """dict: the number of retries made on this connection, by error class."""
+        return dict(self._retry_counts)
+
+    def __setattr__(self, name, value):
+        """Remember the command input so that it can be replayed on a retry.
+
+        Args:
+            name (str): the attribute name.
+            value (Any): the value to set.
+        """
+        if name == "input":
+            object.__setattr__(self, "_input", value)
+        super().__setattr__(name, value)
+
+    def run(self, *args):
+        """Run a command, retrying it when the retry policy allows.
+
+        Args:
+            *args (str): the command and its arguments.
+
+        Returns:
+            list: the command results.
+        """
+        command_class = classify_command(args)
+        command_input = self._input
+        self._input = None
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return self._connection.run(*args)
+            except p4_connection_utility.p4_exception_types() as error:
+                result = self._recover(
+                    args, command_class, command_input, attempt, error
+                )
+                if result is not None:
+                    return result
+
+    def run_iter(self, *args):
+        """Run a command, yielding its results as they arrive, and retrying it like `run()`.
+
+        A command is only retried if it failed before yielding any result.
+
+        Args:
+            *args (str): the command and its arguments.
+
+        Yields:
+            dict | str: the command results.
+        """
+        command_class = classify_command(args)
+        command_input = self._input
+        self._input = None
+        attempt = 0
+        while True:
+            attempt += 1
+            yielded = False
+            try:
+                for record in p4_connection_utility.run_iter(self._connection, *args):
+                    yielded = True
+                    yield record
+                return
+            except p4_connection_utility.p4_exception_types() as error:
+                if yielded:
+                    raise
+                result = self._recover(
+                    args, command_class, command_input, attempt, error
+                )
+                if result is not None:
+                    yield from result
+                    return
+
+    def _recover(self, args, command_class, command_input, attempt, error):
+        """Handle a failed attempt at a command, waiting before the next one.
+
+        Args:
+            args (tuple): the command and its arguments.
+            command_class (str): the command's class, see `classify_command()`.
+            command_input (Any): the command's input, replayed on the next attempt.
+            attempt (int): the number of the attempt that failed.
+            error (Exception): the exception the attempt raised.
+
+        Returns:
+            list: the command results if the failed attempt was applied anyway,
+                or None to make the next attempt.
+
+        Raises:
+            Exception: the error, if the command may not be retried.
+        """
+        if attempt > 1 and command_class == IDEMPOTENT_DELETE:
+            if any(
+                pattern in error_text(error) for pattern in ALREADY_DELETED_PATTERNS
+            ):
+                logging.info("Retried %s found nothing left to delete", " ".join(args))
+                return []
+        error_class = classify_error(error, getattr(self._connection, "messages", None))
+        if error_class == PERMANENT_ERROR or attempt >= self._policy.max_attempts:
+            raise error
+        if not self._may_retry(args, command_class, error):
+            raise error
+
+        delay = self._policy.backoff(attempt)
+        logging.warning(
+            "Retrying '%s' after %s error (attempt %d of %d) in %.2fs: %s",
+            " ".join(args),
+            error_class,
+            attempt,
+            self._policy.max_attempts,
+            delay,
+            error,
+        )
+        self._retry_counts[error_class] += 1
+        metrics_utility.inc("retries_total", error_class=error_class)
+        self._sleep(delay)
+        if error_class == CONNECTION_ERROR:
+            self._reconnect()
+        if command_class == WRITE and self._write_landed(args):
+            logging.info("'%s' was applied before the error", " ".join(args))
+            return []
+        if command_input is not None:
+            self._connection.input = command_input
+        return None
+
+    def _may_retry(self, args, command_class, error):
+        """Check whether a failed command may be retried.
+
+        Args:
+            args (tuple): the command and its arguments.
+            command_class (str): the command's class, see `classify_command()`.
+            error (Exception): the exception the command raised.
+
+        Returns:
+            bool: whether retrying cannot apply the command twice.
+        """
+        if command_class in (READ, IDEMPOTENT_WRITE, IDEMPOTENT_DELETE):
+            return True
+        if any(pattern in error_text(error) for pattern in NOT_EXECUTED_PATTERNS):
+            return True
+        # populate can be verified afterwards by looking at its target.
+        return args[0] == "populate"
+
+    def _write_landed(self, args):
+        """Check whether a write that raised an error was applied anyway.
+
+        Args:
+            args (tuple): the command and its arguments.
+
+        Returns:
+            bool: True if the write is known to have been applied.
+        """
+        if args[0] != "populate":
+            return False
+        target = args[-1]
+        try:
+            return len(self._connection.run("files", "-m", "1", target)) > 0
+        except p4_connection_utility.p4_exception_types():
+            return False
+
+    def _reconnect(self):
+        """Re-establish a dropped connection."""
+        logging.info("Reconnecting to perforce %s", self._connection.port)
+        try:
+            if self._connection.connected():
+                self._connection.disconnect()
+        except p4_connection_utility.p4_exception_types() as error:
+            logging.debug("Error while disconnecting: %s", error)
+        try:
+            self._connection.connect()
+        except p4_connection_utility.p4_exception_types() as error:
+            # The next attempt fails and is counted against the retry policy.
+            logging.warning("Unable to reconnect to perforce: %s", error)
@@ -0,0 +1,565 @@
+# Copyright (C) 2023 DNEG - All Rights reserved.
+"""
+P4 Simulator Utility.
+
+This utility's responsibility is to stand in for a Perforce commit server, with
+enough of its locking behaviour to measure how concurrent show setups contend.
+
+`SimulatedServer` keeps depots, groups, streams, stream file counts and the
+protections table in memory, and serves the commands `P4ShowSetup` runs and
+rolls back with. Every
+command pays a round trip, and takes the server's table locks the way the
+commit server does:
+- every command reads the protections table to check access, and
+  `protect -i` locks it exclusively while the whole table is rewritten, so it
+  waits for every running command and stalls every new one;
+- `populate` and `obliterate` lock the revision tables exclusively, for a time
+  proportional to the number of files they touch;
+- spec writes (`depot`, `group`, `stream -i` and `-d`) briefly lock the spec
+  tables, which spec reads share.
+
+`SimulatedConnection` is a drop-in replacement for the parts of `P4.P4` the
+show setup uses, and adds up the time its commands waited for locks.
+"""
+import collections
+import contextlib
+import copy
+import re
+import threading
+import time
+
+from shared import p4_connection_utility
+
+PROTECTIONS_TABLE = "protections"
+REVISION_TABLES = "revisions"
+SPEC_TABLES = "specs"
+
+START_MARKER = "## START OF DEPOT SPECIFIC PERMISSIONS"
+END_MARKER = "## END OF DEPOT SPECIFIC PERMISSIONS"
+DEFAULT_PROTECTIONS = [
+    "super user p4admin * //...",
+    "write group everyone * //DNEG_Sandbox/...",
+    START_MARKER,
+    END_MARKER,
+]
+
+SimulatorTimings = collections.namedtuple(
+    "SimulatorTimings",
+    [
+        "round_trip_seconds",
+        "protect_write_seconds",
+        "protect_line_seconds",
+        "spec_write_seconds",
+        "populate_file_seconds",
+        "source_files",
+    ],
+)
+SimulatorTimings.__doc__ = """How long the simulated server takes.
+
+Attributes:
+    round_trip_seconds (float): network and dispatch time of every command.
+    protect_write_seconds (float): time `protect -i` holds the protections lock.
+    protect_line_seconds (float): extra lock time per protections table line.
+    spec_write_seconds (float): time a spec write holds the spec tables lock.
+    populate_file_seconds (float): revision tables lock time per populated file.
+    source_files (int): files in branch sources outside the simulated depots,
+        such as the UE5 template.
+"""
+DEFAULT_TIMINGS = SimulatorTimings(
+    round_trip_seconds=0.002,
+    protect_write_seconds=0.05,
+    protect_line_seconds=0.0001,
+    spec_write_seconds=0.005,
+    populate_file_seconds=0.00002,
+    source_files=5000,
+)
+
+_STREAM_PATH = re.compile(r"^(//[^/]+/[^/]+)(?:/\.\.\.)?$")
+
+
+class _ReadWriteLock:
+    """Lock shared by readers, exclusive for writers, preferring writers.
+
+    Waiting writers block new readers, as the commit server's table locks do, so
+    a queued `protect -i` stalls the commands arriving after it.
+    """
+
+    def __init__(self):
+        """Construct an instance of _ReadWriteLock."""
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @contextlib.contextmanager
+    def read(self):
+        """Hold the lock shared.
+
+        Yields:
+            float: the seconds spent waiting for the lock.
+        """
+        start = time.perf_counter()
+        with self._condition:
+            while self._writer or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield time.perf_counter() - start
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def write(self):
+        """Hold the lock exclusively.
+
+        Yields:
+            float: the seconds spent waiting for the lock.
+        """
+        start = time.perf_counter()
+        with self._condition:
+            self._waiting_writers += 1
+            try:
+                while self._writer or self._readers:
+                    self._condition.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield time.perf_counter() - start
+        finally:
+            with self._condition:
+                self._writer = False
+                self._condition.notify_all()
+
+
+class SimulatedServer:
+    """In-memory Perforce server with table locks, shared by simulated connections."""
+
+    def __init__(
+        self,
+        timings: SimulatorTimings = DEFAULT_TIMINGS,
+        protections=None,
+        groups=None,
+        sleep=time.sleep,
+    ):
+        """Construct an instance of SimulatedServer.
+
+        Args:
+            timings (SimulatorTimings, optional): how long commands take.
+            protections (list[str], optional): the initial protections table.
+                Defaults to `DEFAULT_PROTECTIONS`.
+            groups (dict, optional): the initial group specs, by name.
+            sleep (callable, optional): function waiting for a number of seconds.
+        """
+        self.timings = timings
+        self.protections = list(protections or DEFAULT_PROTECTIONS)
+        self.groups = copy.deepcopy(groups or {})
+        self.depots = {}
+        self.streams = {}
+        self.stream_files = {}
+        self.command_counts = collections.Counter()
+        self._sleep = sleep
+        self._state_lock = threading.Lock()
+        self._locks = {
+            PROTECTIONS_TABLE: _ReadWriteLock(),
+            REVISION_TABLES: _ReadWriteLock(),
+            SPEC_TABLES: _ReadWriteLock(),
+        }
+
+    def run(self, args, command_input, user):
+        """Run a command.
+
+        Args:
+            args (tuple[str]): the command and its arguments.
+            command_input (Any): the spec or specs given as input, if any.
+            user (str): the user running the command.
+
+        Returns:
+            tuple: the results and the seconds spent waiting for locks.
+
+        Raises:
+            P4CommandError: if the command fails.
+        """
+        args = _split_arguments(args)
+        command = args[0] if args else ""
+        with self._state_lock:
+            self.command_counts[command] += 1
+        self._sleep(self.timings.round_trip_seconds)
+
+        lock_wait = 0.0
+        with contextlib.ExitStack() as stack:
+            if command == "protect" and "-i" in args:
+                lock_wait += stack.enter_context(self._locks[PROTECTIONS_TABLE].write())
+            else:
+                lock_wait += stack.enter_context(self._locks[PROTECTIONS_TABLE].read())
+            handler = getattr(self, f"_run_{command}", None)
+            if handler is None:
+                raise p4_connection_utility.P4CommandError(
+                    f"Unknown command: {command}",
+                    errors=["Unknown command.  Try 'p4 help'."],
+                )
+            results, held_wait = handler(args[1:], command_input, user, stack)
+        return results, lock_wait + held_wait
+
+    def _hold(self, stack, table, exclusive, seconds):
+        """Take a table lock for the rest of the command, and do the work under it.
+
+        Args:
+            stack (contextlib.ExitStack): the command's locks.
+            table (str): the table to lock.
+            exclusive (bool): whether to lock it exclusively.
+            seconds (float): how long the work under the lock takes.
+
+        Returns:
+            float: the seconds spent waiting for the lock.
+        """
+        lock = self._locks[table]
+        wait = stack.enter_context(lock.write() if exclusive else lock.read())
+        if seconds:
+            self._sleep(seconds)
+        return wait
+
+    @staticmethod
+    def _error(message):
+        """Build the error a failed command raises.
+
+        Args:
+            message (str): the server's error message.
+
+        Returns:
+            P4CommandError: the error.
+        """
+        return p4_connection_utility.P4CommandError(
+            "[P4.run()] Errors during command execution", errors=[message]
+        )
+
+    def _run_info(self, args, command_input, user, stack):
+        """Run `info`."""
+        return [{"userName": user, "serverAddress": "simulated:1666"}], 0.0
+
+    def _run_depots(self, args, command_input, user, stack):
+        """Run `depots [-E name]`."""
+        wait = self._hold(stack, SPEC_TABLES, False, 0)
+        with self._state_lock:
+            names = sorted(self.depots)
+        if "-E" in args:
+            names = [name for name in names if name == args[args.index("-E") + 1]]
+        return [
+            {"name": name, "type": self.depots[name]["Type"]} for name in names
+        ], wait
+
+    def _run_depot(self, args, command_input, user, stack):
+        """Run `depot -o name`, `depot -i` or `depot -d name`."""
+        if "-o" in args:
+            wait = self._hold(stack, SPEC_TABLES, False, 0)
+            name = args[-1]
+            with self._state_lock:
+                depot = self.depots.get(
+                    name, {"Depot": name, "Type": "local", "Owner": user}
+                )
+            return [dict(depot)], wait
+        wait = self._hold(stack, SPEC_TABLES, True, self.timings.spec_write_seconds)
+        if "-d" in args:
+            name = args[-1]
+            with self._state_lock:
+                if name not in self.depots:
+                    raise self._error(f"Depot '{name}' doesn't exist.")
+                if any(stream.startswith(f"//{name}/") for stream in self.streams):
+                    raise self._error(f"Depot {name} isn't empty of streams.")
+                del self.depots[name]
+            return [f"Depot {name} deleted."], wait
+        depot = dict(_first(command_input))
+        with self._state_lock:
+            verb = "saved" if depot["Depot"] in self.depots else "created"
+            self.depots[depot["Depot"]] = depot
+        return [f"Depot {depot['Depot']} {verb}."], wait
+
+    def _run_protect(self, args, command_input, user, stack):
+        """Run `protect -o` or `protect -i`, the latter under the exclusive lock."""
+        if "-i" in args:
+            protections = list(_first(command_input)["Protections"])
+            self._sleep(
+                self.timings.protect_write_seconds
+                + self.timings.protect_line_seconds * len(protections)
+            )
+            with self._state_lock:
+                self.protections = protections
+            return ["Protections saved."], 0.0
+        with self._state_lock:
+            return [{"Protections": list(self.protections)}], 0.0
+
+    def _run_groups(self, args, command_input, user, stack):
+        """Run `groups`, one tagged record per group member, as the server does."""
+        wait = self._hold(stack, SPEC_TABLES, False, 0)
+        records = []
+        with self._state_lock:
+            for name, group in sorted(self.groups.items()):
+                owners, users = group.get("Owners", []), group.get("Users", [])
+                members = list(owners) + [
+                    member for member in users if member not in owners
+                ]
+                if not members:
+                    records.append({"group": name})
+                for member in members:
+                    records.append(
+                        {
+                            "group": name,
+                            "user": member,
+                            "isOwner": "1" if member in owners else "0",
+                            "isUser": "1" if member in users else "0",
+                            "isSubGroup": "0",
+                        }
+                    )
+        return records, wait
+
+    def _run_group(self, args, command_input, user, stack):
+        """Run `group -o name`, `group -i` or `group -d name`."""
+        if "-o" in args:
+            wait = self._hold(stack, SPEC_TABLES, False, 0)
+            name = args[-1]
+            with self._state_lock:
+                group = self.groups.get(name, {"Group": name, "Description": ""})
+            return [copy.deepcopy(group)], wait
+        wait = self._hold(stack, SPEC_TABLES, True, self.timings.spec_write_seconds)
+        if "-d" in args:
+            name = args[-1]
+            with self._state_lock:
+                if self.groups.pop(name, None) is None:
+                    raise self._error(f"Group '{name}' doesn't exist.")
+            return [f"Group {name} deleted."], wait
+        group = copy.deepcopy(_first(command_input))
+        with self._state_lock:
+            verb = "updated" if group["Group"] in self.groups else "created"
+            self.groups[group["Group"]] = group
+        return [f"Group {group['Group']} {verb}"], wait
+
+    def _run_streams(self, args, command_input, user, stack):
+        """Run `streams [//depot/... ...]`."""
+        wait = self._hold(stack, SPEC_TABLES, False, 0)
+        prefixes = tuple(path.rstrip(".") for path in args) or ("//",)
+        with self._state_lock:
+            return [
+                dict(spec)
+                for name, spec in sorted(self.streams.items())
+                if name.startswith(prefixes)
+            ], wait
+
+    def _run_stream(self, args, command_input, user, stack):
+        """Run `stream -o name`, `stream -i`, `stream -d name` or `stream --obliterate`."""
+        name = args[-1]
+        if "-o" in args:
+            wait = self._hold(stack, SPEC_TABLES, False, 0)
+            with self._state_lock:
+                stream = self.streams.get(
+                    name,
+                    {
+                        "Stream": name,
+                        "Owner": user,
+                        "Parent": "none",
+                        "Type": "development",
+                    },
+                )
+            return [dict(stream)], wait
+        if "--obliterate" in args:
+            with self._state_lock:
+                files = self.stream_files.pop(name, 0)
+            wait = self._hold(
+                stack, REVISION_TABLES, True, self.timings.populate_file_seconds * files
+            )
+            return [f"Stream {name} obliterated."], wait
+        wait = self._hold(stack, SPEC_TABLES, True, self.timings.spec_write_seconds)
+        if "-d" in args:
+            with self._state_lock:
+                if name not in self.streams:
+                    raise self._error(f"Stream '{name}' doesn't exist.")
+                if any(spec.get("Parent") == name for spec in self.streams.values()):
+                    raise self._error(f"Stream '{name}' has child streams.")
+                del self.streams[name]
+            return [f"Stream {name} deleted."], wait
+        stream = dict(_first(command_input))
+        name = stream["Stream"]
+        with self._state_lock:
+            if name.split("/")[2] not in self.depots:
+                raise self._error(f"No such depot '{name.split('/')[2]}'.")
+            verb = "updated" if name in self.streams else "saved"
+            stream["Update"] = time.strftime("%Y/%m/%d %H:%M:%S")
+            stream.setdefault("Access", stream["Update"])
+            self.streams[name] = stream
+        return [f"Stream {name} {verb}."], wait
+
+    def _run_populate(self, args, command_input, user, stack):
+        """Run `populate source/... target/...`, locking the revision tables."""
+        source, target = _stream_of(args[-2]), _stream_of(args[-1])
+        with self._state_lock:
+            if target not in self.streams:
+                raise self._error(f"{args[-1]} - no such file(s).")
+            if source.split("/")[2] in self.depots:
+                files = self.stream_files.get(source, 0)
+            else:
+                files = self.timings.source_files
+        if not files:
+            raise self._error(f"{args[-2]} - no such file(s).")
+        wait = self._hold(
+            stack, REVISION_TABLES, True, self.timings.populate_file_seconds * files
+        )
+        with self._state_lock:
+            self.stream_files[target] = files
+        return [{"change": "1", "fileCount": str(files)}], wait
+
+    def _run_files(self, args, command_input, user, stack):
+        """Run `files [-m max] //depot/...`, one record per populated stream."""
+        wait = self._hold(stack, REVISION_TABLES, False, 0)
+        prefix = args[-1].rstrip(".")
+        with self._state_lock:
+            streams = sorted(
+                name
+                for name, files in self.stream_files.items()
+                if files and f"{name}/".startswith(prefix)
+            )
+        if "-m" in args:
+            streams = streams[: int(args[args.index("-m") + 1])]
+        if not streams:
+            raise self._error(f"{args[-1]} - no such file(s).")
+        return [{"depotFile": f"{name}/...", "action": "add"} for name in streams], wait
+
+    def _run_obliterate(self, args, command_input, user, stack):
+        """Run `obliterate -y //depot/...`, locking the revision tables."""
+        depot = args[-1].split("/")[2]
+        with self._state_lock:
+            streams = [
+                name for name in self.stream_files if name.split("/")[2] == depot
+            ]
+            files = sum(self.stream_files.pop(name) for name in streams)
+        wait = self._hold(
+            stack, REVISION_TABLES, True, self.timings.populate_file_seconds * files
+        )
+        return [{"depotFile": args[-1], "revisionsObliterated": str(files)}], wait
+
+
+def _split_arguments(args):
+    """Split arguments given with their value in one string, such as `-d name`.
+
+    Args:
+        args (tuple): the command and its arguments.
+
+    Returns:
+        list[str]: the arguments.
+    """
+    split = []
+    for arg in args:
+        arg = str(arg)
+        split.extend(arg.split(" ", 1) if arg.startswith("-") and " " in arg else [arg])
+    return split
+
+
+def _first(command_input):
+    """Get the spec given as input.
+
+    Args:
+        command_input (dict | list[dict]): the input.
+
+    Returns:
+        dict: the spec.
+    """
+    if isinstance(command_input, (list, tuple)):
+        return command_input[0]
+    return command_input
+
+
+def _stream_of(path):
+    """Get the stream a `//depot/stream/...` path is in.
+
+    Args:
+        path (str): the depot path.
+
+    Returns:
+        str: the stream, or the path if it is not in one.
+    """
+    match = _STREAM_PATH.match(path)
+    return match.group(1) if match else path
+
+
+class SimulatedConnection:
+    """Connection to a `SimulatedServer`, adding up its lock wait time."""
+
+    def __init__(self, server: SimulatedServer, user: str = "loadtest"):
+        """Construct an instance of SimulatedConnection.
+
+        Args:
+            server (SimulatedServer): the server to run the commands on.
+            user (str, optional): the P4USER.
+        """
+        self.server = server
+        self.port = "simulated:1666"
+        self.user = user
+        self.client = None
+        self.password = None
+        self.exception_level = 2
+        self.maxlocktime = 0
+        self.input = None
+        self.errors = []
+        self.warnings = []
+        self.messages = []
+        self.lock_wait = 0.0
+        self.round_trips = 0
+        self._connected = False
+
+    def connect(self):
+        """Open the connection."""
+        self._connected = True
+
+    def connected(self):
+        """Check whether `connect()` was called and `disconnect()` was not.
+
+        Returns:
+            bool: whether the connection is open.
+        """
+        return self._connected
+
+    def disconnect(self):
+        """Close the connection."""
+        self._connected = False
+
+    def abort(self):
+        """Do nothing; simulated commands are not aborted."""
+
+    def setbreak(self, callback):
+        """Ignore the break callback.
+
+        Args:
+            callback (callable): the callback.
+        """
+
+    def set_tunable(self, name, value):
+        """Ignore a client tunable.
+
+        Args:
+            name (str): the tunable name.
+            value (str): the value.
+        """
+
+    def run(self, *args):
+        """Run a command on the simulated server.
+
+        Args:
+            *args (str): the command and its arguments.
+
+        Returns:
+            list: the results.
+
+        Raises:
+            P4CommandError: if the command failed.
+        """
+        command_input, self.input = self.input, None
+        self.errors, self.warnings = [], []
+        self.round_trips += 1
+        try:
+            results, lock_wait = self.server.run(args, command_input, self.user)
+        except p4_connection_utility.P4CommandError as error:
+            self.errors = list(error.errors)
+            raise
+        self.lock_wait += lock_wait
+        return results
@@ -0,0 +1,312 @@
+# Copyright (C) 2023 DNEG - All Rights reserved.
+"""
+Profiling Utility.
+
+This utility's responsibility is to profile a run and attribute its CPU time
+and memory to the setup steps.
+
+- CPU profiling runs a separate cProfile profiler for each step, written as one
+  pstats file per step plus a combined one. A sampling thread also records the
+  call stack of the profiled thread, prefixed with the step, into a collapsed
+  stack file for flame graph tools. Time spent waiting on the server shows up
+  under the connection's `run` frames.
+- Memory profiling traces allocations with tracemalloc, and reports for each
+  step the memory it kept, its peak and the lines that allocated the most.
+
+Steps report themselves through `step_profile()`, which does nothing unless a
+profile is running.
+"""
+import cProfile
+import collections
+import contextlib
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+CPU = "cpu"
+MEMORY = "mem"
+PROFILE_KINDS = (CPU, MEMORY)
+SAMPLE_INTERVAL_SECONDS = 0.005
+TRACEMALLOC_FRAMES = 25
+TOP_ALLOCATIONS = 10
+# Time outside of any step.
+OUTSIDE_STEPS = "run"
+
+_ACTIVE_PROFILER = None
+
+
+class CpuProfiler:
+    """cProfile profiler per step, plus a sampling collapsed-stack profiler."""
+
+    def __init__(self, sample_interval: float = SAMPLE_INTERVAL_SECONDS):
+        """Construct an instance of CpuProfiler.
+
+        Args:
+            sample_interval (float, optional): seconds between stack samples.
+        """
+        self.sample_interval = sample_interval
+        self.profiles = collections.OrderedDict()
+        self.stacks = collections.Counter()
+        self._steps = []
+        self._thread_id = None
+        self._stopped = threading.Event()
+        self._sampler = None
+
+    def _profile(self, step_name):
+        """Get the profiler of a step, creating it on first use.
+
+        Args:
+            step_name (str): the step name.
+
+        Returns:
+            cProfile.Profile: the step's profiler.
+        """
+        if step_name not in self.profiles:
+            self.profiles[step_name] = cProfile.Profile()
+        return self.profiles[step_name]
+
+    def start(self):
+        """Start profiling the current thread."""
+        self._thread_id = threading.get_ident()
+        self._steps = [OUTSIDE_STEPS]
+        self._profile(OUTSIDE_STEPS).enable()
+        self._sampler = threading.Thread(
+            target=self._sample, name="CpuProfilerSampler", daemon=True
+        )
+        self._sampler.start()
+
+    def stop(self):
+        """Stop profiling."""
+        self._profile(self._steps[-1]).disable()
+        self._stopped.set()
+        self._sampler.join()
+
+    @contextlib.contextmanager
+    def step(self, step_name):
+        """Attribute the body to a step.
+
+        Steps run on other threads are not profiled.
+
+        Args:
+            step_name (str): the step name.
+
+        Yields:
+            str: the step name.
+        """
+        if threading.get_ident() != self._thread_id:
+            yield step_name
+            return
+        self._profile(self._steps[-1]).disable()
+        self._steps.append(step_name)
+        self._profile(step_name).enable()
+        try:
+            yield step_name
+        finally:
+            self._profile(step_name).disable()
+            self._steps.pop()
+            self._profile(self._steps[-1]).enable()
+
+    def _sample(self):
+        """Record the profiled thread's stack until profiling stops."""
+        while not self._stopped.wait(self.sample_interval):
+            frame = sys._current_frames().get(self._thread_id)  # pylint: disable=W0212
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(
+                    f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                )
+                frame = frame.f_back
+            names.append(f"step:{self._steps[-1]}")
+            self.stacks[";".join(reversed(names))] += 1
+
+    def write(self, output_dir, prefix):
+        """Write the pstats and collapsed stack files.
+
+        Args:
+            output_dir (str): the directory to write to.
+            prefix (str): the file name prefix.
+
+        Returns:
+            list[str]: the files written.
+        """
+        written = []
+        combined = None
+        for step_name, profile in self.profiles.items():
+            path = os.path.join(output_dir, f"{prefix}_cpu_{step_name}.pstats")
+            profile.dump_stats(path)
+            written.append(path)
+            try:
+                stats = pstats.Stats(profile)
+            except TypeError:
+                # Nothing was recorded for this step.
+                continue
+            logging.info(
+                "CPU time in step %s: %.3fs over %d calls",
+                step_name,
+                stats.total_tt,
+                stats.total_calls,
+            )
+            if combined is None:
+                combined = stats
+            else:
+                combined.add(stats)
+        if combined is not None:
+            path = os.path.join(output_dir, f"{prefix}_cpu.pstats")
+            combined.dump_stats(path)
+            written.append(path)
+
+        path = os.path.join(output_dir, f"{prefix}_cpu.collapsed")
+        with open(path, "w", encoding="utf-8") as collapsed_file:
+            for stack, count in sorted(self.stacks.items()):
+                collapsed_file.write(f"{stack} {count}\n")
+        written.append(path)
+        return written
+
+
+class MemoryProfiler:
+    """tracemalloc profiler reporting the memory each step kept and peaked at."""
+
+    def __init__(self, frames: int = TRACEMALLOC_FRAMES):
+        """Construct an instance of MemoryProfiler.
+
+        Args:
+            frames (int, optional): the traceback depth to record.
+        """
+        self.frames = frames
+        self.steps = []
+        self.final_snapshot = None
+        self._started_tracing = False
+
+    def start(self):
+        """Start tracing allocations."""
+        self._started_tracing = not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start(self.frames)
+
+    def stop(self):
+        """Stop tracing allocations, keeping a final snapshot."""
+        self.final_snapshot = tracemalloc.take_snapshot()
+        if self._started_tracing:
+            tracemalloc.stop()
+
+    @contextlib.contextmanager
+    def step(self, step_name):
+        """Measure the memory a step keeps and peaks at.
+
+        Args:
+            step_name (str): the step name.
+
+        Yields:
+            str: the step name.
+        """
+        before = tracemalloc.take_snapshot()
+        current_before, _ = tracemalloc.get_traced_memory()
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        try:
+            yield step_name
+        finally:
+            current_after, peak = tracemalloc.get_traced_memory()
+            after = tracemalloc.take_snapshot()
+            top = after.compare_to(before, "lineno")[:TOP_ALLOCATIONS]
+            self.steps.append(
+                {
+                    "step": step_name,
+                    "kept": current_after - current_before,
+                    "peak": peak - current_before,
+                    "top": [str(stat) for stat in top],
+                }
+            )
+
+    def write(self, output_dir, prefix):
+        """Write the per-step report and the collapsed stacks of live memory.
+
+        Args:
+            output_dir (str): the directory to write to.
+            prefix (str): the file name prefix.
+
+        Returns:
+            list[str]: the files written.
+        """
+        report_path = os.path.join(output_dir, f"{prefix}_mem.txt")
+        with open(report_path, "w", encoding="utf-8") as report_file:
+            for step in self.steps:
+                logging.info(
+                    "Memory in step %s: kept %d bytes, peak %d bytes",
+                    step["step"],
+                    step["kept"],
+                    step["peak"],
+                )
+                report_file.write(
+                    f"Step {step['step']}: kept {step['kept']} bytes, "
+                    f"peak {step['peak']} bytes\n"
+                )
+                for line in step["top"]:
+                    report_file.write(f"    {line}\n")
+
+        collapsed_path = os.path.join(output_dir, f"{prefix}_mem.collapsed")
+        with open(collapsed_path, "w", encoding="utf-8") as collapsed_file:
+            if self.final_snapshot is not None:
+                for stat in self.final_snapshot.statistics("traceback"):
+                    frames = [
+                        f"{os.path.basename(frame.filename)}:{frame.lineno}"
+                        for frame in reversed(stat.traceback)
+                    ]
+                    collapsed_file.write(f"{';'.join(frames)} {stat.size}\n")
+        return [report_path, collapsed_path]
+
+
+_PROFILERS = {CPU: CpuProfiler, MEMORY: MemoryProfiler}
+
+
+def step_profile(step_name):
+    """Step hook attributing the step to the running profile, if any.
+
+    Args:
+        step_name (str): the step name.
+
+    Returns:
+        contextlib.AbstractContextManager: the step's profiling context.
+    """
+    if _ACTIVE_PROFILER is None:
+        return contextlib.nullcontext(step_name)
+    return _ACTIVE_PROFILER.step(step_name)
+
+
+@contextlib.contextmanager
+def profile(kind, output_dir, prefix):
+    """Profile the body, then write the profile files.
+
+    Args:
+        kind (str): one of `PROFILE_KINDS`.
+        output_dir (str): the directory to write the files to.
+        prefix (str): the file name prefix.
+
+    Yields:
+        CpuProfiler | MemoryProfiler: the profiler.
+
+    Raises:
+        ValueError: if the kind is unknown.
+    """
+    global _ACTIVE_PROFILER  # pylint: disable=global-statement
+    if kind not in _PROFILERS:
+        raise ValueError(f"Unknown profile kind: {kind}")
+    profiler = _PROFILERS[kind]()
+    start = time.perf_counter()
+    profiler.start()
+    _ACTIVE_PROFILER = profiler
+    try:
+        yield profiler
+    finally:
+        _ACTIVE_PROFILER = None
+        profiler.stop()
+        logging.info("Profiled run took %.3fs", time.perf_counter() - start)
+        for path in profiler.write(output_dir, prefix):
+            logging.info("Wrote profile %s", path)
@@ -0,0 +1,482 @@
+# Copyright (C) 2023 DNEG - All Rights reserved.
+"""
+Protections Utility.
+
+This utility's responsibility is to read the lines of the Perforce protections
+table, so that they can be matched to the shows and groups they grant access
+to without string searches over the whole table.
+
+A protections line is `mode type name host path`, optionally followed by a
+`##` comment, e.g. `write group SHOW * //SHOW/... ## added by jdoe`. Lines
+starting with `##` are comments of their own, such as the section markers.
+
+It can also evaluate the table locally, the way the server does: for each
+access right, the table is read from the bottom up and the first line that
+matches the user, host and path and grants or excludes that right decides
+it. A line excluding an access level, with a `-` prefixed path, excludes it
+and every level above it; a line excluding a right, such as `=write`, only
+excludes that right.
+
+`ProtectionsEvaluator` compiles the table once, with its lines indexed by
+depot, and expands groups from a snapshot of the tagged `groups` output, so
+it answers "what access does this user have from this host on this file"
+without a `p4 protects` round trip.
+"""
+import collections
+import functools
+import heapq
+import re
+
+ProtectionEntry = collections.namedtuple(
+    "ProtectionEntry", ["mode", "type", "name", "host", "path", "comment", "line"]
+)
+ProtectionEntry.__doc__ = """A parsed protections table line.
+
+Attributes:
+    mode (str): the access level, e.g. "write".
+    type (str): "user" or "group".
+    name (str): the user or group name.
+    host (str): the host the line applies to, e.g. "*".
+    path (str): the depot path, `-` prefixed for exclusions.
+    comment (str): the text after `##`, or "".
+    line (str): the line as it is in the table.
+"""
+
+Rule = collections.namedtuple(
+    "Rule",
+    ["entry", "exclusion", "rights", "name_pattern", "host_pattern", "path_pattern"],
+)
+Rule.__doc__ = """A protections line, compiled for evaluation.
+
+Attributes:
+    entry (ProtectionEntry): the parsed line.
+    exclusion (bool): whether the line excludes access.
+    rights (frozenset[str]): the rights the line grants, or excludes.
+    name_pattern (re.Pattern): matches the user names of a user line, None for a group line.
+    host_pattern (re.Pattern): matches the client hosts.
+    path_pattern (re.Pattern): matches the depot files.
+"""
+
+# Access levels, lowest first, and the rights each one grants.
+ACCESS_LEVELS = ("list", "read", "open", "write", "admin", "super")
+LEVEL_RIGHTS = {
+    "list": frozenset(("list",)),
+    "read": frozenset(("list", "read", "branch")),
+    "open": frozenset(("list", "read", "branch", "open")),
+    "write": frozenset(("list", "read", "branch", "open", "write")),
+    "admin": frozenset(("list", "read", "branch", "open", "write", "review", "admin")),
+    "super": frozenset(
+        ("list", "read", "branch", "open", "write", "review", "admin", "super")
+    ),
+    "review": frozenset(("list", "read", "branch", "review")),
+}
+ALL_RIGHTS = LEVEL_RIGHTS["super"]
+
+
+def parse_entry(line: str):
+    """Parse a protections table line.
+
+    Args:
+        line (str): the line.
+
+    Returns:
+        ProtectionEntry: the parsed line, or None for comment lines and lines
+            that are not protections.
+    """
+    rule, _, comment = line.partition("##")
+    fields = rule.split()
+    if len(fields) < 5:
+        return None
+    return ProtectionEntry(
+        fields[0],
+        fields[1],
+        fields[2],
+        fields[3],
+        " ".join(fields[4:]),
+        comment.strip(),
+        line,
+    )
+
+
+def rule_of(line: str):
+    """Get a protections line without its comment, with whitespace normalized.
+
+    Args:
+        line (str): the line.
+
+    Returns:
+        str: the line's rule.
+    """
+    return " ".join(line.split("##", 1)[0].split())
+
+
+def depot_of(path: str):
+    """Get the depot a protections path is in.
+
+    Args:
+        path (str): the depot path, possibly `-` prefixed.
+
+    Returns:
+        str: the depot name, or None if the path does not name one, e.g. `//...`.
+    """
+    parts = path.lstrip('-"').split("/")
+    if len(parts) < 3 or not parts[2] or "..." in parts[2] or "*" in parts[2]:
+        return None
+    return parts[2]
+
+
+def show_entries(protections, show, groups=()):
+    """Get the protections lines granting access to a show.
+
+    A line belongs to the show if its path is in the show's depot, or if it
+    grants access to one of the show's groups. Depot and group names are
+    compared without regard to case, as on the show setup server.
+
+    Args:
+        protections (list[str]): the protections table lines.
+        show (str): the show code.
+        groups (Iterable[str], optional): the show's groups.
+
+    Returns:
+        list[str]: the show's lines, in table order.
+    """
+    show = show.casefold()
+    groups = {grp.casefold() for grp in groups}
+    entries = []
+    for line in protections:
+        entry = parse_entry(line)
+        if entry is None:
+            continue
+        depot = depot_of(entry.path)
+        if (depot is not None and depot.casefold() == show) or (
+            entry.type == "group" and entry.name.casefold() in groups
+        ):
+            entries.append(line)
+    return entries
+
+
+def rights_of(mode: str, exclusion: bool = False):
+    """Get the rights a protections line's mode grants, or excludes.
+
+    Args:
+        mode (str): the mode, an access level such as "write" or a right such as "=write".
+        exclusion (bool, optional): whether the line excludes access.
+
+    Returns:
+        frozenset[str]: the rights.
+    """
+    if mode.startswith("="):
+        return frozenset((mode[1:],))
+    rights = LEVEL_RIGHTS.get(mode, frozenset())
+    if exclusion and mode in ACCESS_LEVELS:
+        # Excluding a level also excludes the levels above it.
+        lower = ACCESS_LEVELS.index(mode)
+        return ALL_RIGHTS - (
+            LEVEL_RIGHTS[ACCESS_LEVELS[lower - 1]] if lower else frozenset()
+        )
+    return rights
+
+
+@functools.lru_cache(maxsize=None)
+def path_pattern(path: str):
+    """Compile a depot path with Perforce wildcards.
+
+    Paths are matched without regard to case, as on the show setup server.
+
+    Args:
+        path (str): the depot path, without the exclusion `-`.
+
+    Returns:
+        re.Pattern: matches the depot files the path maps.
+    """
+    parts = re.split(r"(\.\.\.|\*|%%[0-9])", path.strip('"'))
+    regex = "".join(
+        ".*"
+        if part == "..."
+        else "[^/]*"
+        if part == "*" or part.startswith("%%")
+        else re.escape(part)
+        for part in parts
+    )
+    return re.compile(regex + r"\Z", re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=None)
+def host_pattern(host: str):
+    """Compile a protections line's host field.
+
+    Args:
+        host (str): the host, e.g. "*" or "10.*".
+
+    Returns:
+        re.Pattern: matches the client addresses the host field covers.
+    """
+    return re.compile(".*".join(re.escape(part) for part in host.split("*")) + r"\Z")
+
+
+def compile_rule(line: str):
+    """Compile a protections line for evaluation.
+
+    Args:
+        line (str): the line.
+
+    Returns:
+        Rule: the compiled line, or None for comment lines.
+    """
+    entry = parse_entry(line)
+    if entry is None:
+        return None
+    exclusion = entry.path.startswith("-")
+    return Rule(
+        entry,
+        exclusion,
+        rights_of(entry.mode, exclusion),
+        host_pattern(entry.name) if entry.type == "user" else None,
+        host_pattern(entry.host),
+        path_pattern(entry.path[1:] if exclusion else entry.path),
+    )
+
+
+def compile_rules(protections):
+    """Compile the protections table lines for evaluation.
+
+    Args:
+        protections (list[str]): the protections table lines.
+
+    Returns:
+        list[Rule]: the compiled lines, in table order.
+    """
+    return [
+        rule
+        for rule in (compile_rule(line) for line in protections)
+        if rule is not None
+    ]
+
+
+def rule_applies(rule, user, groups, host, path):
+    """Check whether a compiled line applies to a user, host and file.
+
+    Args:
+        rule (Rule): the compiled line.
+        user (str): the user.
+        groups (Collection[str]): the groups the user is in.
+        host (str): the client address.
+        path (str): the depot file.
+
+    Returns:
+        bool: whether it applies.
+    """
+    if rule.name_pattern is None:
+        if rule.entry.name not in groups:
+            return False
+    elif not rule.name_pattern.match(user):
+        return False
+    return bool(rule.host_pattern.match(host) and rule.path_pattern.match(path))
+
+
+def access(rules, user, host, path, groups=()):
+    """Evaluate the rights a user has on a file, the way the server does.
+
+    Args:
+        rules (list[Rule]): the compiled table, from `compile_rules()`.
+        user (str): the user.
+        host (str): the client address.
+        path (str): the depot file.
+        groups (Collection[str], optional): the groups the user is in.
+
+    Returns:
+        frozenset[str]: the rights granted.
+    """
+    undecided = set(ALL_RIGHTS)
+    granted = set()
+    for rule in reversed(rules):
+        decided = undecided & rule.rights
+        if not decided or not rule_applies(rule, user, groups, host, path):
+            continue
+        if not rule.exclusion:
+            granted |= decided
+        undecided -= decided
+        if not undecided:
+            break
+    return frozenset(granted)
+
+
+def access_level(rights):
+    """Get the highest access level a set of rights amounts to.
+
+    Args:
+        rights (Collection[str]): the rights.
+
+    Returns:
+        str: the level, or "none".
+    """
+    level = "none"
+    for candidate in ACCESS_LEVELS:
+        if LEVEL_RIGHTS[candidate] <= set(rights):
+            level = candidate
+    return level
+
+
+def example_of(pattern: str, wildcard_value: str = "probe"):
+    """Fill in the wildcards of a path, host or user pattern, to get something it matches.
+
+    Args:
+        pattern (str): the pattern.
+        wildcard_value (str, optional): what to fill single level wildcards with.
+
+    Returns:
+        str: the example. `...` is filled with two levels.
+    """
+    return re.sub(
+        r"\.\.\.|\*|%%[0-9]",
+        lambda match: f"{wildcard_value}/file"
+        if match.group() == "..."
+        else wildcard_value,
+        pattern.lstrip("-").strip('"'),
+    )
+
+
+class GroupSnapshot:
+    """The groups of a tagged `groups` snapshot, expanded for membership questions.
+
+    A user is in a group if they are one of its users, or in one of its
+    subgroups, at any depth. Expansions are cached, since the snapshot does
+    not change.
+    """
+
+    def __init__(self, records=()):
+        """Index the snapshot.
+
+        Args:
+            records (Iterable): the tagged `groups` records, one per group member.
+        """
+        self._user_groups = collections.defaultdict(set)
+        self._parent_groups = collections.defaultdict(set)
+        for record in records:
+            if not isinstance(record, dict) or not record.get("user"):
+                continue
+            if record.get("isSubGroup") == "1":
+                self._parent_groups[record["user"]].add(record["group"])
+            elif record.get("isUser") == "1":
+                self._user_groups[record["user"]].add(record["group"])
+        self._enclosing = {}
+        self._memberships = {}
+
+    def enclosing(self, group):
+        """Get a group and every group it is a subgroup of, at any depth.
+
+        Args:
+            group (str): the group.
+
+        Returns:
+            frozenset[str]: the groups its members are in.
+        """
+        if group not in self._enclosing:
+            found = {group}
+            pending = [group]
+            while pending:
+                for parent in self._parent_groups.get(pending.pop(), ()):
+                    if parent not in found:
+                        found.add(parent)
+                        pending.append(parent)
+            self._enclosing[group] = frozenset(found)
+        return self._enclosing[group]
+
+    def groups_of(self, user):
+        """Get every group a user is in.
+
+        Args:
+            user (str): the user.
+
+        Returns:
+            frozenset[str]: the groups.
+        """
+        if user not in self._memberships:
+            groups = set()
+            for group in self._user_groups.get(user, ()):
+                groups |= self.enclosing(group)
+            self._memberships[user] = frozenset(groups)
+        return self._memberships[user]
+
+
+class ProtectionsEvaluator:
+    """A protections table compiled to answer access questions locally.
+
+    The lines are indexed by the depot of their path, so a question about a
+    file is only matched against the lines of its depot, and the lines whose
+    path spans depots such as `//...`, in table order.
+    """
+
+    def __init__(self, protections, groups=None):
+        """Compile and index the table.
+
+        Args:
+            protections (list[str]): the protections table lines.
+            groups (GroupSnapshot, optional): the groups to expand users with.
+                No user is in any group if not given.
+        """
+        self.rules = compile_rules(protections)
+        self.groups = groups if groups is not None else GroupSnapshot()
+        self._depot_rules = collections.defaultdict(list)
+        self._spanning_rules = []
+        for position, rule in enumerate(self.rules):
+            depot = depot_of(rule.entry.path)
+            if depot is None:
+                self._spanning_rules.append((position, rule))
+            else:
+                self._depot_rules[depot.lower()].append((position, rule))
+        self._rules_by_depot = {}
+
+    def rules_for(self, path):
+        """Get the lines that can apply to a file, in table order.
+
+        Args:
+            path (str): the depot file.
+
+        Returns:
+            list[Rule]: the compiled lines.
+        """
+        depot = depot_of(path)
+        key = depot.lower() if depot else None
+        if key not in self._rules_by_depot:
+            self._rules_by_depot[key] = [
+                rule
+                for _, rule in heapq.merge(
+                    self._depot_rules.get(key, []),
+                    self._spanning_rules,
+                    key=lambda item: item[0],
+                )
+            ]
+        return self._rules_by_depot[key]
+
+    def access(self, user, host, path, groups=None):
+        """Evaluate the rights a user has on a file.
+
+        Args:
+            user (str): the user.
+            host (str): the client address.
+            path (str): the depot file.
+            groups (Collection[str], optional): the groups the user is in.
+                Taken from the group snapshot if not given.
+
+        Returns:
+            frozenset[str]: the rights granted.
+        """
+        if groups is None:
+            groups = self.groups.groups_of(user)
+        return access(self.rules_for(path), user, host, path, groups)
+
+    def access_level(self, user, host, path, groups=None):
+        """Evaluate the highest access level a user has on a file.
+
+        Args:
+            user (str): the user.
+            host (str): the client address.
+            path (str): the depot file.
+            groups (Collection[str], optional): the groups the user is in.
+                Taken from the group snapshot if not given.
+
+        Returns:
+            str: the access level, or "none".
+        """
+        return access_level(self.access(user, host, path, groups))
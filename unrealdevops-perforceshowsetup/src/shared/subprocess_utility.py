@@ -1,7 +1,45 @@
 # Copyright (C) 2023 DNEG - All Rights reserved.
 """Handle calling external processes outside of git."""
+import codecs
+import collections
 import logging
+import os
+import signal
 import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+CHUNK_SIZE = 64 * 1024
+DEFAULT_MAX_LINES = 10000
+KILL_WAIT_SECONDS = 5.0
+CANCEL_POLL_SECONDS = 0.1
+
+StreamingResult = collections.namedtuple(
+    "StreamingResult",
+    [
+        "command",
+        "returncode",
+        "stdout",
+        "stderr",
+        "truncated",
+        "timed_out",
+        "duration",
+    ],
+)
+StreamingResult.__doc__ = """Outcome of a command run by `run_streaming()`.
+
+Attributes:
+    command (str | list[str]): the command.
+    returncode (int): the exit status. Negative if killed by a signal on POSIX.
+    stdout (list[str]): the last lines of standard output, without line endings.
+    stderr (list[str]): the last lines of standard error. Empty when merged into
+        stdout.
+    truncated (bool): whether earlier lines were dropped from stdout or stderr.
+    timed_out (bool): whether the command was killed for running too long.
+    duration (float): the run time in seconds.
+"""
 
 
 def trigger_subprocess(command: str, dry_run: bool = False):
@@ -47,34 +85,550 @@ def trigger_subprocess_with_output(command: str, dry_run: bool = False):
 
     Returns:
         bool: Value determining wether the command failed.
-        list: List containing all lines in he command's output if any.
+        list: List containing the last `DEFAULT_MAX_LINES` lines in the command's
+            output if any, or the error if the command failed.
 
     """
     logging.info("Triggering external command: %s", command)
     if dry_run:
         return (True, command)
     try:
+        result = run_streaming(
+            command,
+            merge_stderr=True,
+            # Intended print
+            line_callback=lambda line: print(line.strip()),  # noqa: T201
+        )
+    except subprocess.CalledProcessError as ex:
+        return (False, ex)
+
+    logging.debug("Command Response:\n%s", repr(result.stdout))
+    if result.returncode != 0:
+        return (
+            False,
+            subprocess.CalledProcessError(
+                result.returncode, command, output="\n".join(result.stdout)
+            ),
+        )
+    return (True, result.stdout)
+
+
+class _StreamCollector:
+    """Decode a byte stream incrementally and keep its last lines.
+
+    Bytes are fed in chunks of any size. Multi-byte characters and lines split
+    across chunks are reassembled before being stored or passed on.
+    """
+
+    def __init__(
+        self,
+        max_lines=DEFAULT_MAX_LINES,
+        line_callback=None,
+        spool_file=None,
+        encoding="utf-8",
+    ):
+        """Construct an instance of _StreamCollector.
+
+        Args:
+            max_lines (int, optional): the number of lines to keep.
+            line_callback (callable, optional): called with every complete line.
+            spool_file (file, optional): binary file every byte is also written to.
+            encoding (str, optional): the stream's encoding.
+        """
+        self.lines = collections.deque(maxlen=max_lines)
+        self.line_count = 0
+        self._line_callback = line_callback
+        self._spool_file = spool_file
+        self._decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        self._partial = ""
+
+    @property
+    def truncated(self):
+        """bool: whether lines have been dropped to stay within `max_lines`."""
+        return self.line_count > len(self.lines)
+
+    def feed(self, chunk):
+        """Add a chunk of the stream.
+
+        Args:
+            chunk (bytes): the chunk.
+        """
+        if self._spool_file is not None:
+            self._spool_file.write(chunk)
+        text = self._partial + self._decoder.decode(chunk)
+        lines = text.splitlines(keepends=True)
+        self._partial = ""
+        if lines and not lines[-1].endswith(("\n", "\r")):
+            self._partial = lines.pop()
+        elif lines and lines[-1].endswith("\r"):
+            # The "\n" of a "\r\n" may be in the next chunk.
+            self._partial = lines.pop()
+        for line in lines:
+            self._add_line(line.rstrip("\r\n"))
+
+    def close(self):
+        """Flush what is left at the end of the stream."""
+        text = self._partial + self._decoder.decode(b"", final=True)
+        self._partial = ""
+        for line in text.splitlines():
+            self._add_line(line)
+
+    def _add_line(self, line):
+        """Store a complete line and pass it to the line callback.
+
+        Args:
+            line (str): the line, without its line ending.
+        """
+        self.line_count += 1
+        self.lines.append(line)
+        if self._line_callback is not None:
+            self._line_callback(line)
+
+
+def _popen_group_arguments():
+    """Get the Popen arguments starting the command in its own process group.
+
+    Returns:
+        dict: keyword arguments for `subprocess.Popen`.
+    """
+    if sys.platform == "win32":
+        return {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {"start_new_session": True}
+
+
+def _kill_process_group(pid):
+    """Kill a process and every process it started.
+
+    Args:
+        pid (int): the process id, which is also its process group id.
+    """
+    try:
+        if sys.platform == "win32":
+            subprocess.run(
+                ["taskkill", "/F", "/T", "/PID", str(pid)],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                check=False,
+            )
+        else:
+            os.killpg(pid, signal.SIGKILL)
+    except (OSError, subprocess.SubprocessError) as error:
+        logging.debug("Unable to kill process group %s: %s", pid, error)
+
+
+def _open_spool(spool_path):
+    """Open the file to spool standard output to.
+
+    Args:
+        spool_path (str): the file path, or None not to spool.
+
+    Returns:
+        file: the open binary file, or None.
+    """
+    if spool_path is None:
+        return None
+    return open(spool_path, "wb")  # pylint: disable=consider-using-with
+
+
+def _pump(pipe, collector):
+    """Read a pipe in chunks into a collector until the end of the stream.
+
+    Args:
+        pipe (io.BufferedReader): the pipe.
+        collector (_StreamCollector): the collector.
+    """
+    read = getattr(pipe, "read1", pipe.read)
+    while True:
+        chunk = read(CHUNK_SIZE)
+        if not chunk:
+            break
+        collector.feed(chunk)
+    collector.close()
+
+
+def run_streaming(
+    command,
+    timeout: float = None,
+    line_callback=None,
+    stderr_callback=None,
+    max_lines: int = DEFAULT_MAX_LINES,
+    spool_path: str = None,
+    merge_stderr: bool = False,
+    encoding: str = "utf-8",
+    cwd: str = None,
+    env: dict = None,
+    cancel_event: threading.Event = None,
+):
+    """Run a command, streaming its output instead of buffering all of it.
+
+    Output is read in chunks and decoded incrementally. Only the last
+    `max_lines` lines of each stream are kept in memory; pass `spool_path` to
+    keep all of standard output on disk. The command runs in its own process
+    group, so that a timeout kills everything it started.
+
+    Args:
+        command (str | list[str]): the command. Strings are run by the shell.
+        timeout (float, optional): seconds the command may run. No limit if None.
+        line_callback (callable, optional): called with every line of stdout.
+        stderr_callback (callable, optional): called with every line of stderr.
+        max_lines (int, optional): lines of each stream to keep in memory.
+        spool_path (str, optional): file to write all of stdout to.
+        merge_stderr (bool, optional): whether to merge stderr into stdout.
+        encoding (str, optional): the output encoding.
+        cwd (str, optional): the working directory.
+        env (dict, optional): the environment. Inherited if None.
+        cancel_event (threading.Event, optional): kills the command when set.
+
+    Returns:
+        StreamingResult: the exit status and output.
+    """
+    logging.info("Triggering external command: %s", command)
+    start = time.perf_counter()
+    spool_file = _open_spool(spool_path)
+    try:
+        stdout = _StreamCollector(max_lines, line_callback, spool_file, encoding)
+        stderr = _StreamCollector(max_lines, stderr_callback, None, encoding)
         with subprocess.Popen(
             command,
-            shell=True,
+            shell=isinstance(command, str),
+            stdin=subprocess.DEVNULL,
             stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
+            stderr=subprocess.STDOUT if merge_stderr else subprocess.PIPE,
+            cwd=cwd,
+            env=env,
+            **_popen_group_arguments(),
         ) as process:
-            final_output = []
-
-            while True:
-                output = process.stdout.readline().decode(
-                    encoding="utf-8",
-                    errors="ignore",
+            readers = [threading.Thread(target=_pump, args=(process.stdout, stdout))]
+            if not merge_stderr:
+                readers.append(
+                    threading.Thread(target=_pump, args=(process.stderr, stderr))
                 )
-                if output == "" and process.poll() is not None:
-                    break
-                if output:
-                    output = output.rstrip()
-                    print(output.strip())  # noqa: T201 - Intended print
-                    final_output.append(output)
-
-            logging.debug("Command Response:\n%s", repr(final_output))
-            return (True, final_output)
-    except subprocess.CalledProcessError as ex:
-        return (False, ex)
+            for reader in readers:
+                reader.daemon = True
+                reader.start()
+
+            returncode, timed_out, killed = _wait(process, timeout, cancel_event)
+            if killed:
+                _kill_process_group(process.pid)
+                returncode = process.wait(timeout=KILL_WAIT_SECONDS)
+            for reader in readers:
+                # Descendants that escaped the process group may hold the pipe open.
+                reader.join(KILL_WAIT_SECONDS if killed else None)
+    finally:
+        if spool_file is not None:
+            spool_file.close()
+
+    return StreamingResult(
+        command=command,
+        returncode=returncode,
+        stdout=list(stdout.lines),
+        stderr=list(stderr.lines),
+        truncated=stdout.truncated or stderr.truncated,
+        timed_out=timed_out,
+        duration=time.perf_counter() - start,
+    )
+
+
+def _wait(process, timeout, cancel_event):
+    """Wait for a process to exit, its timeout to pass, or its cancellation.
+
+    Args:
+        process (subprocess.Popen): the process.
+        timeout (float): seconds the process may run. No limit if None.
+        cancel_event (threading.Event): cancels the wait when set, if not None.
+
+    Returns:
+        tuple: the exit status (None if still running), whether the timeout
+            passed, and whether the process needs to be killed.
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        wait_time = None if deadline is None else max(0.0, deadline - time.monotonic())
+        if cancel_event is not None:
+            wait_time = (
+                CANCEL_POLL_SECONDS
+                if wait_time is None
+                else min(wait_time, CANCEL_POLL_SECONDS)
+            )
+        try:
+            return (process.wait(timeout=wait_time), False, False)
+        except subprocess.TimeoutExpired:
+            pass
+        if cancel_event is not None and cancel_event.is_set():
+            logging.warning("Command cancelled: %s", process.args)
+            return (None, False, True)
+        if deadline is not None and time.monotonic() >= deadline:
+            logging.warning("Command timed out after %ss: %s", timeout, process.args)
+            return (None, True, True)
+
+
+def run_many(commands, max_workers: int = None, fail_fast: bool = False, **kwargs):
+    """Run several commands at once, on a bounded pool.
+
+    Each command runs in its own process, so threads are enough to use every
+    core; the pool only bounds how many run at the same time.
+
+    Args:
+        commands (list): the commands, see `run_streaming()`.
+        max_workers (int, optional): how many commands may run at once. Defaults
+            to the number of CPUs.
+        fail_fast (bool, optional): whether to stop at the first command that
+            fails or times out. Commands still running are killed and commands
+            not yet started are skipped. Otherwise every command runs, and every
+            failure is in the results.
+        **kwargs (Any): keyworded arguments to forward to `run_streaming()`,
+            such as `timeout` or `max_lines`.
+
+    Returns:
+        list[StreamingResult]: the results, in the order of `commands`. Skipped
+            commands have a `returncode` of None.
+    """
+    commands = list(commands)
+    cancel_event = threading.Event() if fail_fast else None
+    max_workers = max_workers or os.cpu_count() or 1
+
+    def _run(command):
+        if cancel_event is not None and cancel_event.is_set():
+            return StreamingResult(command, None, [], [], False, False, 0.0)
+        result = run_streaming(command, cancel_event=cancel_event, **kwargs)
+        if cancel_event is not None and (result.returncode != 0 or result.timed_out):
+            cancel_event.set()
+        return result
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(
+        max_workers=max(1, min(max_workers, len(commands) or 1)),
+        thread_name_prefix="RunMany",
+    ) as executor:
+        results = list(executor.map(_run, commands))
+
+    failures = sum(1 for result in results if result.returncode not in (0, None))
+    logging.info(
+        "Ran %d commands in %.2fs: %d failed, %d skipped",
+        len(results),
+        time.perf_counter() - start,
+        failures,
+        sum(1 for result in results if result.returncode is None),
+    )
+    for result in results:
+        logging.debug(
+            "%.2fs exit %s: %s", result.duration, result.returncode, result.command
+        )
+    return results
+
+
+class StreamingProcess:
+    """Command whose raw standard output is consumed by the caller as it arrives.
+
+    Use as a context manager: the process is started on entry, and killed with
+    its process group on exit if it is still running. Standard input is fed
+    from a background thread and standard error is collected in a ring buffer,
+    so that neither can block the caller reading standard output.
+    """
+
+    def __init__(
+        self,
+        command,
+        input_data: bytes = None,
+        max_lines: int = DEFAULT_MAX_LINES,
+        cwd: str = None,
+        env: dict = None,
+    ):
+        """Construct an instance of StreamingProcess.
+
+        Args:
+            command (str | list[str]): the command. Strings are run by the shell.
+            input_data (bytes, optional): the data to send to standard input.
+            max_lines (int, optional): lines of standard error to keep.
+            cwd (str, optional): the working directory.
+            env (dict, optional): the environment. Inherited if None.
+        """
+        self.command = command
+        self.input_data = input_data
+        self.process = None
+        self._cwd = cwd
+        self._env = env
+        self._stderr = _StreamCollector(max_lines)
+        self._threads = []
+
+    @property
+    def stdout(self):
+        """io.BufferedReader: the process's standard output."""
+        return self.process.stdout
+
+    @property
+    def stderr(self):
+        """list[str]: the last lines of standard error read so far."""
+        return list(self._stderr.lines)
+
+    def __enter__(self):
+        """Start the process.
+
+        Returns:
+            StreamingProcess: the running process.
+        """
+        logging.debug("Triggering external command: %s", self.command)
+        self.process = subprocess.Popen(  # pylint: disable=consider-using-with
+            self.command,
+            shell=isinstance(self.command, str),
+            stdin=subprocess.DEVNULL if self.input_data is None else subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=self._cwd,
+            env=self._env,
+            **_popen_group_arguments(),
+        )
+        self._threads.append(
+            threading.Thread(target=_pump, args=(self.process.stderr, self._stderr))
+        )
+        if self.input_data is not None:
+            self._threads.append(threading.Thread(target=self._write_input))
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+        return self
+
+    def _write_input(self):
+        """Send the input data, then close standard input."""
+        try:
+            self.process.stdin.write(self.input_data)
+            self.process.stdin.close()
+        except (BrokenPipeError, OSError) as error:
+            logging.debug("Command stopped reading its input: %s", error)
+
+    def kill(self):
+        """Kill the process and everything it started."""
+        if self.process is not None and self.process.poll() is None:
+            _kill_process_group(self.process.pid)
+
+    def wait(self, timeout: float = None):
+        """Wait for the process to exit.
+
+        Args:
+            timeout (float, optional): seconds to wait. Forever if None.
+
+        Returns:
+            int: the exit status.
+        """
+        returncode = self.process.wait(timeout=timeout)
+        for thread in self._threads:
+            thread.join(KILL_WAIT_SECONDS)
+        return returncode
+
+    def __exit__(self, *exc_info):
+        """Kill the process if it is still running, and release its pipes.
+
+        Args:
+            *exc_info (Any): the exception raised in the context, if any.
+        """
+        self.kill()
+        self.wait(KILL_WAIT_SECONDS)
+        self.process.stdout.close()
+
+
+async def _pump_async(stream, collector):
+    """Read an asyncio stream in chunks into a collector until the end of the stream.
+
+    Args:
+        stream (asyncio.StreamReader): the stream.
+        collector (_StreamCollector): the collector.
+    """
+    while True:
+        chunk = await stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        collector.feed(chunk)
+    collector.close()
+
+
+async def run_streaming_async(
+    command,
+    timeout: float = None,
+    line_callback=None,
+    stderr_callback=None,
+    max_lines: int = DEFAULT_MAX_LINES,
+    spool_path: str = None,
+    merge_stderr: bool = False,
+    encoding: str = "utf-8",
+    cwd: str = None,
+    env: dict = None,
+):
+    """Run a command without blocking the event loop, streaming its output.
+
+    Behaves like `run_streaming()`. On Windows this needs the proactor event
+    loop, which is the default from Python 3.8.
+
+    Args:
+        command (str | list[str]): the command. Strings are run by the shell.
+        timeout (float, optional): seconds the command may run. No limit if None.
+        line_callback (callable, optional): called with every line of stdout.
+        stderr_callback (callable, optional): called with every line of stderr.
+        max_lines (int, optional): lines of each stream to keep in memory.
+        spool_path (str, optional): file to write all of stdout to.
+        merge_stderr (bool, optional): whether to merge stderr into stdout.
+        encoding (str, optional): the output encoding.
+        cwd (str, optional): the working directory.
+        env (dict, optional): the environment. Inherited if None.
+
+    Returns:
+        StreamingResult: the exit status and output.
+    """
+    import asyncio  # pylint: disable=import-outside-toplevel
+
+    logging.info("Triggering external command: %s", command)
+    start = time.perf_counter()
+    options = dict(
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT if merge_stderr else subprocess.PIPE,
+        cwd=cwd,
+        env=env,
+        **_popen_group_arguments(),
+    )
+    if isinstance(command, str):
+        process = await asyncio.create_subprocess_shell(command, **options)
+    else:
+        process = await asyncio.create_subprocess_exec(*command, **options)
+
+    spool_file = _open_spool(spool_path)
+    try:
+        stdout = _StreamCollector(max_lines, line_callback, spool_file, encoding)
+        stderr = _StreamCollector(max_lines, stderr_callback, None, encoding)
+        pumps = [_pump_async(process.stdout, stdout)]
+        if not merge_stderr:
+            pumps.append(_pump_async(process.stderr, stderr))
+        communication = asyncio.gather(*pumps, process.wait())
+
+        timed_out = False
+        try:
+            await asyncio.wait_for(asyncio.shield(communication), timeout)
+        except asyncio.TimeoutError:
+            timed_out = True
+            logging.warning("Command timed out after %ss: %s", timeout, command)
+            _kill_process_group(process.pid)
+            try:
+                await asyncio.wait_for(communication, KILL_WAIT_SECONDS)
+            except asyncio.TimeoutError:
+                # Descendants that escaped the process group may hold the pipe open.
+                communication.cancel()
+                await process.wait()
+        except asyncio.CancelledError:
+            # The shield keeps the command running, so it is killed here.
+            logging.warning("Command cancelled: %s", command)
+            _kill_process_group(process.pid)
+            communication.cancel()
+            await process.wait()
+            raise
+    finally:
+        if spool_file is not None:
+            spool_file.close()
+
+    return StreamingResult(
+        command=command,
+        returncode=process.returncode,
+        stdout=list(stdout.lines),
+        stderr=list(stderr.lines),
+        truncated=stdout.truncated or stderr.truncated,
+        timed_out=timed_out,
+        duration=time.perf_counter() - start,
+    )
@@ -1,12 +1,45 @@
 # Copyright (C) 2023 DNEG - All Rights Reserved.
 # pylint:disable=unused-argument,import-outside-toplevel
 """Pytest config fixtures and Base classes."""
+import copy
 import logging
 import os
 import unittest
 
 import pytest
 
+import p4_show_setup
+from shared import p4_connection_utility
+from shared import p4_simulator_utility
+
+SIMULATOR_NO_DELAY = p4_simulator_utility.SimulatorTimings(
+    0, 0, 0, 0, 0, source_files=10
+)
+SHOW_JSON_CONFIG = {
+    "permissions": [
+        "write group {show} * //{show}/... ## {user} {mdy_str}",
+        "read group {show}-Core * //VPCORE/{show}-Core-rel/... ## {user} {mdy_str}",
+    ],
+    "groups": {"{show}": "empty", "{show}-Core": "empty"},
+    "streams": {
+        "//{show}/{show}-main": {
+            "type": "mainline",
+            "branch": "//DNEG_Sandbox/UE5/Template",
+        },
+        "//{show}/{show}-dev": {
+            "type": "development",
+            "parent": "//{show}/{show}-main",
+        },
+    },
+}
+SHOW_SETUP_STEPS = (
+    "create_depot",
+    "populate_permissions_table",
+    "create_groups",
+    "create_initial_streams",
+)
+
+
 class BaseUnitTestClass(unittest.TestCase):
     """Test wrapper class to set up and tear down test.
 
@@ -96,3 +129,90 @@ class BaseUnitTestClass(unittest.TestCase):
         """Close tool's ui object if created."""
         if self.tool_object is not None:
             self.tool_object.close()
+
+
+@pytest.fixture(name="json_config")
+def fixture_json_config():
+    """Get the division config that simulated shows are set up with.
+
+    Test modules override this fixture to set up shows with another config.
+
+    Returns:
+        dict: the division config.
+    """
+    return copy.deepcopy(SHOW_JSON_CONFIG)
+
+
+@pytest.fixture(name="source_groups")
+def fixture_source_groups():
+    """Get the groups the simulated server has before any show is set up.
+
+    Test modules override this fixture to add the groups show groups copy
+    their members from.
+
+    Returns:
+        dict: the group specs, by name.
+    """
+    return {}
+
+
+@pytest.fixture(name="simulated_server")
+def fixture_simulated_server(source_groups):
+    """Create a simulated server whose commands take no time.
+
+    Args:
+        source_groups (dict): the groups the server starts with.
+
+    Returns:
+        p4_simulator_utility.SimulatedServer: the server.
+    """
+    return p4_simulator_utility.SimulatedServer(
+        SIMULATOR_NO_DELAY, groups=source_groups
+    )
+
+
+@pytest.fixture(name="simulated_pool")
+def fixture_simulated_pool(simulated_server):
+    """Create a pool of connections to the simulated server.
+
+    Args:
+        simulated_server (p4_simulator_utility.SimulatedServer): the server.
+
+    Yields:
+        p4_connection_utility.ConnectionPool: the pool, closed after the test.
+    """
+
+    def _factory():
+        connection = p4_simulator_utility.SimulatedConnection(simulated_server)
+        connection.connect()
+        return connection
+
+    pool = p4_connection_utility.ConnectionPool(_factory, size=4)
+    yield pool
+    pool.close()
+
+
+@pytest.fixture(name="set_up_show")
+def fixture_set_up_show(simulated_server, json_config):
+    """Get a function setting up shows on the simulated server.
+
+    Args:
+        simulated_server (p4_simulator_utility.SimulatedServer): the server.
+        json_config (dict): the division config the shows are set up with.
+
+    Returns:
+        callable: takes the show codes, and optionally the setup steps to
+            run, which default to every step that writes to the server.
+    """
+
+    def _set_up(*shows, steps=SHOW_SETUP_STEPS):
+        for show in shows:
+            connection = p4_simulator_utility.SimulatedConnection(simulated_server)
+            connection.connect()
+            show_setup_instance = p4_show_setup.P4ShowSetup(
+                show, json_config, p4=connection
+            )
+            for step_name in steps:
+                getattr(show_setup_instance, step_name)()
+
+    return _set_up
@@ -0,0 +1,95 @@
+# pylint: disable=W0212
+"""Unit tests for the event utility module."""
+import json
+import logging
+from unittest.mock import MagicMock
+
+import pytest
+
+from shared import event_utility as test_target
+from shared import logging_utility
+
+
+@pytest.fixture(name="events")
+def fixture_events(tmp_path):
+    """Write events to a temporary file.
+
+    Args:
+        tmp_path (fixture): a temporary directory.
+
+    Yields:
+        callable: returns the events written so far.
+    """
+    path = tmp_path / "events.jsonl"
+    handler = test_target.configure(str(path))
+
+    def _read():
+        handler.flush()
+        return [json.loads(line) for line in path.read_text().splitlines()]
+
+    yield _read
+    test_target._EVENT_LOGGER.removeHandler(handler)
+    handler.close()
+
+
+def test_summarize():
+    """Test that large payloads are replaced by bounded summaries."""
+    protections = [f"write group G{index} * //D{index}/..." for index in range(1000)]
+    summary = test_target.summarize({"Protections": protections, "Owner": "me"})
+    assert summary["Owner"] == "me"
+    assert summary["Protections"]["count"] == 1000
+    assert summary["Protections"]["sample"] == protections[: test_target.SAMPLE_SIZE]
+    assert (
+        summary["Protections"]["hash"]
+        == test_target.summarize(list(protections))["hash"]
+    )
+    assert test_target.summarize("x" * 1000)["length"] == 1000
+    assert test_target.summarize([1, 2]) == [1, 2]
+
+
+def test_fields_are_lazy():
+    """Test that nothing is computed when events are not written."""
+    payload = MagicMock()
+    test_target.emit("step_end", payload=payload)
+    payload.assert_not_called()
+    assert test_target.enabled() is False
+
+
+def test_step_and_write_events(events):
+    """Test step events, and write events from the connection wrapper."""
+    mock_p4 = MagicMock()
+    mock_p4.run.return_value = [{"depotFile": f"//D/{index}"} for index in range(10)]
+    connection = test_target.EventConnection(mock_p4)
+
+    with logging_utility.logging_context(show="SHOW"):
+        with test_target.step_events("groups"):
+            connection.input = [{"Group": "SHOW", "Users": ["a"]}]
+            connection.run("group", "-i")
+            connection.run("group", "-o", "SHOW")
+        connection.run("populate", "//A/...", "//SHOW/main/...")
+        with logging_utility.logging_context(step="undo"):
+            connection.run("group", "-d SHOW")
+
+    written = events()
+    assert [event["event"] for event in written] == [
+        "step_start",
+        "spec_write",
+        "step_end",
+        "populate",
+        "rollback",
+    ]
+    assert all(event["show"] == "SHOW" for event in written)
+    assert written[1]["spec"] == [{"Group": "SHOW", "Users": ["a"]}]
+    assert written[2]["outcome"] == "succeeded"
+    assert written[3]["files"] == 10
+    assert written[3]["results"]["count"] == 10
+    assert mock_p4.input == [{"Group": "SHOW", "Users": ["a"]}]
+
+
+def test_failed_step_event(events):
+    """Test that a failing step is reported as failed."""
+    with pytest.raises(KeyError):
+        with test_target.step_events("depot"):
+            raise KeyError("depot")
+    assert events()[-1]["outcome"] == "failed"
+    assert events()[-1]["level"] == logging.getLevelName(logging.INFO)
@@ -1,2 +1,119 @@
 # pylint: disable=W0212
 """Unit tests for the logging utility module."""
+import gzip
+import logging
+import os
+import queue
+import threading
+
+import pytest
+
+from shared import logging_utility as test_target
+
+
+@pytest.fixture(name="restore_root_logger")
+def fixture_restore_root_logger():
+    """Restore the root logger's handlers and level after the test.
+
+    Yields:
+        logging.Logger: the root logger.
+    """
+    root_logger = logging.getLogger()
+    handlers, level = list(root_logger.handlers), root_logger.level
+    yield root_logger
+    test_target.stop_queue_logging()
+    root_logger.handlers = handlers
+    root_logger.setLevel(level)
+
+
+class _SlowHandler(logging.Handler):
+    """Handler recording records, and the thread writing them."""
+
+    def __init__(self, delay=None):
+        """Construct an instance of _SlowHandler.
+
+        Args:
+            delay (threading.Event, optional): emit waits for this to be set.
+        """
+        super().__init__()
+        self.records = []
+        self.threads = set()
+        self.delay = delay
+
+    def emit(self, record):
+        """Record a record.
+
+        Args:
+            record (logging.LogRecord): the record.
+        """
+        if self.delay is not None:
+            self.delay.wait(5)
+        self.threads.add(threading.current_thread().name)
+        self.records.append(record)
+
+
+def test_queue_logging_writes_in_background(restore_root_logger):
+    """Test that records are written by the listener thread, with their context."""
+    handler = _SlowHandler()
+    test_target.start_queue_logging([handler])
+    with test_target.logging_context(show="SHOW", step="groups"):
+        logging.warning("Permissions: %s", ["write group SHOW * //SHOW/..."])
+    logging.warning("Outside: %s", "context")
+    test_target.stop_queue_logging()
+
+    assert [record.getMessage() for record in handler.records] == [
+        "Permissions: ['write group SHOW * //SHOW/...']",
+        "Outside: context",
+    ]
+    assert threading.current_thread().name not in handler.threads
+    assert handler.records[0].context == " [show=SHOW step=groups]"
+    assert (handler.records[0].show, handler.records[0].worker) == ("SHOW", "-")
+    assert handler.records[1].context == ""
+
+
+def test_queue_drop_policy(restore_root_logger):
+    """Test that the drop policy drops info records, never warnings, and reports."""
+    release = threading.Event()
+    handler = _SlowHandler(delay=release)
+    restore_root_logger.setLevel(logging.DEBUG)
+    queue_handler = test_target.start_queue_logging(
+        [handler], queue_size=2, overflow_policy=test_target.OVERFLOW_DROP
+    )
+    for index in range(10):
+        logging.info("info %d", index)
+    assert queue_handler.dropped > 0
+    release.set()
+    logging.warning("kept")
+    test_target.stop_queue_logging()
+
+    messages = [record.getMessage() for record in handler.records]
+    assert "kept" in messages
+    assert any(message.startswith("Dropped ") for message in messages)
+    assert len(messages) < 12
+
+
+def test_unknown_overflow_policy():
+    """Test that an unknown policy is rejected."""
+    with pytest.raises(ValueError):
+        test_target.BoundedQueueHandler(queue.Queue(), overflow_policy="spill")
+
+
+def test_gzip_rotation(tmp_path):
+    """Test that rotated logs are compressed."""
+    log_path = str(tmp_path / "log.txt")
+    handler = test_target.GzipRotatingFileHandler(
+        log_path, max_bytes=100, backup_count=2
+    )
+    logger = logging.getLogger("test_gzip_rotation")
+    logger.propagate = False
+    logger.addHandler(handler)
+    try:
+        for index in range(20):
+            logger.warning("line %d %s", index, "x" * 20)
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
+
+    assert sorted(os.listdir(tmp_path)) == ["log.txt", "log.txt.1.gz", "log.txt.2.gz"]
+    with gzip.open(log_path + ".1.gz", "rt") as rotated:
+        assert "line" in rotated.read()
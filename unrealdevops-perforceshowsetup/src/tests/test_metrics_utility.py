@@ -0,0 +1,113 @@
+# Copyright (C) 2023 DNEG - All Rights reserved.
+"""Tests for shared.metrics_utility."""
+import os
+from unittest import mock
+
+import pytest
+
+from shared import metrics_utility
+
+
+@pytest.fixture(name="metrics_file")
+def fixture_metrics_file(tmp_path):
+    """Collect metrics into a clean registry, for a textfile in a temporary directory."""
+    path = str(tmp_path / "p4_show_setup.prom")
+    metrics_utility.REGISTRY.clear()
+    metrics_utility.configure(path)
+    yield path
+    metrics_utility.configure(None)
+    metrics_utility.REGISTRY.clear()
+
+
+def test_nothing_is_collected_when_not_configured():
+    metrics_utility.REGISTRY.clear()
+    metrics_utility.inc("retries_total", error_class="transient")
+    with metrics_utility.step_metrics("depot"):
+        pass
+    assert metrics_utility.REGISTRY.render() == ""
+    assert metrics_utility.write_textfile() is None
+
+
+def test_write_textfile_renders_prometheus_format(metrics_file):
+    with metrics_utility.step_metrics("depot"):
+        pass
+    metrics_utility.inc("retries_total", error_class="transient")
+    metrics_utility.record_run("apply", True)
+
+    assert metrics_utility.write_textfile() == metrics_file
+    text = open(metrics_file, encoding="utf-8").read()
+    assert "# TYPE p4_show_setup_step_duration_seconds histogram" in text
+    assert (
+        'p4_show_setup_step_duration_seconds_bucket{outcome="succeeded",step="depot",le="+Inf"} 1'
+        in text
+    )
+    assert (
+        'p4_show_setup_step_duration_seconds_count{outcome="succeeded",step="depot"} 1'
+        in text
+    )
+    assert 'p4_show_setup_retries_total{error_class="transient"} 1' in text
+    assert 'p4_show_setup_runs_total{command="apply",outcome="succeeded"} 1' in text
+    # Only the textfile is left behind, no temporary file.
+    assert os.listdir(os.path.dirname(metrics_file)) == ["p4_show_setup.prom"]
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = metrics_utility.MetricsRegistry()
+    for latency in (0.001, 0.02, 0.02, 100.0):
+        registry.observe("round_trip_seconds", latency, command="info")
+    text = registry.render()
+    assert (
+        'p4_show_setup_round_trip_seconds_bucket{command="info",le="0.005"} 1' in text
+    )
+    assert (
+        'p4_show_setup_round_trip_seconds_bucket{command="info",le="0.025"} 3' in text
+    )
+    assert 'p4_show_setup_round_trip_seconds_bucket{command="info",le="60"} 3' in text
+    assert 'p4_show_setup_round_trip_seconds_bucket{command="info",le="+Inf"} 4' in text
+
+
+@pytest.mark.usefixtures("metrics_file")
+def test_metrics_connection_counts_round_trips_and_populate():
+    connection = mock.Mock()
+    connection.run.side_effect = [
+        [{"depotFile": "//SHOW/dev/a"}, {"depotFile": "//SHOW/dev/b"}],
+        [{"fileCount": "2", "fileSize": "2048"}],
+        [{"Group": "SHOW_artists"}],
+    ]
+    metrics_connection = metrics_utility.MetricsConnection(connection)
+
+    metrics_connection.run("populate", "//SHOW/main/...", "//SHOW/dev/...")
+    metrics_connection.run("-x", "-", "group", "-o")
+
+    connection.run.assert_any_call("sizes", "-s", "//SHOW/dev/...")
+    registry = metrics_utility.REGISTRY
+    assert registry.get("round_trips_total", command="populate") == 1
+    assert registry.get("round_trips_total", command="group") == 1
+    assert registry.get("populate_files_total") == 2
+    assert registry.get("populate_bytes_total") == 2048
+
+
+class _StreamingConnection:
+    """Connection streaming a populate's files, and listing sizes with `run()`."""
+
+    def __init__(self):
+        self.run = mock.Mock(return_value=[{"fileCount": "2", "fileSize": "2048"}])
+
+    def run_iter(self, *_args):
+        yield {"depotFile": "//SHOW/dev/a"}
+        yield {"depotFile": "//SHOW/dev/b"}
+
+
+@pytest.mark.usefixtures("metrics_file")
+def test_metrics_connection_counts_streamed_populate():
+    metrics_connection = metrics_utility.MetricsConnection(_StreamingConnection())
+
+    files = list(
+        metrics_connection.run_iter("populate", "//SHOW/main/...", "//SHOW/dev/...")
+    )
+
+    assert len(files) == 2
+    registry = metrics_utility.REGISTRY
+    assert registry.get("round_trips_total", command="populate") == 1
+    assert registry.get("populate_files_total") == 2
+    assert registry.get("populate_bytes_total") == 2048
@@ -0,0 +1,93 @@
+# pylint: disable=W0212
+"""Unit tests for the P4 batch utility module."""
+from unittest.mock import MagicMock
+
+from shared import p4_batch_utility as test_target
+from shared import p4_connection_utility
+from shared import p4_retry_utility
+
+
+class _FakeConnection:
+    """Connection answering `group -o`, in batches through `-x -`."""
+
+    supports_argument_files = True
+
+    def __init__(self, missing=(), failing=()):
+        """Construct an instance of _FakeConnection.
+
+        Args:
+            missing (tuple): groups the batch silently skips.
+            failing (tuple): groups whose command fails.
+        """
+        self.missing = missing
+        self.failing = failing
+        self.exception_level = 2
+        self.input = None
+        self.calls = []
+
+    def run(self, *args):
+        """Run a command.
+
+        Args:
+            *args (str): the command and its arguments.
+
+        Returns:
+            list[dict]: the results.
+        """
+        self.calls.append(args)
+        if args[:2] == ("-x", "-"):
+            names = self.input.split()
+            self.input = None
+            if self.exception_level and any(name in self.failing for name in names):
+                raise p4_connection_utility.P4CommandError("batch failed")
+            return [
+                {"Group": name, "Users": []}
+                for name in names
+                if name not in self.missing and name not in self.failing
+            ]
+        if args[-1] in self.failing:
+            raise p4_connection_utility.P4CommandError(f"{args[-1]} failed")
+        return [{"Group": args[-1], "Users": []}]
+
+
+def test_batches_and_demultiplexes():
+    """Test that operands are sent in batches and results matched back."""
+    connection = _FakeConnection()
+    groups = [f"G{index}" for index in range(5)]
+    batch_result = test_target.BatchReader(connection, batch_size=2).read(
+        ("group", "-o"), groups + ["G0"]
+    )
+    assert list(batch_result.results) == groups
+    assert all(batch_result.results[name][0]["Group"] == name for name in groups)
+    assert connection.calls == [("-x", "-", "group", "-o")] * 3
+    assert connection.exception_level == 2
+
+
+def test_falls_back_to_individual_calls():
+    """Test that unanswered and failed operands get their own command."""
+    connection = _FakeConnection(missing=("G1",), failing=("G2",))
+    batch_result = test_target.BatchReader(connection).read(
+        ("group", "-o"), ["G0", "G1", "G2"]
+    )
+    assert sorted(batch_result.results) == ["G0", "G1"]
+    assert str(batch_result.errors["G2"]) == "G2 failed"
+    assert connection.calls[1:] == [("group", "-o", "G1"), ("group", "-o", "G2")]
+
+
+def test_unsupported_connection_runs_individually():
+    """Test that connections without argument files run one command per operand."""
+    connection = MagicMock()
+    connection.run.side_effect = lambda *args: [{"Group": args[-1]}]
+    batch_result = test_target.BatchReader(connection).read(
+        ("group", "-o"), ["G0", "G1"]
+    )
+    assert sorted(batch_result.results) == ["G0", "G1"]
+    assert connection.run.call_count == 2
+
+
+def test_batched_reads_are_retried_as_reads():
+    """Test that the retry policy sees through the argument file flag."""
+    assert (
+        p4_retry_utility.classify_command(("-x", "-", "group", "-o"))
+        == p4_retry_utility.READ
+    )
@@ -0,0 +1,187 @@
+# pylint: disable=W0212
+"""Unit tests for the P4 connection utility module."""
+import queue
+import threading
+from unittest.mock import MagicMock
+
+import pytest
+
+from shared import p4_connection_utility as test_target
+
+
+def _factory(created):
+    """Build a connection factory recording what it creates.
+
+    Args:
+        created (list): the list to add new connections to.
+
+    Returns:
+        callable: the factory.
+    """
+
+    def _create():
+        connection = MagicMock()
+        connection.connected.return_value = True
+        created.append(connection)
+        return connection
+
+    return _create
+
+
+def test_wrapper_delegates():
+    """Test that wrappers pass attributes and commands through."""
+    mock_p4 = MagicMock()
+    wrapper = test_target.ConnectionWrapper(mock_p4)
+    wrapper.input = "spec"
+    wrapper._state = 1
+    assert mock_p4.input == "spec"
+    assert wrapper._state == 1
+    wrapper.run("info")
+    mock_p4.run.assert_called_once_with("info")
+
+
+def test_run_iter_streams_only_when_supported():
+    """Test that wrappers stream from connections that can, and run the others."""
+
+    class _Streaming:
+        def run_iter(self, *args):
+            yield from args
+
+    assert list(
+        test_target.ConnectionWrapper(_Streaming()).run_iter("groups", "a")
+    ) == ["groups", "a"]
+    mock_p4 = MagicMock()
+    mock_p4.run.return_value = [{"group": "a"}]
+    assert list(test_target.run_iter(mock_p4, "groups")) == [{"group": "a"}]
+    mock_p4.run.assert_called_once_with("groups")
+
+
+def test_pool_reuses_connections():
+    """Test that released connections are handed out again."""
+    created = []
+    pool = test_target.ConnectionPool(_factory(created), size=2)
+    with pool.acquire() as first:
+        pass
+    with pool.acquire() as second:
+        pass
+    assert first is second
+    assert len(created) == 1
+
+
+def test_pool_is_bounded():
+    """Test that no more than `size` connections are created."""
+    created = []
+    pool = test_target.ConnectionPool(_factory(created), size=2)
+    barrier = threading.Barrier(2)
+
+    def _hold():
+        with pool.acquire():
+            barrier.wait()
+
+    threads = [threading.Thread(target=_hold) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(created) == 2
+
+    with pool.acquire(), pool.acquire():
+        with pytest.raises(queue.Empty):
+            with pool.acquire(timeout=0.01):
+                pass
+    assert len(created) == 2
+
+
+def test_pool_discards_dropped_connections():
+    """Test that connections dropped while borrowed are replaced."""
+    created = []
+    pool = test_target.ConnectionPool(_factory(created), size=1)
+    with pool.acquire() as connection:
+        connection.connected.return_value = False
+    with pool.acquire() as replacement:
+        assert replacement is not connection
+    assert len(created) == 2
+
+
+def test_pool_close_disconnects():
+    """Test that closing the pool disconnects idle connections."""
+    created = []
+    pool = test_target.ConnectionPool(_factory(created), size=1)
+    with pool.acquire():
+        pass
+    pool.close()
+    created[0].disconnect.assert_called_once_with()
+    with pytest.raises(RuntimeError):
+        with pool.acquire():
+            pass
+
+
+def _wait_for_connection(pool):
+    """Start a thread waiting to borrow a connection from a full pool.
+
+    Args:
+        pool (ConnectionPool): the pool.
+
+    Returns:
+        tuple: the thread, and the list it adds the connection or error to.
+    """
+    outcome = []
+
+    def _borrow():
+        try:
+            with pool.acquire(timeout=5) as connection:
+                outcome.append(connection)
+        except (queue.Empty, RuntimeError, test_target.P4CommandError) as error:
+            outcome.append(error)
+
+    thread = threading.Thread(target=_borrow)
+    thread.start()
+    return thread, outcome
+
+
+def test_pool_waiter_gets_replacement_for_dropped_connection():
+    """Test that releasing a dropped connection lets a waiting caller create another."""
+    created = []
+    pool = test_target.ConnectionPool(_factory(created), size=1)
+    with pool.acquire() as connection:
+        thread, outcome = _wait_for_connection(pool)
+        connection.connected.return_value = False
+    thread.join()
+    assert outcome == [created[1]]
+
+
+def test_pool_waiter_gets_slot_of_failed_creation():
+    """Test that a failed connection attempt lets a waiting caller try again."""
+    created = []
+    create = _factory(created)
+    started = threading.Event()
+    release = threading.Event()
+
+    def _factory_failing_once():
+        if not started.is_set():
+            started.set()
+            assert release.wait(5)
+            raise test_target.P4CommandError("Connect to server failed")
+        return create()
+
+    pool = test_target.ConnectionPool(_factory_failing_once, size=1)
+    first, first_outcome = _wait_for_connection(pool)
+    assert started.wait(5)
+    thread, outcome = _wait_for_connection(pool)
+    release.set()
+    first.join()
+    thread.join()
+    assert isinstance(first_outcome[0], test_target.P4CommandError)
+    assert outcome == created
+
+
+def test_pool_close_wakes_waiters():
+    """Test that closing the pool fails the callers waiting for a connection."""
+    created = []
+    pool = test_target.ConnectionPool(_factory(created), size=1)
+    with pool.acquire():
+        thread, outcome = _wait_for_connection(pool)
+        pool.close()
+        thread.join()
+    assert isinstance(outcome[0], RuntimeError)
+    created[0].disconnect.assert_called_once_with()
@@ -0,0 +1,153 @@
+# pylint: disable=W0212
+"""Unit tests for the P4 deadline utility module."""
+import os
+import signal
+import threading
+import time
+from unittest.mock import MagicMock
+
+import pytest
+
+from shared import p4_connection_utility
+from shared import p4_deadline_utility as test_target
+
+
+def _connection(run=None, **kwargs):
+    """Build a deadline connection around a mocked P4 connection.
+
+    Args:
+        run (callable, optional): side effect of the mocked run.
+        **kwargs (Any): keyworded arguments to forward.
+
+    Returns:
+        tuple: the deadline connection and the mocked connection.
+    """
+    mock_p4 = MagicMock(
+        spec=["run", "setbreak", "set_tunable", "maxlocktime", "disconnect"]
+    )
+    mock_p4.run.side_effect = run
+    return (test_target.DeadlineConnection(mock_p4, **kwargs), mock_p4)
+
+
+def test_connection_timeout_settings():
+    """Test that the break callback, network and lock timeouts are set."""
+    connection, mock_p4 = _connection(default_timeout=5.0, timeouts={"populate": 20.0})
+    mock_p4.setbreak.assert_called_once_with(connection._is_alive)
+    mock_p4.set_tunable.assert_called_once_with("net.maxwait", "20")
+    mock_p4.run.return_value = ["ok"]
+    mock_p4.run.side_effect = None
+    assert connection.run("info") == ["ok"]
+    assert mock_p4.maxlocktime == 5000
+
+
+def _late_failure(*_args):
+    """Fail a command after its deadline."""
+    time.sleep(0.05)
+    raise p4_connection_utility.P4CommandError("Partner exited unexpectedly.")
+
+
+def test_command_deadline_exceeded():
+    """Test that a command failing after its deadline raises."""
+    connection, _ = _connection(_late_failure, default_timeout=0.01, timeouts={})
+    with pytest.raises(test_target.DeadlineExceeded):
+        connection.run("populate", "//A/...", "//B/...")
+
+
+def test_late_success_is_returned():
+    """Test that a command finishing after its deadline returns, and the next one raises."""
+    connection, mock_p4 = _connection(
+        lambda *args: time.sleep(0.05) or ["Group FOO created"], default_timeout=60.0
+    )
+    with connection.step_deadline(0.01, name="groups"):
+        assert connection.run("group", "-i") == ["Group FOO created"]
+        with pytest.raises(test_target.DeadlineExceeded, match="'groups' step"):
+            connection.run("group", "-i")
+    assert mock_p4.run.call_count == 1
+
+
+def test_streamed_command_within_deadline():
+    """Test that a streamed command is bound by its deadline until it finishes."""
+    connection, _ = _connection(default_timeout=60.0)
+
+    class _Streaming:
+        def run_iter(self, *_args):
+            yield connection._command_deadline
+
+    connection._connection = _Streaming()
+    assert [deadline.seconds for deadline in connection.run_iter("groups")] == [60.0]
+    assert connection._command_deadline is None
+
+
+def test_step_deadline_limits_commands():
+    """Test that commands only get the time left in their step."""
+    connection, mock_p4 = _connection(default_timeout=60.0)
+    with connection.step_deadline(0.01, name="streams"):
+        time.sleep(0.02)
+        with pytest.raises(test_target.DeadlineExceeded, match="'streams' step"):
+            connection.run("stream", "-o", "//A/main")
+    mock_p4.run.assert_not_called()
+
+
+def test_cancelled_before_command():
+    """Test that no command starts once the run is cancelled."""
+    token = test_target.CancellationToken()
+    connection, mock_p4 = _connection(token=token)
+    token.cancel("Received SIGTERM")
+    with pytest.raises(test_target.OperationCancelled, match="SIGTERM"):
+        connection.run("info")
+    mock_p4.run.assert_not_called()
+
+
+def test_cancel_aborts_command_in_flight():
+    """Test that the break callback stops a running command once cancelled."""
+    token = test_target.CancellationToken()
+
+    def run(*_args):
+        token.cancel("Received SIGINT")
+        # P4API polls the break callback and aborts the command.
+        assert connection._is_alive() is False
+        raise p4_connection_utility.P4CommandError("Command terminated.")
+
+    connection, _ = _connection(run, token=token)
+    with pytest.raises(test_target.OperationCancelled):
+        connection.run("populate", "//A/...", "//B/...")
+
+
+def test_watchdog_aborts_connection(monkeypatch):
+    """Test that a command ignoring its break callback has its connection aborted."""
+    monkeypatch.setattr(test_target, "WATCHDOG_GRACE_SECONDS", 0.01)
+    aborted = threading.Event()
+
+    def run(*_args):
+        assert aborted.wait(5)
+        raise p4_connection_utility.P4CommandError("Partner exited unexpectedly.")
+
+    connection, mock_p4 = _connection(run, default_timeout=0.01, timeouts={})
+    mock_p4.disconnect.side_effect = aborted.set
+    with pytest.raises(test_target.DeadlineExceeded):
+        connection.run("obliterate", "-y", "//A/...")
+    mock_p4.disconnect.assert_called_once()
+
+
+def test_cancellable_sleep():
+    """Test that waiting stops early when cancelled."""
+    token = test_target.CancellationToken()
+    threading.Timer(0.01, token.cancel).start()
+    start = time.monotonic()
+    with pytest.raises(test_target.OperationCancelled):
+        token.sleep(5)
+    assert time.monotonic() - start < 5
+    token.reset()
+    assert not token.cancelled
+
+
+def test_termination_signal_cancels():
+    """Test that SIGTERM cancels the token and the previous handler is restored."""
+    token = test_target.CancellationToken()
+    previous_handler = signal.getsignal(signal.SIGTERM)
+    with test_target.handle_termination_signals(token):
+        os.kill(os.getpid(), signal.SIGTERM)
+        time.sleep(0.01)
+        assert token.cancelled
+        assert token.reason == "Received SIGTERM"
+    assert signal.getsignal(signal.SIGTERM) == previous_handler
@@ -0,0 +1,166 @@
+# pylint: disable=W0212
+"""Unit tests for the P4 marshal utility module."""
+import marshal
+import sys
+import textwrap
+import threading
+import time
+
+import pytest
+
+from shared import p4_connection_utility
+from shared import p4_marshal_utility as test_target
+
+FAKE_P4 = textwrap.dedent(
+    """
+    import marshal, os, sys, time
+    args = sys.argv[sys.argv.index("-G") + 1:]
+    while args[0] in ("-p", "-u", "-c", "-P", "-v", "-z"):
+        args = args[2:]
+    out = sys.stdout.buffer
+
+    def emit(**record):
+        marshal.dump(
+            {key.encode(): value if isinstance(value, int) else value.encode()
+             for key, value in record.items()},
+            out, 0)
+        out.flush()
+
+    if args[0] == "info":
+        emit(code="stat", userName="fake", serverAddress="fake:1666")
+    elif args[0] == "groups":
+        for index in range(int(args[1])):
+            emit(code="stat", group=f"group{index}", user="someone")
+            time.sleep(0.01)
+    elif args[:2] == ["group", "-o"]:
+        emit(code="stat", Group=args[2], Users0="alice", Users1="bob", MaxResults="unset")
+    elif args[:2] == ["group", "-i"]:
+        spec = marshal.load(sys.stdin.buffer)
+        users = [spec[key].decode() for key in sorted(spec) if key.startswith(b"Users")]
+        emit(code="info", data=f"Group {spec[b'Group'].decode()} saved: {','.join(users)}")
+    elif args[0] == "files":
+        emit(code="error", severity=2, generic=17, data="no such file(s).\\n")
+    elif args[0] == "password":
+        emit(code="stat", argv=" ".join(sys.argv), P4PASSWD=os.environ.get("P4PASSWD", ""))
+    elif args[0] == "sleep":
+        time.sleep(30)
+    else:
+        sys.stderr.write("Perforce client error: Connect to server failed\\n")
+        sys.exit(1)
+    """
+)
+
+
+@pytest.fixture(name="connection")
+def fixture_connection(tmp_path):
+    """Create a connected marshal connection to a fake p4 client.
+
+    Args:
+        tmp_path (fixture): a temporary directory.
+
+    Returns:
+        p4_marshal_utility.P4MarshalConnection: the connection.
+    """
+    script = tmp_path / "fake_p4.py"
+    script.write_text(FAKE_P4)
+    connection = test_target.P4MarshalConnection(
+        executable=[sys.executable, str(script)], port="fake:1666"
+    )
+    connection.connect()
+    return connection
+
+
+def test_decode_record():
+    """Test that records are decoded and numbered fields combined."""
+    record = test_target.decode_record(
+        {b"Group": b"G", b"Owners1": b"b", b"Owners0": b"a", b"level": 3}
+    )
+    assert record == {"Group": "G", "Owners": ["a", "b"], "level": 3}
+    assert marshal.loads(
+        test_target.encode_spec({"Group": "G", "Owners": ["a", "b"]})
+    ) == {b"Group": b"G", b"Owners0": b"a", b"Owners1": b"b"}
+
+
+def test_connect_and_spec_round_trip(connection):
+    """Test connecting, reading a spec and writing it back through input."""
+    assert connection.connected() is True
+    assert connection.user == "fake"
+    spec = connection.run("group", "-o", "G1")[0]
+    assert spec["Users"] == ["alice", "bob"]
+
+    spec["Users"].append("carol")
+    connection.input = [spec]
+    assert connection.run("group", "-i") == ["Group G1 saved: alice,bob,carol"]
+    assert connection.input is None
+
+
+def test_run_iter_streams(connection):
+    """Test that records are yielded before the command has finished."""
+    start = time.perf_counter()
+    results = connection.run_iter("groups", "50")
+    first = next(results)
+    first_elapsed = time.perf_counter() - start
+    remaining = list(results)
+    assert first["group"] == "group0"
+    assert len(remaining) == 49
+    assert first_elapsed < time.perf_counter() - start
+
+
+def test_errors_and_warnings(connection):
+    """Test the exception levels, and errors reported outside of -G."""
+    with pytest.raises(p4_connection_utility.P4CommandError) as error:
+        connection.run("files", "//nothing/...")
+    assert error.value.warnings == ["no such file(s)."]
+    assert connection.messages[0].generic == 17
+
+    connection.exception_level = test_target.RAISE_ERRORS
+    assert connection.run("files", "//nothing/...") == []
+
+    with pytest.raises(p4_connection_utility.P4CommandError) as error:
+        connection.run("unknown")
+    assert "Connect to server failed" in error.value.errors[0]
+
+
+def test_password_not_on_command_line(connection):
+    """Test that the password reaches p4 through P4PASSWD, not the arguments."""
+    connection.password = "s3cret"
+    result = connection.run("password")[0]
+    assert result["P4PASSWD"] == "s3cret"
+    assert "s3cret" not in result["argv"]
+    assert "-P" not in connection._command(("password",))
+
+
+def test_abort_kills_command(connection):
+    """Test that abort() kills a command that is waiting on the server."""
+    timer = threading.Timer(0.5, connection.abort)
+    timer.start()
+    start = time.perf_counter()
+    with pytest.raises(p4_connection_utility.P4CommandError):
+        connection.run("sleep")
+    assert time.perf_counter() - start < 5
+
+
+def test_break_callback_aborts(connection):
+    """Test that the break callback stops a command between records."""
+    records = []
+    connection.setbreak(lambda: len(records) < 3)
+    with pytest.raises(p4_connection_utility.P4CommandError, match="aborted"):
+        for record in connection.run_iter("groups", "50"):
+            records.append(record)
+    assert len(records) == 3
+
+
+def test_backend_selection(monkeypatch):
+    """Test that the backend is picked from the environment."""
+    monkeypatch.setenv(p4_connection_utility.BACKEND_ENVIRONMENT_VARIABLE, "marshal")
+    connection = p4_connection_utility.create_connection(port="ssl:p4:1666", user="me")
+    assert isinstance(connection, test_target.P4MarshalConnection)
+    assert connection._command(("info",))[-5:] == [
+        "-p",
+        "ssl:p4:1666",
+        "-u",
+        "me",
+        "info",
+    ]
+    with pytest.raises(ValueError):
+        p4_connection_utility.create_connection(backend="telnet")
@@ -0,0 +1,118 @@
+# Copyright (C) 2023 DNEG - All Rights reserved.
+"""Tests for shared.p4_recording_utility."""
+import gzip
+from unittest import mock
+
+import pytest
+
+from shared import p4_connection_utility
+from shared import p4_recording_utility
+
+
+def _record(path):
+    """Record a short session on a fake connection, and save it."""
+    connection = mock.Mock(user="jdoe", errors=[], warnings=[])
+    connection.run.side_effect = [
+        [{"Group": "SHOW_artists", "Owners": ["asmith"], "Users": ["jdoe", "bwong"]}],
+        [
+            {
+                "Protections": [
+                    "write user asmith * //SHOW/...",
+                    "read group SHOW_artists * //SHOW/...",
+                ]
+            }
+        ],
+        p4_connection_utility.P4CommandError(
+            "[P4.run()] Errors during command execution",
+            errors=["Depot SHOW doesn't exist."],
+        ),
+        ["Stream //SHOW/main saved."],
+    ]
+    recorder = p4_recording_utility.Recorder(path)
+    recording_connection = p4_recording_utility.RecordingConnection(
+        connection, recorder
+    )
+    recording_connection.run("group", "-o", "SHOW_artists")
+    recording_connection.run("protect", "-o")
+    with pytest.raises(p4_connection_utility.P4CommandError):
+        recording_connection.run("depot", "-d", "SHOW")
+    recording_connection.input = [
+        {
+            "Stream": "//SHOW/main",
+            "Owner": "jdoe",
+            "Description": "Created by jdoe 1/2/2023",
+        }
+    ]
+    recording_connection.run("stream", "-i")
+    recorder.save()
+    return connection
+
+
+def test_recording_scrubs_user_names(tmp_path):
+    path = str(tmp_path / "session.jsonl.gz")
+    _record(path)
+
+    with gzip.open(path, "rt", encoding="utf-8") as recording_file:
+        text = recording_file.read()
+    for name in ("jdoe", "asmith", "bwong"):
+        assert name not in text
+    recording = p4_recording_utility.Recording.load(path)
+    assert recording.header["user"] == "user1"
+    assert len(recording.entries) == 4
+    assert (
+        recording.entries[1]["results"][0]["Protections"][0]
+        == "write user user2 * //SHOW/..."
+    )
+    assert (
+        recording.entries[3]["input"][0]["Description"] == "Created by user1 1/2/2023"
+    )
+
+
+def test_replay_serves_recorded_results_and_errors(tmp_path):
+    path = str(tmp_path / "session.jsonl.gz")
+    _record(path)
+    replay = p4_recording_utility.ReplayConnection(
+        p4_recording_utility.Recording.load(path)
+    )
+    replay.connect()
+
+    # Recorded with a different group name; matched on the command's shape.
+    assert replay.run("protect", "-o")[0]["Protections"][1].startswith("read group")
+    assert replay.run("group", "-o", "OTHER_artists")[0]["Users"] == ["user1", "user3"]
+    with pytest.raises(p4_connection_utility.P4CommandError) as error:
+        replay.run("depot", "-d", "SHOW")
+    assert error.value.errors == ["Depot SHOW doesn't exist."]
+    assert replay.run("stream", "-i") == ["Stream //SHOW/main saved."]
+    assert replay.recording.remaining == 0
+    with pytest.raises(p4_connection_utility.P4CommandError):
+        replay.run("stream", "-i")
+
+
+def test_replay_scales_recorded_latency(tmp_path):
+    path = str(tmp_path / "session.jsonl.gz")
+    _record(path)
+    recording = p4_recording_utility.Recording.load(path)
+    recording.entries[1]["duration"] = 0.5
+    sleep = mock.Mock()
+    replay = p4_recording_utility.ReplayConnection(
+        recording, latency_scale=2.0, sleep=sleep
+    )
+    replay.connect()
+
+    replay.run("protect", "-o")
+
+    sleep.assert_called_once_with(1.0)
+
+
+def test_create_connection_replays_configured_recording(tmp_path, monkeypatch):
+    path = str(tmp_path / "session.jsonl.gz")
+    _record(path)
+    monkeypatch.setattr(p4_recording_utility, "_REPLAY", None)
+    monkeypatch.setenv(p4_recording_utility.REPLAY_FILE_ENVIRONMENT_VARIABLE, path)
+
+    connection = p4_connection_utility.create_connection(
+        backend=p4_connection_utility.REPLAY_BACKEND
+    )
+
+    assert isinstance(connection, p4_recording_utility.ReplayConnection)
+    assert connection.user == "user1"
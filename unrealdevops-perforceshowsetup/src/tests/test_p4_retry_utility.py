@@ -0,0 +1,212 @@
+# pylint: disable=W0212
+"""Unit tests for the P4 retry utility module."""
+from unittest.mock import MagicMock, call
+
+import pytest
+
+from shared import p4_connection_utility
+from shared import p4_retry_utility as test_target
+
+P4CommandError = p4_connection_utility.P4CommandError
+
+
+@pytest.mark.parametrize(
+    "error, expected",
+    [
+        (
+            P4CommandError("TCP receive failed.\nread: socket: WSAECONNRESET"),
+            "connection",
+        ),
+        (
+            P4CommandError("failed", errors=["Partner exited unexpectedly."]),
+            "connection",
+        ),
+        (P4CommandError("Operation took too long; over 600000 ms"), "transient"),
+        (P4CommandError("Group FOO doesn't exist."), "permanent"),
+        (P4CommandError("Replica does not support this command."), "permanent"),
+    ],
+)
+def test_classify_error(error, expected):
+    """Test that errors are classified from their messages."""
+    assert test_target.classify_error(error) == expected
+
+
+def test_classify_error_generic_code():
+    """Test that the P4API communication error code marks a connection error."""
+    message = MagicMock(generic=test_target.P4_GENERIC_COMMUNICATION_ERROR)
+    assert (
+        test_target.classify_error(P4CommandError("error"), [message]) == "connection"
+    )
+
+
+@pytest.mark.parametrize(
+    "args, expected",
+    [
+        (("protect", "-o"), test_target.READ),
+        (("depots", "-E", "FOO"), test_target.READ),
+        (("group", "-i"), test_target.IDEMPOTENT_WRITE),
+        (("group", "-d", "FOO"), test_target.IDEMPOTENT_DELETE),
+        (("stream", "--obliterate", "-y", "//FOO/main"), test_target.IDEMPOTENT_DELETE),
+        (("obliterate", "-y", "//FOO/..."), test_target.IDEMPOTENT_DELETE),
+        (("populate", "//A/...", "//B/..."), test_target.WRITE),
+    ],
+)
+def test_classify_command(args, expected):
+    """Test that commands are classified by what they do."""
+    assert test_target.classify_command(args) == expected
+
+
+def test_backoff_is_bounded():
+    """Test that the backoff grows exponentially but never exceeds the maximum."""
+    policy = test_target.RetryPolicy(base_delay=1.0, max_delay=4.0)
+    for attempt, cap in [(1, 1.0), (2, 2.0), (3, 4.0), (10, 4.0)]:
+        delays = [policy.backoff(attempt) for _ in range(50)]
+        assert all(0 <= delay <= cap for delay in delays)
+
+
+def _connection(side_effect):
+    """Build a retrying connection around a mocked P4 connection.
+
+    Args:
+        side_effect (list): the results or errors of each run call.
+
+    Returns:
+        tuple: the retrying connection, the mocked connection and mocked sleep.
+    """
+    mock_p4 = MagicMock()
+    mock_p4.messages = []
+    mock_p4.run.side_effect = side_effect
+    sleep = MagicMock()
+    return (test_target.RetryingConnection(mock_p4, sleep=sleep), mock_p4, sleep)
+
+
+def test_read_retried_with_reconnect():
+    """Test that reads are retried, reconnecting after a dropped connection."""
+    connection, mock_p4, sleep = _connection(
+        [P4CommandError("TCP receive failed."), [{"Protections": []}]]
+    )
+    assert connection.run("protect", "-o") == [{"Protections": []}]
+    assert mock_p4.run.call_count == 2
+    mock_p4.connect.assert_called_once()
+    sleep.assert_called_once()
+    assert connection.retry_count == 1
+    assert connection.retry_counts == {"connection": 1}
+
+
+def test_permanent_error_not_retried():
+    """Test that permanent errors are raised immediately."""
+    connection, mock_p4, sleep = _connection([P4CommandError("error")])
+    with pytest.raises(P4CommandError):
+        connection.run("depots", "-E", "FOO")
+    mock_p4.run.assert_called_once()
+    sleep.assert_not_called()
+    assert connection.retry_count == 0
+
+
+def test_retries_exhausted():
+    """Test that the error is raised once the policy runs out of attempts."""
+    connection, mock_p4, _ = _connection(
+        [P4CommandError("Operation took too long")] * 4
+    )
+    with pytest.raises(P4CommandError):
+        connection.run("groups")
+    assert mock_p4.run.call_count == test_target.DEFAULT_RETRY_POLICY.max_attempts
+    assert connection.retry_count == 3
+
+
+def test_spec_write_replays_input():
+    """Test that spec writes are retried with the same input."""
+    connection, mock_p4, _ = _connection(
+        [P4CommandError("TCP send failed."), ["Group FOO created"]]
+    )
+    connection.input = [{"Group": "FOO"}]
+    assert connection.run("group", "-i") == ["Group FOO created"]
+    assert mock_p4.input == [{"Group": "FOO"}]
+    assert mock_p4.run.call_count == 2
+
+
+def test_delete_already_applied():
+    """Test that a retried delete that finds nothing to delete succeeds."""
+    connection, _, _ = _connection(
+        [
+            P4CommandError("TCP receive failed."),
+            P4CommandError("Group FOO doesn't exist."),
+        ]
+    )
+    assert connection.run("group", "-d", "FOO") == []
+
+
+def test_populate_verified_before_retry():
+    """Test that populate is not run twice when its target already has files."""
+    connection, mock_p4, _ = _connection(
+        [P4CommandError("TCP receive failed."), [{"depotFile": "//B/file"}]]
+    )
+    assert connection.run("populate", "//A/...", "//B/...") == []
+    assert mock_p4.run.call_args_list == [
+        call("populate", "//A/...", "//B/..."),
+        call("files", "-m", "1", "//B/..."),
+    ]
+
+
+def test_unverifiable_write_not_retried():
+    """Test that writes which cannot be verified are not retried after a drop."""
+    connection, mock_p4, _ = _connection([P4CommandError("TCP receive failed.")])
+    with pytest.raises(P4CommandError):
+        connection.run("submit", "-d", "change")
+    mock_p4.run.assert_called_once()
+
+
+class _StreamingConnection:
+    """Connection streaming results, failing as told before or after the first one."""
+
+    def __init__(self, attempts):
+        """Construct an instance of _StreamingConnection.
+
+        Args:
+            attempts (list): for each attempt, the results to yield then the
+                error to raise, if any.
+        """
+        self.attempts = list(attempts)
+        self.messages = []
+        self.port = "ssl:perforce:1666"
+
+    def run_iter(self, *_args):
+        results, error = self.attempts.pop(0)
+        yield from results
+        if error is not None:
+            raise error
+
+    def connected(self):
+        """Report the connection as dropped."""
+        return False
+
+    def connect(self):
+        """Do nothing."""
+
+
+def test_stream_retried_before_first_result():
+    """Test that a streamed read is retried if it failed before yielding anything."""
+    connection = test_target.RetryingConnection(
+        _StreamingConnection(
+            [([], P4CommandError("TCP receive failed.")), (["a", "b"], None)]
+        ),
+        sleep=MagicMock(),
+    )
+    assert list(connection.run_iter("groups")) == ["a", "b"]
+    assert connection.retry_count == 1
+
+
+def test_stream_not_retried_after_a_result():
+    """Test that a streamed read failing part way through is not run again."""
+    connection = test_target.RetryingConnection(
+        _StreamingConnection(
+            [(["a"], P4CommandError("TCP receive failed.")), (["a"], None)]
+        ),
+        sleep=MagicMock(),
+    )
+    records = []
+    with pytest.raises(P4CommandError):
+        for record in connection.run_iter("groups"):
+            records.append(record)
+    assert records == ["a"]
+    assert connection.retry_count == 0
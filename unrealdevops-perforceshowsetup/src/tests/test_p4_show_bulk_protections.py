@@ -0,0 +1,116 @@
+# Copyright (C) 2023 DNEG - All Rights reserved.
+"""Tests for p4_show_bulk_protections."""
+import pytest
+
+import p4_show_bulk_protections
+from shared import p4_simulator_utility
+
+TABLE = [
+    "super user p4admin * //...",
+    "## START OF DEPOT SPECIFIC PERMISSIONS",
+    "write group ALPHA * //ALPHA/...",
+    "write group GAMMA * //GAMMA/...",
+    "## END OF DEPOT SPECIFIC PERMISSIONS",
+]
+
+
+@pytest.fixture(name="json_config")
+def fixture_json_config():
+    """Get a division config with one protections line.
+
+    Returns:
+        dict: the division config.
+    """
+    return {
+        "permissions": ["write group {show} * //{show}/... ## {user} {mdy_str}"],
+        "groups": {"{show}": "empty"},
+        "streams": {"//{show}/{show}-main": {"type": "mainline"}},
+    }
+
+
+def test_insert_missing_keeps_alphabetical_order():
+    update = p4_show_bulk_protections.insert_missing(
+        TABLE,
+        {
+            "ALPHA": [
+                "write group ALPHA * //ALPHA/... ## other comment",
+                "read group ALPHA-Review * //ALPHA/...",
+            ],
+            "BETA": ["write group BETA * //BETA/..."],
+            "ZETA": ["write group ZETA * //ZETA/..."],
+        },
+    )
+    assert update.added == {
+        "ALPHA": ["read group ALPHA-Review * //ALPHA/..."],
+        "BETA": ["write group BETA * //BETA/..."],
+        "ZETA": ["write group ZETA * //ZETA/..."],
+    }
+    assert update.updated == [
+        "super user p4admin * //...",
+        "## START OF DEPOT SPECIFIC PERMISSIONS",
+        "write group ALPHA * //ALPHA/...",
+        "read group ALPHA-Review * //ALPHA/...",
+        "write group BETA * //BETA/...",
+        "write group GAMMA * //GAMMA/...",
+        "write group ZETA * //ZETA/...",
+        "## END OF DEPOT SPECIFIC PERMISSIONS",
+    ]
+    diff = p4_show_bulk_protections.unified_diff(update)
+    assert "+read group ALPHA-Review * //ALPHA/..." in diff.splitlines()
+
+
+def test_insert_missing_without_changes_or_block():
+    assert (
+        p4_show_bulk_protections.insert_missing(TABLE, {"ALPHA": [TABLE[2]]}).added
+        == {}
+    )
+    with pytest.raises(ValueError):
+        p4_show_bulk_protections.insert_missing(TABLE[:1], {"ALPHA": [TABLE[2]]})
+
+
+def test_update_every_show_in_one_write(simulated_server, set_up_show, json_config):
+    server = simulated_server
+    set_up_show(
+        "SHOWA",
+        "SHOWB",
+        "SHOWC",
+        steps=("create_depot", "populate_permissions_table"),
+    )
+    new_config = dict(json_config)
+    new_config["permissions"] = json_config["permissions"] + [
+        "read group {show}-Review * //{show}/... ## {user} {mdy_str}"
+    ]
+    p4 = p4_simulator_utility.SimulatedConnection(server)
+    p4.connect()
+
+    update = p4_show_bulk_protections.plan_update(p4, {"VFX": new_config})
+    assert sorted(update.added) == ["SHOWA", "SHOWB", "SHOWC"]
+    server.command_counts.clear()
+    assert p4_show_bulk_protections.submit_update(p4, update)
+    assert server.command_counts["protect"] == 2
+
+    review = [line for line in server.protections if "-Review" in line]
+    assert [line.split()[2] for line in review] == [
+        "SHOWA-Review",
+        "SHOWB-Review",
+        "SHOWC-Review",
+    ]
+    # Each show's new line follows its existing one.
+    for show in ("SHOWA", "SHOWB", "SHOWC"):
+        index = next(
+            i for i, line in enumerate(server.protections) if f"group {show} " in line
+        )
+        assert f"{show}-Review" in server.protections[index + 1]
+    assert p4_show_bulk_protections.plan_update(p4, {"VFX": new_config}).added == {}
+
+
+def test_stale_update_is_not_submitted(simulated_server, json_config):
+    server = simulated_server
+    server.depots["SHOWA"] = {"Depot": "SHOWA", "Type": "stream"}
+    p4 = p4_simulator_utility.SimulatedConnection(server)
+    p4.connect()
+    update = p4_show_bulk_protections.plan_update(p4, {"VFX": json_config})
+    assert update.added
+    server.protections.insert(0, "read user someone * //...")
+    assert not p4_show_bulk_protections.submit_update(p4, update)
+    assert not any("SHOWA" in line for line in server.protections)
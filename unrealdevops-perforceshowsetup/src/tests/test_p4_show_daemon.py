@@ -0,0 +1,272 @@
+# Copyright (C) 2023 DNEG. All Rights Reserved.
+"""Test file for p4_show_daemon.py."""
+import json
+import threading
+import urllib.error
+import urllib.request
+from unittest.mock import MagicMock
+
+import pytest
+
+import p4_show_daemon as test_target
+import p4_show_setup as p4ss
+from shared import p4_connection_utility
+
+
+@pytest.fixture(name="job_queue")
+def fixture_job_queue(tmp_path):
+    """Create a job queue in a temporary directory.
+
+    Args:
+        tmp_path (fixture): a temporary directory.
+
+    Returns:
+        p4_show_daemon.JobQueue: the queue.
+    """
+    return test_target.JobQueue(str(tmp_path / "jobs.sqlite3"))
+
+
+@pytest.fixture(name="service")
+def fixture_service(job_queue):
+    """Create a service on a pool of mocked connections.
+
+    Args:
+        job_queue (p4_show_daemon.JobQueue): the queue.
+
+    Returns:
+        p4_show_daemon.ShowSetupService: the service, not started.
+    """
+
+    def _factory():
+        connection = MagicMock()
+        connection.connected.return_value = True
+        return connection
+
+    pool = p4_connection_utility.ConnectionPool(_factory, size=1)
+    return test_target.ShowSetupService(job_queue, workers=1, pool=pool)
+
+
+def test_queue_survives_restart(job_queue):
+    """Test that jobs are claimed in order, and persist across instances."""
+    first = job_queue.submit("apply", "SHOWA", "VFX")
+    second = job_queue.submit("audit", "SHOWB")
+    with pytest.raises(ValueError):
+        job_queue.submit("obliterate", "SHOWC")
+
+    reopened = test_target.JobQueue(job_queue.path)
+    claimed = reopened.claim()
+    assert claimed["id"] == first
+    assert claimed["status"] == test_target.RUNNING
+    reopened.finish(first, {"Depot": "SHOWA"})
+    assert reopened.get(first)["result"] == {"Depot": "SHOWA"}
+    assert reopened.claim()["id"] == second
+    assert reopened.claim() is None
+
+
+def test_recover_interrupted_jobs(job_queue):
+    """Test that interrupted audits are requeued and interrupted setups failed."""
+    setup_id = job_queue.submit("apply", "SHOWA")
+    audit_id = job_queue.submit("audit", "SHOWB")
+    job_queue.claim()
+    job_queue.claim()
+
+    assert test_target.JobQueue(job_queue.path).recover() == 2
+    assert job_queue.get(setup_id)["status"] == test_target.FAILED
+    assert "restart" in job_queue.get(setup_id)["error"]
+    assert job_queue.get(audit_id)["status"] == test_target.QUEUED
+
+
+def test_run_apply_job(service, monkeypatch):
+    """Test that apply jobs run every step on a pooled connection."""
+    steps = []
+    for step_name in p4ss.SETUP_STEPS:
+        monkeypatch.setattr(
+            p4ss.P4ShowSetup,
+            step_name,
+            lambda self, name=step_name: steps.append((name, self.p4)),
+        )
+    job_id = service.job_queue.submit("apply", "SHOWA", "VFX")
+    service.run_job(service.job_queue.claim())
+
+    assert service.job_queue.get(job_id)["status"] == test_target.SUCCEEDED
+    assert [name for name, _ in steps] == list(p4ss.SETUP_STEPS)
+    assert all(isinstance(p4, MagicMock) for _, p4 in steps)
+
+
+def test_run_failing_job_rolls_back(service, monkeypatch):
+    """Test that a failing apply job is rolled back and recorded as failed."""
+    undo = MagicMock()
+    monkeypatch.setattr(p4ss.P4ShowSetup, "create_depot", lambda self: None)
+    monkeypatch.setattr(
+        p4ss.P4ShowSetup,
+        "populate_permissions_table",
+        MagicMock(side_effect=p4_connection_utility.P4CommandError("protect failed")),
+    )
+    monkeypatch.setattr(p4ss.P4ShowSetup, "undo_show_setup", undo)
+    job_id = service.job_queue.submit("apply", "SHOWA", "VFX")
+    service.run_job(service.job_queue.claim())
+
+    job = service.job_queue.get(job_id)
+    assert job["status"] == test_target.FAILED
+    assert "protect failed" in job["error"]
+    undo.assert_called_once_with()
+
+
+def test_existing_depot_rolls_back(service, monkeypatch):
+    """Test that the bare Exception raised for an existing depot still rolls back."""
+    undo = MagicMock()
+    monkeypatch.setattr(
+        p4ss.P4ShowSetup, "create_depot", MagicMock(side_effect=Exception)
+    )
+    monkeypatch.setattr(p4ss.P4ShowSetup, "undo_show_setup", undo)
+    job_id = service.job_queue.submit("apply", "SHOWA", "VFX")
+    service.run_job(service.job_queue.claim())
+
+    assert service.job_queue.get(job_id)["status"] == test_target.FAILED
+    undo.assert_called_once_with()
+
+
+def test_jobs_for_the_same_show_run_one_at_a_time(job_queue, monkeypatch):
+    """Test that jobs for one show are serialized, and jobs for other shows are not."""
+    pool = p4_connection_utility.ConnectionPool(MagicMock, size=3)
+    service = test_target.ShowSetupService(job_queue, workers=3, pool=pool)
+    running = []
+    overlapped = []
+    first_started = threading.Event()
+    other_show_done = threading.Event()
+
+    def _audit(self):
+        overlapped.append(self.show in running)
+        running.append(self.show)
+        if self.show == "SHOWB":
+            other_show_done.set()
+        elif not first_started.is_set():
+            first_started.set()
+            assert other_show_done.wait(5)
+        running.remove(self.show)
+        return {}
+
+    monkeypatch.setattr(p4ss.P4ShowSetup, "audit", _audit)
+    jobs = [
+        job_queue.submit("audit", show, "VFX") for show in ("SHOWA", "SHOWA", "SHOWB")
+    ]
+    threads = [
+        threading.Thread(target=service.run_job, args=(job_queue.claim(),))
+        for _ in jobs
+    ]
+    threads[0].start()
+    assert first_started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert overlapped == [False, False, False]
+    assert all(
+        job_queue.get(job_id)["status"] == test_target.SUCCEEDED for job_id in jobs
+    )
+    # Locks of shows without running or waiting jobs are not kept.
+    assert not service._show_locks  # pylint: disable=W0212
+
+
+def test_submit_rejects_unknown_division(service):
+    """Test that a division missing from the configs is rejected at submit time."""
+    with pytest.raises(ValueError, match="Unknown division"):
+        service.submit("apply", "SHOWA", "XYZ")
+    assert service.job_queue.list() == []
+    assert service.submit("apply", "SHOWA", "VFX") == 1
+
+
+def test_unexpected_error_is_recorded(service, monkeypatch):
+    """Test that a job failing with an unexpected error is counted in the metrics."""
+    record_run = MagicMock()
+    monkeypatch.setattr(test_target.metrics_utility, "record_run", record_run)
+    monkeypatch.setattr(
+        service, "_execute", MagicMock(side_effect=RuntimeError("unexpected"))
+    )
+    job_id = service.job_queue.submit("apply", "SHOWA", "VFX")
+    service.run_job(service.job_queue.claim())
+
+    assert "unexpected" in service.job_queue.get(job_id)["error"]
+    record_run.assert_called_once_with("apply", False)
+
+
+def test_failed_verification_rolls_back(service, monkeypatch):
+    """Test that an apply job fails and rolls back when the permissions are not granted."""
+    undo = MagicMock()
+    for step_name in ("create_depot", "populate_permissions_table"):
+        monkeypatch.setattr(p4ss.P4ShowSetup, step_name, lambda self: None)
+    monkeypatch.setattr(
+        p4ss.P4ShowSetup, "verify_permissions", lambda self: [{"Group": "SHOWA"}]
+    )
+    create_groups = MagicMock()
+    monkeypatch.setattr(p4ss.P4ShowSetup, "create_groups", create_groups)
+    monkeypatch.setattr(p4ss.P4ShowSetup, "undo_show_setup", undo)
+    job_id = service.job_queue.submit("apply", "SHOWA", "VFX")
+    service.run_job(service.job_queue.claim())
+
+    job = service.job_queue.get(job_id)
+    assert job["status"] == test_target.FAILED
+    assert "PermissionsVerificationError" in job["error"]
+    create_groups.assert_not_called()
+    undo.assert_called_once_with()
+
+
+def test_invalid_show_job(service):
+    """Test that invalid show codes fail without connecting."""
+    job_id = service.job_queue.submit("apply", "1FOO")
+    service.run_job(service.job_queue.claim())
+    assert "start with a number" in service.job_queue.get(job_id)["error"]
+
+
+def test_http_api(service):
+    """Test submitting and reading jobs over HTTP."""
+    server = test_target.create_server(service, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base_url = "http://%s:%s" % server.server_address[:2]
+    try:
+        request = urllib.request.Request(
+            base_url + "/jobs",
+            data=json.dumps({"command": "audit", "show": "SHOWA"}).encode("utf-8"),
+            method="POST",
+        )
+        with urllib.request.urlopen(request) as response:
+            assert response.status == 202
+            job_id = json.load(response)["id"]
+        with urllib.request.urlopen(f"{base_url}/jobs/{job_id}") as response:
+            assert json.load(response)["status"] == test_target.QUEUED
+        with urllib.request.urlopen(f"{base_url}/jobs?status=queued") as response:
+            assert [job["id"] for job in json.load(response)["jobs"]] == [job_id]
+        for body in ({}, {"show": "SHOWA", "division": "XYZ"}):
+            with pytest.raises(urllib.error.HTTPError) as error:
+                urllib.request.urlopen(
+                    urllib.request.Request(
+                        base_url + "/jobs",
+                        data=json.dumps(body).encode("utf-8"),
+                        method="POST",
+                    )
+                )
+            assert error.value.code == 400
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_workers_process_queue(service, monkeypatch):
+    """Test that started workers run queued jobs, and stop cleanly."""
+    monkeypatch.setattr(test_target, "POLL_INTERVAL_SECONDS", 0.01)
+    audited = threading.Event()
+
+    def _audit(self):
+        audited.set()
+        return {}
+
+    monkeypatch.setattr(p4ss.P4ShowSetup, "audit", _audit)
+    job_id = service.job_queue.submit("audit", "SHOWA", "VFX")
+    service.start()
+    try:
+        assert audited.wait(5)
+    finally:
+        service.stop()
+    assert service.job_queue.get(job_id)["status"] == test_target.SUCCEEDED
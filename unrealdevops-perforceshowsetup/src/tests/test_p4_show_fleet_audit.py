@@ -0,0 +1,153 @@
+# Copyright (C) 2023 DNEG - All Rights reserved.
+"""Tests for p4_show_fleet_audit."""
+import pytest
+
+import p4_show_fleet_audit
+import p4_show_setup
+from shared import p4_simulator_utility
+from shared import protections_utility
+
+
+@pytest.fixture(name="json_config")
+def fixture_json_config(json_config):
+    """Copy the owners of the shows' Core group from a source group.
+
+    Args:
+        json_config (dict): the shared division config.
+
+    Returns:
+        dict: the division config.
+    """
+    json_config["groups"]["{show}-Core"] = {"Owners": [{"groups": "vp_leads"}]}
+    return json_config
+
+
+@pytest.fixture(name="source_groups")
+def fixture_source_groups():
+    """Get the source group the shows' Core group copies.
+
+    Returns:
+        dict: the group specs, by name.
+    """
+    return {"vp_leads": {"Group": "vp_leads", "Description": "", "Users": ["lead"]}}
+
+
+def test_index_protections():
+    lines_by_depot, lines_by_group = p4_show_fleet_audit.index_protections(
+        [
+            "## START OF DEPOT SPECIFIC PERMISSIONS",
+            "super user p4admin * //...",
+            "write group SHOW * //SHOW/... ## jdoe",
+            "read user jdoe * //OTHER/...",
+        ]
+    )
+    assert lines_by_depot == {
+        "SHOW": ["write group SHOW * //SHOW/... ## jdoe"],
+        "OTHER": ["read user jdoe * //OTHER/..."],
+    }
+    assert lines_by_group == {"SHOW": ["write group SHOW * //SHOW/... ## jdoe"]}
+
+
+def test_index_groups_splits_owners_and_users():
+    groups = p4_show_fleet_audit.index_groups(
+        [
+            {
+                "group": "SHOW",
+                "user": "lead",
+                "isOwner": "1",
+                "isUser": "0",
+                "isSubGroup": "0",
+            },
+            {
+                "group": "SHOW",
+                "user": "artist",
+                "isOwner": "0",
+                "isUser": "1",
+                "isSubGroup": "0",
+            },
+            {
+                "group": "SHOW",
+                "user": "SUB",
+                "isOwner": "0",
+                "isUser": "0",
+                "isSubGroup": "1",
+            },
+            "EMPTY",
+        ]
+    )
+    assert groups == {
+        "SHOW": {"Owners": {"lead"}, "Users": {"artist"}},
+        "EMPTY": {"Owners": set(), "Users": set()},
+    }
+
+
+def test_matching_fleet_has_no_differences(simulated_pool, set_up_show, json_config):
+    set_up_show("SHOWA", "SHOWB")
+    assert p4_show_fleet_audit.audit_fleet(simulated_pool, {"VFX": json_config}) == {}
+
+
+def test_audit_and_converge_agree_after_setup(
+    simulated_server, simulated_pool, set_up_show, json_config
+):
+    json_config["groups"]["{show}-Core"]["Owners"].append("tjen")
+    set_up_show("SHOWA")
+    assert simulated_server.groups["SHOWA-Core"]["Owners"] == ["lead", "tjen"]
+
+    assert p4_show_fleet_audit.audit_fleet(simulated_pool, {"VFX": json_config}) == {}
+    connection = p4_simulator_utility.SimulatedConnection(simulated_server)
+    connection.connect()
+    show_setup_instance = p4_show_setup.P4ShowSetup("SHOWA", json_config, p4=connection)
+    assert show_setup_instance.plan_converge() == {}
+
+
+def test_audit_reports_drift_per_show(
+    simulated_server, simulated_pool, set_up_show, json_config
+):
+    server = simulated_server
+    set_up_show("SHOWA", "SHOWB", "SHOWC")
+    # SHOWA lost a line and got one added by hand.
+    server.protections.remove(
+        next(
+            line
+            for line in server.protections
+            if line.startswith("read group SHOWA-Core")
+        )
+    )
+    server.protections.append("write user jdoe * //SHOWA/... ## by hand")
+    # SHOWB lost its owners and its dev stream was reparented.
+    server.groups["SHOWB-Core"]["Owners"] = []
+    server.streams["//SHOWB/SHOWB-dev"]["Parent"] = "none"
+    # SHOWC lost a group and a stream.
+    del server.groups["SHOWC"]
+    del server.streams["//SHOWC/SHOWC-dev"]
+    # Not shows.
+    server.depots["DNEG_Sandbox"] = {"Depot": "DNEG_Sandbox", "Type": "stream"}
+    server.depots["SPARE"] = {"Depot": "SPARE", "Type": "local"}
+    server.command_counts.clear()
+
+    report = p4_show_fleet_audit.audit_fleet(
+        simulated_pool, {"VFX": json_config}, page_size=2
+    )
+
+    assert [
+        protections_utility.rule_of(line) for line in report["SHOWA"]["Permissions"]
+    ] == ["read group SHOWA-Core * //VPCORE/SHOWA-Core-rel/..."]
+    assert report["SHOWA"]["Extra Permissions"] == [
+        "write user jdoe * //SHOWA/... ## by hand"
+    ]
+    assert len(report["SHOWA"]) == 2
+    assert report["SHOWB"] == {
+        "Owners": {"SHOWB-Core": ["lead"]},
+        "Mismatched Streams": ["//SHOWB/SHOWB-dev"],
+    }
+    assert report["SHOWC"] == {
+        "Groups": ["SHOWC"],
+        "Streams": ["//SHOWC/SHOWC-dev"],
+    }
+    # Bulk queries only: the streams of three shows in two pages.
+    assert server.command_counts == {
+        "depots": 1,
+        "groups": 1,
+        "protect": 1,
+        "streams": 2,
+    }
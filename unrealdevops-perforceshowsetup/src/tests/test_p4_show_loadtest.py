@@ -0,0 +1,80 @@
+# pylint: disable=W0212
+# Copyright (C) 2023 DNEG - All Rights reserved.
+"""Tests for p4_show_loadtest."""
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import p4_show_loadtest
+from shared import p4_simulator_utility
+from .conftest import SIMULATOR_NO_DELAY
+
+
+@pytest.fixture(name="json_config")
+def fixture_json_config(json_config):
+    """Give the shows one protections line and an External group copying vendors.
+
+    Args:
+        json_config (dict): the shared division config.
+
+    Returns:
+        dict: the division config.
+    """
+    json_config["permissions"] = json_config["permissions"][:1]
+    json_config["groups"] = {
+        "{show}": "empty",
+        "{show}-External": {"Owners": [{"groups": "vendors"}]},
+    }
+    return json_config
+
+
+def test_percentile():
+    values = [float(value) for value in range(1, 101)]
+    assert p4_show_loadtest.percentile(values, 0.5) == 50.0
+    assert p4_show_loadtest.percentile(values, 0.99) == 99.0
+    assert p4_show_loadtest.percentile([], 0.5) == 0.0
+
+
+def test_run_level_sets_up_every_show(json_config):
+    # One at a time, so that no setup overwrites another's protections entries.
+    report, outcomes = p4_show_loadtest.run_level(1, 3, json_config, SIMULATOR_NO_DELAY)
+
+    assert [outcome.error for outcome in outcomes] == [None, None, None]
+    assert report.concurrency == 1
+    assert report.failures == 0
+    assert report.throughput > 0
+    assert report.p50 <= report.p95 <= report.p99
+    assert all(outcome.round_trips > 0 for outcome in outcomes)
+    assert "conc" in p4_show_loadtest.format_report([report])
+
+
+def test_concurrent_operators_lose_permissions_entries(json_config):
+    timings = p4_simulator_utility.SimulatorTimings(0, 0.01, 0, 0, 0, source_files=10)
+    report, outcomes = p4_show_loadtest.run_level(8, 16, json_config, timings)
+
+    # Each setup has its own lock, as separate processes would, so their
+    # protections updates overwrite each other and verification fails them.
+    assert report.lost_permissions > 0
+    assert report.failures == sum(outcome.permissions_lost for outcome in outcomes)
+
+
+def test_setups_sharing_a_lock_keep_every_permissions_entry(json_config):
+    timings = p4_simulator_utility.SimulatorTimings(0, 0.01, 0, 0, 0, source_files=10)
+    server = p4_simulator_utility.SimulatedServer(timings)
+    protections_lock = p4_show_loadtest._OperatorLock()
+    shows = [f"SHARED{index}" for index in range(8)]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        outcomes = list(
+            executor.map(
+                lambda show: p4_show_loadtest._run_setup(
+                    server, show, json_config, protections_lock
+                ),
+                shows,
+            )
+        )
+
+    assert [outcome.error for outcome in outcomes] == [None] * 8
+    assert p4_show_loadtest._lost_permissions(server, outcomes, json_config) == 0
+    # The time spent waiting for the shared lock is counted as lock wait.
+    assert protections_lock.wait > 0
+    assert sum(outcome.lock_wait for outcome in outcomes) >= protections_lock.wait
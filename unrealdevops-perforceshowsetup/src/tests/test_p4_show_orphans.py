@@ -0,0 +1,112 @@
+# Copyright (C) 2023 DNEG - All Rights reserved.
+"""Tests for p4_show_orphans."""
+import pytest
+
+import p4_show_orphans
+
+
+@pytest.fixture(name="config_data")
+def fixture_config_data(json_config):
+    """Get the configs for every division.
+
+    Args:
+        json_config (dict): the shared division config.
+
+    Returns:
+        dict: the configs, with the shared config as the only division.
+    """
+    return {"VFX": json_config}
+
+
+def test_show_group_patterns_skip_the_bare_group(config_data):
+    patterns = p4_show_orphans.show_group_patterns(config_data)
+    assert [pattern.match("SHOW-Core").group("show") for pattern in patterns] == [
+        "SHOW"
+    ]
+    assert not any(pattern.match("SHOW") for pattern in patterns)
+
+
+def test_find_orphans(config_data):
+    report = p4_show_orphans.find_orphans(
+        depots=["LIVE", "VPCORE"],
+        groups=["LIVE", "LIVE-Core", "GONE", "GONE-Core", "ADMINS"],
+        protections=[
+            "## START OF DEPOT SPECIFIC PERMISSIONS",
+            "write group LIVE * //LIVE/...",
+            "write group GONE * //GONE/...",
+            "read group GONE-Core * //VPCORE/GONE-Core-rel/...",
+            "write user jdoe * //OLD/...",
+            "super user p4admin * //...",
+        ],
+        streams=[
+            {"Stream": "//GONE/GONE-main", "Parent": "none"},
+            {"Stream": "//GONE/GONE-dev", "Parent": "//GONE/GONE-main"},
+            {"Stream": "//LIVE/LIVE-main", "Parent": "none"},
+        ],
+        config_data=config_data,
+    )
+    assert report.groups == ["GONE", "GONE-Core"]
+    assert report.protections == [
+        "write group GONE * //GONE/...",
+        "read group GONE-Core * //VPCORE/GONE-Core-rel/...",
+        "write user jdoe * //OLD/...",
+    ]
+    assert report.stream_levels == [["//GONE/GONE-dev"], ["//GONE/GONE-main"]]
+
+
+def test_find_orphans_ignores_case(config_data):
+    report = p4_show_orphans.find_orphans(
+        depots=["SHOW"],
+        groups=["SHOW", "SHOW-Core", "GONE", "GONE-Core"],
+        protections=[
+            "write group SHOW * //show/...",
+            "write group show * //Show/main/...",
+            "read group GONE-Core * //gone/...",
+            "write group gone * //VPCORE/...",
+        ],
+        streams=[
+            {"Stream": "//show/show-main", "Parent": "none"},
+            {"Stream": "//Gone/Gone-main", "Parent": "none"},
+        ],
+        config_data=config_data,
+    )
+    assert report.groups == ["GONE", "GONE-Core"]
+    assert report.protections == [
+        "read group GONE-Core * //gone/...",
+        "write group gone * //VPCORE/...",
+    ]
+    assert report.stream_levels == [["//Gone/Gone-main"]]
+
+
+def test_scan_and_cleanup_after_partial_undo(
+    simulated_server, simulated_pool, set_up_show, config_data
+):
+    server = simulated_server
+    set_up_show("LIVE", "GONE")
+    # The template and the core release depots are not shows.
+    for depot in ("DNEG_Sandbox", "VPCORE"):
+        server.depots[depot] = {"Depot": depot, "Type": "stream"}
+    # Only the depot of GONE was removed.
+    del server.depots["GONE"]
+    protections = [line for line in server.protections if "GONE" not in line]
+    pool = simulated_pool
+
+    server.command_counts.clear()
+    report = p4_show_orphans.scan(pool, config_data)
+    assert server.command_counts == {
+        "depots": 1,
+        "groups": 1,
+        "protect": 1,
+        "streams": 1,
+    }
+    assert report.groups == ["GONE", "GONE-Core"]
+    assert len(report.protections) == 2
+    assert report.stream_levels == [["//GONE/GONE-dev"], ["//GONE/GONE-main"]]
+
+    server.command_counts.clear()
+    assert p4_show_orphans.cleanup(pool, report) == {}
+    assert server.command_counts["protect"] == 2
+    assert server.protections == protections
+    assert "GONE" not in server.groups and "LIVE" in server.groups
+    assert sorted(server.streams) == ["//LIVE/LIVE-dev", "//LIVE/LIVE-main"]
+    assert p4_show_orphans.scan(pool, config_data) == ([], [], [])
@@ -0,0 +1,107 @@
+# Copyright (C) 2023 DNEG - All Rights reserved.
+"""Tests for p4_show_owner_sync."""
+import pytest
+
+import p4_show_owner_sync
+
+
+@pytest.fixture(name="json_config")
+def fixture_json_config():
+    """Get a division config whose groups copy members from source groups.
+
+    Returns:
+        dict: the division config.
+    """
+    return {
+        "permissions": ["write group {show} * //{show}/... ## {user} {mdy_str}"],
+        "groups": {
+            "{show}": "empty",
+            "{show}-External": {"Owners": [{"groups": "vp_leads"}]},
+            "{show}-Core": {"Owners": [{"groups": "vp_core"}, "admin"]},
+        },
+        "streams": {},
+    }
+
+
+@pytest.fixture(name="source_groups")
+def fixture_source_groups():
+    """Get the source groups the show groups copy.
+
+    Returns:
+        dict: the group specs, by name.
+    """
+    return {
+        "vp_leads": {"Group": "vp_leads", "Description": "", "Users": ["lead"]},
+        "vp_core": {"Group": "vp_core", "Description": "", "Users": ["core"]},
+    }
+
+
+@pytest.fixture(name="set_up_groups")
+def fixture_set_up_groups(set_up_show):
+    """Get a function setting up the groups of shows on the simulated server.
+
+    Args:
+        set_up_show (callable): the shared show setup function.
+
+    Returns:
+        callable: takes the show codes.
+    """
+
+    def _set_up(*shows):
+        set_up_show(*shows, steps=("create_depot", "create_groups"))
+
+    return _set_up
+
+
+def test_source_index_maps_sources_to_show_groups(json_config):
+    index = p4_show_owner_sync.source_index(["SHOWA", "SHOWB"], {"VFX": json_config})
+    assert sorted(index) == ["vp_core", "vp_leads"]
+    assert [dependent.group for dependent in index["vp_leads"]] == [
+        "SHOWA-External",
+        "SHOWB-External",
+    ]
+
+
+def test_sync_rewrites_only_stale_groups(
+    simulated_server, simulated_pool, set_up_groups, json_config
+):
+    server = simulated_server
+    set_up_groups("SHOWA", "SHOWB")
+    server.groups["vp_leads"]["Users"] = ["newlead"]
+    pool = simulated_pool
+    config_data = {"VFX": json_config}
+
+    changes = p4_show_owner_sync.plan_fleet_sync(pool, config_data)
+    assert changes == {
+        "SHOWA-External": {"Owners": {"add": ["newlead"], "remove": []}},
+        "SHOWB-External": {"Owners": {"add": ["newlead"], "remove": []}},
+    }
+    server.command_counts.clear()
+    assert p4_show_owner_sync.apply_sync(pool, changes) == {}
+    # One read and one write per stale group, none for the rest.
+    assert server.command_counts == {"group": 4}
+    assert server.groups["SHOWA-External"]["Owners"] == ["lead", "newlead"]
+    assert p4_show_owner_sync.plan_fleet_sync(pool, config_data) == {}
+
+
+def test_sync_prunes_removed_members(
+    simulated_server, simulated_pool, set_up_groups, json_config
+):
+    server = simulated_server
+    set_up_groups("SHOWA")
+    server.groups["vp_leads"]["Users"] = ["newlead"]
+    server.groups["vp_core"]["Users"] = ["core2"]
+    pool = simulated_pool
+    config_data = {"VFX": json_config}
+
+    changes = p4_show_owner_sync.plan_fleet_sync(
+        pool, config_data, sources=["vp_leads"], prune=True
+    )
+    assert changes == {
+        "SHOWA-External": {"Owners": {"add": ["newlead"], "remove": ["lead"]}}
+    }
+    p4_show_owner_sync.apply_sync(pool, changes)
+    assert server.groups["SHOWA-External"]["Owners"] == ["newlead"]
+    # Literal members in the config are kept.
+    changes = p4_show_owner_sync.plan_fleet_sync(pool, config_data, prune=True)
+    assert changes == {"SHOWA-Core": {"Owners": {"add": ["core2"], "remove": ["core"]}}}
@@ -0,0 +1,91 @@
+# Copyright (C) 2023 DNEG - All Rights reserved.
+"""Tests for p4_show_protections_optimizer."""
+import p4_show_protections_optimizer
+from shared import p4_simulator_utility
+from .conftest import SIMULATOR_NO_DELAY
+
+PROTECTIONS = [
+    "super user p4admin * //...",
+    "## START OF DEPOT SPECIFIC PERMISSIONS",
+    "write group SHOW 10.* //SHOW/*-dev/... ## added by setup",
+    "write group SHOW * //SHOW/... ## added by hand",
+    "write group SHOW * //SHOW/... ## added by hand again",
+    "read group SHOW-Outgoing * //SHOW/*-outgoing/...",
+    "write group OTHER * //OTHER/...",
+    "write user jdoe * -//OTHER/secret/...",
+    "write group OTHER 10.* //OTHER/secret/...",
+    "read group OTHER 10.* //OTHER/docs/...",
+    "## END OF DEPOT SPECIFIC PERMISSIONS",
+]
+
+
+def test_analyze_finds_lines_that_change_no_access():
+    findings = p4_show_protections_optimizer.analyze(PROTECTIONS)
+    assert [(finding.index, finding.kind) for finding in findings] == [
+        (2, "shadowed"),
+        (3, "duplicate"),
+        (9, "redundant"),
+    ]
+    assert findings[0].covered_by == PROTECTIONS[4]
+
+
+def test_lines_under_an_exclusion_are_kept():
+    # jdoe is excluded from writing to the secret folder, except from 10.* hosts.
+    findings = p4_show_protections_optimizer.analyze(PROTECTIONS)
+    assert 8 not in [finding.index for finding in findings]
+
+
+def test_optimize_is_equivalent():
+    optimization = p4_show_protections_optimizer.optimize(PROTECTIONS)
+    assert len(optimization.updated) == len(PROTECTIONS) - 3
+    assert optimization.differences == []
+    assert p4_show_protections_optimizer.summary(optimization) == {
+        "Lines": [11, 8],
+        "Evaluation Cost": [29, 19],
+        "Duplicate": 1,
+        "Shadowed": 1,
+        "Redundant": 1,
+        "Access Changes": 0,
+    }
+
+
+def test_differences_catch_access_changes():
+    changed = p4_show_protections_optimizer.differences(PROTECTIONS, PROTECTIONS[:-3])
+    assert (
+        (
+            "jdoe",
+            ["OTHER", "SHOW", "SHOW-Outgoing"],
+            "10.1",
+            "//OTHER/secret/probe/file",
+        ),
+        ["branch", "list", "open", "read", "write"],
+        ["branch", "list", "open", "read"],
+    ) in changed
+
+
+def test_submit_optimization_writes_once():
+    server = p4_simulator_utility.SimulatedServer(
+        SIMULATOR_NO_DELAY, protections=PROTECTIONS
+    )
+    connection = p4_simulator_utility.SimulatedConnection(server)
+    connection.connect()
+    optimization = p4_show_protections_optimizer.plan_optimization(connection)
+    assert p4_show_protections_optimizer.submit_optimization(connection, optimization)
+    assert server.protections == optimization.updated
+    assert server.command_counts["protect"] == 3
+    # Nothing is left to optimize.
+    assert not p4_show_protections_optimizer.plan_optimization(connection).findings
+
+
+def test_submit_optimization_aborts_if_the_table_changed():
+    server = p4_simulator_utility.SimulatedServer(
+        SIMULATOR_NO_DELAY, protections=PROTECTIONS
+    )
+    connection = p4_simulator_utility.SimulatedConnection(server)
+    connection.connect()
+    optimization = p4_show_protections_optimizer.plan_optimization(connection)
+    server.protections.append("read user jdoe * //SHOW/...")
+    assert not p4_show_protections_optimizer.submit_optimization(
+        connection, optimization
+    )
+    assert server.protections[-1] == "read user jdoe * //SHOW/..."
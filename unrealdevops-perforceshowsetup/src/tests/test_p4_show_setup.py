@@ -6,9 +6,12 @@ import json
 import logging
 import os
 import pytest
+import subprocess
+import sys
 from unittest.mock import patch, call
 
 from parameterized import parameterized
+
 # Import cmds for use in mocked functions. pylint: disable=unused-import
 from P4 import P4, P4Exception  # noqa
 
@@ -16,7 +19,12 @@ from P4 import P4, P4Exception  # noqa
 
 import p4_show_setup as p4ss
 from shared import arg_parser_utility
-from .conftest import BaseUnitTestClass
+from shared import event_utility
+from shared import p4_connection_utility
+from shared import p4_retry_utility
+from shared import p4_simulator_utility
+from .conftest import BaseUnitTestClass, SIMULATOR_NO_DELAY
+
 
 class TestP4ShowSetup(BaseUnitTestClass):
     """Test wrapper class to test P4ShowSetup.
@@ -34,7 +42,7 @@ class TestP4ShowSetup(BaseUnitTestClass):
 
         # Set up test json.
         try:
-            with open('.\\config\\show_setup_configs.json', 'r') as config_file:
+            with open(".\\config\\show_setup_configs.json", "r") as config_file:
                 config_data = json.load(config_file)
         except OSError as error:
             logging.warning("Unable to open file show_setup_configs.json: %s", error)
@@ -49,14 +57,11 @@ class TestP4ShowSetup(BaseUnitTestClass):
         self.mock_warning = self.create_patch(
             "tests.test_p4_show_setup.p4ss.logging.warning"
         )
-        self.mock_info = self.create_patch(
-            "tests.test_p4_show_setup.p4ss.logging.info"
-        )
+        self.mock_info = self.create_patch("tests.test_p4_show_setup.p4ss.logging.info")
         self.mock_debug = self.create_patch(
             "tests.test_p4_show_setup.p4ss.logging.debug"
         )
 
-
     def test_init_success(self):
         """Test the __init__ function of P4ShowSetup."""
         show_setup_instance = p4ss.P4ShowSetup("TESTDPT", self.json_config)
@@ -64,14 +69,16 @@ class TestP4ShowSetup(BaseUnitTestClass):
         assert show_setup_instance.json_config == self.json_config
         assert show_setup_instance.result == {}
 
-# Ignore use of protected functions for testing. pylint: disable=W0212
-    @parameterized.expand([
-        [123, "Show code data type invalid: <class 'int'>"],
-        ["", "Show code can not be empty"],
-        ["1FOO", "Show code can not start with a number"],
-        ["F", "Show code length must be at least 2 characters"],
-        ["TEST", "TEST is a precious name and can not be used as a show code"]
-    ])
+    # Ignore use of protected functions for testing. pylint: disable=W0212
+    @parameterized.expand(
+        [
+            [123, "Show code data type invalid: <class 'int'>"],
+            ["", "Show code can not be empty"],
+            ["1FOO", "Show code can not start with a number"],
+            ["F", "Show code length must be at least 2 characters"],
+            ["TEST", "TEST is a precious name and can not be used as a show code"],
+        ]
+    )
     def test_validate_show_fails(self, showcode, err_msg):
         """Test a variety of invalid showcodes.
 
@@ -91,19 +98,22 @@ class TestP4ShowSetup(BaseUnitTestClass):
         """Test successful creation of show depot."""
         show = "TESTDEPOT"
         user = "tester"
-        self.mock_p4_run.side_effect = [[],
-            [{
-                'Depot': show,
-                'Owner': user,
-                'Date': '2023/07/27 17:04:32',
-                'Description': f'Created by {user}.\n',
-                'Type': 'local',
-                'Address': 'local',
-                'Suffix': '.p4s',
-                'StreamDepth': f'//{show}/1',
-                'Map': f'{show}/...'
-            }],
-            [f'Depot {show} saved.']
+        self.mock_p4_run.side_effect = [
+            [],
+            [
+                {
+                    "Depot": show,
+                    "Owner": user,
+                    "Date": "2023/07/27 17:04:32",
+                    "Description": f"Created by {user}.\n",
+                    "Type": "local",
+                    "Address": "local",
+                    "Suffix": ".p4s",
+                    "StreamDepth": f"//{show}/1",
+                    "Map": f"{show}/...",
+                }
+            ],
+            [f"Depot {show} saved."],
         ]
         show_setup_instance = p4ss.P4ShowSetup(show, self.json_config)
         show_setup_instance.create_depot()
@@ -112,13 +122,10 @@ class TestP4ShowSetup(BaseUnitTestClass):
         run_calls = [
             call("depots", "-E", show),
             call("depot", "-o", show),
-            call("depot", "-i")
+            call("depot", "-i"),
         ]
         self.mock_p4_run.assert_has_calls(run_calls)
-        info_calls = [
-            call("Creating perforce depot"),
-            call(["Depot TESTDEPOT saved."])
-        ]
+        info_calls = [call("Creating perforce depot"), call(["Depot TESTDEPOT saved."])]
         self.mock_info.assert_has_calls(info_calls)
         self.mock_debug.assert_called_once_with("Checking for duplicate depot")
         self.mock_error.assert_not_called()
@@ -151,18 +158,24 @@ class TestP4ShowSetup(BaseUnitTestClass):
         self.mock_debug.assert_called_once_with("Checking for duplicate depot")
         self.mock_error.assert_called_once()
 
-    @parameterized.expand([
-        [[{
-            "Protections": [
-                "write group line1 10.* //line1/*-dev/...## Internal content",
-                "write group line2 10.* //line2/*-dev/...## Internal content",
-                "## START OF DEPOT SPECIFIC PERMISSIONS",
-                "write group line3 10.* //line3/*-dev/...## Internal content",
-                "## END OF DEPOT SPECIFIC PERMISSIONS",
-                "write group line4 10.* //line4/*-dev/...## Internal content",
-            ]
-        }]],
-    ])
+    @parameterized.expand(
+        [
+            [
+                [
+                    {
+                        "Protections": [
+                            "write group line1 10.* //line1/*-dev/...## Internal content",
+                            "write group line2 10.* //line2/*-dev/...## Internal content",
+                            "## START OF DEPOT SPECIFIC PERMISSIONS",
+                            "write group line3 10.* //line3/*-dev/...## Internal content",
+                            "## END OF DEPOT SPECIFIC PERMISSIONS",
+                            "write group line4 10.* //line4/*-dev/...## Internal content",
+                        ]
+                    }
+                ]
+            ],
+        ]
+    )
     def test_populate_perms_success(self, curr_permissions):
         """Test populating the permissions table successfully.
 
@@ -177,7 +190,9 @@ class TestP4ShowSetup(BaseUnitTestClass):
 
         for line in self.json_config["permissions"]:
             expected_permissions.append(
-                ((line.replace("{show}", show)).replace("{user}", self.user)).replace("{mdy_str}", self.mdy_str)
+                ((line.replace("{show}", show)).replace("{user}", self.user)).replace(
+                    "{mdy_str}", self.mdy_str
+                )
             )
 
         show_setup_instance.populate_permissions_table()
@@ -185,39 +200,53 @@ class TestP4ShowSetup(BaseUnitTestClass):
         assert show_setup_instance.result == {"Permissions": expected_permissions}
         self.mock_p4_run.assert_any_call("protect", "-o")
         self.mock_p4_run.assert_any_call("protect", "-i")
-        self.mock_info.assert_any_call("Populating permissions table with new permissions")
+        self.mock_info.assert_any_call(
+            "Populating permissions table with new permissions"
+        )
         assert self.mock_info.call_count == 2 + len(expected_permissions)
         debug_calls = [
             call("Grabbing configurated permissions from json"),
             call("Checking for duplicate permissions"),
-            call("Loading permissions changes back into permissions table")
+            call("Loading permissions changes back into permissions table"),
         ]
         self.mock_debug.assert_has_calls(debug_calls)
         self.mock_error.assert_not_called()
 
-    @parameterized.expand([
-        [[{
-            "Protections": [
-                "line1",
-                "line2"
-                "line3",
-                "## END OF DEPOT SPECIFIC PERMISSIONS",
-                "line4",
-            ]
-        }], "Permissions table is missing '## START OF DEPOT SPECIFIC PERMISSIONS'.\n"
-            "Cancelling process to avoid conflicts. Please verify permissions table."],
-        [[{
-            "Protections": [
-                "line1",
-                "line2"
-                "## START OF DEPOT SPECIFIC PERMISSIONS",
-                "write group GroupName 10.* //TESTPERMS/*-dev/...##",
-                "## END OF DEPOT SPECIFIC PERMISSIONS",
-                "line4",
-            ]
-        }], "Some permissions for this show already exist.\n"
-            "Cancelling process to avoid conflicts. Please verify permissions table."],
-    ])
+    @parameterized.expand(
+        [
+            [
+                [
+                    {
+                        "Protections": [
+                            "line1",
+                            "line2",
+                            "line3",
+                            "## END OF DEPOT SPECIFIC PERMISSIONS",
+                            "line4",
+                        ]
+                    }
+                ],
+                "Permissions table is missing '## START OF DEPOT SPECIFIC PERMISSIONS'.\n"
+                "Cancelling process to avoid conflicts. Please verify permissions table.",
+            ],
+            [
+                [
+                    {
+                        "Protections": [
+                            "line1",
+                            "line2",
+                            "## START OF DEPOT SPECIFIC PERMISSIONS",
+                            "write group GroupName 10.* //TESTPERMS/*-dev/...##",
+                            "## END OF DEPOT SPECIFIC PERMISSIONS",
+                            "line4",
+                        ]
+                    }
+                ],
+                "Some permissions for this show already exist.\n"
+                "Cancelling process to avoid conflicts. Please verify permissions table.",
+            ],
+        ]
+    )
     def test_populate_permissions_fails(self, curr_permissions, warning_msg):
         """Test adding permissions to table fails.
 
@@ -234,10 +263,12 @@ class TestP4ShowSetup(BaseUnitTestClass):
         assert show_setup_instance.result == {}
 
         self.mock_p4_run.assert_called_once_with("protect", "-o")
-        self.mock_info.assert_called_once_with("Populating permissions table with new permissions")
+        self.mock_info.assert_called_once_with(
+            "Populating permissions table with new permissions"
+        )
         debug_calls = [
             call("Grabbing configurated permissions from json"),
-            call("Checking for duplicate permissions")
+            call("Checking for duplicate permissions"),
         ]
         self.mock_debug.assert_has_calls(debug_calls)
         self.mock_error.assert_any_call(warning_msg)
@@ -259,26 +290,32 @@ class TestP4ShowSetup(BaseUnitTestClass):
         assert show_setup_instance.result == {}
 
         self.mock_p4_run.assert_called_once_with("protect", "-o")
-        self.mock_info.assert_called_once_with("Populating permissions table with new permissions")
-        self.mock_debug.assert_called_once_with("Grabbing configurated permissions from json")
+        self.mock_info.assert_called_once_with(
+            "Populating permissions table with new permissions"
+        )
+        self.mock_debug.assert_called_once_with(
+            "Grabbing configurated permissions from json"
+        )
         self.mock_error.assert_called_once()
 
     def test_create_groups_success(self):
         """Test adding groups."""
         show = "TESTGROUPS"
         self.mock_p4_run.side_effect = [
-            [{'Group': show, 'Description': ''}],
+            [{"Group": show, "Description": ""}],
             [f"Group {show} created"],
-            [{'Group': f'{show}-External', 'Description': ''}],
-            [{'Group': 'dnegvp_volume', 'Users': ['tjen', 'empty']}],
+            [{"Group": f"{show}-External", "Description": ""}],
+            [{"Group": "dnegvp_volume", "Users": ["tjen", "empty"]}],
             [f"Group {show}-External created"],
-            [{'Group': f'{show}-Main', 'Description': ''}],
-            [{'Group': 'dnegvp_volume', 'Users': ['tjen', 'empty']}],
+            [{"Group": f"{show}-Main", "Description": ""}],
+            [{"Group": "dnegvp_volume", "Users": ["tjen", "empty"]}],
             [f"Group {show}-Main created"],
-            [{'Group': f'{show}-Main-External', 'Description': ''}],
+            [{"Group": f"{show}-Main-External", "Description": ""}],
             [f"Group {show}-Main-External created"],
         ]
-        expected_groups = [key.replace("{show}", show) for key in self.json_config["groups"]]
+        expected_groups = [
+            key.replace("{show}", show) for key in self.json_config["groups"]
+        ]
         show_setup_instance = p4ss.P4ShowSetup(show, self.json_config)
         show_setup_instance.create_groups()
         assert show_setup_instance.result == {"Groups": expected_groups}
@@ -292,25 +329,28 @@ class TestP4ShowSetup(BaseUnitTestClass):
         show = "TESTGROUPS"
         empty_description = "Default description"
         self.mock_p4_run.side_effect = [
-            [{'Group': show, 'Description': ''}],
+            [{"Group": show, "Description": "", "Users": ["empty"]}],
             [f"Group {show} updated"],
-            [{'Group': f'{show}-External', 'Description': empty_description}],
-            [{'Group': 'dnegvp_volume', 'Users': ['tjen', 'empty']}],
+            [{"Group": f"{show}-External", "Description": empty_description}],
+            [{"Group": "dnegvp_volume", "Users": ["tjen", "empty"]}],
             [f"Group {show}-External created"],
-            [{'Group': f'{show}-Main', 'Description': ''}],
-            [{'Group': 'dnegvp_volume', 'Users': ['tjen', 'empty']}],
+            [{"Group": f"{show}-Main", "Description": "", "Users": ["empty"]}],
+            [{"Group": "dnegvp_volume", "Users": ["tjen", "empty"]}],
             [f"Group {show}-Main updated"],
-            [{'Group': f'{show}-Main-External', 'Description': ''}],
+            [{"Group": f"{show}-Main-External", "Description": ""}],
             [f"Group {show}-Main-External created"],
         ]
 
-        expected_groups = [f'{show}-External', f'{show}-Main-External']
+        expected_groups = [f"{show}-External", f"{show}-Main-External"]
         show_setup_instance = p4ss.P4ShowSetup(show, self.json_config)
         show_setup_instance.create_groups()
         assert show_setup_instance.result == {"Groups": expected_groups}
         assert self.mock_p4_run.call_count == 10
         assert self.mock_info.call_count == 1 + (2 * len(self.json_config["groups"]))
-        assert self.mock_debug.call_count == 1 + (4 * len(self.json_config["groups"])) + 2 + 3 + 6
+        assert (
+            self.mock_debug.call_count
+            == 1 + (4 * len(self.json_config["groups"])) + 2 + 3 + 6
+        )
         self.mock_error.assert_not_called()
 
     def test_create_groups_exception(self):
@@ -319,17 +359,17 @@ class TestP4ShowSetup(BaseUnitTestClass):
         user = ["test_user"]
         empty_description = "Default description"
         self.mock_p4_run.side_effect = [
-            [{'Group': show, 'Description': empty_description}],
+            [{"Group": show, "Description": empty_description}],
             [f"Group {show} created"],
-            [{'Group': f'{show}-External', 'Description': ''}],
-            [{'Group': 'dnegvp_volume', 'Users': ['tjen', 'empty']}],
+            [{"Group": f"{show}-External", "Description": ""}],
+            [{"Group": "dnegvp_volume", "Users": ["tjen", "empty"]}],
             [f"Group {show}-External created"],
-            [{'Group': f'{show}-Main', 'Description': ''}],
-            [{'Group': 'dnegvp_volume', 'Users': ['tjen', 'empty']}],
+            [{"Group": f"{show}-Main", "Description": ""}],
+            [{"Group": "dnegvp_volume", "Users": ["tjen", "empty"]}],
             [f"Group {show}-Main created"],
-            P4Exception("error")
+            P4Exception("error"),
         ]
-        expected_groups = [show, f'{show}-External', f'{show}-Main']
+        expected_groups = [show, f"{show}-External", f"{show}-Main"]
         show_setup_instance = p4ss.P4ShowSetup(show, self.json_config)
         show_setup_instance.create_groups()
         assert show_setup_instance.result == {"Groups": expected_groups}
@@ -340,62 +380,74 @@ class TestP4ShowSetup(BaseUnitTestClass):
         description = f"Created by {self.user} {self.mdy_str} \n"
         show = "TESTSTREAMS"
         self.mock_p4_run.side_effect = [
-            [{
-                'Stream': f'//{show}/{show}-main',
-                'Owner': {self.user},
-                'Name': f'{show}-main',
-                'Parent': 'none', 'Type': 'development',
-                'Description': description,
-                'Options': 'allsubmit unlocked toparent fromparent mergedown',
-                'ParentView': 'inherit'
-            }],
-            [f'Stream //{show}/{show}-main saved.'],
-            [{'fileCount': '1498', 'change': '138'}],
-            [{
-                'Stream': f'//{show}/{show}-dev',
-                'Owner': {self.user},
-                'Name': f'{show}-dev',
-                'Parent': 'none',
-                'Type': 'development',
-                'Description': description,
-                'Options': 'allsubmit unlocked toparent fromparent mergedown',
-                'ParentView': 'inherit'
-            }],
-            [f'Stream //{show}/{show}-dev saved.'],
-            [{
-                'Branch': 'placeholder2',
-                'Owner': {self.user},
-                'Description': description,
-                'Options': 'unlocked',
-                'View': [f'//{show}/{show}-dev/... //{show}/{show}-main/...']
-            }],
-            [{
-                'Stream': f'//{show}/{show}-incoming',
-                'Owner': {self.user},
-                'Name': f'{show}-incoming',
-                'Parent': 'none',
-                'Type': 'development',
-                'Description': description,
-                'Options': 'allsubmit unlocked toparent fromparent mergedown',
-                'ParentView': 'inherit'
-            }],
-            [f'Stream //{show}/{show}-incoming saved.'],
-            [{
-                'Stream': f'//{show}/{show}-outgoing',
-                'Owner': {self.user},
-                'Name': f'{show}-outgoing',
-                'Parent': 'none', 'Type': 'development',
-                'Description': description,
-                'Options': 'allsubmit unlocked toparent fromparent mergedown',
-                'ParentView': 'inherit'
-            }],
-            [f'Stream //{show}/{show}-outgoing saved.'],
+            [
+                {
+                    "Stream": f"//{show}/{show}-main",
+                    "Owner": {self.user},
+                    "Name": f"{show}-main",
+                    "Parent": "none",
+                    "Type": "development",
+                    "Description": description,
+                    "Options": "allsubmit unlocked toparent fromparent mergedown",
+                    "ParentView": "inherit",
+                }
+            ],
+            [f"Stream //{show}/{show}-main saved."],
+            [{"fileCount": "1498", "change": "138"}],
+            [
+                {
+                    "Stream": f"//{show}/{show}-dev",
+                    "Owner": {self.user},
+                    "Name": f"{show}-dev",
+                    "Parent": "none",
+                    "Type": "development",
+                    "Description": description,
+                    "Options": "allsubmit unlocked toparent fromparent mergedown",
+                    "ParentView": "inherit",
+                }
+            ],
+            [f"Stream //{show}/{show}-dev saved."],
+            [
+                {
+                    "Branch": "placeholder2",
+                    "Owner": {self.user},
+                    "Description": description,
+                    "Options": "unlocked",
+                    "View": [f"//{show}/{show}-dev/... //{show}/{show}-main/..."],
+                }
+            ],
+            [
+                {
+                    "Stream": f"//{show}/{show}-incoming",
+                    "Owner": {self.user},
+                    "Name": f"{show}-incoming",
+                    "Parent": "none",
+                    "Type": "development",
+                    "Description": description,
+                    "Options": "allsubmit unlocked toparent fromparent mergedown",
+                    "ParentView": "inherit",
+                }
+            ],
+            [f"Stream //{show}/{show}-incoming saved."],
+            [
+                {
+                    "Stream": f"//{show}/{show}-outgoing",
+                    "Owner": {self.user},
+                    "Name": f"{show}-outgoing",
+                    "Parent": "none",
+                    "Type": "development",
+                    "Description": description,
+                    "Options": "allsubmit unlocked toparent fromparent mergedown",
+                    "ParentView": "inherit",
+                }
+            ],
+            [f"Stream //{show}/{show}-outgoing saved."],
         ]
         expected_streams = [
-            f'//{show}/{show}-main',
-            f'//{show}/{show}-dev',
-            f'//{show}/{show}-incoming',
-            f'//{show}/{show}-outgoing'
+            f"//{show}/{show}-main",
+            f"//{show}/{show}-dev",
+            f"//{show}/{show}-incoming",
+            f"//{show}/{show}-outgoing",
         ]
         result = p4ss._create_initial_streams(show, self.json_config["streams"])
         self.assertEqual(result, expected_streams)
@@ -407,96 +459,104 @@ class TestP4ShowSetup(BaseUnitTestClass):
         objs_to_remove = {
             "Depot": show,
             "Permissions": [
-                (f"write group {show} 10.* //{show}/*-dev/...## Internal content "
-                    f"creation access - {self.user} {self.mdy_str}"),
-                (f"write group {show}-External * //{show}/*-dev/...## External "
-                    f"content creation access - {self.user} {self.mdy_str}"),
-                (f"write group {show}-Incoming * //{show}/*-incoming/...## External "
+                (
+                    f"write group {show} 10.* //{show}/*-dev/...## Internal content "
+                    f"creation access - {self.user} {self.mdy_str}"
+                ),
+                (
+                    f"write group {show}-External * //{show}/*-dev/...## External "
+                    f"content creation access - {self.user} {self.mdy_str}"
+                ),
+                (
+                    f"write group {show}-Incoming * //{show}/*-incoming/...## External "
                     f"write access for incoming client data - {self.user} "
-                    f"{self.mdy_str}"),
-                (f"read group {show}-Outgoing * //{show}/*-outgoing/...## External "
+                    f"{self.mdy_str}"
+                ),
+                (
+                    f"read group {show}-Outgoing * //{show}/*-outgoing/...## External "
                     f"read-only access for outgoing client data - {self.user} "
-                    f"{self.mdy_str}"),
-                (f"write group {show}-Production * //{show}/...## Production "
-                    f"management access for the depot - {self.user} {self.mdy_str}"),
-                (f"write group {show}-Build-External * //{show}/...## DNEGVP "
-                    f"external OSS access - {self.user} {self.mdy_str}"),
-                (f"admin user {show}_LEDWall * //{show}/...## DNEGVP LED Wall user -"
-                    f" {self.user} {self.mdy_str}"),
-                (f"owner group dnegvp_volume * //{show}/...## Granting sub-permissions"
-                    f" access for DNEG VP - {self.user} {self.mdy_str}"),
+                    f"{self.mdy_str}"
+                ),
+                (
+                    f"write group {show}-Production * //{show}/...## Production "
+                    f"management access for the depot - {self.user} {self.mdy_str}"
+                ),
+                (
+                    f"write group {show}-Build-External * //{show}/...## DNEGVP "
+                    f"external OSS access - {self.user} {self.mdy_str}"
+                ),
+                (
+                    f"admin user {show}_LEDWall * //{show}/...## DNEGVP LED Wall user -"
+                    f" {self.user} {self.mdy_str}"
+                ),
+                (
+                    f"owner group dnegvp_volume * //{show}/...## Granting sub-permissions"
+                    f" access for DNEG VP - {self.user} {self.mdy_str}"
+                ),
             ],
             "Groups": [
                 show,
-                f'{show}-External',
-                f'{show}-Incoming',
-                f'{show}-Outgoing',
-                f'{show}-Production',
-                f'{show}-Build-External'
+                f"{show}-External",
+                f"{show}-Incoming",
+                f"{show}-Outgoing",
+                f"{show}-Production",
+                f"{show}-Build-External",
             ],
             "Streams": [
-                f'//{show}/{show}-main',
-                f'//{show}/{show}-dev',
-                f'//{show}/{show}-incoming',
-                f'//{show}/{show}-outgoing'
-            ]
+                f"//{show}/{show}-main",
+                f"//{show}/{show}-dev",
+                f"//{show}/{show}-incoming",
+                f"//{show}/{show}-outgoing",
+            ],
         }
-        p4ss._undo_show_setup(objs_to_remove)
+        show_setup_instance = p4ss.P4ShowSetup(show, self.json_config)
+        show_setup_instance.result = objs_to_remove
+        show_setup_instance.undo_show_setup()
+        # protect -o/-i, files, obliterate and depot -d, then one command per
+        # group and stream.
         assert self.mock_p4_run.call_count == (
-            3 + len(objs_to_remove['Groups']) + (2 * len(objs_to_remove['Streams']))
+            5 + len(objs_to_remove["Groups"]) + len(objs_to_remove["Streams"])
         )
-        for stream in objs_to_remove['Streams']:
-            self.mock_p4_run.assert_any_call("stream", "--obliterate -y", stream)
+        for stream in objs_to_remove["Streams"]:
             self.mock_p4_run.assert_any_call("stream", "-d", stream)
-        for group in objs_to_remove['Groups']:
-            self.mock_p4_run.assert_any_call("group", f"-d {group}")
+        for group in objs_to_remove["Groups"]:
+            self.mock_p4_run.assert_any_call("group", "-d", group)
         self.mock_p4_run.assert_any_call("protect", "-o")
         self.mock_p4_run.assert_any_call("protect", "-i")
-        self.mock_p4_run.assert_any_call("depot", f"-d {show}")
-        assert self.mock_info.call_count == (
-            5 + len(objs_to_remove["Groups"]) + len(objs_to_remove["Streams"])
-        )
+        self.mock_p4_run.assert_any_call("files", "-m", "1", f"//{show}/...")
+        self.mock_p4_run.assert_any_call("obliterate", "-y", f"//{show}/...")
+        self.mock_p4_run.assert_any_call("depot", "-d", show)
+        assert self.mock_p4_run.mock_calls[-1] == call("depot", "-d", show)
 
     def test_partial_undo_show_setup(self):
-        """Test deleting the depot, permissions, and streams."""
+        """Test that undo skips the steps that did not get to create anything."""
         show = "TESTUNDO"
         objs_to_remove = {
             "Depot": show,
-            "Permissions": [
-                (f"write group {show} 10.* //{show}/*-dev/...## Internal content "
-                    f"creation access - {self.user} {self.mdy_str}"),
-                (f"write group {show}-Incoming * //{show}/*-incoming/...## External "
-                    f"write access for incoming client data - {self.user} "
-                    f"{self.mdy_str}"),
-                (f"write group {show}-Production * //{show}/...## Production "
-                    f"management access for the depot - {self.user} {self.mdy_str}"),
-                (f"write group {show}-Build-External * //{show}/...## DNEGVP "
-                    f"external OSS access - {self.user} {self.mdy_str}"),
-                (f"owner group dnegvp_volume * //{show}/...## Granting sub-permissions"
-                    f" access for DNEG VP - {self.user} {self.mdy_str}"),
-            ],
             "Groups": [
                 show,
-                f'{show}-External',
-                f'{show}-Incoming',
+                f"{show}-External",
+                f"{show}-Incoming",
             ],
-            "Streams": [
-                f'//{show}/{show}-main',
-                f'//{show}/{show}-dev',
-            ]
         }
-        p4ss._undo_show_setup(objs_to_remove)
-        assert self.mock_p4_run.call_count == (
-            3 + len(objs_to_remove['Groups']) + (2 * len(objs_to_remove['Streams']))
-        )
-        for stream in objs_to_remove['Streams']:
-            self.mock_p4_run.assert_any_call("stream", "--obliterate -y", stream)
-            self.mock_p4_run.assert_any_call("stream", "-d", stream)
-        for group in objs_to_remove['Groups']:
-            self.mock_p4_run.assert_any_call("group", f"-d {group}")
-        self.mock_p4_run.assert_any_call("protect", "-o")
-        self.mock_p4_run.assert_any_call("protect", "-i")
-        self.mock_p4_run.assert_any_call("depot", f"-d {show}")
+
+        def run(*args):
+            if args[0] == "files":
+                raise P4Exception(f"//{show}/... - no such file(s).")
+            return [f"{args[0]} done"]
+
+        self.mock_p4_run.side_effect = run
+        show_setup_instance = p4ss.P4ShowSetup(show, self.json_config)
+        show_setup_instance.result = objs_to_remove
+        show_setup_instance.undo_show_setup()
+        assert self.mock_p4_run.call_count == 2 + len(objs_to_remove["Groups"])
+        for group in objs_to_remove["Groups"]:
+            self.mock_p4_run.assert_any_call("group", "-d", group)
+        self.mock_p4_run.assert_any_call("depot", "-d", show)
+        called = {mock_call[1][0] for mock_call in self.mock_p4_run.mock_calls}
+        assert not called & {"protect", "obliterate", "stream"}
+
+
 # pylint: enable=W0212
 
 
@@ -516,7 +576,9 @@ class TestRunP4Setup(BaseUnitTestClass):
         # Set up mocking functions.
         self.mock_input = self.create_patch("tests.test_p4_show_setup.p4ss.input")
         self.mock_validate_show = self.create_patch("p4_show_setup._validate_show")
-        self.mock_setup_p4_instance = self.create_patch("p4_show_setup._setup_p4_instance")
+        self.mock_setup_p4_instance = self.create_patch(
+            "p4_show_setup._setup_p4_instance"
+        )
         self.mock_create_depot = self.create_patch("p4_show_setup._create_depot")
         self.mock_populate_permissions = self.create_patch(
             "p4_show_setup._populate_permissions_table"
@@ -525,7 +587,9 @@ class TestRunP4Setup(BaseUnitTestClass):
         self.mock_create_initial_streams = self.create_patch(
             "p4_show_setup._create_initial_streams"
         )
-        self.mock_cleanup_p4_instance = self.create_patch("p4_show_setup._cleanup_p4_instance")
+        self.mock_cleanup_p4_instance = self.create_patch(
+            "p4_show_setup._cleanup_p4_instance"
+        )
         self.mock_undo = self.create_patch("p4_show_setup._undo_show_setup")
         self.mock_error = self.create_patch(
             "tests.test_p4_show_setup.p4ss.logging.error"
@@ -533,15 +597,13 @@ class TestRunP4Setup(BaseUnitTestClass):
         self.mock_warning = self.create_patch(
             "tests.test_p4_show_setup.p4ss.logging.warning"
         )
-        self.mock_info = self.create_patch(
-            "tests.test_p4_show_setup.p4ss.logging.info"
-        )
+        self.mock_info = self.create_patch("tests.test_p4_show_setup.p4ss.logging.info")
         self.mock_debug = self.create_patch(
             "tests.test_p4_show_setup.p4ss.logging.debug"
         )
 
         try:
-            with open('.\\config\\show_setup_configs.json', 'r') as self.config_file:
+            with open(".\\config\\show_setup_configs.json", "r") as self.config_file:
                 self.config_data = json.load(self.config_file)
         except OSError as error:
             logging.warning("Unable to open file show_setup_configs.json: %s", error)
@@ -552,11 +614,11 @@ class TestRunP4Setup(BaseUnitTestClass):
             "tests.test_p4_show_setup.p4ss.json.load"
         )
 
-
-    @patch('argparse.ArgumentParser.parse_args',
+    @patch(
+        "argparse.ArgumentParser.parse_args",
         return_value=arg_parser_utility.argparse.Namespace(
             show="TESTRUN", users=["test1"], division="TESTDIV"
-        )
+        ),
     )
     def test_success(self, mock_args):
         """Test that run_P4_show_setup succeeds if given all valid values.
@@ -572,30 +634,40 @@ class TestRunP4Setup(BaseUnitTestClass):
         self.mock_setup_p4_instance.return_value = None
         self.mock_create_depot.return_value = show
         self.mock_populate_permissions.return_value = [
-            (f"write group {show} 10.* //{show}/...## Only for those who need "
-                f"access to the entire depot - {self.user} {self.mdy_str}"),
-            (f"write group {show}-External * //{show}/...## Only for those who need"
-                f" access to the entire depot - {self.user} {self.mdy_str}"),
-            (f"write group {show}-Main 10.* //{show}/*-main/...## For those who "
+            (
+                f"write group {show} 10.* //{show}/...## Only for those who need "
+                f"access to the entire depot - {self.user} {self.mdy_str}"
+            ),
+            (
+                f"write group {show}-External * //{show}/...## Only for those who need"
+                f" access to the entire depot - {self.user} {self.mdy_str}"
+            ),
+            (
+                f"write group {show}-Main 10.* //{show}/*-main/...## For those who "
                 f"need to manage data transfers to or from the mainline - "
-                f"{self.user} {self.mdy_str}"),
-            (f"write group {show}-Main-External * //{show}/*-main/...## For those "
+                f"{self.user} {self.mdy_str}"
+            ),
+            (
+                f"write group {show}-Main-External * //{show}/*-main/...## For those "
                 f"who need to manage data transfers to or from the mainline - "
-                f"{self.user} {self.mdy_str}"),
-            (f"write group dnegvp_volume * //{show}/...## Granting sub-permissions "
-                f"access for DNEG VP - {self.user} {self.mdy_str}")
+                f"{self.user} {self.mdy_str}"
+            ),
+            (
+                f"write group dnegvp_volume * //{show}/...## Granting sub-permissions "
+                f"access for DNEG VP - {self.user} {self.mdy_str}"
+            ),
         ]
         self.mock_create_groups.return_value = [
             show,
-            f'{show}-External',
-            f'{show}-Main',
-            f'{show}-Main-External'
+            f"{show}-External",
+            f"{show}-Main",
+            f"{show}-Main-External",
         ]
         self.mock_create_initial_streams.return_value = [
-            f'//{show}/{show}-main',
-            f'//{show}/{show}-dev',
-            f'//{show}/{show}-incoming',
-            f'//{show}/{show}-outgoing'
+            f"//{show}/{show}-main",
+            f"//{show}/{show}-dev",
+            f"//{show}/{show}-incoming",
+            f"//{show}/{show}-outgoing",
         ]
 
         p4ss.run_p4_show_setup()
@@ -605,17 +677,13 @@ class TestRunP4Setup(BaseUnitTestClass):
         self.mock_setup_p4_instance.assert_called_once()
         self.mock_create_depot.assert_called_once_with(show)
         self.mock_populate_permissions.assert_called_once_with(
-            show,
-            self.json_config["permissions"]
+            show, self.json_config["permissions"]
         )
         self.mock_create_groups.assert_called_once_with(
-            show,
-            self.json_config["groups"],
-            users
+            show, self.json_config["groups"], users
         )
         self.mock_create_initial_streams.assert_called_once_with(
-            show,
-            self.json_config["streams"]
+            show, self.json_config["streams"]
         )
         self.mock_cleanup_p4_instance.assert_called_once()
 
@@ -623,10 +691,11 @@ class TestRunP4Setup(BaseUnitTestClass):
         self.mock_undo.assert_not_called()
         self.mock_warning.assert_not_called()
 
-    @patch('argparse.ArgumentParser.parse_args',
-            return_value=arg_parser_utility.argparse.Namespace(
-                show="TEST_RUN_INVALID", users=[], division="TESTDIV"
-            )
+    @patch(
+        "argparse.ArgumentParser.parse_args",
+        return_value=arg_parser_utility.argparse.Namespace(
+            show="TEST_RUN_INVALID", users=[], division="TESTDIV"
+        ),
     )
     def test_show_invalid_fails(self, mock_args):
         """Test that run_P4_show_setup fails with invalid show name.
@@ -657,10 +726,11 @@ class TestRunP4Setup(BaseUnitTestClass):
         self.mock_cleanup_p4_instance.assert_not_called()
         self.mock_undo.assert_not_called()
 
-    @patch('argparse.ArgumentParser.parse_args',
+    @patch(
+        "argparse.ArgumentParser.parse_args",
         return_value=arg_parser_utility.argparse.Namespace(
             show="TESTRUN", users=["test1"], division="TESTDIV"
-        )
+        ),
     )
     def test_json_load_fails(self, mock_args):
         """Test that run_P4_show_setup fails if perforce setup fails.
@@ -690,10 +760,11 @@ class TestRunP4Setup(BaseUnitTestClass):
         self.mock_cleanup_p4_instance.assert_not_called()
         self.mock_undo.assert_not_called()
 
-    @patch('argparse.ArgumentParser.parse_args',
-            return_value=arg_parser_utility.argparse.Namespace(
-                show="TESTRUN", users=["test1"], division="TESTDIV"
-            )
+    @patch(
+        "argparse.ArgumentParser.parse_args",
+        return_value=arg_parser_utility.argparse.Namespace(
+            show="TESTRUN", users=["test1"], division="TESTDIV"
+        ),
     )
     def test_setup_p4_instance_fails(self, mock_args):
         """Test that run_P4_show_setup fails if perforce setup fails.
@@ -726,10 +797,11 @@ class TestRunP4Setup(BaseUnitTestClass):
         self.mock_cleanup_p4_instance.assert_not_called()
         self.mock_undo.assert_not_called()
 
-    @patch('argparse.ArgumentParser.parse_args',
+    @patch(
+        "argparse.ArgumentParser.parse_args",
         return_value=arg_parser_utility.argparse.Namespace(
             show="TESTRUN", users=["test1"], division="TESTDIV"
-        )
+        ),
     )
     def test_depot_fails(self, mock_args):
         """Test that run_P4_show_setup fails and when depot fails.
@@ -752,7 +824,9 @@ class TestRunP4Setup(BaseUnitTestClass):
         self.mock_create_depot.assert_called_once_with(show)
 
         # Error handling
-        self.mock_warning.assert_called_once_with("Could not create show depot. Cancelling operation")
+        self.mock_warning.assert_called_once_with(
+            "Could not create show depot. Cancelling operation"
+        )
         self.mock_cleanup_p4_instance.assert_called_once()
 
         # Verify the rest of the function was not called.
@@ -761,16 +835,19 @@ class TestRunP4Setup(BaseUnitTestClass):
         self.mock_create_initial_streams.assert_not_called()
         self.mock_undo.assert_not_called()
 
-    @parameterized.expand([
-        [P4Exception("error")],
-        [TypeError("error")],
-        [AttributeError("error")],
-        [KeyError("error")],
-    ])
-    @patch('argparse.ArgumentParser.parse_args',
+    @parameterized.expand(
+        [
+            [P4Exception("error")],
+            [TypeError("error")],
+            [AttributeError("error")],
+            [KeyError("error")],
+        ]
+    )
+    @patch(
+        "argparse.ArgumentParser.parse_args",
         return_value=arg_parser_utility.argparse.Namespace(
             show="TESTRUN", users=["test1"], division="TESTDIV"
-        )
+        ),
     )
     def test_depot_fails_exception(self, exc_type, mock_args):
         """Test that run_P4_show_setup fails and runs undo when exception is thrown.
@@ -803,16 +880,19 @@ class TestRunP4Setup(BaseUnitTestClass):
         self.mock_create_groups.assert_not_called()
         self.mock_create_initial_streams.assert_not_called()
 
-    @parameterized.expand([
-        [P4Exception("error")],
-        [TypeError("error")],
-        [AttributeError("error")],
-        [KeyError("error")],
-    ])
-    @patch('argparse.ArgumentParser.parse_args',
+    @parameterized.expand(
+        [
+            [P4Exception("error")],
+            [TypeError("error")],
+            [AttributeError("error")],
+            [KeyError("error")],
+        ]
+    )
+    @patch(
+        "argparse.ArgumentParser.parse_args",
         return_value=arg_parser_utility.argparse.Namespace(
             show="TESTRUN", users=["test1"], division="TESTDIV"
-        )
+        ),
     )
     def test_permissions_fail_exception(self, exc_type, mock_args):
         """Test that run_P4_show_setup fails and runs undo when exception is thrown.
@@ -839,8 +919,7 @@ class TestRunP4Setup(BaseUnitTestClass):
         self.mock_json_load.assert_called_once()
         self.mock_create_depot.assert_called_once_with(show)
         self.mock_populate_permissions.assert_called_once_with(
-            show,
-            self.json_config["permissions"]
+            show, self.json_config["permissions"]
         )
 
         # Error handling
@@ -852,16 +931,19 @@ class TestRunP4Setup(BaseUnitTestClass):
         self.mock_create_groups.assert_not_called()
         self.mock_create_initial_streams.assert_not_called()
 
-    @parameterized.expand([
-        [P4Exception("error")],
-        [TypeError("error")],
-        [AttributeError("error")],
-        [KeyError("error")],
-    ])
-    @patch('argparse.ArgumentParser.parse_args',
+    @parameterized.expand(
+        [
+            [P4Exception("error")],
+            [TypeError("error")],
+            [AttributeError("error")],
+            [KeyError("error")],
+        ]
+    )
+    @patch(
+        "argparse.ArgumentParser.parse_args",
         return_value=arg_parser_utility.argparse.Namespace(
             show="TESTRUN", users=["test1"], division="TESTDIV"
-        )
+        ),
     )
     def test_groups_fail_exception(self, exc_type, mock_args):
         """Test that run_P4_show_setup fails and runs undo when exception is thrown.
@@ -875,18 +957,28 @@ class TestRunP4Setup(BaseUnitTestClass):
         result = {
             "Depot": show,
             "Permissions": [
-                (f"write group {show} 10.* //{show}/...## Only for those who need "
-                    f"access to the entire depot - {self.user} {self.mdy_str}"),
-                (f"write group {show}-External * //{show}/...## Only for those who need"
-                    f" access to the entire depot - {self.user} {self.mdy_str}"),
-                (f"write group {show}-Main 10.* //{show}/*-main/...## For those who "
+                (
+                    f"write group {show} 10.* //{show}/...## Only for those who need "
+                    f"access to the entire depot - {self.user} {self.mdy_str}"
+                ),
+                (
+                    f"write group {show}-External * //{show}/...## Only for those who need"
+                    f" access to the entire depot - {self.user} {self.mdy_str}"
+                ),
+                (
+                    f"write group {show}-Main 10.* //{show}/*-main/...## For those who "
                     f"need to manage data transfers to or from the mainline - "
-                    f"{self.user} {self.mdy_str}"),
-                (f"write group {show}-Main-External * //{show}/*-main/...## For those "
+                    f"{self.user} {self.mdy_str}"
+                ),
+                (
+                    f"write group {show}-Main-External * //{show}/*-main/...## For those "
                     f"who need to manage data transfers to or from the mainline - "
-                    f"{self.user} {self.mdy_str}"),
-                (f"write group dnegvp_volume * //{show}/...## Granting sub-permissions "
-                    f"access for DNEG VP - {self.user} {self.mdy_str}")
+                    f"{self.user} {self.mdy_str}"
+                ),
+                (
+                    f"write group dnegvp_volume * //{show}/...## Granting sub-permissions "
+                    f"access for DNEG VP - {self.user} {self.mdy_str}"
+                ),
             ],
         }
         self.mock_input.return_value = show
@@ -895,18 +987,28 @@ class TestRunP4Setup(BaseUnitTestClass):
         self.mock_json_load.return_value = self.config_data
         self.mock_create_depot.return_value = show
         self.mock_populate_permissions.return_value = [
-            (f"write group {show} 10.* //{show}/...## Only for those who need "
-                f"access to the entire depot - {self.user} {self.mdy_str}"),
-            (f"write group {show}-External * //{show}/...## Only for those who need"
-                f" access to the entire depot - {self.user} {self.mdy_str}"),
-            (f"write group {show}-Main 10.* //{show}/*-main/...## For those who "
+            (
+                f"write group {show} 10.* //{show}/...## Only for those who need "
+                f"access to the entire depot - {self.user} {self.mdy_str}"
+            ),
+            (
+                f"write group {show}-External * //{show}/...## Only for those who need"
+                f" access to the entire depot - {self.user} {self.mdy_str}"
+            ),
+            (
+                f"write group {show}-Main 10.* //{show}/*-main/...## For those who "
                 f"need to manage data transfers to or from the mainline - "
-                f"{self.user} {self.mdy_str}"),
-            (f"write group {show}-Main-External * //{show}/*-main/...## For those "
+                f"{self.user} {self.mdy_str}"
+            ),
+            (
+                f"write group {show}-Main-External * //{show}/*-main/...## For those "
                 f"who need to manage data transfers to or from the mainline - "
-                f"{self.user} {self.mdy_str}"),
-            (f"write group dnegvp_volume * //{show}/...## Granting sub-permissions "
-                f"access for DNEG VP - {self.user} {self.mdy_str}")
+                f"{self.user} {self.mdy_str}"
+            ),
+            (
+                f"write group dnegvp_volume * //{show}/...## Granting sub-permissions "
+                f"access for DNEG VP - {self.user} {self.mdy_str}"
+            ),
         ]
         self.mock_create_groups.side_effect = exc_type
 
@@ -917,13 +1019,10 @@ class TestRunP4Setup(BaseUnitTestClass):
         self.mock_json_load.assert_called_once()
         self.mock_create_depot.assert_called_once_with(show)
         self.mock_populate_permissions.assert_called_once_with(
-            show,
-            self.json_config["permissions"]
+            show, self.json_config["permissions"]
         )
         self.mock_create_groups.assert_called_once_with(
-            show,
-            self.json_config["groups"],
-            users
+            show, self.json_config["groups"], users
         )
 
         # Error handling
@@ -934,16 +1033,19 @@ class TestRunP4Setup(BaseUnitTestClass):
         # Verify the rest of the function was not called.
         self.mock_create_initial_streams.assert_not_called()
 
-    @parameterized.expand([
-        [P4Exception("error")],
-        [TypeError("error")],
-        [AttributeError("error")],
-        [KeyError("error")],
-    ])
-    @patch('argparse.ArgumentParser.parse_args',
+    @parameterized.expand(
+        [
+            [P4Exception("error")],
+            [TypeError("error")],
+            [AttributeError("error")],
+            [KeyError("error")],
+        ]
+    )
+    @patch(
+        "argparse.ArgumentParser.parse_args",
         return_value=arg_parser_utility.argparse.Namespace(
             show="TESTRUN", users=["test1"], division="TESTDIV"
-        )
+        ),
     )
     def test_streams_fail_exception(self, exc_type, mock_args):
         """Test that run_P4_show_setup fails and runs undo when exception is thrown.
@@ -957,25 +1059,35 @@ class TestRunP4Setup(BaseUnitTestClass):
         result = {
             "Depot": show,
             "Permissions": [
-                (f"write group {show} 10.* //{show}/...## Only for those who need "
-                    f"access to the entire depot - {self.user} {self.mdy_str}"),
-                (f"write group {show}-External * //{show}/...## Only for those who need"
-                    f" access to the entire depot - {self.user} {self.mdy_str}"),
-                (f"write group {show}-Main 10.* //{show}/*-main/...## For those who "
+                (
+                    f"write group {show} 10.* //{show}/...## Only for those who need "
+                    f"access to the entire depot - {self.user} {self.mdy_str}"
+                ),
+                (
+                    f"write group {show}-External * //{show}/...## Only for those who need"
+                    f" access to the entire depot - {self.user} {self.mdy_str}"
+                ),
+                (
+                    f"write group {show}-Main 10.* //{show}/*-main/...## For those who "
                     f"need to manage data transfers to or from the mainline - "
-                    f"{self.user} {self.mdy_str}"),
-                (f"write group {show}-Main-External * //{show}/*-main/...## For those "
+                    f"{self.user} {self.mdy_str}"
+                ),
+                (
+                    f"write group {show}-Main-External * //{show}/*-main/...## For those "
                     f"who need to manage data transfers to or from the mainline - "
-                    f"{self.user} {self.mdy_str}"),
-                (f"write group dnegvp_volume * //{show}/...## Granting sub-permissions "
-                    f"access for DNEG VP - {self.user} {self.mdy_str}")
+                    f"{self.user} {self.mdy_str}"
+                ),
+                (
+                    f"write group dnegvp_volume * //{show}/...## Granting sub-permissions "
+                    f"access for DNEG VP - {self.user} {self.mdy_str}"
+                ),
             ],
             "Groups": [
                 show,
-                f'{show}-External',
-                f'{show}-Main',
-                f'{show}-Main-External'
-            ]
+                f"{show}-External",
+                f"{show}-Main",
+                f"{show}-Main-External",
+            ],
         }
         self.mock_input.return_value = show
         self.mock_validate_show.return_value = []
@@ -983,24 +1095,34 @@ class TestRunP4Setup(BaseUnitTestClass):
         self.mock_json_load.return_value = self.config_data
         self.mock_create_depot.return_value = show
         self.mock_populate_permissions.return_value = [
-            (f"write group {show} 10.* //{show}/...## Only for those who need "
-                f"access to the entire depot - {self.user} {self.mdy_str}"),
-            (f"write group {show}-External * //{show}/...## Only for those who need"
-                f" access to the entire depot - {self.user} {self.mdy_str}"),
-            (f"write group {show}-Main 10.* //{show}/*-main/...## For those who "
+            (
+                f"write group {show} 10.* //{show}/...## Only for those who need "
+                f"access to the entire depot - {self.user} {self.mdy_str}"
+            ),
+            (
+                f"write group {show}-External * //{show}/...## Only for those who need"
+                f" access to the entire depot - {self.user} {self.mdy_str}"
+            ),
+            (
+                f"write group {show}-Main 10.* //{show}/*-main/...## For those who "
                 f"need to manage data transfers to or from the mainline - "
-                f"{self.user} {self.mdy_str}"),
-            (f"write group {show}-Main-External * //{show}/*-main/...## For those "
+                f"{self.user} {self.mdy_str}"
+            ),
+            (
+                f"write group {show}-Main-External * //{show}/*-main/...## For those "
                 f"who need to manage data transfers to or from the mainline - "
-                f"{self.user} {self.mdy_str}"),
-            (f"write group dnegvp_volume * //{show}/...## Granting sub-permissions "
-                f"access for DNEG VP - {self.user} {self.mdy_str}")
+                f"{self.user} {self.mdy_str}"
+            ),
+            (
+                f"write group dnegvp_volume * //{show}/...## Granting sub-permissions "
+                f"access for DNEG VP - {self.user} {self.mdy_str}"
+            ),
         ]
         self.mock_create_groups.return_value = [
             show,
-            f'{show}-External',
-            f'{show}-Main',
-            f'{show}-Main-External'
+            f"{show}-External",
+            f"{show}-Main",
+            f"{show}-Main-External",
         ]
         self.mock_create_initial_streams.side_effect = exc_type
 
@@ -1011,20 +1133,760 @@ class TestRunP4Setup(BaseUnitTestClass):
         self.mock_json_load.assert_called_once()
         self.mock_create_depot.assert_called_once_with(show)
         self.mock_populate_permissions.assert_called_once_with(
-            show,
-            self.json_config["permissions"]
+            show, self.json_config["permissions"]
         )
         self.mock_create_groups.assert_called_once_with(
-            show,
-            self.json_config["groups"],
-            users
+            show, self.json_config["groups"], users
         )
         self.mock_create_initial_streams.assert_called_once_with(
-            show,
-            self.json_config["streams"]
+            show, self.json_config["streams"]
         )
 
         # Error handling
         self.mock_undo.assert_called_once_with(result)
         assert self.mock_warning.call_count == 2
         self.mock_cleanup_p4_instance.assert_called_once()
+
+
+class TestCommandLine(BaseUnitTestClass):
+    """Test wrapper class to test the p4_show_setup subcommands.
+
+    Args:
+        BaseUnitTestClass: unit test class decorator.
+    """
+
+    def setUp(self):
+        """Run setup function before each test."""
+        with open(p4ss.CONFIG_PATH, "r") as config_file:
+            self.config_data = json.load(config_file)
+        self.json_config = self.config_data["TESTDIV"]
+        self.mock_initialize_logging = self.create_patch(
+            "p4_show_setup._initialize_logging"
+        )
+        self.mock_create_connection = self.create_patch(
+            "p4_show_setup.p4_connection_utility.create_connection"
+        )
+
+    def test_import_time_budget(self):
+        """Test that importing the module is fast and does not import P4Python."""
+        import_time, p4_imported = p4ss._measure_import_time()
+        assert p4_imported is False
+        assert import_time < p4ss.IMPORT_TIME_BUDGET_SECONDS
+
+    def test_import_skips_optional_modules(self):
+        """Test that importing the module does not import what only some runs use."""
+        optional_modules = (
+            "asyncio",
+            "cProfile",
+            "gzip",
+            "tracemalloc",
+            "shared.p4_batch_utility",
+            "shared.p4_recording_utility",
+            "shared.p4_simulator_utility",
+            "shared.profiling_utility",
+        )
+        module_dir = os.path.dirname(os.path.abspath(p4ss.__file__))
+        result = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                f"import sys; sys.path.insert(0, {module_dir!r}); import p4_show_setup; "
+                f"print([name for name in {optional_modules!r} if name in sys.modules])",
+            ],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        assert result.stdout.strip() == "[]"
+
+    def test_profile_kinds(self):
+        """Test that --profile offers the kinds the profiling module supports."""
+        from shared import profiling_utility  # pylint: disable=import-outside-toplevel
+
+        assert p4ss.PROFILE_KINDS == profiling_utility.PROFILE_KINDS
+
+    @parameterized.expand(
+        [
+            [["-s", "FOO", "-d", "TS"], ["apply", "-s", "FOO", "-d", "TS"]],
+            [["-l", "DEBUG", "--show=FOO"], ["-l", "DEBUG", "apply", "--show=FOO"]],
+            [["plan", "-s", "FOO"], ["plan", "-s", "FOO"]],
+            [["-h"], ["-h"]],
+        ]
+    )
+    def test_normalize_arguments(self, argv, expected):
+        """Test that invocations without a subcommand default to apply.
+
+        Args:
+            argv (list): command line arguments.
+            expected (list): the arguments that should be parsed.
+        """
+        assert p4ss._normalize_arguments(argv) == expected
+
+    @parameterized.expand(
+        [
+            [["validate", "-s", "FOO", "-d", "VFX"], 0],
+            [["validate", "-s", "TEST", "-d", "VFX"], 1],
+            [["plan", "-s", "FOO", "-d", "TESTDIV"], 0],
+            [["plan", "-s", "1FOO"], 1],
+        ]
+    )
+    def test_offline_commands(self, argv, exit_status):
+        """Test that validate and plan never connect to the server.
+
+        Args:
+            argv (list): command line arguments.
+            exit_status (int): the expected exit status.
+        """
+        assert p4ss.run_p4_show_setup(argv) == exit_status
+        self.mock_create_connection.assert_not_called()
+
+    @parameterized.expand(
+        [
+            [[]],
+            [["-l", "DEBUG"]],
+        ]
+    )
+    def test_missing_show(self, argv):
+        """Test that running without a command or show is an argument error.
+
+        Args:
+            argv (list): command line arguments.
+        """
+        with pytest.raises(SystemExit) as exit_info:
+            p4ss.run_p4_show_setup(argv)
+        assert exit_info.value.code == 2
+        self.mock_create_connection.assert_not_called()
+
+    def test_plan(self):
+        """Test that the plan renders every configured entity for the show."""
+        show = "PLAN"
+        plan = p4ss.P4ShowSetup(show, self.json_config).plan(user="tester")
+        assert plan["Depot"] == show
+        assert len(plan["Permissions"]) == len(self.json_config["permissions"])
+        assert all("tester" in entry for entry in plan["Permissions"])
+        assert plan["Groups"] == [
+            show,
+            f"{show}-External",
+            f"{show}-Main",
+            f"{show}-Main-External",
+        ]
+        assert plan["Streams"][f"//{show}/{show}-dev"] == {
+            "type": "development",
+            "parent": f"//{show}/{show}-main",
+        }
+
+    def test_audit_arguments(self):
+        """Test that audit takes either one show or --all."""
+        parser = p4ss._setup_parse_arguments()
+        args = parser.parse_args(["audit", "--all", "--workers", "8"])
+        assert args.all and args.show is None and args.workers == 8
+        assert parser.parse_args(["audit", "-s", "FOO"]).all is False
+        with pytest.raises(SystemExit):
+            parser.parse_args(["audit"])
+        with pytest.raises(SystemExit):
+            parser.parse_args(["audit", "-s", "FOO", "--all"])
+
+    def test_audit(self):
+        """Test that the audit reports only what is missing or different."""
+        show = "AUDIT"
+        mock_p4 = self.create_patch("p4_show_setup._get_p4_connection").return_value
+        mock_p4.user = "tester"
+        plan = p4ss.P4ShowSetup(show, self.json_config).plan(user="tester")
+        mock_p4.run.side_effect = [
+            [{"name": show}],
+            [
+                {
+                    "Protections": [
+                        "## START OF DEPOT SPECIFIC PERMISSIONS",
+                        # Comments are ignored when matching entries.
+                        plan["Permissions"][0].split("##")[0] + "## added by hand",
+                    ]
+                    + plan["Permissions"][1:4]
+                }
+            ],
+            [{"group": show}, {"group": f"{show}-Main"}, {"group": "other"}],
+            [
+                {
+                    "Stream": f"//{show}/{show}-main",
+                    "Type": "mainline",
+                    "Parent": "none",
+                },
+                {
+                    "Stream": f"//{show}/{show}-dev",
+                    "Type": "mainline",
+                    "Parent": "none",
+                },
+            ],
+        ]
+        differences = p4ss.P4ShowSetup(show, self.json_config).audit()
+        assert differences == {
+            "Permissions": [plan["Permissions"][4]],
+            "Groups": [f"{show}-External", f"{show}-Main-External"],
+            "Streams": [f"//{show}/{show}-incoming", f"//{show}/{show}-outgoing"],
+            "Mismatched Streams": [f"//{show}/{show}-dev"],
+        }
+        mock_p4.run.assert_any_call("streams", f"//{show}/...")
+
+    def test_decommission_confirms_after_the_plan(self):
+        """Test that decommission shows the plan before asking for confirmation."""
+        show = "DECOM"
+        self.create_patch("p4_show_setup.p4_connection_utility.ConnectionPool")
+        mock_teardown_class = self.create_patch(
+            "p4_show_setup.p4_show_teardown.ShowTeardown"
+        )
+        mock_teardown = mock_teardown_class.return_value
+        mock_teardown.plan.return_value = p4ss.p4_show_teardown.TeardownPlan(
+            show, show, [], [show], []
+        )
+        mock_input = self.create_patch("p4_show_setup.input")
+        # The plan has been read by the time the user is asked, who then declines.
+        mock_input.side_effect = (
+            lambda _: mock_teardown.plan.assert_called_once() or "OTHER"
+        )
+
+        assert (
+            p4ss.run_p4_show_setup(["decommission", "-s", show, "-d", "TESTDIV"]) == 1
+        )
+        mock_input.assert_called_once()
+        mock_teardown.execute.assert_not_called()
+        assert mock_teardown_class.call_args[0][:2] == (show, self.json_config)
+
+    def test_decommission_rejects_unknown_division(self):
+        """Test that decommission does not guess the config of an unknown division."""
+        mock_pool_class = self.create_patch(
+            "p4_show_setup.p4_connection_utility.ConnectionPool"
+        )
+        mock_teardown_class = self.create_patch(
+            "p4_show_setup.p4_show_teardown.ShowTeardown"
+        )
+
+        assert p4ss.run_p4_show_setup(["decommission", "-s", "DECOM", "-d", "XX"]) == 1
+        mock_pool_class.assert_not_called()
+        mock_teardown_class.assert_not_called()
+
+
+class TestSetupPrefetch(BaseUnitTestClass):
+    """Test wrapper class to test connecting and prefetching during the prompts.
+
+    Args:
+        BaseUnitTestClass: unit test class decorator.
+    """
+
+    def setUp(self):
+        """Run setup function before each test."""
+        self.mock_initialize_logging = self.create_patch(
+            "p4_show_setup._initialize_logging"
+        )
+        self.mock_setup_p4_instance = self.create_patch(
+            "p4_show_setup._setup_p4_instance", return_value=None
+        )
+        self.mock_cleanup_p4_instance = self.create_patch(
+            "p4_show_setup._cleanup_p4_instance"
+        )
+        self.mock_p4 = self.create_patch(
+            "p4_show_setup._get_p4_connection"
+        ).return_value
+        self.mock_input = self.create_patch("p4_show_setup.input")
+        self.mock_create_depot = self.create_patch(
+            "p4_show_setup.P4ShowSetup.create_depot"
+        )
+        self.mock_populate_permissions = self.create_patch(
+            "p4_show_setup.P4ShowSetup.populate_permissions_table"
+        )
+        self.mock_check_permissions = self.create_patch(
+            "p4_show_setup.P4ShowSetup.check_permissions"
+        )
+        self.mock_create_groups = self.create_patch(
+            "p4_show_setup.P4ShowSetup.create_groups"
+        )
+        self.mock_create_streams = self.create_patch(
+            "p4_show_setup.P4ShowSetup.create_initial_streams"
+        )
+
+    def test_prefetch_while_prompting(self):
+        """Test that the connection and first reads happen before confirmation."""
+        show = "PREFETCH"
+        self.mock_p4.run.side_effect = lambda *args: [list(args)]
+        self.mock_input.return_value = show
+        instance = p4ss._start_prefetched_instance(
+            arg_parser_utility.argparse.Namespace(show=show, division=["TESTDIV"])
+        )
+        assert instance.show == show
+        self.mock_setup_p4_instance.assert_called_once()
+        assert set(instance.prefetched) == {
+            ("depots", "-E", show),
+            ("protect", "-o"),
+            ("group", "-o", "dnegvp_volume"),
+        }
+
+        # Prefetched results are used instead of running the command again, once.
+        self.mock_p4.run.reset_mock()
+        assert instance._run_prefetched("depots", "-E", show) == [
+            ["depots", "-E", show]
+        ]
+        self.mock_p4.run.assert_not_called()
+        instance._run_prefetched("depots", "-E", show)
+        self.mock_p4.run.assert_called_once_with("depots", "-E", show)
+
+    def test_prefetch_batches_group_reads(self):
+        """Test that group specs are prefetched in one batch when supported."""
+        show = "PREFETCH"
+        self.mock_p4.supports_argument_files = True
+        self.mock_p4.run.side_effect = lambda *args: (
+            [{"Group": "dnegvp_volume"}] if args[0] == "-x" else [list(args)]
+        )
+        self.mock_input.return_value = show
+        instance = p4ss._start_prefetched_instance(
+            arg_parser_utility.argparse.Namespace(show=show, division=["TESTDIV"])
+        )
+        assert instance.prefetched[("group", "-o", "dnegvp_volume")][1] == [
+            {"Group": "dnegvp_volume"}
+        ]
+        assert (
+            call("group", "-o", "dnegvp_volume") not in self.mock_p4.run.call_args_list
+        )
+
+    def test_stale_prefetch_is_ignored(self):
+        """Test that prefetched results older than the maximum age are refetched."""
+        instance = p4ss.P4ShowSetup("STALE", {}, p4=self.mock_p4)
+        instance.prefetched[("protect", "-o")] = (
+            p4ss.time.monotonic() - p4ss.PREFETCH_MAX_AGE_SECONDS - 1,
+            ["stale"],
+        )
+        self.mock_p4.run.return_value = ["fresh"]
+        assert instance._run_prefetched("protect", "-o") == ["fresh"]
+
+    def test_abort_cancels_prefetch(self):
+        """Test that failing the confirmation stops the work and disconnects."""
+        self.mock_input.return_value = "WRONG"
+        assert p4ss.run_p4_show_setup(["apply", "-s", "ABORT", "-d", "TESTDIV"]) == 1
+        self.mock_cleanup_p4_instance.assert_called_once()
+        self.mock_create_depot.assert_not_called()
+
+    def test_apply_after_prefetch(self):
+        """Test that every step runs once the show is confirmed."""
+        self.mock_input.return_value = "APPLY"
+        self.mock_p4.run.return_value = []
+        assert p4ss.run_p4_show_setup(["apply", "-s", "APPLY", "-d", "VFX"]) == 0
+        self.mock_setup_p4_instance.assert_called_once()
+        self.mock_create_depot.assert_called_once()
+        self.mock_populate_permissions.assert_called_once()
+        self.mock_check_permissions.assert_called_once()
+        self.mock_create_groups.assert_called_once()
+        self.mock_create_streams.assert_called_once()
+        self.mock_cleanup_p4_instance.assert_called_once()
+
+    def test_cancelled_setup_rolls_back(self):
+        """Test that a cancelled step stops the setup and runs the rollback."""
+        self.mock_input.return_value = "CANCEL"
+        self.mock_p4.run.return_value = []
+        self.mock_create_groups.side_effect = p4ss.p4_deadline_utility.DeadlineExceeded(
+            "The 'groups' step deadline has passed"
+        )
+        mock_undo = self.create_patch("p4_show_setup.P4ShowSetup.undo_show_setup")
+        p4ss._CANCELLATION.cancel("Received SIGINT")
+
+        assert p4ss.run_p4_show_setup(["apply", "-s", "CANCEL", "-d", "VFX"]) == 1
+        mock_undo.assert_called_once()
+        # The token is cleared so that the rollback commands can run.
+        assert not p4ss._CANCELLATION.cancelled
+        self.mock_create_streams.assert_not_called()
+        self.mock_cleanup_p4_instance.assert_called_once()
+
+    @parameterized.expand(
+        [
+            [p4_connection_utility.P4CommandError("undo failed")],
+            [p4ss.p4_deadline_utility.OperationCancelled("Received SIGINT")],
+        ]
+    )
+    def test_failed_rollback_still_cleans_up(self, rollback_error):
+        """Test that a rollback error is logged, and the connection still cleaned up.
+
+        Args:
+            rollback_error (Exception): the error the rollback raises.
+        """
+        self.mock_input.return_value = "ROLLBACK"
+        self.mock_p4.run.return_value = []
+        self.mock_create_groups.side_effect = p4_connection_utility.P4CommandError(
+            "groups failed"
+        )
+        mock_undo = self.create_patch("p4_show_setup.P4ShowSetup.undo_show_setup")
+        mock_undo.side_effect = rollback_error
+
+        with self.assertLogs(level="ERROR") as logs:
+            assert p4ss.run_p4_show_setup(["apply", "-s", "ROLLBACK", "-d", "VFX"]) == 1
+        assert "Rolling back the setup of ROLLBACK failed" in logs.output[0]
+        mock_undo.assert_called_once()
+        self.mock_cleanup_p4_instance.assert_called_once()
+
+    def test_failed_setup_logs_what_it_removes(self):
+        """Test that a failed setup logs each result it is about to roll back."""
+        self.mock_input.return_value = "LOGGED"
+        self.mock_p4.run.return_value = []
+        self.mock_create_groups.side_effect = p4_connection_utility.P4CommandError(
+            "groups failed"
+        )
+        self.create_patch("p4_show_setup.P4ShowSetup.undo_show_setup")
+
+        with patch.object(
+            p4ss.P4ShowSetup,
+            "create_depot",
+            new=lambda instance: instance.result.update(Depot="LOGGED"),
+        ), self.assertLogs(level="WARNING") as logs:
+            assert p4ss.run_p4_show_setup(["apply", "-s", "LOGGED", "-d", "VFX"]) == 1
+        assert "WARNING:root:Removing Depot: LOGGED" in logs.output
+
+    def test_steps_have_deadlines(self):
+        """Test that every server step runs inside its step deadline."""
+        instance = p4ss.P4ShowSetup("STEPS", {}, p4=self.mock_p4)
+        with instance.step("groups"):
+            pass
+        self.mock_p4.step_deadline.assert_called_once_with(
+            p4ss.STEP_DEADLINES["groups"], name="groups"
+        )
+
+
+def test_rollback_after_failed_populate_removes_everything(simulated_server):
+    """Test rolling back on pooled connections after a mid-setup failure."""
+    server = simulated_server
+    json_config = {
+        "permissions": ["write group {show} * //{show}/... ## {user} {mdy_str}"],
+        "groups": {"{show}": "empty", "{show}-External": "empty"},
+        "streams": {
+            "//{show}/{show}-main": {
+                "type": "mainline",
+                "branch": "//DNEG_Sandbox/UE5/Template",
+            },
+            "//{show}/{show}-dev": {
+                "type": "development",
+                "parent": "//{show}/{show}-main",
+            },
+            # Populating from a stream that does not exist fails the setup.
+            "//{show}/{show}-incoming": {
+                "type": "mainline",
+                "branch": "//ROLLBACK/missing",
+            },
+        },
+    }
+
+    def connect():
+        connection = p4_simulator_utility.SimulatedConnection(server)
+        connection.connect()
+        return connection
+
+    protections = list(server.protections)
+    show_setup_instance = p4ss.P4ShowSetup("ROLLBACK", json_config, p4=connect())
+    show_setup_instance.create_depot()
+    show_setup_instance.populate_permissions_table()
+    show_setup_instance.create_groups()
+    with pytest.raises(p4_connection_utility.P4CommandError):
+        show_setup_instance.create_initial_streams()
+
+    pool = p4_connection_utility.ConnectionPool(connect, size=4)
+    server.command_counts.clear()
+    show_setup_instance.undo_show_setup(pool=pool)
+    pool.close()
+
+    assert server.depots == {} and server.streams == {} and server.stream_files == {}
+    assert server.protections == protections
+    assert "ROLLBACK" not in server.groups and "ROLLBACK-External" not in server.groups
+    # One obliterate for the whole depot, and one spec deletion per stream.
+    assert server.command_counts["obliterate"] == 1
+    assert server.command_counts["stream"] == 3
+
+
+def test_pooled_rollback_keeps_the_logging_context(tmp_path, simulated_server):
+    """Test that removals run on pooled connections are reported as the show's rollback."""
+    server = simulated_server
+    json_config = {
+        "permissions": ["write group {show} * //{show}/... ## {user} {mdy_str}"],
+        "groups": {"{show}": "empty", "{show}-External": "empty"},
+        "streams": {
+            "//{show}/{show}-main": {
+                "type": "mainline",
+                "branch": "//DNEG_Sandbox/UE5/Template",
+            },
+        },
+    }
+
+    def connect():
+        connection = p4_simulator_utility.SimulatedConnection(server)
+        connection.connect()
+        return event_utility.EventConnection(connection)
+
+    show_setup_instance = p4ss.P4ShowSetup("POOLED", json_config, p4=connect())
+    show_setup_instance.create_depot()
+    show_setup_instance.populate_permissions_table()
+    show_setup_instance.create_groups()
+    show_setup_instance.create_initial_streams()
+
+    path = tmp_path / "events.jsonl"
+    handler = event_utility.configure(str(path))
+    pool = p4_connection_utility.ConnectionPool(connect, size=4)
+    try:
+        show_setup_instance.undo_show_setup(pool=pool)
+    finally:
+        pool.close()
+        event_utility._EVENT_LOGGER.removeHandler(handler)
+        handler.close()
+
+    events = [json.loads(line) for line in path.read_text().splitlines()]
+    removals = [event for event in events if event["event"] in ("delete", "rollback")]
+    # The two groups, the stream, the obliterate and the depot.
+    assert len(removals) == 5
+    assert all(event["event"] == "rollback" for event in removals)
+    assert all(
+        event["show"] == "POOLED" and event["step"] == "undo" for event in removals
+    )
+
+
+class _DroppingConnection(p4_simulator_utility.SimulatedConnection):
+    """Simulated connection that drops after the first spec write of each entity lands."""
+
+    def __init__(self, server):
+        super().__init__(server)
+        self.dropped = set()
+
+    def run(self, *args):
+        spec = (
+            dict(self.input[0]) if args in (("group", "-i"), ("stream", "-i")) else {}
+        )
+        result = super().run(*args)
+        name = spec.get("Group", spec.get("Stream"))
+        if name and name not in self.dropped:
+            self.dropped.add(name)
+            raise p4_connection_utility.P4CommandError("TCP receive failed.")
+        return result
+
+
+def test_retried_creates_are_recorded(simulated_server):
+    """Test that groups and streams whose create landed before a retry are rolled back."""
+    server = simulated_server
+    json_config = {
+        "permissions": ["write group {show} * //{show}/... ## {user} {mdy_str}"],
+        "groups": {"{show}": "empty"},
+        "streams": {
+            "//{show}/{show}-main": {
+                "type": "mainline",
+                "branch": "//DNEG_Sandbox/UE5/Template",
+            },
+        },
+    }
+    server.groups["EXISTING"] = {
+        "Group": "EXISTING",
+        "Description": "",
+        "Users": ["jdoe"],
+    }
+    json_config["groups"]["EXISTING"] = "empty"
+    connection = _DroppingConnection(server)
+    connection.connect()
+    p4 = p4_retry_utility.RetryingConnection(connection, sleep=lambda _: None)
+    show_setup_instance = p4ss.P4ShowSetup("RETRIED", json_config, p4=p4)
+    show_setup_instance.create_depot()
+    show_setup_instance.create_groups()
+    show_setup_instance.create_initial_streams()
+
+    assert p4.retry_count == 3
+    assert show_setup_instance.result["Groups"] == ["RETRIED"]
+    assert show_setup_instance.result["Streams"] == ["//RETRIED/RETRIED-main"]
+    show_setup_instance.undo_show_setup()
+    assert "RETRIED" not in server.groups and "EXISTING" in server.groups
+    assert server.streams == {}
+
+
+def test_depot_file_check_only_treats_no_such_files_as_empty(simulated_server):
+    """Test that the rollback's file check raises errors other than an empty depot."""
+    server = simulated_server
+    connection = p4_simulator_utility.SimulatedConnection(server)
+    connection.connect()
+    show_setup_instance = p4ss.P4ShowSetup("EMPTY", {}, p4=connection)
+    assert show_setup_instance._depot_has_files("EMPTY") is False
+
+    with patch.object(
+        connection,
+        "run",
+        side_effect=p4_connection_utility.P4CommandError("TCP receive failed."),
+    ):
+        with pytest.raises(p4_connection_utility.P4CommandError):
+            show_setup_instance._depot_has_files("EMPTY")
+
+
+def test_populate_writes_the_current_table_not_the_prefetched_one(simulated_server):
+    """Test that populate keeps lines added since the prefetch, which only stops duplicates."""
+    server = simulated_server
+    connection = p4_simulator_utility.SimulatedConnection(server)
+    connection.connect()
+    json_config = {
+        "permissions": ["write group {show} * //{show}/... ## {user} {mdy_str}"]
+    }
+    show_setup_instance = p4ss.P4ShowSetup("FRESH", json_config, p4=connection)
+    show_setup_instance.prefetched[("protect", "-o")] = (
+        p4ss.time.monotonic(),
+        [{"Protections": list(server.protections)}],
+    )
+    server.protections.append("write group OTHER * //OTHER/...")
+    show_setup_instance.populate_permissions_table()
+    assert "write group OTHER * //OTHER/..." in server.protections
+    assert any(line.startswith("write group FRESH ") for line in server.protections)
+
+    duplicate = p4ss.P4ShowSetup("FRESH", json_config, p4=connection)
+    duplicate.prefetched[("protect", "-o")] = (
+        p4ss.time.monotonic(),
+        [{"Protections": list(server.protections)}],
+    )
+    server.command_counts.clear()
+    with pytest.raises(Exception):
+        duplicate.populate_permissions_table()
+    assert server.command_counts == {}
+
+
+def _converge_server(json_config, *shows):
+    """Set up shows on a simulated server with the setup steps."""
+    server = p4_simulator_utility.SimulatedServer(
+        SIMULATOR_NO_DELAY,
+        groups={
+            "vp_leads": {"Group": "vp_leads", "Description": "", "Users": ["lead"]}
+        },
+    )
+    for show in shows:
+        connection = p4_simulator_utility.SimulatedConnection(server)
+        connection.connect()
+        show_setup_instance = p4ss.P4ShowSetup(show, json_config, p4=connection)
+        show_setup_instance.create_depot()
+        show_setup_instance.populate_permissions_table()
+        show_setup_instance.create_groups()
+        show_setup_instance.create_initial_streams()
+    return server
+
+
+def test_converge_applies_only_the_config_change():
+    """Test that converging an existing show writes only what the config changed."""
+    json_config = {
+        "permissions": [
+            "write group {show} * //{show}/... ## {user} {mdy_str}",
+            "read group {show}-Outgoing * //{show}/*-outgoing/... ## {user} {mdy_str}",
+        ],
+        "groups": {
+            "{show}": "empty",
+            "{show}-Outgoing": {"Owners": [{"groups": "vp_leads"}]},
+        },
+        "streams": {
+            "//{show}/{show}-main": {
+                "type": "mainline",
+                "branch": "//DNEG_Sandbox/UE5/Template",
+            },
+            "//{show}/{show}-dev": {
+                "type": "development",
+                "parent": "//{show}/{show}-main",
+            },
+        },
+    }
+    server = _converge_server(json_config, "CONV", "CONVB")
+    new_config = json.loads(json.dumps(json_config))
+    new_config["permissions"][
+        1
+    ] = "write group {show}-Outgoing * //{show}/*-outgoing/... ## {user} {mdy_str}"
+    new_config["permissions"].append(
+        "read group {show}-Review * //{show}/... ## {user}"
+    )
+    new_config["groups"]["{show}-Review"] = "empty"
+    new_config["streams"]["//{show}/{show}-outgoing"] = {
+        "type": "mainline",
+        "branch": "//DNEG_Sandbox/UE5/Template",
+    }
+    server.groups["CONV-Outgoing"]["Owners"] = []
+    connection = p4_simulator_utility.SimulatedConnection(server)
+    connection.connect()
+    show_setup_instance = p4ss.P4ShowSetup("CONV", new_config, p4=connection)
+
+    delta = show_setup_instance.plan_converge()
+    assert sorted(delta) == [
+        "Changed Permissions",
+        "Group Members",
+        "Groups",
+        "Permissions",
+        "Streams",
+    ]
+    assert delta["Group Members"] == {"CONV-Outgoing": {"Owners": ["lead"]}}
+    assert delta["Groups"] == ["CONV-Review"]
+    assert delta["Streams"] == ["//CONV/CONV-outgoing"]
+    server.command_counts.clear()
+    show_setup_instance.converge(delta)
+
+    # One table write; one spec write per new or changed group and stream.
+    assert server.command_counts["protect"] == 2
+    assert server.command_counts["group"] == 4
+    assert server.command_counts["stream"] == 2
+    assert server.groups["CONV-Outgoing"]["Owners"] == ["lead"]
+    assert "CONV-Review" in server.groups and "//CONV/CONV-outgoing" in server.streams
+    rules = [p4ss.strip_permission_comment(entry) for entry in server.protections]
+    assert "write group CONV-Outgoing * //CONV/*-outgoing/..." in rules
+    assert "read group CONV-Outgoing * //CONV/*-outgoing/..." not in rules
+    # The new lines stay with the show's, before the next show's.
+    assert rules.index("read group CONV-Review * //CONV/...") < rules.index(
+        "write group CONVB * //CONVB/..."
+    )
+    assert show_setup_instance.plan_converge() == {}
+
+
+def test_verify_permissions_evaluates_every_group_and_stream_locally(simulated_server):
+    """Test that the configured access is verified with one read of the table and the groups."""
+    json_config = {
+        "permissions": [
+            "write group {show} 10.* //{show}/*-dev/... ## {user} {mdy_str}",
+            "write group {show}-Production * //{show}/... ## {user} {mdy_str}",
+            "read group {show}-Outgoing * //{show}/*-outgoing/... ## {user} {mdy_str}",
+        ],
+        "groups": {
+            "{show}": "empty",
+            "{show}-Production": "empty",
+            "{show}-Outgoing": "empty",
+        },
+        "streams": {
+            "//{show}/{show}-main": {
+                "type": "mainline",
+                "branch": "//DNEG_Sandbox/UE5/Template",
+            },
+            "//{show}/{show}-dev": {
+                "type": "development",
+                "parent": "//{show}/{show}-main",
+            },
+            "//{show}/{show}-outgoing": {
+                "type": "development",
+                "parent": "//{show}/{show}-main",
+            },
+        },
+    }
+    server = simulated_server
+    connection = p4_simulator_utility.SimulatedConnection(server)
+    connection.connect()
+    show_setup_instance = p4ss.P4ShowSetup("VERIFY", json_config, p4=connection)
+    show_setup_instance.create_depot()
+    show_setup_instance.populate_permissions_table()
+    server.command_counts.clear()
+    assert show_setup_instance.verify_permissions() == []
+    assert server.command_counts == {"protect": 1, "groups": 1}
+
+    # A line below the show's entries takes write access to the dev stream away.
+    server.protections.append("write group VERIFY * -//VERIFY/VERIFY-dev/...")
+    assert show_setup_instance.verify_permissions() == [
+        {
+            "Group": "VERIFY",
+            "Host": "10.1",
+            "Path": "//VERIFY/VERIFY-dev/probe/file",
+            "Expected": "write",
+            "Actual": "open",
+        }
+    ]
+    with pytest.raises(p4ss.PermissionsVerificationError) as error:
+        show_setup_instance.check_permissions()
+    assert error.value.failures[0]["Path"] == "//VERIFY/VERIFY-dev/probe/file"
+
+    # Permissions that cannot be read fail the check rather than pass it unverified.
+    with patch.object(
+        server,
+        "_run_groups",
+        side_effect=p4_connection_utility.P4CommandError("Access denied"),
+    ):
+        with pytest.raises(p4_connection_utility.P4CommandError):
+            show_setup_instance.check_permissions()
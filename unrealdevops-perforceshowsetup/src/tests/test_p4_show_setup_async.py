@@ -0,0 +1,141 @@
+# Copyright (C) 2023 DNEG. All Rights Reserved.
+"""Test file for p4_show_setup_async.py."""
+import asyncio
+import threading
+import time
+
+import pytest
+
+import p4_show_setup as p4ss
+import p4_show_setup_async as test_target
+from shared import p4_connection_utility
+
+JSON_CONFIG = {"permissions": [], "groups": {}, "streams": {}}
+STEP_SECONDS = 0.05
+
+
+@pytest.fixture(name="step_calls")
+def fixture_step_calls(monkeypatch):
+    """Replace the setup steps with slow steps recording their connection.
+
+    Args:
+        monkeypatch (fixture): A fixture to mock functions.
+
+    Returns:
+        list: (show, step, connection) for every step run.
+    """
+    calls = []
+    lock = threading.Lock()
+
+    def _step(step_name):
+        def _run(self):
+            time.sleep(STEP_SECONDS)
+            with lock:
+                calls.append((self.show, step_name, self.p4))
+            self.result[step_name] = self.show
+
+        return _run
+
+    for step_name in test_target.SETUP_STEPS + ("undo_show_setup",):
+        monkeypatch.setattr(p4ss.P4ShowSetup, step_name, _step(step_name))
+    return calls
+
+
+def test_apply_shows_concurrently(step_calls, simulated_pool):
+    """Test that gathered shows run their steps at the same time."""
+
+    async def _apply_all():
+        async with test_target.AsyncShowSetupRunner(
+            max_workers=2, pool=simulated_pool
+        ) as runner:
+            return await asyncio.gather(
+                runner.setup("SHOWA", JSON_CONFIG).apply(),
+                runner.setup("SHOWB", JSON_CONFIG).apply(),
+            )
+
+    start = time.monotonic()
+    results = asyncio.run(_apply_all())
+    elapsed = time.monotonic() - start
+
+    assert [result["create_depot"] for result in results] == ["SHOWA", "SHOWB"]
+    assert len(step_calls) == 10
+    # Sequential would take 10 steps, concurrent 5.
+    assert elapsed < STEP_SECONDS * 9
+    # A show keeps the order of its steps.
+    for show in ("SHOWA", "SHOWB"):
+        steps = [step for call_show, step, _ in step_calls if call_show == show]
+        assert tuple(steps) == test_target.SETUP_STEPS
+    # Every step ran on a pooled connection.
+    assert all(p4 is not None for _, _, p4 in step_calls)
+
+
+def test_apply_rolls_back_on_failure(step_calls, monkeypatch, simulated_pool):
+    """Test that a failing step undoes what was created, then raises."""
+
+    def _fail(self):
+        raise p4_connection_utility.P4CommandError("groups failed")
+
+    monkeypatch.setattr(p4ss.P4ShowSetup, "create_groups", _fail)
+
+    async def _apply():
+        async with test_target.AsyncShowSetupRunner(
+            max_workers=1, pool=simulated_pool
+        ) as runner:
+            setup = runner.setup("SHOWA", JSON_CONFIG)
+            with pytest.raises(p4_connection_utility.P4CommandError):
+                await setup.apply()
+            return setup
+
+    setup = asyncio.run(_apply())
+    assert [step for _, step, _ in step_calls] == [
+        "create_depot",
+        "populate_permissions_table",
+        "check_permissions",
+        "undo_show_setup",
+    ]
+    assert setup.show_setup_instance._p4 is None  # pylint: disable=W0212
+
+
+def test_apply_invalid_show(step_calls, simulated_pool):
+    """Test that an invalid show code is rejected before any step runs."""
+
+    async def _apply():
+        async with test_target.AsyncShowSetupRunner(
+            max_workers=1, pool=simulated_pool
+        ) as runner:
+            await runner.setup("1FOO", JSON_CONFIG).apply()
+
+    with pytest.raises(ValueError, match="Invalid show code"):
+        asyncio.run(_apply())
+    assert not step_calls
+
+
+def test_setup_rejects_unknown_division(simulated_pool):
+    """Test that an unknown division is rejected instead of deduced from the show."""
+    runner = test_target.AsyncShowSetupRunner(max_workers=1, pool=simulated_pool)
+    try:
+        with pytest.raises(ValueError, match="Unknown division: XX"):
+            runner.setup("SHOWA", division="XX")
+        assert runner.setup("SHOWA", division="TESTDIV").show_setup_instance.json_config
+    finally:
+        asyncio.run(runner.close())
+
+
+def test_apply_rolls_back_on_cancel(step_calls, simulated_pool):
+    """Test that a cancelled setup waits for its step, then rolls back."""
+
+    async def _apply():
+        async with test_target.AsyncShowSetupRunner(
+            max_workers=1, pool=simulated_pool
+        ) as runner:
+            task = asyncio.ensure_future(runner.setup("SHOWA", JSON_CONFIG).apply())
+            await asyncio.sleep(STEP_SECONDS / 2)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+    asyncio.run(_apply())
+    assert [step for _, step, _ in step_calls] == [
+        "create_depot",
+        "undo_show_setup",
+    ]
@@ -0,0 +1,77 @@
+# Copyright (C) 2023 DNEG - All Rights reserved.
+"""Tests for p4_show_teardown."""
+import pytest
+
+import p4_show_teardown
+
+
+@pytest.fixture(name="json_config")
+def fixture_json_config(json_config):
+    """Add a second mainline stream to the shows' config.
+
+    Args:
+        json_config (dict): the shared division config.
+
+    Returns:
+        dict: the division config.
+    """
+    json_config["streams"]["//{show}/{show}-incoming"] = {"type": "mainline"}
+    return json_config
+
+
+def test_stream_levels_put_children_first():
+    specs = [
+        {"Stream": "//S/main", "Parent": "none"},
+        {"Stream": "//S/dev", "Parent": "//S/main"},
+        {"Stream": "//S/task", "Parent": "//S/dev"},
+        {"Stream": "//S/incoming", "Parent": "none"},
+    ]
+    assert p4_show_teardown.stream_levels(specs) == [
+        ["//S/task"],
+        ["//S/dev"],
+        ["//S/incoming", "//S/main"],
+    ]
+
+
+def test_decommission_removes_only_the_show(
+    simulated_server, simulated_pool, set_up_show, json_config
+):
+    server = simulated_server
+    set_up_show("SHOWA", "SHOWB")
+    # Named like the show's groups, but not one of its division config's.
+    server.groups["SHOWA-Admins"] = {
+        "Group": "SHOWA-Admins",
+        "Description": "",
+        "Users": ["admin"],
+    }
+    server.protections.append("super group SHOWA-Admins * //...")
+    teardown = p4_show_teardown.ShowTeardown(
+        "SHOWA",
+        json_config,
+        simulated_pool,
+        obliterate_mode=p4_show_teardown.FAST_OBLITERATE,
+    )
+
+    plan = teardown.plan()
+    assert plan.groups == ["SHOWA", "SHOWA-Core"]
+    assert len(plan.protections) == 2
+    assert plan.stream_levels[0] == ["//SHOWA/SHOWA-dev"]
+
+    report = teardown.execute(plan)
+
+    assert report["Errors"] == {}
+    assert report["Depot"] == "SHOWA"
+    assert sorted(report["Streams"]) == [
+        "//SHOWA/SHOWA-dev",
+        "//SHOWA/SHOWA-incoming",
+        "//SHOWA/SHOWA-main",
+    ]
+    assert list(server.depots) == ["SHOWB"]
+    assert sorted(server.groups) == ["SHOWA-Admins", "SHOWB", "SHOWB-Core"]
+    assert [line for line in server.protections if "SHOWA" in line] == [
+        "super group SHOWA-Admins * //..."
+    ]
+    assert sum("SHOWB" in line for line in server.protections) == 2
+    assert all(stream.startswith("//SHOWB/") for stream in server.streams)
+    # Two setups, the discovery, and one table read and write to remove the lines.
+    assert server.command_counts["protect"] == 4 + 1 + 2
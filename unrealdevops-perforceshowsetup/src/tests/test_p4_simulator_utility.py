@@ -0,0 +1,79 @@
+# Copyright (C) 2023 DNEG - All Rights reserved.
+"""Tests for shared.p4_simulator_utility."""
+import threading
+import time
+
+import pytest
+
+from shared import p4_connection_utility
+from shared import p4_simulator_utility
+from .conftest import SIMULATOR_NO_DELAY
+
+
+def _connection(server):
+    connection = p4_simulator_utility.SimulatedConnection(server)
+    connection.connect()
+    return connection
+
+
+def test_specs_and_populate():
+    server = p4_simulator_utility.SimulatedServer(SIMULATOR_NO_DELAY)
+    p4 = _connection(server)
+
+    p4.input = [{"Depot": "SHOW", "Type": "stream"}]
+    assert p4.run("depot", "-i") == ["Depot SHOW created."]
+    for stream in ("//SHOW/SHOW-main", "//SHOW/SHOW-dev"):
+        p4.input = [{"Stream": stream, "Type": "mainline"}]
+        assert p4.run("stream", "-i") == [f"Stream {stream} saved."]
+    p4.run("populate", "//DNEG_Sandbox/UE5/Template/...", "//SHOW/SHOW-main/...")
+    p4.run("populate", "//SHOW/SHOW-main/...", "//SHOW/SHOW-dev/...")
+
+    assert server.stream_files == {"//SHOW/SHOW-main": 10, "//SHOW/SHOW-dev": 10}
+    # Streams have to be removed before their depot.
+    with pytest.raises(p4_connection_utility.P4CommandError):
+        p4.run("depot", "-d", "SHOW")
+    assert p4.errors == ["Depot SHOW isn't empty of streams."]
+    assert p4.round_trips == 6
+
+
+def test_files_and_child_streams():
+    server = p4_simulator_utility.SimulatedServer(SIMULATOR_NO_DELAY)
+    p4 = _connection(server)
+    p4.input = [{"Depot": "SHOW", "Type": "stream"}]
+    p4.run("depot", "-i")
+    p4.input = [{"Stream": "//SHOW/SHOW-main", "Type": "mainline", "Parent": "none"}]
+    p4.run("stream", "-i")
+    p4.input = [
+        {
+            "Stream": "//SHOW/SHOW-dev",
+            "Type": "development",
+            "Parent": "//SHOW/SHOW-main",
+        }
+    ]
+    p4.run("stream", "-i")
+
+    with pytest.raises(p4_connection_utility.P4CommandError):
+        p4.run("files", "-m", "1", "//SHOW/...")
+    p4.run("populate", "//DNEG_Sandbox/UE5/Template/...", "//SHOW/SHOW-main/...")
+    assert len(p4.run("files", "-m", "1", "//SHOW/...")) == 1
+
+    with pytest.raises(p4_connection_utility.P4CommandError):
+        p4.run("stream", "-d", "//SHOW/SHOW-main")
+    p4.run("stream", "-d", "//SHOW/SHOW-dev")
+    p4.run("stream", "-d", "//SHOW/SHOW-main")
+    assert server.streams == {}
+
+
+def test_protect_write_blocks_other_commands():
+    timings = SIMULATOR_NO_DELAY._replace(protect_write_seconds=0.2)
+    server = p4_simulator_utility.SimulatedServer(timings)
+    writer, reader = _connection(server), _connection(server)
+    writer.input = writer.run("protect", "-o")
+
+    thread = threading.Thread(target=writer.run, args=("protect", "-i"))
+    thread.start()
+    time.sleep(0.05)
+    reader.run("depots")
+    thread.join()
+
+    assert reader.lock_wait >= 0.1
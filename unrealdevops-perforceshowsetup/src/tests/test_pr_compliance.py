@@ -222,6 +222,23 @@ def test_black_compliant_repo():
     ), "Found black errors in the following files: " + "\t\n".join(file_errors)
 
 
+def test_crlf_line_endings():
+    """Tests if every python file in this repo uses CRLF line endings."""
+    main_directory = str(Path(__file__).parent.parent.parent)
+    assert os.path.isdir(main_directory)
+
+    file_errors = set()
+    for file_path in _get_filtered_python_files(main_directory):
+        with open(file_path, "rb") as file_:
+            content = file_.read()
+        if content.count(b"\n") != content.count(b"\r\n"):
+            file_errors.add(file_path)
+
+    assert not any(
+        file_errors
+    ), "Found LF line endings in the following files: " + "\t\n".join(file_errors)
+
+
 @pytest.mark.skip(
     reason="Force run if you wish to see the list of "
     "files which require black + pipe-lint compliance"
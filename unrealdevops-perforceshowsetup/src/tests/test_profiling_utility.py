@@ -0,0 +1,66 @@
+# Copyright (C) 2023 DNEG - All Rights reserved.
+"""Tests for shared.profiling_utility."""
+import os
+import pstats
+import time
+
+import pytest
+
+from shared import profiling_utility
+
+
+def _busy(seconds):
+    """Spend CPU time for a while."""
+    end = time.perf_counter() + seconds
+    total = 0
+    while time.perf_counter() < end:
+        total += sum(range(100))
+    return total
+
+
+def test_step_profile_is_inactive_outside_a_profile():
+    with profiling_utility.step_profile("depot") as step_name:
+        assert step_name == "depot"
+    assert profiling_utility._ACTIVE_PROFILER is None
+
+
+def test_cpu_profile_attributes_time_to_steps(tmp_path):
+    with profiling_utility.profile(
+        profiling_utility.CPU, str(tmp_path), "apply"
+    ) as profiler:
+        with profiling_utility.step_profile("depot"):
+            _busy(0.05)
+        with profiling_utility.step_profile("groups"):
+            _busy(0.05)
+    assert profiling_utility._ACTIVE_PROFILER is None
+
+    assert list(profiler.profiles) == ["run", "depot", "groups"]
+    depot_stats = pstats.Stats(str(tmp_path / "apply_cpu_depot.pstats"))
+    assert any(function[2] == "_busy" for function in depot_stats.stats)
+    assert os.path.isfile(tmp_path / "apply_cpu.pstats")
+
+    collapsed = (tmp_path / "apply_cpu.collapsed").read_text().splitlines()
+    assert collapsed
+    assert any(line.startswith("step:depot;") for line in collapsed)
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in collapsed)
+
+
+def test_memory_profile_reports_steps(tmp_path):
+    with profiling_utility.profile(
+        profiling_utility.MEMORY, str(tmp_path), "apply"
+    ) as profiler:
+        with profiling_utility.step_profile("streams"):
+            kept = [bytearray(1024) for _ in range(100)]
+    assert kept
+
+    assert [step["step"] for step in profiler.steps] == ["streams"]
+    assert profiler.steps[0]["kept"] >= 100 * 1024
+    report = (tmp_path / "apply_mem.txt").read_text()
+    assert report.startswith("Step streams: kept ")
+    assert os.path.isfile(tmp_path / "apply_mem.collapsed")
+
+
+def test_profile_rejects_unknown_kind(tmp_path):
+    with pytest.raises(ValueError):
+        with profiling_utility.profile("wall", str(tmp_path), "apply"):
+            pass
@@ -0,0 +1,128 @@
+# Copyright (C) 2023 DNEG - All Rights reserved.
+"""Tests for shared.protections_utility."""
+from shared import protections_utility
+
+PROTECTIONS = [
+    "super user p4admin * //...",
+    "## START OF DEPOT SPECIFIC PERMISSIONS",
+    "write group SHOW 10.* //SHOW/... ## added by jdoe 1/2/2023",
+    "read group SHOW-Core * //VPCORE/SHOW-Core-rel/... ## added by jdoe 1/2/2023",
+    "write group SHOWX * //SHOWX/...",
+    "write user jdoe * -//SHOW/secret/...",
+    "## END OF DEPOT SPECIFIC PERMISSIONS",
+]
+
+
+def test_parse_entry():
+    entry = protections_utility.parse_entry(PROTECTIONS[2])
+    assert entry.mode == "write"
+    assert entry.type == "group"
+    assert entry.name == "SHOW"
+    assert entry.host == "10.*"
+    assert entry.path == "//SHOW/..."
+    assert entry.comment == "added by jdoe 1/2/2023"
+    assert protections_utility.parse_entry(PROTECTIONS[1]) is None
+
+
+def test_rule_and_depot_of():
+    assert (
+        protections_utility.rule_of(PROTECTIONS[2])
+        == "write group SHOW 10.* //SHOW/..."
+    )
+    assert protections_utility.depot_of("-//SHOW/secret/...") == "SHOW"
+    assert protections_utility.depot_of("//...") is None
+
+
+def test_show_entries():
+    assert protections_utility.show_entries(
+        PROTECTIONS, "SHOW", ["SHOW", "SHOW-Core"]
+    ) == [PROTECTIONS[2], PROTECTIONS[3], PROTECTIONS[5]]
+
+
+def test_show_entries_ignore_case():
+    protections = [
+        "write group Show-Core * //other/...",
+        "read user artist * //show/...",
+        "write group OTHER * //OTHER/...",
+    ]
+    assert (
+        protections_utility.show_entries(protections, "SHOW", ["SHOW", "SHOW-Core"])
+        == protections[:2]
+    )
+
+
+def test_path_and_host_patterns():
+    assert protections_utility.path_pattern("//SHOW/*-dev/...").match(
+        "//show/SHOW-dev/a/b.uasset"
+    )
+    assert not protections_utility.path_pattern("//SHOW/*-dev/...").match(
+        "//SHOW/x/SHOW-dev/a"
+    )
+    assert protections_utility.host_pattern("10.*").match("10.2.3.4")
+    assert not protections_utility.host_pattern("10.*").match("192.168.0.1")
+
+
+def test_access():
+    rules = protections_utility.compile_rules(PROTECTIONS)
+    assert (
+        protections_utility.access_level(
+            protections_utility.access(
+                rules, "artist", "10.0.0.1", "//SHOW/a", ["SHOW"]
+            )
+        )
+        == "write"
+    )
+    # SHOW only grants access from 10.* hosts.
+    assert not protections_utility.access(
+        rules, "artist", "192.168.0.1", "//SHOW/a", ["SHOW"]
+    )
+    # The exclusion takes away write and above, but not read.
+    assert (
+        protections_utility.access_level(
+            protections_utility.access(
+                rules, "jdoe", "10.0.0.1", "//SHOW/secret/a", ["SHOW"]
+            )
+        )
+        == "open"
+    )
+    assert (
+        protections_utility.access_level(
+            protections_utility.access(rules, "p4admin", "10.0.0.1", "//SHOW/secret/a")
+        )
+        == "super"
+    )
+
+
+def test_evaluator_expands_groups_from_the_snapshot():
+    groups = protections_utility.GroupSnapshot(
+        [
+            {"group": "SHOW", "user": "SHOW-Leads", "isSubGroup": "1"},
+            {"group": "SHOW-Leads", "user": "lead", "isUser": "1", "isSubGroup": "0"},
+            {"group": "SHOW-Leads", "user": "owner", "isOwner": "1", "isUser": "0"},
+        ]
+    )
+    assert groups.groups_of("lead") == {"SHOW", "SHOW-Leads"}
+    assert groups.groups_of("owner") == frozenset()
+    evaluator = protections_utility.ProtectionsEvaluator(PROTECTIONS, groups)
+    assert evaluator.access_level("lead", "10.0.0.1", "//SHOW/a") == "write"
+    assert evaluator.access_level("owner", "10.0.0.1", "//SHOW/a") == "none"
+    assert (
+        evaluator.access_level("lead", "10.0.0.1", "//VPCORE/SHOW-Core-rel/a") == "none"
+    )
+    assert (
+        evaluator.access_level("p4admin", "10.0.0.1", "//VPCORE/SHOW-Core-rel/a")
+        == "super"
+    )
+
+
+def test_evaluator_only_matches_the_lines_of_the_file_depot():
+    evaluator = protections_utility.ProtectionsEvaluator(PROTECTIONS)
+    assert [rule.entry.line for rule in evaluator.rules_for("//show/a")] == [
+        PROTECTIONS[0],
+        PROTECTIONS[2],
+        PROTECTIONS[5],
+    ]
+    assert (
+        protections_utility.example_of("-//SHOW/*-dev/...")
+        == "//SHOW/probe-dev/probe/file"
+    )
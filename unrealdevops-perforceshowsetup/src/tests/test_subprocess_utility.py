@@ -1,5 +1,7 @@
 # pylint: disable=W0212
 """Unit tests for the subprocess utility module."""
+import asyncio
+
 import pytest
 
 from shared import subprocess_utility as test_target
@@ -87,3 +89,166 @@ def test_dry_runs():
     assert (True, command) == test_target.trigger_subprocess_with_output(
         command, dry_run=True
     )
+
+
+def _python_command(code):
+    """Build a command running Python code in a fresh interpreter.
+
+    Args:
+        code (str): the code to run.
+
+    Returns:
+        list[str]: the command.
+    """
+    return [test_target.sys.executable, "-c", code]
+
+
+def test_stream_collector_reassembles_chunks():
+    """Test that lines and characters split across chunks are reassembled."""
+    lines = []
+    collector = test_target._StreamCollector(max_lines=2, line_callback=lines.append)
+    data = "one\r\ntwö\nthree".encode("utf-8")
+    for index in range(len(data)):
+        collector.feed(data[index : index + 1])
+    collector.close()
+    assert lines == ["one", "twö", "three"]
+    assert list(collector.lines) == ["twö", "three"]
+    assert collector.truncated is True
+
+
+def test_run_streaming(tmp_path):
+    """Test the exit status, separate streams, ring buffer and spool file."""
+    spool_path = str(tmp_path / "stdout.txt")
+    seen = []
+    result = test_target.run_streaming(
+        _python_command(
+            "import sys\n"
+            "for i in range(100): print(i)\n"
+            "print('bad', file=sys.stderr)\n"
+            "sys.exit(3)"
+        ),
+        line_callback=seen.append,
+        max_lines=10,
+        spool_path=spool_path,
+    )
+    assert result.returncode == 3
+    assert result.stdout == [str(i) for i in range(90, 100)]
+    assert result.stderr == ["bad"]
+    assert result.truncated is True
+    assert result.timed_out is False
+    assert len(seen) == 100
+    with open(spool_path, "r") as spool_file:
+        assert spool_file.read().split() == [str(i) for i in range(100)]
+
+
+def test_run_streaming_timeout_kills_group():
+    """Test that a timeout kills the command and everything it started."""
+    result = test_target.run_streaming(
+        _python_command(
+            "import subprocess, sys, time\n"
+            "subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(30)'])\n"
+            "print('started', flush=True)\n"
+            "time.sleep(30)"
+        ),
+        timeout=1.0,
+    )
+    assert result.timed_out is True
+    assert result.returncode != 0
+    assert result.stdout == ["started"]
+    # The grandchild held stdout open; it is dead, so the readers finished early.
+    assert result.duration < test_target.KILL_WAIT_SECONDS
+
+
+def test_run_streaming_async():
+    """Test the asyncio variant, including its timeout."""
+    result = asyncio.run(
+        test_target.run_streaming_async(
+            _python_command("print('out'); import sys; print('err', file=sys.stderr)")
+        )
+    )
+    assert (result.returncode, result.stdout, result.stderr) == (0, ["out"], ["err"])
+
+    result = asyncio.run(
+        test_target.run_streaming_async(
+            _python_command("import time; time.sleep(30)"), timeout=0.5
+        )
+    )
+    assert result.timed_out is True
+    assert result.duration < test_target.KILL_WAIT_SECONDS
+
+
+@pytest.mark.skipif(
+    test_target.sys.platform == "win32", reason="checks the pid with a signal"
+)
+def test_run_streaming_async_cancel_kills_command():
+    """Test that cancelling the coroutine kills the command."""
+    pids = []
+
+    async def cancel_once_started():
+        task = asyncio.ensure_future(
+            test_target.run_streaming_async(
+                _python_command(
+                    "import os, time; print(os.getpid(), flush=True); time.sleep(30)"
+                ),
+                line_callback=pids.append,
+            )
+        )
+        while not pids:
+            await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    start = test_target.time.perf_counter()
+    asyncio.run(cancel_once_started())
+    assert test_target.time.perf_counter() - start < test_target.KILL_WAIT_SECONDS
+    with pytest.raises(ProcessLookupError):
+        test_target.os.kill(int(pids[0]), 0)
+
+
+def test_subprocess_with_output_exit_status():
+    """Test that a failing command is reported as failed."""
+    (success, response) = test_target.trigger_subprocess_with_output(
+        "echo failing && exit 2"
+    )
+    assert success is False
+    assert response.returncode == 2
+    assert response.output == "failing"
+
+
+def test_run_many_collects_all():
+    """Test that every command runs, results keep their order and streams stay apart."""
+    commands = [
+        _python_command(
+            f"import sys, time; time.sleep({0.3 - index * 0.1}); "
+            f"print({index}); print('e{index}', file=sys.stderr); "
+            f"sys.exit({index})"
+        )
+        for index in range(3)
+    ]
+    start = test_target.time.perf_counter()
+    results = test_target.run_many(commands, max_workers=3)
+    elapsed = test_target.time.perf_counter() - start
+
+    assert [result.returncode for result in results] == [0, 1, 2]
+    assert [result.stdout for result in results] == [["0"], ["1"], ["2"]]
+    assert [result.stderr for result in results] == [["e0"], ["e1"], ["e2"]]
+    assert all(result.duration > 0 for result in results)
+    # Concurrent: about as long as the slowest command, not their sum.
+    assert elapsed < sum(result.duration for result in results)
+
+
+def test_run_many_fail_fast():
+    """Test that the first failure kills running commands and skips the rest."""
+    commands = [
+        _python_command("import sys; sys.exit(1)"),
+        _python_command("import time; time.sleep(30)"),
+        _python_command("print('never')"),
+        _python_command("print('never')"),
+    ]
+    results = test_target.run_many(commands, max_workers=2, fail_fast=True)
+
+    assert results[0].returncode == 1
+    assert results[1].returncode != 0
+    assert results[1].duration < test_target.KILL_WAIT_SECONDS
+    assert [result.returncode for result in results[2:]] == [None, None]